@@ -0,0 +1,467 @@
+/*=========================================================================
+
+  Program:   3D Slicer
+
+  See COPYRIGHT.txt
+  or http://www.slicer.org/copyright/copyright.txt for details.
+
+     This software is distributed WITHOUT ANY WARRANTY; without even
+     the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+     PURPOSE.  See the above copyright notice for more information.
+
+=========================================================================*/
+#include "vtkCachedTubeFilter.h"
+
+#include <vtkAppendPolyData.h>
+#include <vtkCellArray.h>
+#include <vtkCellData.h>
+#include <vtkDataArray.h>
+#include <vtkIdTypeArray.h>
+#include <vtkInformation.h>
+#include <vtkInformationVector.h>
+#include <vtkNew.h>
+#include <vtkObjectFactory.h>
+#include <vtkPointData.h>
+#include <vtkPoints.h>
+#include <vtkPolyData.h>
+#include <vtkSmartPointer.h>
+#include <vtkSMPTools.h>
+#include <vtkTubeFilter.h>
+#include <vtkVersion.h>
+
+// STD includes
+#include <algorithm>
+#include <atomic>
+#include <iostream>
+#include <list>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+vtkStandardNewMacro(vtkCachedTubeFilter);
+
+namespace
+{
+
+const char* SourcePointIdsName = "vtkCachedTubeFilterPointIds";
+const char* SourceCellIdsName = "vtkCachedTubeFilterCellIds";
+const vtkIdType LinesPerChunk = 1000;
+
+// Identifies the tube geometry of an input. The arrays of the lines are
+// kept with the key, so that their storage is not reused by other lines.
+struct TubeKey
+{
+  vtkMTimeType PointsTime;
+  vtkSmartPointer<vtkDataArray> Connectivity;
+  vtkSmartPointer<vtkDataArray> Offsets;
+  vtkIdType NumberOfLines;
+  vtkIdType NumberOfLineIds;
+  double Radius;
+  int NumberOfSides;
+
+  bool operator==(const TubeKey& other) const
+  {
+    return this->PointsTime == other.PointsTime &&
+      storage(this->Connectivity) == storage(other.Connectivity) &&
+      storage(this->Offsets) == storage(other.Offsets) &&
+      this->NumberOfLines == other.NumberOfLines &&
+      this->NumberOfLineIds == other.NumberOfLineIds &&
+      this->Radius == other.Radius &&
+      this->NumberOfSides == other.NumberOfSides;
+  }
+
+  static const void* storage(vtkDataArray* array)
+  {
+    return array ? array->GetVoidPointer(0) : NULL;
+  }
+};
+
+// Copy of the input lines owned by the worker thread: the points of each
+// line in order, with the input point id of each point and the input cell
+// id of each line.
+struct FiberLines
+{
+  std::vector<float> Points;
+  std::vector<vtkIdType> PointIds;
+  std::vector<vtkIdType> Offsets;
+  std::vector<vtkIdType> CellIds;
+};
+
+//----------------------------------------------------------------------------
+// Key of the tubes of the input, without traversing its lines
+TubeKey computeTubeKey(vtkPolyData* input, double radius, int numberOfSides)
+{
+  TubeKey key;
+  key.PointsTime = input->GetPoints() ? input->GetPoints()->GetMTime() : 0;
+  vtkCellArray* lines = input->GetLines();
+#if VTK_MAJOR_VERSION >= 9 || (VTK_MAJOR_VERSION >= 8 && VTK_MINOR_VERSION >= 90)
+  key.Connectivity = lines->GetConnectivityArray();
+  key.Offsets = lines->GetOffsetsArray();
+#else
+  key.Connectivity = lines->GetData();
+#endif
+  key.NumberOfLines = lines->GetNumberOfCells();
+  key.NumberOfLineIds = key.Connectivity ? key.Connectivity->GetNumberOfValues() : 0;
+  key.Radius = radius;
+  key.NumberOfSides = numberOfSides;
+  return key;
+}
+
+//----------------------------------------------------------------------------
+void copyFiberLines(vtkPolyData* input, FiberLines& fiberLines)
+{
+  vtkIdType npts;
+#if VTK_MAJOR_VERSION >= 9 || (VTK_MAJOR_VERSION >= 8 && VTK_MINOR_VERSION >= 90)
+  const vtkIdType* pts;
+#else
+  vtkIdType* pts;
+#endif
+  vtkPoints* points = input->GetPoints();
+  vtkCellArray* lines = input->GetLines();
+  // lines are numbered after the vertices
+  vtkIdType cellId = input->GetNumberOfVerts();
+  double x[3];
+
+  fiberLines.Offsets.push_back(0);
+  for (lines->InitTraversal(); lines->GetNextCell(npts, pts); cellId++)
+    {
+    for (vtkIdType j = 0; j < npts; j++)
+      {
+      points->GetPoint(pts[j], x);
+      fiberLines.Points.push_back(static_cast<float>(x[0]));
+      fiberLines.Points.push_back(static_cast<float>(x[1]));
+      fiberLines.Points.push_back(static_cast<float>(x[2]));
+      fiberLines.PointIds.push_back(pts[j]);
+      }
+    fiberLines.Offsets.push_back(static_cast<vtkIdType>(fiberLines.PointIds.size()));
+    fiberLines.CellIds.push_back(cellId);
+    }
+}
+
+//----------------------------------------------------------------------------
+vtkSmartPointer<vtkPolyData> generateChunkTubes(const FiberLines& fiberLines,
+                                                vtkIdType beginLine, vtkIdType endLine,
+                                                double radius, int numberOfSides)
+{
+  const vtkIdType firstPoint = fiberLines.Offsets[beginLine];
+  const vtkIdType numberOfPoints = fiberLines.Offsets[endLine] - firstPoint;
+
+  vtkNew<vtkPoints> points;
+  points->SetDataTypeToFloat();
+  points->SetNumberOfPoints(numberOfPoints);
+  vtkNew<vtkIdTypeArray> pointIds;
+  pointIds->SetName(SourcePointIdsName);
+  pointIds->SetNumberOfValues(numberOfPoints);
+  for (vtkIdType p = 0; p < numberOfPoints; p++)
+    {
+    points->SetPoint(p, &fiberLines.Points[3 * (firstPoint + p)]);
+    pointIds->SetValue(p, fiberLines.PointIds[firstPoint + p]);
+    }
+
+  vtkNew<vtkCellArray> lines;
+  vtkNew<vtkIdTypeArray> cellIds;
+  cellIds->SetName(SourceCellIdsName);
+  cellIds->SetNumberOfValues(endLine - beginLine);
+  for (vtkIdType i = beginLine; i < endLine; i++)
+    {
+    lines->InsertNextCell(fiberLines.Offsets[i + 1] - fiberLines.Offsets[i]);
+    for (vtkIdType p = fiberLines.Offsets[i]; p < fiberLines.Offsets[i + 1]; p++)
+      {
+      lines->InsertCellPoint(p - firstPoint);
+      }
+    cellIds->SetValue(i - beginLine, fiberLines.CellIds[i]);
+    }
+
+  vtkNew<vtkPolyData> chunk;
+  chunk->SetPoints(points.GetPointer());
+  chunk->SetLines(lines.GetPointer());
+  chunk->GetPointData()->AddArray(pointIds.GetPointer());
+  chunk->GetCellData()->AddArray(cellIds.GetPointer());
+
+  vtkNew<vtkTubeFilter> tubeFilter;
+  tubeFilter->SetInputData(chunk.GetPointer());
+  tubeFilter->SetRadius(radius);
+  tubeFilter->SetNumberOfSides(numberOfSides);
+  tubeFilter->Update();
+  return tubeFilter->GetOutput();
+}
+
+//----------------------------------------------------------------------------
+// Tube geometry of the lines, generated over chunks of lines in parallel.
+// The tubes keep the input point and cell ids they were generated from.
+vtkSmartPointer<vtkPolyData> generateTubes(const FiberLines& fiberLines,
+                                           double radius, int numberOfSides,
+                                           const std::atomic<bool>& canceled)
+{
+  const vtkIdType numberOfLines = static_cast<vtkIdType>(fiberLines.CellIds.size());
+  const vtkIdType numberOfChunks = (numberOfLines + LinesPerChunk - 1) / LinesPerChunk;
+  std::vector<vtkSmartPointer<vtkPolyData> > chunkTubes(numberOfChunks);
+
+  vtkSMPTools::For(0, numberOfChunks, 1, [&](vtkIdType begin, vtkIdType end)
+    {
+    for (vtkIdType c = begin; c < end && !canceled; c++)
+      {
+      chunkTubes[c] = generateChunkTubes(fiberLines, c * LinesPerChunk,
+                                         std::min(numberOfLines, (c + 1) * LinesPerChunk),
+                                         radius, numberOfSides);
+      }
+    });
+
+  vtkSmartPointer<vtkPolyData> tubes = vtkSmartPointer<vtkPolyData>::New();
+  if (canceled)
+    {
+    return tubes;
+    }
+  // append in the order of the lines, so that tube cells follow the lines
+  vtkNew<vtkAppendPolyData> append;
+  for (vtkIdType c = 0; c < numberOfChunks; c++)
+    {
+    if (chunkTubes[c]->GetNumberOfPoints() > 0)
+      {
+      append->AddInputData(chunkTubes[c]);
+      }
+    }
+  if (append->GetNumberOfInputConnections(0) > 0)
+    {
+    append->Update();
+    tubes->ShallowCopy(append->GetOutput());
+    }
+  return tubes;
+}
+
+//----------------------------------------------------------------------------
+// Gather the attributes of the input at the ids the tubes were generated from
+void copyAttributes(vtkDataSetAttributes* input, vtkDataSetAttributes* output,
+                    vtkIdTypeArray* sourceIds)
+{
+  const vtkIdType numberOfTuples = sourceIds ? sourceIds->GetNumberOfValues() : 0;
+  output->CopyAllocate(input, numberOfTuples);
+  for (vtkIdType i = 0; i < numberOfTuples; i++)
+    {
+    output->CopyData(input, sourceIds->GetValue(i), i);
+    }
+}
+
+} // end anonymous namespace
+
+//----------------------------------------------------------------------------
+class vtkCachedTubeFilter::vtkInternal
+{
+public:
+  struct CacheEntry
+  {
+    TubeKey Key;
+    vtkSmartPointer<vtkPolyData> Tubes;
+    unsigned long Size; // in kibibytes
+  };
+  // most recently used first
+  std::list<CacheEntry> Cache;
+
+  vtkPolyData* FindTubes(const TubeKey& key)
+  {
+    for (std::list<CacheEntry>::iterator it = this->Cache.begin(); it != this->Cache.end(); ++it)
+      {
+      if (it->Key == key)
+        {
+        this->Cache.splice(this->Cache.begin(), this->Cache, it);
+        return this->Cache.front().Tubes;
+        }
+      }
+    return NULL;
+  }
+
+  void AddTubes(const TubeKey& key, vtkPolyData* tubes, unsigned long memoryLimit)
+  {
+    CacheEntry entry;
+    entry.Key = key;
+    entry.Tubes = tubes;
+    entry.Size = tubes->GetActualMemorySize();
+    this->Cache.push_front(entry);
+
+    // The tubes of the most lines of the same points are the full detail
+    // ones, kept with the new tubes
+    std::list<CacheEntry>::iterator fullDetail = this->Cache.begin();
+    unsigned long size = 0;
+    for (std::list<CacheEntry>::iterator it = this->Cache.begin(); it != this->Cache.end(); ++it)
+      {
+      if (it->Key.PointsTime == key.PointsTime &&
+          it->Key.NumberOfLineIds > fullDetail->Key.NumberOfLineIds)
+        {
+        fullDetail = it;
+        }
+      size += it->Size;
+      }
+    std::list<CacheEntry>::iterator it = this->Cache.end();
+    while (size > memoryLimit && --it != this->Cache.begin())
+      {
+      if (it != fullDetail)
+        {
+        size -= it->Size;
+        it = this->Cache.erase(it);
+        }
+      }
+  }
+
+  void RunJob()
+  {
+    vtkSmartPointer<vtkPolyData> tubes = generateTubes(this->JobLines,
+      this->JobKey.Radius, this->JobKey.NumberOfSides, this->JobCanceled);
+    std::lock_guard<std::mutex> lock(this->JobMutex);
+    this->JobOutput = tubes;
+    this->JobDone = true;
+  }
+
+  void CancelJob()
+  {
+    if (this->JobThread.joinable())
+      {
+      this->JobCanceled = true;
+      this->JobThread.join();
+      }
+    this->JobRunning = false;
+    this->JobOutput = NULL;
+    this->JobDone = false;
+  }
+
+  // Background generation, JobRunning and JobKey are used from the main
+  // thread only, JobOutput and JobDone are guarded by JobMutex.
+  bool JobRunning = false;
+  TubeKey JobKey;
+  FiberLines JobLines;
+  std::thread JobThread;
+  std::atomic<bool> JobCanceled;
+  std::mutex JobMutex;
+  vtkSmartPointer<vtkPolyData> JobOutput;
+  bool JobDone = false;
+};
+
+//----------------------------------------------------------------------------
+vtkCachedTubeFilter::vtkCachedTubeFilter()
+{
+  this->Radius = 0.5;
+  this->NumberOfSides = 3;
+  this->CacheMemoryLimit = 256 * 1024;
+  this->BackgroundGeneration = 0;
+  this->TubesPending = false;
+  this->Internal = new vtkInternal;
+  this->Internal->JobCanceled = false;
+}
+
+//----------------------------------------------------------------------------
+vtkCachedTubeFilter::~vtkCachedTubeFilter()
+{
+  this->Internal->CancelJob();
+  delete this->Internal;
+}
+
+//----------------------------------------------------------------------------
+bool vtkCachedTubeFilter::ProcessBackgroundTubes()
+{
+  if (!this->Internal->JobRunning)
+    {
+    return false;
+    }
+  vtkSmartPointer<vtkPolyData> tubes;
+    {
+    std::lock_guard<std::mutex> lock(this->Internal->JobMutex);
+    if (!this->Internal->JobDone)
+      {
+      return false;
+      }
+    tubes = this->Internal->JobOutput;
+    }
+  this->Internal->JobThread.join();
+  this->Internal->AddTubes(this->Internal->JobKey, tubes, this->CacheMemoryLimit);
+  this->Internal->JobRunning = false;
+  this->Internal->JobOutput = NULL;
+  this->Internal->JobDone = false;
+  this->Internal->JobLines = FiberLines();
+  this->Modified();
+  return true;
+}
+
+//----------------------------------------------------------------------------
+void vtkCachedTubeFilter::ClearCache()
+{
+  this->Internal->Cache.clear();
+  this->Modified();
+}
+
+//----------------------------------------------------------------------------
+int vtkCachedTubeFilter::RequestData(
+  vtkInformation *vtkNotUsed(request),
+  vtkInformationVector **inputVector,
+  vtkInformationVector *outputVector)
+{
+  // get the info objects
+  vtkInformation *inInfo = inputVector[0]->GetInformationObject(0);
+  vtkInformation *outInfo = outputVector->GetInformationObject(0);
+
+  // get the input and ouptut
+  vtkPolyData *input = vtkPolyData::SafeDownCast(
+    inInfo->Get(vtkDataObject::DATA_OBJECT()));
+  vtkPolyData *output = vtkPolyData::SafeDownCast(
+    outInfo->Get(vtkDataObject::DATA_OBJECT()));
+
+  this->TubesPending = false;
+  if (!input || !input->GetPoints() || input->GetNumberOfLines() == 0)
+    {
+    return 1;
+    }
+
+  TubeKey key = computeTubeKey(input, this->Radius, this->NumberOfSides);
+  vtkSmartPointer<vtkPolyData> tubes = this->Internal->FindTubes(key);
+  if (!tubes && !this->BackgroundGeneration)
+    {
+    vtkDebugMacro(<< "Generating tubes");
+    FiberLines fiberLines;
+    copyFiberLines(input, fiberLines);
+    std::atomic<bool> canceled(false);
+    tubes = generateTubes(fiberLines, this->Radius, this->NumberOfSides, canceled);
+    this->Internal->AddTubes(key, tubes, this->CacheMemoryLimit);
+    }
+
+  if (!tubes)
+    {
+    // The worker generates one geometry at a time: tubes requested
+    // meanwhile are generated once the filter is modified by
+    // ProcessBackgroundTubes
+    if (!this->Internal->JobRunning)
+      {
+      vtkDebugMacro(<< "Generating tubes in the background");
+      this->Internal->JobRunning = true;
+      this->Internal->JobKey = key;
+      this->Internal->JobCanceled = false;
+      this->Internal->JobLines = FiberLines();
+      copyFiberLines(input, this->Internal->JobLines);
+      this->Internal->JobThread = std::thread(&vtkInternal::RunJob, this->Internal);
+      this->InvokeEvent(vtkCachedTubeFilter::TubesPendingEvent);
+      }
+    this->TubesPending = true;
+    output->ShallowCopy(input);
+    return 1;
+    }
+
+  output->SetPoints(tubes->GetPoints());
+  output->SetStrips(tubes->GetStrips());
+  output->SetPolys(tubes->GetPolys());
+  copyAttributes(input->GetPointData(), output->GetPointData(),
+    vtkIdTypeArray::SafeDownCast(tubes->GetPointData()->GetArray(SourcePointIdsName)));
+  output->GetPointData()->SetNormals(tubes->GetPointData()->GetNormals());
+  copyAttributes(input->GetCellData(), output->GetCellData(),
+    vtkIdTypeArray::SafeDownCast(tubes->GetCellData()->GetArray(SourceCellIdsName)));
+
+  return 1;
+}
+
+//----------------------------------------------------------------------------
+void vtkCachedTubeFilter::PrintSelf(std::ostream& os, vtkIndent indent)
+{
+  this->Superclass::PrintSelf(os,indent);
+
+  os << indent << "Radius: " << this->Radius << "\n";
+  os << indent << "NumberOfSides: " << this->NumberOfSides << "\n";
+  os << indent << "CacheMemoryLimit: " << this->CacheMemoryLimit << "\n";
+  os << indent << "BackgroundGeneration: " << this->BackgroundGeneration << "\n";
+  os << indent << "TubesPending: " << this->TubesPending << "\n";
+}
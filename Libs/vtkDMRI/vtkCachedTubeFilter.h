@@ -0,0 +1,118 @@
+/*=========================================================================
+
+  Program:   3D Slicer
+
+  See COPYRIGHT.txt
+  or http://www.slicer.org/copyright/copyright.txt for details.
+
+     This software is distributed WITHOUT ANY WARRANTY; without even
+     the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+     PURPOSE.  See the above copyright notice for more information.
+
+=========================================================================*/
+
+#ifndef __vtkCachedTubeFilter_h
+#define __vtkCachedTubeFilter_h
+
+#include "vtkPolyDataAlgorithm.h"
+#include "vtkDMRIConfigure.h"
+
+// VTK includes
+#include <vtkCommand.h>
+
+// STD includes
+#include <iosfwd>
+
+/// \brief Generates tubes around the lines of the input, and caches them.
+///
+/// The tubes are generated by vtkTubeFilter over chunks of lines in
+/// parallel. The tube geometry is cached, keyed on the input points, the
+/// storage and number of the lines, the radius and the number of sides:
+/// the lines of a fiber bundle at a level of detail are views of a layout
+/// of the lines, so each level has its own tubes, and going back to a level
+/// reuses them. Lines edited in place, keeping their storage and number,
+/// are not detected: call ClearCache() then. The point and cell data of the
+/// input are mapped onto the cached geometry at each execution, so
+/// recoloring the lines does not regenerate the tubes.
+///
+/// The least recently used tubes are evicted when the cache holds more than
+/// CacheMemoryLimit, except the most recent ones and the ones of the most
+/// lines of the same points (full detail).
+///
+/// With BackgroundGeneration on, tubes missing from the cache are generated
+/// on a worker thread and the input lines are passed through meanwhile.
+/// TubesPendingEvent is invoked when the worker thread starts, and
+/// ProcessBackgroundTubes() must then be called regularly from the main
+/// thread until it caches the finished tubes.
+class vtkDMRI_EXPORT vtkCachedTubeFilter : public vtkPolyDataAlgorithm
+{
+public:
+  static vtkCachedTubeFilter *New();
+  vtkTypeMacro(vtkCachedTubeFilter, vtkPolyDataAlgorithm);
+  void PrintSelf(std::ostream& os, vtkIndent indent) override;
+
+  enum
+  {
+    /// Invoked when tubes start being generated on the worker thread
+    TubesPendingEvent = vtkCommand::UserEvent + 1
+  };
+
+  ///
+  /// Radius of the tubes
+  vtkSetClampMacro(Radius, double, 0.0, VTK_DOUBLE_MAX);
+  vtkGetMacro(Radius, double);
+
+  ///
+  /// Number of sides of the tubes
+  vtkSetClampMacro(NumberOfSides, int, 3, VTK_INT_MAX);
+  vtkGetMacro(NumberOfSides, int);
+
+  ///
+  /// Memory size of the tubes kept in the cache, in kibibytes. 256 MiB by
+  /// default.
+  vtkSetMacro(CacheMemoryLimit, unsigned long);
+  vtkGetMacro(CacheMemoryLimit, unsigned long);
+
+  ///
+  /// Generate the tubes missing from the cache on a worker thread, and pass
+  /// the input lines through until they are done. Off by default.
+  vtkSetMacro(BackgroundGeneration, int);
+  vtkGetMacro(BackgroundGeneration, int);
+  vtkBooleanMacro(BackgroundGeneration, int);
+
+  ///
+  /// True if the last execution passed the lines through because their
+  /// tubes were still being generated.
+  vtkGetMacro(TubesPending, bool);
+
+  ///
+  /// Cache the tubes finished by the worker thread. Returns true if tubes
+  /// were cached, the filter is then modified to output them.
+  bool ProcessBackgroundTubes();
+
+  ///
+  /// Empty the cache
+  void ClearCache();
+
+protected:
+  vtkCachedTubeFilter();
+  ~vtkCachedTubeFilter();
+
+  /// Usual data generation method
+  virtual int RequestData(vtkInformation *, vtkInformationVector **, vtkInformationVector *) override;
+
+  double Radius;
+  int NumberOfSides;
+  unsigned long CacheMemoryLimit;
+  int BackgroundGeneration;
+  bool TubesPending;
+
+  class vtkInternal;
+  vtkInternal* Internal;
+
+private:
+  vtkCachedTubeFilter(const vtkCachedTubeFilter&);  /// Not implemented.
+  void operator=(const vtkCachedTubeFilter&);  /// Not implemented.
+};
+
+#endif
@@ -20,19 +20,29 @@
 #include <vtkAlgorithmOutput.h>
 #include <vtkCellArray.h>
 #include <vtkCommand.h>
+#include <vtkDoubleArray.h>
+#include <vtkFloatArray.h>
+#include <vtkIdTypeArray.h>
 #include <vtkInformation.h>
 #include <vtkMath.h>
 #include <vtkNew.h>
 #include <vtkPointData.h>
+#include <vtkPoints.h>
 #include <vtkPolyDataWriter.h>
+#include <vtkSMPThreadLocal.h>
+#include <vtkSMPTools.h>
 #include <vtkStreamingDemandDrivenPipeline.h>
 #include <vtkTimerLog.h>
 #include <vtkTransformPolyDataFilter.h>
 #include <vtkVersion.h>
 
 // STD includes
+#include <algorithm>
+#include <cmath>
+#include <cstring>
 #include <iostream>
 #include <sstream>
+#include <vector>
 
 //----------------------------------------------------------------------------
 vtkStandardNewMacro(vtkSeedTracts);
@@ -71,6 +81,18 @@ vtkSeedTracts::vtkSeedTracts()
   // collections
   this->Streamlines = vtkCollection::New();
 
+  // output of the batch integration
+  this->BatchIntegration = 0;
+  this->AbortExecute = 0;
+  this->ProgressInterval = 0.1;
+  this->BatchPoints = vtkPoints::New();
+  this->BatchPoints->SetDataTypeToDouble();
+  this->BatchTensors = vtkFloatArray::New();
+  this->BatchTensors->SetNumberOfComponents(9);
+  this->BatchOffsets = vtkIdTypeArray::New();
+  this->BatchOffsets->InsertNextValue(0);
+  this->BatchSeedIds = vtkIdTypeArray::New();
+  this->BatchNumberOfSeeds = 0;
 
   // Streamline parameters for all streamlines
   this->IntegrationDirection = VTK_INTEGRATE_BOTH_DIRECTIONS;
@@ -112,6 +134,10 @@ vtkSeedTracts::~vtkSeedTracts()
     this->DeleteAllStreamlines();
     this->Streamlines->Delete();
     }
+  this->BatchPoints->Delete();
+  this->BatchTensors->Delete();
+  this->BatchOffsets->Delete();
+  this->BatchSeedIds->Delete();
   if (FileDirectoryName)
     {
     delete [] FileDirectoryName;
@@ -464,6 +490,702 @@ void vtkSeedTracts::SeedStreamlineFromPoint(double x,
   //newStreamline->Delete();
 }
 
+//----------------------------------------------------------------------------
+int vtkSeedTracts::IsBatchIntegrationUsed()
+{
+  return this->BatchIntegration && this->FileDirectoryName == NULL &&
+    this->TypeOfHyperStreamline == USE_VTK_HYPERSTREAMLINE_POINTS;
+}
+
+//----------------------------------------------------------------------------
+void vtkSeedTracts::WarnIfBatchIntegrationUnsupported()
+{
+  if (this->BatchIntegration && this->FileDirectoryName == NULL &&
+      this->TypeOfHyperStreamline != USE_VTK_HYPERSTREAMLINE_POINTS)
+    {
+    vtkWarningMacro("Batch integration only supports vtkHyperStreamlineDTMRI "
+                    "(UseVtkHyperStreamlinePoints), the seeds are traced one by one.");
+    }
+}
+
+//----------------------------------------------------------------------------
+void vtkSeedTracts::SeedStreamlinesFromPoints(vtkPoints *points)
+{
+  // test we have input
+  if (this->InputTensorFieldConnection == NULL)
+    {
+      vtkErrorMacro("No tensor data input.");
+      return;
+    }
+  if (points == NULL)
+    {
+      return;
+    }
+
+  if (!this->IsBatchIntegrationUsed())
+    {
+    this->WarnIfBatchIntegrationUnsupported();
+    for (vtkIdType i = 0; i < points->GetNumberOfPoints(); i++)
+      {
+      double *pointw = points->GetPoint(i);
+      this->SeedStreamlineFromPoint(pointw[0], pointw[1], pointw[2]);
+      }
+    return;
+    }
+
+  // Transform from world coords to scaled ijk of the input tensors
+  vtkNew<vtkPoints> seeds;
+  seeds->SetDataTypeToDouble();
+  seeds->SetNumberOfPoints(points->GetNumberOfPoints());
+  double point[3];
+  for (vtkIdType i = 0; i < points->GetNumberOfPoints(); i++)
+    {
+    this->WorldToTensorScaledIJK->TransformPoint(points->GetPoint(i), point);
+    seeds->SetPoint(i, point);
+    }
+
+  this->TraceSeedsInBatch(seeds.GetPointer(), 0);
+}
+
+//----------------------------------------------------------------------------
+// Batch integration.
+// The integration below follows vtkHyperStreamlineDTMRI::RequestData
+// (second order Runge-Kutta along the chosen eigenvector, tensors
+// interpolated trilinearly in the current voxel, same stopping criteria)
+// but reads the tensor array of the image directly, so that the seeds
+// can be traced concurrently without a pipeline object per seed.
+//----------------------------------------------------------------------------
+namespace
+{
+
+// copied from vtkHyperStreamlineDTMRI
+// Make sure coordinate systems are consistent
+void FixVectors(double **prev, double **current, int iv, int ix, int iy)
+{
+  double p0[3], p1[3], p2[3];
+  double v0[3], v1[3], v2[3];
+  double temp[3];
+  int i;
+
+  for (i=0; i<3; i++)
+    {
+    v0[i] = current[i][iv];
+    v1[i] = current[i][ix];
+    v2[i] = current[i][iy];
+    }
+
+  if ( prev == NULL ) //make sure coord system is right handed
+    {
+    vtkMath::Cross(v0,v1,temp);
+    if ( vtkMath::Dot(v2,temp) < 0.0 )
+      {
+      for (i=0; i<3; i++)
+        {
+        current[i][iy] *= -1.0;
+        }
+      }
+    }
+
+  else //make sure vectors consistent from one point to the next
+    {
+    for (i=0; i<3; i++)
+      {
+      p0[i] = prev[i][iv];
+      p1[i] = prev[i][ix];
+      p2[i] = prev[i][iy];
+      }
+    if ( vtkMath::Dot(p0,v0) < 0.0 )
+      {
+      for (i=0; i<3; i++)
+        {
+        current[i][iv] *= -1.0;
+        }
+      }
+    if ( vtkMath::Dot(p1,v1) < 0.0 )
+      {
+      for (i=0; i<3; i++)
+        {
+        current[i][ix] *= -1.0;
+        }
+      }
+    if ( vtkMath::Dot(p2,v2) < 0.0 )
+      {
+      for (i=0; i<3; i++)
+        {
+        current[i][iy] *= -1.0;
+        }
+      }
+    }
+}
+
+//----------------------------------------------------------------------------
+// Read-only description of the tensor field, shared by all the threads
+struct TensorField
+{
+  vtkDataArray *Tensors;
+  double Origin[3];  // position of the first point
+  double Spacing[3];
+  int Dimensions[3];
+  double Tolerance2; // same as vtkHyperStreamlineDTMRI
+};
+
+//----------------------------------------------------------------------------
+// One point of a streamline, with the eigensystem used to integrate
+struct TrackPoint
+{
+  double X[3];
+  double T[3][3];
+  double W[3];
+  double V[3][3];
+  double D;
+};
+
+//----------------------------------------------------------------------------
+// Trilinear interpolation of the tensors in the voxel the streamline is in.
+// Each streamline has its own copy, which keeps the tensors at the corners
+// of the current voxel.
+class TensorInterpolator
+{
+public:
+  TensorInterpolator(const TensorField *field) : Field(field) {}
+
+  /// Find the voxel containing x (within tol2 of the bounds), as
+  /// vtkImageData::FindCell does. Returns false if x is outside.
+  bool FindCell(const double x[3], double tol2, double pcoords[3])
+    {
+    const TensorField *field = this->Field;
+    double dist2 = 0.0;
+    for (int i = 0; i < 3; i++)
+      {
+      double c = (x[i] - field->Origin[i]) / field->Spacing[i];
+      int maxIndex = field->Dimensions[i] - 1;
+      if (c < 0.0)
+        {
+        dist2 += c * c * field->Spacing[i] * field->Spacing[i];
+        c = 0.0;
+        }
+      else if (c > maxIndex)
+        {
+        dist2 += (c - maxIndex) * (c - maxIndex) * field->Spacing[i] * field->Spacing[i];
+        c = maxIndex;
+        }
+      int index = static_cast<int>(floor(c));
+      if (index == maxIndex && maxIndex > 0)
+        {
+        // on the upper boundary
+        index--;
+        }
+      this->Index[i] = index;
+      pcoords[i] = c - index;
+      }
+    if (dist2 > tol2)
+      {
+      return false;
+      }
+
+    vtkIdType dimX = field->Dimensions[0];
+    vtkIdType dimXY = dimX * field->Dimensions[1];
+    for (int corner = 0; corner < 8; corner++)
+      {
+      vtkIdType i = std::min(this->Index[0] + (corner & 1), field->Dimensions[0] - 1);
+      vtkIdType j = std::min(this->Index[1] + ((corner >> 1) & 1), field->Dimensions[1] - 1);
+      vtkIdType k = std::min(this->Index[2] + ((corner >> 2) & 1), field->Dimensions[2] - 1);
+      field->Tensors->GetTuple(i + j * dimX + k * dimXY, this->Corners[corner]);
+      }
+    return true;
+    }
+
+  /// Parametric coordinates of x in the current voxel.
+  /// Returns true if x is inside the voxel.
+  bool EvaluatePosition(const double x[3], double pcoords[3]) const
+    {
+    bool inside = true;
+    for (int i = 0; i < 3; i++)
+      {
+      if (this->Field->Dimensions[i] == 1)
+        {
+        pcoords[i] = 0.0;
+        continue;
+        }
+      pcoords[i] = (x[i] - this->Field->Origin[i]) / this->Field->Spacing[i] - this->Index[i];
+      inside = inside && pcoords[i] >= 0.0 && pcoords[i] <= 1.0;
+      }
+    return inside;
+    }
+
+  /// Interpolate the tensor at pcoords. As for vtkVoxel the weights are
+  /// not clamped, positions outside the voxel are extrapolated.
+  void Interpolate(const double pcoords[3], double **m) const
+    {
+    for (int j = 0; j < 3; j++)
+      {
+      for (int i = 0; i < 3; i++)
+        {
+        m[i][j] = 0.0;
+        }
+      }
+    for (int corner = 0; corner < 8; corner++)
+      {
+      double w = ((corner & 1) ? pcoords[0] : 1.0 - pcoords[0]) *
+        (((corner >> 1) & 1) ? pcoords[1] : 1.0 - pcoords[1]) *
+        (((corner >> 2) & 1) ? pcoords[2] : 1.0 - pcoords[2]);
+      const double *tensor = this->Corners[corner];
+      for (int j = 0; j < 3; j++)
+        {
+        for (int i = 0; i < 3; i++)
+          {
+          m[i][j] += tensor[i+3*j] * w;
+          }
+        }
+      }
+    }
+
+  const TensorField *Field;
+  int Index[3];
+  double Corners[8][9];
+};
+
+//----------------------------------------------------------------------------
+// vtkSMPTools functor tracing a range of seeds. Each thread appends the
+// streamlines it keeps to its own flat buffers, tagged with the seed index,
+// so that they can be gathered in seed order afterwards.
+class BatchTracer
+{
+public:
+  struct LocalOutput
+    {
+    std::vector<double> Points;
+    std::vector<float> Tensors;
+    std::vector<vtkIdType> SeedIds;  // seed of each kept streamline
+    std::vector<vtkIdType> Offsets;  // first point of each kept streamline
+    std::vector<TrackPoint> Forward; // work space
+    std::vector<TrackPoint> Backward;
+    };
+
+  const TensorField *Field;
+  const double *Seeds;
+  double IntegrationStepLength;
+  double MaximumPropagationDistance;
+  double RadiusOfCurvature;
+  double StoppingThreshold;
+  double TerminalEigenvalue;
+  double MinimumPathLength;
+  int ThresholdMode;
+  int IntegrationEigenvector;
+  int IntegrationDirection;
+  int UseStartingThreshold;
+  double StartingThreshold;
+  const std::atomic<int> *AbortExecute;
+  vtkSMPThreadLocal<LocalOutput> Local;
+
+  void Initialize()
+    {
+    }
+
+  void operator()(vtkIdType begin, vtkIdType end)
+    {
+    LocalOutput &local = this->Local.Local();
+    int iv = this->IntegrationEigenvector;
+    int ix = (iv + 1) % 3;
+    int iy = (iv + 2) % 3;
+    double *m[3], m0[3], m1[3], m2[3];
+    m[0] = m0; m[1] = m1; m[2] = m2;
+
+    for (vtkIdType seedId = begin; seedId < end && !*this->AbortExecute; ++seedId)
+      {
+      const double *x = this->Seeds + 3 * seedId;
+      TensorInterpolator interpolator(this->Field);
+      double pcoords[3];
+      if (!interpolator.FindCell(x, 0.0, pcoords))
+        {
+        // outside of tensor dataset
+        continue;
+        }
+
+      if (this->UseStartingThreshold)
+        {
+        // Check the tensor threshold at the voxel of the seed
+        const double *tensor = interpolator.Corners[0];
+        double w[3], *v[3], v0[3], v1[3], v2[3];
+        v[0] = v0; v[1] = v1; v[2] = v2;
+        for (int j=0; j<3; j++)
+          {
+          for (int i=0; i<3; i++)
+            {
+            m[i][j] = tensor[3*j+i];
+            }
+          }
+        vtkDiffusionTensorMathematics::TeemEigenSolver(m,w,v);
+        double cl = (this->ThresholdMode == vtkDiffusionTensorMathematics::VTK_TENS_FRACTIONAL_ANISOTROPY) ?
+          vtkDiffusionTensorMathematics::FractionalAnisotropy(w) :
+          vtkDiffusionTensorMathematics::LinearMeasure(w);
+        if (cl < this->StartingThreshold)
+          {
+          continue;
+          }
+        }
+
+      TrackPoint start;
+      double *startV[3] = {start.V[0], start.V[1], start.V[2]};
+      for (int i = 0; i < 3; i++)
+        {
+        start.X[i] = x[i];
+        }
+      interpolator.Interpolate(pcoords, m);
+      for (int i = 0; i < 3; i++)
+        {
+        for (int j = 0; j < 3; j++)
+          {
+          start.T[i][j] = m[i][j];
+          }
+        }
+      vtkDiffusionTensorMathematics::TeemEigenSolver(m, start.W, startV);
+      FixVectors(NULL, startV, iv, ix, iy);
+      start.D = 0.0;
+
+      // a path that is not integrated only has the seed point
+      if (this->IntegrationDirection == VTK_INTEGRATE_BACKWARD)
+        {
+        local.Forward.assign(1, start);
+        }
+      else
+        {
+        this->Integrate(interpolator, start, 1.0, local.Forward);
+        }
+      if (this->IntegrationDirection == VTK_INTEGRATE_FORWARD)
+        {
+        local.Backward.assign(1, start);
+        }
+      else
+        {
+        this->Integrate(interpolator, start, -1.0, local.Backward);
+        }
+
+      // one trajectory per seed point: the seed is in both paths
+      vtkIdType numPts = static_cast<vtkIdType>(local.Forward.size() + local.Backward.size()) - 1;
+      double length = (numPts - 1) * this->IntegrationStepLength;
+      if (length <= this->MinimumPathLength)
+        {
+        continue;
+        }
+
+      local.SeedIds.push_back(seedId);
+      local.Offsets.push_back(static_cast<vtkIdType>(local.Points.size() / 3));
+      // go backwards through the first path and skip the seed point,
+      // then forwards through the second path
+      for (size_t n = local.Forward.size() - 1; n > 0; n--)
+        {
+        this->Append(local.Forward[n], local);
+        }
+      for (size_t n = 0; n < local.Backward.size(); n++)
+        {
+        this->Append(local.Backward[n], local);
+        }
+      }
+    }
+
+  void Reduce()
+    {
+    }
+
+  void Append(const TrackPoint &point, LocalOutput &local) const
+    {
+    local.Points.insert(local.Points.end(), point.X, point.X + 3);
+    for (int row = 0; row < 3; row++)
+      {
+      for (int col = 0; col < 3; col++)
+        {
+        local.Tensors.push_back(static_cast<float>(point.T[row][col]));
+        }
+      }
+    }
+
+  double StoppingMeasure(double w[3]) const
+    {
+    switch (this->ThresholdMode)
+      {
+      case vtkDiffusionTensorMathematics::VTK_TENS_FRACTIONAL_ANISOTROPY:
+        return vtkDiffusionTensorMathematics::FractionalAnisotropy(w);
+      case vtkDiffusionTensorMathematics::VTK_TENS_PLANAR_MEASURE:
+        return vtkDiffusionTensorMathematics::PlanarMeasure(w);
+      case vtkDiffusionTensorMathematics::VTK_TENS_SPHERICAL_MEASURE:
+        return vtkDiffusionTensorMathematics::SphericalMeasure(w);
+      case vtkDiffusionTensorMathematics::VTK_TENS_LINEAR_MEASURE:
+      default:
+        return vtkDiffusionTensorMathematics::LinearMeasure(w);
+      }
+    }
+
+  /// Integrate from start in direction dir until one of the stopping
+  /// criteria is met. The path includes the start point.
+  void Integrate(TensorInterpolator interpolator, const TrackPoint &start,
+                 double dir, std::vector<TrackPoint> &path) const
+    {
+    int iv = this->IntegrationEigenvector;
+    int ix = (iv + 1) % 3;
+    int iy = (iv + 2) % 3;
+    double step = this->IntegrationStepLength;
+    double *m[3], m0[3], m1[3], m2[3];
+    double *v[3], v0[3], v1[3], v2[3];
+    m[0] = m0; m[1] = m1; m[2] = m2;
+    v[0] = v0; v[1] = v1; v[2] = v2;
+    double ev[3], xNext[3], pcoords[3];
+    double kv1[3], kv2[3], ku1[3], ku2[3], kl1, kl2, kn[3], K = 0.0;
+
+    path.clear();
+    path.push_back(start);
+    size_t pointCount = 0;
+    bool keepIntegrating = true;
+
+    while (fabs(path[pointCount].W[0]) > this->TerminalEigenvalue &&
+           path[pointCount].D < this->MaximumPropagationDistance &&
+           keepIntegrating)
+      {
+      TrackPoint current = path[pointCount];
+      double *currentV[3] = {current.V[0], current.V[1], current.V[2]};
+
+      // Test curvature (accumulated as in vtkHyperStreamlineDTMRI)
+      if (pointCount > 2)
+        {
+        const TrackPoint &prev = path[pointCount-1];
+        const TrackPoint &prevPrev = path[pointCount-2];
+        kl2 = 0;
+        kl1 = 0;
+        for (int i=0; i<3; i++)
+          {
+          kv2[i] = prevPrev.X[i] - prev.X[i];
+          kv1[i] = prev.X[i] - current.X[i];
+          kl2 += kv2[i]*kv2[i];
+          kl1 += kv1[i]*kv1[i];
+          }
+        kl2 = sqrt(kl2);
+        kl1 = sqrt(kl1);
+        for (int i=0; i<3; i++)
+          {
+          ku2[i] = kv2[i]/kl2;
+          ku1[i] = kv1[i]/kl1;
+          }
+        for (int i=0; i<3; i++)
+          {
+          kn[i] = 2*(ku2[i]-ku1[i])/(kl1+kl2);
+          K += kn[i]*kn[i];
+          }
+        K = sqrt(K);
+        if (K != 0 && (1/K) < this->RadiusOfCurvature)
+          {
+          keepIntegrating = false;
+          }
+        }
+      else
+        {
+        K = 0;
+        }
+
+      // compute updated position using this step (Euler integration)
+      for (int i=0; i<3; i++)
+        {
+        xNext[i] = current.X[i] + dir * step * current.V[i][iv];
+        }
+      interpolator.EvaluatePosition(xNext, pcoords);
+      interpolator.Interpolate(pcoords, m);
+      vtkDiffusionTensorMathematics::TeemEigenSolver(m, ev, v);
+      FixVectors(currentV, v, iv, ix, iy);
+
+      // now compute final position
+      for (int i=0; i<3; i++)
+        {
+        xNext[i] = current.X[i] + dir * (step/2.0) * (current.V[i][iv] + v[i][iv]);
+        }
+      if (!interpolator.EvaluatePosition(xNext, pcoords) &&
+          !interpolator.FindCell(xNext, this->Field->Tolerance2, pcoords))
+        {
+        // integration has passed out of dataset
+        break;
+        }
+
+      TrackPoint next;
+      double *nextV[3] = {next.V[0], next.V[1], next.V[2]};
+      interpolator.Interpolate(pcoords, m);
+      vtkDiffusionTensorMathematics::TeemEigenSolver(m, next.W, nextV);
+      FixVectors(currentV, nextV, iv, ix, iy);
+
+      // test anisotropy cutoff
+      if (this->StoppingMeasure(next.W) < this->StoppingThreshold)
+        {
+        keepIntegrating = false;
+        }
+
+      for (int i=0; i<3; i++)
+        {
+        next.X[i] = xNext[i];
+        for (int j=0; j<3; j++)
+          {
+          next.T[i][j] = m[i][j];
+          }
+        }
+      next.D = current.D + sqrt(vtkMath::Distance2BetweenPoints(current.X, next.X));
+
+      path.push_back(next);
+      pointCount++;
+      }
+    }
+};
+
+//----------------------------------------------------------------------------
+// Where a streamline traced by BatchTracer is stored
+struct BatchStreamline
+{
+  vtkIdType SeedId;
+  BatchTracer::LocalOutput *Local;
+  size_t Index;
+
+  bool operator<(const BatchStreamline &other) const
+    {
+    return this->SeedId < other.SeedId;
+    }
+};
+
+} // end of anonymous namespace
+
+//----------------------------------------------------------------------------
+void vtkSeedTracts::TraceSeedsInBatch(vtkPoints *seeds, int useStartingThreshold)
+{
+  vtkAlgorithm* producer = this->InputTensorFieldConnection->GetProducer();
+  producer->Update();
+  vtkImageData* inputTensorField = vtkImageData::SafeDownCast(producer->GetOutputDataObject(0));
+  if (inputTensorField == NULL || inputTensorField->GetPointData()->GetTensors() == NULL)
+    {
+    vtkErrorMacro("No tensor data defined!");
+    return;
+    }
+
+  // Settings are taken from the example streamline object
+  vtkHyperStreamlineDTMRI *settings = this->VtkHyperStreamlinePointsSettings;
+  vtkNew<vtkHyperStreamlineDTMRI> defaultSettings;
+  if (settings == NULL)
+    {
+    settings = defaultSettings.GetPointer();
+    }
+
+  TensorField field;
+  field.Tensors = inputTensorField->GetPointData()->GetTensors();
+  inputTensorField->GetSpacing(field.Spacing);
+  inputTensorField->GetDimensions(field.Dimensions);
+  int *extent = inputTensorField->GetExtent();
+  double *origin = inputTensorField->GetOrigin();
+  for (int i = 0; i < 3; i++)
+    {
+    field.Origin[i] = origin[i] + extent[2*i] * field.Spacing[i];
+    }
+  field.Tolerance2 = inputTensorField->GetLength() / 1000.0;
+  field.Tolerance2 = field.Tolerance2 * field.Tolerance2;
+
+  vtkNew<vtkDoubleArray> seedArray;
+  seedArray->DeepCopy(seeds->GetData());
+
+  BatchTracer tracer;
+  tracer.Field = &field;
+  tracer.Seeds = seedArray->GetPointer(0);
+  tracer.IntegrationStepLength = settings->GetIntegrationStepLength();
+  tracer.MaximumPropagationDistance = settings->GetMaximumPropagationDistance();
+  tracer.RadiusOfCurvature = settings->GetRadiusOfCurvature();
+  tracer.StoppingThreshold = settings->GetStoppingThreshold();
+  tracer.TerminalEigenvalue = settings->GetTerminalEigenvalue();
+  tracer.ThresholdMode = settings->GetThresholdMode();
+  tracer.IntegrationEigenvector = settings->GetIntegrationEigenvector();
+  tracer.IntegrationDirection = this->IntegrationDirection;
+  tracer.MinimumPathLength = this->MinimumPathLength;
+  tracer.UseStartingThreshold = useStartingThreshold;
+  tracer.StartingThreshold = this->StartingThreshold;
+  tracer.AbortExecute = &this->AbortExecute;
+
+  // Trace in blocks to report progress and bound the temporary memory.
+  // The blocks start small and are sized to take about ProgressInterval.
+  const vtkIdType minBlockSize = 64;
+  const vtkIdType maxBlockSize = 10000;
+  vtkIdType blockSize = minBlockSize;
+  vtkIdType numSeeds = seeds->GetNumberOfPoints();
+  vtkIdType blockEnd = 0;
+  for (vtkIdType blockStart = 0; blockStart < numSeeds && !this->AbortExecute; blockStart = blockEnd)
+    {
+    blockEnd = std::min(blockStart + blockSize, numSeeds);
+    double blockStartTime = vtkTimerLog::GetUniversalTime();
+    vtkSMPTools::For(blockStart, blockEnd, tracer);
+    double blockTime = vtkTimerLog::GetUniversalTime() - blockStartTime;
+
+    // Gather the streamlines of all the threads in seed order
+    std::vector<BatchStreamline> streamlines;
+    for (vtkSMPThreadLocal<BatchTracer::LocalOutput>::iterator it = tracer.Local.begin();
+         it != tracer.Local.end(); ++it)
+      {
+      for (size_t n = 0; n < it->SeedIds.size(); n++)
+        {
+        BatchStreamline streamline = {it->SeedIds[n], &(*it), n};
+        streamlines.push_back(streamline);
+        }
+      }
+    std::sort(streamlines.begin(), streamlines.end());
+
+    vtkIdType numLines = static_cast<vtkIdType>(streamlines.size());
+    vtkIdType numPts = this->BatchPoints->GetNumberOfPoints();
+    vtkIdType firstLine = this->BatchOffsets->GetNumberOfTuples() - 1;
+    for (vtkIdType line = 0; line < numLines; line++)
+      {
+      const BatchStreamline &streamline = streamlines[line];
+      const BatchTracer::LocalOutput &local = *streamline.Local;
+      vtkIdType begin = local.Offsets[streamline.Index];
+      vtkIdType end = (streamline.Index + 1 < local.Offsets.size()) ?
+        local.Offsets[streamline.Index + 1] : static_cast<vtkIdType>(local.Points.size() / 3);
+      numPts += end - begin;
+      this->BatchOffsets->InsertNextValue(numPts);
+      this->BatchSeedIds->InsertNextValue(this->BatchNumberOfSeeds + streamline.SeedId);
+      }
+
+    this->BatchPoints->SetNumberOfPoints(numPts);
+    this->BatchTensors->SetNumberOfTuples(numPts);
+    double *outPoints = vtkDoubleArray::SafeDownCast(this->BatchPoints->GetData())->GetPointer(0);
+    float *outTensors = this->BatchTensors->GetPointer(0);
+    vtkIdType *offsets = this->BatchOffsets->GetPointer(firstLine);
+    vtkSMPTools::For(0, numLines, [&](vtkIdType begin, vtkIdType end)
+      {
+      for (vtkIdType line = begin; line < end; line++)
+        {
+        const BatchStreamline &streamline = streamlines[line];
+        const BatchTracer::LocalOutput &local = *streamline.Local;
+        vtkIdType first = local.Offsets[streamline.Index];
+        vtkIdType count = offsets[line + 1] - offsets[line];
+        memcpy(outPoints + 3 * offsets[line], &local.Points[3 * first], 3 * count * sizeof(double));
+        memcpy(outTensors + 9 * offsets[line], &local.Tensors[9 * first], 9 * count * sizeof(float));
+        }
+      });
+
+    for (vtkSMPThreadLocal<BatchTracer::LocalOutput>::iterator it = tracer.Local.begin();
+         it != tracer.Local.end(); ++it)
+      {
+      it->Points.clear();
+      it->Tensors.clear();
+      it->SeedIds.clear();
+      it->Offsets.clear();
+      }
+
+    double progress = static_cast<double>(blockEnd) / numSeeds;
+    this->InvokeEvent(vtkCommand::ProgressEvent, (void *)&progress);
+
+    // at most 4 times larger from one block to the next
+    vtkIdType nextBlockSize = 4 * blockSize;
+    if (blockTime > 0 && this->ProgressInterval * blockSize < nextBlockSize * blockTime)
+      {
+      nextBlockSize = static_cast<vtkIdType>(this->ProgressInterval * blockSize / blockTime);
+      }
+    blockSize = std::max(minBlockSize, std::min(maxBlockSize, nextBlockSize));
+    }
+  this->BatchNumberOfSeeds += numSeeds;
+  this->BatchPoints->Modified();
+  this->BatchTensors->Modified();
+  this->BatchOffsets->Modified();
+  this->BatchSeedIds->Modified();
+}
+
 // Seed in an ROI using a continous grid with the resolution given by
 //this->IsotropicSeedingResolution.
 //----------------------------------------------------------------------------
@@ -575,6 +1297,16 @@ void vtkSeedTracts::SeedStreamlinesInROI()
 
   vtkImageData* inputROI = vtkImageData::SafeDownCast(this->InputROIConnection->GetProducer()->GetOutputDataObject(0));
 
+  // With batch integration the seeds are only collected here,
+  // and traced all together at the end.
+  int batch = this->IsBatchIntegrationUsed();
+  if (!batch)
+    {
+    this->WarnIfBatchIntegrationUnsupported();
+    }
+  vtkNew<vtkPoints> seeds;
+  seeds->SetDataTypeToDouble();
+
   for (idxZ = 0; idxZ <= maxZ; idxZ+=gridIncZ)
     {
       // just output (fractional or integer) current slice number
@@ -635,6 +1367,12 @@ void vtkSeedTracts::SeedStreamlinesInROI()
                   // Now transform to scaled ijk of the input tensors
                   this->WorldToTensorScaledIJK->TransformPoint(point2,point);
 
+                  if (batch)
+                    {
+                    seeds->InsertNextPoint(point);
+                    continue;
+                    }
+
                   // make sure it is within the bounds of the tensor dataset
                   if (this->PointWithinTensorData(point,point2))
                     {
@@ -751,6 +1489,10 @@ void vtkSeedTracts::SeedStreamlinesInROI()
 
     }
 
+  if (batch)
+    {
+    this->TraceSeedsInBatch(seeds.GetPointer(), this->UseStartingThreshold);
+    }
 }
 
 
@@ -798,6 +1540,21 @@ void vtkSeedTracts::SeedStreamlinesInROIWithMultipleValues()
   this->InputROIValue = initialROIValue;
 }
 
+namespace
+{
+//----------------------------------------------------------------------------
+// Points, tensors and lines of one or more streamlines, whose points are
+// stored contiguously in the output starting at OutputBegin.
+struct StreamlinePointsBlock
+{
+  vtkPoints *Points;
+  vtkDataArray *Tensors;
+  vtkCellArray *Lines; // NULL for consecutive points (batch)
+  vtkIdType OutputBegin;
+};
+} // end of anonymous namespace
+
+//----------------------------------------------------------------------------
 void vtkSeedTracts::TransformStreamlinesToRASAndAppendToPolyData(vtkPolyData *outFibers)
   {
 
@@ -807,132 +1564,161 @@ void vtkSeedTracts::TransformStreamlinesToRASAndAppendToPolyData(vtkPolyData *ou
     return;
     }
 
-  // Create transformation matrix to place actors in scene
-  // This is used to transform the models before writing them to disk
-  vtkNew<vtkTransform> transform;
-  transform->SetMatrix(this->WorldToTensorScaledIJK->GetMatrix());
-  transform->Inverse();
-
-  vtkNew<vtkTransformPolyDataFilter> transformer;
-  transformer->SetTransform(transform.GetPointer());
-
-  vtkHyperStreamline *streamline;
-  int npts = 0;
-  int ncells = 0;
-  //Loop through the collection and gather total number of points
+  // Matrix to place the streamlines in the scene (inverse of
+  // WorldToTensorScaledIJK), and rotation of the tensors.
+  vtkNew<vtkMatrix4x4> scaledIJKToWorld;
+  vtkMatrix4x4::Invert(this->WorldToTensorScaledIJK->GetMatrix(), scaledIJKToWorld.GetPointer());
+  double (*pointMatrix)[4] = scaledIJKToWorld->Element;
+  double (*rotation)[4] = this->TensorRotationMatrix->Element;
+
+  // Gather the sources of the points: the streamlines of the collection
+  // then the streamlines traced in batch, and the total number of points.
+  std::vector<StreamlinePointsBlock> blocks;
+  std::vector<vtkIdType> blockStarts;
+  vtkIdType npts = 0;
+  vtkIdType ncells = 0;
   for (int i=0; i<this->Streamlines->GetNumberOfItems(); i++)
     {
-    streamline = static_cast<vtkHyperStreamline*> (this->Streamlines->GetItemAsObject(i));
-    npts += streamline->GetOutput()->GetNumberOfPoints();
-    ncells += streamline->GetOutput()->GetNumberOfLines();
+    vtkHyperStreamline *streamline = static_cast<vtkHyperStreamline*> (this->Streamlines->GetItemAsObject(i));
+    vtkPolyData *streamlinePolyData = streamline->GetOutput();
+    if (streamlinePolyData->GetNumberOfPoints() == 0)
+      {
+      continue;
+      }
+    StreamlinePointsBlock block = {streamlinePolyData->GetPoints(),
+                                   streamlinePolyData->GetPointData()->GetTensors(),
+                                   streamlinePolyData->GetLines(), npts};
+    blocks.push_back(block);
+    blockStarts.push_back(npts);
+    npts += streamlinePolyData->GetNumberOfPoints();
+    ncells += streamlinePolyData->GetNumberOfLines();
+    }
+  vtkIdType numCollectionPoints = npts;
+  vtkIdType numBatchLines = this->BatchOffsets->GetNumberOfTuples() - 1;
+  if (numBatchLines > 0)
+    {
+    StreamlinePointsBlock block = {this->BatchPoints, this->BatchTensors, NULL, npts};
+    blocks.push_back(block);
+    blockStarts.push_back(npts);
+    npts += this->BatchPoints->GetNumberOfPoints();
+    ncells += numBatchLines;
     }
   if (npts == 0 || ncells == 0)
     {
     return;
     }
+  blockStarts.push_back(npts);
 
   //Preallocate PolyData elements
   vtkNew<vtkPoints> points;
+  points->SetNumberOfPoints(npts);
   outFibers->SetPoints(points.GetPointer());
-  //outFibers->GetPoints()->SetNumberOfPoints(npts);
+  float *outPoints = static_cast<float*>(points->GetVoidPointer(0));
+
+  vtkNew<vtkFloatArray> newTensors;
+  newTensors->SetNumberOfComponents(9);
+  newTensors->SetNumberOfTuples(npts);
+  outFibers->GetPointData()->SetTensors(newTensors.GetPointer());
+  float *outTensors = newTensors->GetPointer(0);
 
   vtkNew<vtkCellArray> outFibersCellArray;
   outFibers->SetLines(outFibersCellArray.GetPointer());
-  outFibersCellArray->SetNumberOfCells(this->Streamlines->GetNumberOfItems());
+  outFibersCellArray->SetNumberOfCells(ncells);
 
   vtkIdTypeArray *cellArray = outFibersCellArray->GetData();
   cellArray->SetNumberOfTuples(npts+ncells);
+  vtkIdType *cells = cellArray->GetPointer(0);
 
-  vtkNew<vtkFloatArray> newTensors;
-  newTensors->SetNumberOfComponents(9);
-  newTensors->Allocate(9*npts);
-  outFibers->GetPointData()->SetTensors(newTensors.GetPointer());
-
-  int ptId=0;
-  int cellId=0;
-  int ptOffset = 0;
-  vtkIdType cellIndex;
-  for (int i=0; i<this->Streamlines->GetNumberOfItems(); i++)
+  // Transform all the points to RAS and rotate the tensors
+  // into the same (world) coordinate system: R T R'
+  vtkSMPTools::For(0, npts, [&](vtkIdType begin, vtkIdType end)
     {
-    streamline = static_cast<vtkHyperStreamline*> (this->Streamlines->GetItemAsObject(i));
-    transformer->SetInputConnection(streamline->GetOutputPort());
-    transformer->Update();
-
-    // Fill points and cells
-    for (int k=0; k<transformer->GetOutput()->GetNumberOfPoints(); k++)
+    size_t blockIdx = std::upper_bound(blockStarts.begin(), blockStarts.end(), begin) - blockStarts.begin() - 1;
+    double point[3];
+    double tensor[9];
+    double temp[3][3];
+    for (vtkIdType ptId = begin; ptId < end; ++ptId)
       {
-      outFibers->GetPoints()->InsertNextPoint(transformer->GetOutput()->GetPoint(k));
-      ptId++;
+      while (ptId >= blockStarts[blockIdx + 1])
+        {
+        blockIdx++;
+        }
+      const StreamlinePointsBlock &block = blocks[blockIdx];
+      vtkIdType sourceId = ptId - block.OutputBegin;
+
+      block.Points->GetPoint(sourceId, point);
+      float *outPoint = outPoints + 3 * ptId;
+      for (int row = 0; row < 3; row++)
+        {
+        outPoint[row] = static_cast<float>(pointMatrix[row][0] * point[0] +
+          pointMatrix[row][1] * point[1] + pointMatrix[row][2] * point[2] + pointMatrix[row][3]);
+        }
+
+      float *outTensor = outTensors + 9 * ptId;
+      if (block.Tensors == NULL)
+        {
+        std::fill(outTensor, outTensor + 9, 0.0f);
+        continue;
+        }
+      block.Tensors->GetTuple(sourceId, tensor);
+      for (int row = 0; row < 3; row++)
+        {
+        for (int col = 0; col < 3; col++)
+          {
+          temp[row][col] = rotation[row][0] * tensor[col] +
+            rotation[row][1] * tensor[3+col] + rotation[row][2] * tensor[6+col];
+          }
+        }
+      for (int row = 0; row < 3; row++)
+        {
+        for (int col = 0; col < 3; col++)
+          {
+          outTensor[3*row+col] = static_cast<float>(temp[row][0] * rotation[col][0] +
+            temp[row][1] * rotation[col][1] + temp[row][2] * rotation[col][2]);
+          }
+        }
       }
-    vtkIdTypeArray *cellArrayTransf = transformer->GetOutput()->GetLines()->GetData();
-    cellIndex = cellArrayTransf->GetNumberOfTuples()-1;
-    cellArray->SetTypedTuple(cellId, &cellIndex);
-    cellId++;
-    for (int k=1; k<cellArrayTransf->GetNumberOfTuples(); k++)
+    });
+
+  // Lines of the collection streamlines, shifted to their output points
+  vtkIdType cellPos = 0;
+  for (size_t blockIdx = 0; blockIdx < blocks.size(); blockIdx++)
+    {
+    if (blocks[blockIdx].Lines == NULL)
       {
-      //cellArray->InsertNextValue(ptOffset+cellArrayTransf->GetValue(k));
-      cellIndex = ptOffset+cellArrayTransf->GetValue(k);
-      cellArray->SetTypedTuple(cellId, &cellIndex);
-      cellId++;
+      continue;
       }
-    ptOffset += transformer->GetOutput()->GetNumberOfPoints();
-
-    // transform any tensors as well (rotate them)
-    // this should be a vtk class but leave that for slicer3/vtk5
-    // Here we rotate the tensors into the same (world) coordinate system.
-    // -------------------------------------------------
-    vtkDebugMacro("Rotating tensors");
-    int numPts = transformer->GetOutput()->GetNumberOfPoints();
-
-    vtkDebugMacro("Rotating tensors: init");
-    double (*matrix)[4] = this->TensorRotationMatrix->Element;
-    double tensor[9];
-    double tensor3x3[3][3];
-    double temp3x3[3][3];
-    double matrix3x3[3][3];
-    double matrixTranspose3x3[3][3];
-    for (int row = 0; row < 3; row++)
+    vtkIdTypeArray *streamlineCells = blocks[blockIdx].Lines->GetData();
+    vtkIdType numValues = streamlineCells->GetNumberOfTuples();
+    vtkIdType k = 0;
+    while (k < numValues)
       {
-      for (int col = 0; col < 3; col++)
+      vtkIdType numCellPts = streamlineCells->GetValue(k++);
+      cells[cellPos++] = numCellPts;
+      for (vtkIdType n = 0; n < numCellPts; n++)
         {
-          matrix3x3[row][col] = matrix[row][col];
-          matrixTranspose3x3[row][col] = matrix[col][row];
+        cells[cellPos++] = blocks[blockIdx].OutputBegin + streamlineCells->GetValue(k++);
         }
       }
+    }
 
-     vtkDebugMacro("Rotating tensors: get tensors from probe");
-     vtkDataArray *oldTensors = transformer->GetOutput()->GetPointData()->GetTensors();
-     vtkDebugMacro("Rotating tensors: rotate");
-     for (vtkIdType ii = 0; ii < numPts; ii++)
-       {
-         oldTensors->GetTuple(ii,tensor);
-         int idx = 0;
-         for (int row = 0; row < 3; row++)
-           {
-             for (int col = 0; col < 3; col++)
-               {
-                 tensor3x3[row][col] = tensor[idx];
-                 idx++;
-               }
-           }
-         // rotate by our matrix
-         // R T R'
-         vtkMath::Multiply3x3(matrix3x3,tensor3x3,temp3x3);
-         vtkMath::Multiply3x3(temp3x3,matrixTranspose3x3,tensor3x3);
-         idx =0;
-         for (int row = 0; row < 3; row++)
-           {
-             for (int col = 0; col < 3; col++)
-                {
-                  tensor[idx] = tensor3x3[row][col];
-                  idx++;
-                }
-            }
-          newTensors->InsertNextTuple(tensor);
+  // Lines of the batch streamlines: consecutive points
+  const vtkIdType *batchOffsets = this->BatchOffsets->GetPointer(0);
+  vtkIdType batchCellPos = cellPos;
+  vtkSMPTools::For(0, numBatchLines, [&](vtkIdType begin, vtkIdType end)
+    {
+    for (vtkIdType line = begin; line < end; ++line)
+      {
+      vtkIdType *cell = cells + batchCellPos + batchOffsets[line] + line;
+      vtkIdType firstPt = numCollectionPoints + batchOffsets[line];
+      vtkIdType numCellPts = batchOffsets[line + 1] - batchOffsets[line];
+      *cell++ = numCellPts;
+      for (vtkIdType n = 0; n < numCellPts; n++)
+        {
+        *cell++ = firstPt + n;
         }
-    // End of tensor rotation code.
-    // -------------------------------------------------
-    }
+      }
+    });
 
 #ifdef VTK_CELL_ARRAY_V2
   // For vtk9 vtkCellArray::GetData returns a copy of the structure,
@@ -1197,6 +1983,12 @@ void vtkSeedTracts::DeleteAllStreamlines()
       i++;
     }
 
+  this->BatchPoints->Reset();
+  this->BatchTensors->Reset();
+  this->BatchOffsets->Reset();
+  this->BatchOffsets->InsertNextValue(0);
+  this->BatchSeedIds->Reset();
+  this->BatchNumberOfSeeds = 0;
 }
 
 // Delete one streamline and all of its associated objects.
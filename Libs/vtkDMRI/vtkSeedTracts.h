@@ -31,11 +31,17 @@
 #include "vtkHyperStreamlineTeem.h"
 #include "vtkPreciseHyperStreamlinePoints.h"
 
+#include <atomic>
+
 #define USE_VTK_HYPERSTREAMLINE 0
 #define USE_VTK_HYPERSTREAMLINE_POINTS 1
 #define USE_VTK_PRECISE_HYPERSTREAMLINE_POINTS 2
 #define USE_VTK_HYPERSTREAMLINE_TEEM 3
 
+class vtkFloatArray;
+class vtkIdTypeArray;
+class vtkPoints;
+
 /// Individual streamlines can be started at a point, or
 /// many can be started inside a region of interest.
 class vtkDMRI_EXPORT vtkSeedTracts : public vtkObject
@@ -73,6 +79,63 @@ public:
   /// The point should be in the world coordinates of the scene.
   void SeedStreamlineFromPoint(double x, double y, double z);
 
+  /// Description
+  /// Start a streamline from each of the input points.
+  /// The points should be in the world coordinates of the scene.
+  /// With BatchIntegration on, all the seeds are traced at once.
+  void SeedStreamlinesFromPoints(vtkPoints *points);
+
+  /// Description
+  /// Trace the streamlines of SeedStreamlinesFromPoints and
+  /// SeedStreamlinesInROI with a built-in integrator instead of one
+  /// vtkHyperStreamlineDTMRI pipeline per seed. The seeds are traced
+  /// concurrently (vtkSMPTools) on the shared tensor field, using the
+  /// settings of VtkHyperStreamlinePointsSettings, and the results are
+  /// stored in BatchPoints, BatchTensors and BatchOffsets in seed order
+  /// instead of the Streamlines collection.
+  /// Streamlines written to FileDirectoryName are always traced one by one,
+  /// and so are the other types of hyperstreamline, with a warning.
+  vtkSetMacro(BatchIntegration,int)
+  vtkGetMacro(BatchIntegration,int)
+  vtkBooleanMacro(BatchIntegration,int)
+
+  /// Description
+  /// Whether the seeds are traced in batch: BatchIntegration is on, no
+  /// FileDirectoryName is set and the type of hyperstreamline is
+  /// vtkHyperStreamlineDTMRI (UseVtkHyperStreamlinePoints).
+  int IsBatchIntegrationUsed();
+
+  /// Description
+  /// Stop the batch integration: the seeds that are not traced yet are
+  /// skipped. Can be set by an observer of the ProgressEvent or from
+  /// another thread. The streamlines traced so far are kept.
+  vtkSetMacro(AbortExecute,int)
+  vtkGetMacro(AbortExecute,int)
+  vtkBooleanMacro(AbortExecute,int)
+
+  /// Description
+  /// Approximate time between two ProgressEvent of the batch integration,
+  /// in seconds: the size of the blocks of seeds traced between two events
+  /// follows the tracing speed. Default is 0.1.
+  vtkSetMacro(ProgressInterval,double)
+  vtkGetMacro(ProgressInterval,double)
+
+  /// Description
+  /// Output of the batch integration: points (in scaled ijk of the
+  /// tensor field) and tensors of all the streamlines, one after
+  /// the other. Streamline i uses points BatchOffsets[i] to
+  /// BatchOffsets[i+1]-1.
+  vtkGetObjectMacro(BatchPoints, vtkPoints);
+  vtkGetObjectMacro(BatchTensors, vtkFloatArray);
+  vtkGetObjectMacro(BatchOffsets, vtkIdTypeArray);
+
+  /// Description
+  /// Seed of each batch streamline: index in the list of all the seeds
+  /// traced in batch since the streamlines were last deleted. Seeds whose
+  /// streamline was rejected (too short, outside of the tensors, below
+  /// StartingThreshold) have no streamline.
+  vtkGetObjectMacro(BatchSeedIds, vtkIdTypeArray);
+
   /// Description
   /// Input tensor field in which to seed streamlines
   vtkSetObjectMacro(InputTensorFieldConnection, vtkAlgorithmOutput);
@@ -237,6 +300,14 @@ public:
  vtkGetMacro(MinimumPathLength,double);
  vtkSetMacro(MinimumPathLength,double);
 
+ /// Description
+ /// Direction(s) in which streamlines are integrated from their seed:
+ /// VTK_INTEGRATE_FORWARD, VTK_INTEGRATE_BACKWARD or
+ /// VTK_INTEGRATE_BOTH_DIRECTIONS (default). It overrides the direction of
+ /// the streamline settings objects.
+ vtkSetClampMacro(IntegrationDirection,int,VTK_INTEGRATE_FORWARD,VTK_INTEGRATE_BOTH_DIRECTIONS);
+ vtkGetMacro(IntegrationDirection,int);
+
  /// Description
  /// Minimum value of CL to start seeding.
  vtkGetMacro(StartingThreshold,double);
@@ -265,8 +336,23 @@ protected:
 
   vtkHyperStreamline *CreateHyperStreamline();
 
+  /// Trace streamlines from seeds given in scaled ijk of the tensor field
+  /// and append them to the batch output. If useStartingThreshold is set,
+  /// seeds whose anisotropy is lower than StartingThreshold are skipped.
+  void TraceSeedsInBatch(vtkPoints *seeds, int useStartingThreshold);
+  void WarnIfBatchIntegrationUnsupported();
+
   vtkCollection *Streamlines;
 
+  int BatchIntegration;
+  std::atomic<int> AbortExecute;
+  double ProgressInterval;
+  vtkPoints *BatchPoints;
+  vtkFloatArray *BatchTensors;
+  vtkIdTypeArray *BatchOffsets;
+  vtkIdTypeArray *BatchSeedIds;
+  vtkIdType BatchNumberOfSeeds;
+
   vtkTransform *ROIToWorld;
   vtkTransform *ROI2ToWorld;
   vtkTransform *WorldToTensorScaledIJK;
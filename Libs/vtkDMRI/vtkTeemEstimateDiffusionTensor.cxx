@@ -19,15 +19,20 @@
 #include "vtkPointData.h"
 #include "vtkImageData.h"
 #include "vtkFloatArray.h"
+#include <vtkSMPThreadLocal.h>
+#include <vtkSMPTools.h>
 #include <vtkVersion.h>
 
 // STD includes
+#include <algorithm>
 #include <iostream>
+#include <vector>
 
 #define VTKEPS 10e-12
 
 //----------------------------------------------------------------------------
 vtkStandardNewMacro(vtkTeemEstimateDiffusionTensor);
+vtkCxxSetObjectMacro(vtkTeemEstimateDiffusionTensor, Mask, vtkImageData);
 
 
 //----------------------------------------------------------------------------
@@ -35,6 +40,8 @@ vtkTeemEstimateDiffusionTensor::vtkTeemEstimateDiffusionTensor()
 {
   // may be set by user
   this->Transform = NULL;
+  this->Mask = NULL;
+  this->FitBaselineOutsideMask = 0;
 
   this->NumberOfGradients = 7;
 
@@ -91,6 +98,7 @@ vtkTeemEstimateDiffusionTensor::~vtkTeemEstimateDiffusionTensor()
     {
     this->Transform->Delete();
     }
+  this->SetMask(NULL);
 }
 
 //----------------------------------------------------------------------------
@@ -314,6 +322,12 @@ int vtkTeemEstimateDiffusionTensor::RequestData(
   //This is done in a different array to preserve the original gradients set by the user
   this->RescaleGradients();
 
+  if (this->Mask)
+    {
+    output->AllocateScalars(outInfo);
+    return this->RequestDataInMask(inData, output);
+    }
+
   // jump back into normal pipeline: call standard superclass method here
   //Do not jump to do the proper allocation of output data
   return this->Superclass::RequestData(request, inputVector, outputVector);
@@ -321,6 +335,8 @@ int vtkTeemEstimateDiffusionTensor::RequestData(
 
 //----------------------------------------------------------------------------
 // This templated function executes the filter for any type of data.
+// It is called by each thread for its own piece of the output extent and
+// uses its own Teem estimation context, so voxels are estimated in parallel.
 template <class T>
 static void vtkTeemEstimateDiffusionTensorExecute(vtkTeemEstimateDiffusionTensor *self,
                                            vtkImageData *inData,
@@ -339,9 +355,8 @@ static void vtkTeemEstimateDiffusionTensorExecute(vtkTeemEstimateDiffusionTensor
   double *dwi;
   double averageDWI;
   int numDWI;
-  vtkDataArray *outTensors;
-  float outT[3][3];
-  int ptId;
+  float *outT;
+  vtkIdType ptId;
 
   T * baselinePtr = NULL;
   T * averageDWIPtr = NULL;
@@ -351,8 +366,17 @@ static void vtkTeemEstimateDiffusionTensorExecute(vtkTeemEstimateDiffusionTensor
   ngrad  = nrrdNew();
   nbmat = nrrdNew();
 
-  // Get information to march through output tensor data
-  outTensors = self->GetOutput()->GetPointData()->GetTensors();
+  // Get information to march through output tensor data.
+  // Tensors are allocated as floats in RequestData, each thread writes
+  // its own tuples directly.
+  vtkFloatArray *outTensors = vtkFloatArray::SafeDownCast(
+    self->GetOutput()->GetPointData()->GetTensors());
+  if (outTensors == NULL)
+    {
+    nrrdNix(ngrad);
+    nrrdNuke(nbmat);
+    return;
+    }
 
   // Set Ten Context
   tenEstimateContext *tec = tenEstimateContextNew();
@@ -392,6 +416,13 @@ static void vtkTeemEstimateDiffusionTensorExecute(vtkTeemEstimateDiffusionTensor
   numInputs = inData->GetNumberOfScalarComponents();
   dwi = new double[numInputs];
 
+  // Diffusion weighted components averaged into the AverageDWI output
+  std::vector<bool> isDWI(numInputs);
+  for (int k = 0; k < numInputs; k++)
+    {
+    isDWI[k] = self->GetBValues()->GetValue(k) > 1;
+    }
+
   double _ten[7];
 
   for (idxZ = 0; idxZ <= maxZ; idxZ++)
@@ -414,7 +445,7 @@ static void vtkTeemEstimateDiffusionTensorExecute(vtkTeemEstimateDiffusionTensor
              for (int k=0; k< numInputs; k++)
              {
                dwi[k] = (double) inPtr[k];
-               if (self->GetBValues()->GetValue(k) > 1)
+               if (isDWI[k])
                  {
                  averageDWI += dwi[k];
                  numDWI++;
@@ -423,15 +454,15 @@ static void vtkTeemEstimateDiffusionTensorExecute(vtkTeemEstimateDiffusionTensor
              // Set dwi to context
              //Main method
               tenEstimate1TensorSingle_d(tec,_ten, dwi);
-              outT[0][0] = _ten[1];
-              outT[0][1] = outT[1][0] = _ten[2];
-              outT[0][2] = outT[2][0] = _ten[3];
-              outT[1][1] = _ten[4];
-              outT[1][2] = outT[2][1] = _ten[5];
-              outT[2][2] = _ten[6];
 
               // Pixel operation
-              outTensors->SetTuple(ptId,(float *)outT);
+              outT = outTensors->GetPointer(9*ptId);
+              outT[0] = _ten[1];
+              outT[1] = outT[3] = _ten[2];
+              outT[2] = outT[6] = _ten[3];
+              outT[4] = _ten[4];
+              outT[5] = outT[7] = _ten[5];
+              outT[8] = _ten[6];
               // copy no diffusion data through for scalars
               *outPtr = (T) tec->estimatedB0;
 
@@ -471,6 +502,258 @@ static void vtkTeemEstimateDiffusionTensorExecute(vtkTeemEstimateDiffusionTensor
   nrrdNuke(nbmat);
 }
 
+//----------------------------------------------------------------------------
+// Estimates the tensors of a list of voxels in parallel. Each thread sets
+// up its own Teem estimation context the first time it gets work, and keeps
+// it for the next blocks until Free.
+template <class T>
+class vtkTeemEstimateDiffusionTensorMaskedFunctor
+{
+public:
+  struct LocalContext
+    {
+    LocalContext() : Context(NULL), Gradients(NULL), BMatrix(NULL), Valid(false) {}
+    tenEstimateContext *Context;
+    Nrrd *Gradients;
+    Nrrd *BMatrix;
+    std::vector<double> DWI;
+    bool Valid;
+    };
+
+  vtkTeemEstimateDiffusionTensor *Self;
+  const vtkIdType *PointIds;
+  const T *InPtr;
+  vtkIdType InIncrements[3];
+  int Dimensions[3];
+  int NumberOfComponents;
+  T *OutPtr;
+  T *BaselinePtr;
+  float *TensorPtr;
+  bool WriteTensors;
+  vtkSMPThreadLocal<LocalContext> Local;
+  bool Failed;
+
+  void Initialize()
+    {
+    LocalContext &local = this->Local.Local();
+    if (local.Context)
+      {
+      return;
+      }
+    local.Gradients = nrrdNew();
+    local.BMatrix = nrrdNew();
+    local.Context = tenEstimateContextNew();
+    local.DWI.resize(this->NumberOfComponents);
+    local.Valid = !this->Self->SetTenContext(local.Context, local.Gradients, local.BMatrix);
+    }
+
+  void operator()(vtkIdType begin, vtkIdType end)
+    {
+    LocalContext &local = this->Local.Local();
+    if (!local.Valid)
+      {
+      return;
+      }
+    double ten[7];
+    for (vtkIdType n = begin; n < end; ++n)
+      {
+      vtkIdType ptId = this->PointIds[n];
+      vtkIdType i = ptId % this->Dimensions[0];
+      vtkIdType j = (ptId / this->Dimensions[0]) % this->Dimensions[1];
+      vtkIdType k = ptId / (static_cast<vtkIdType>(this->Dimensions[0]) * this->Dimensions[1]);
+      const T *inPtr = this->InPtr
+        + i * this->InIncrements[0] + j * this->InIncrements[1] + k * this->InIncrements[2];
+      for (int c = 0; c < this->NumberOfComponents; c++)
+        {
+        local.DWI[c] = (double) inPtr[c];
+        }
+      tenEstimate1TensorSingle_d(local.Context, ten, &local.DWI[0]);
+
+      if (this->WriteTensors)
+        {
+        float *outT = this->TensorPtr + 9 * ptId;
+        outT[0] = ten[1];
+        outT[1] = outT[3] = ten[2];
+        outT[2] = outT[6] = ten[3];
+        outT[4] = ten[4];
+        outT[5] = outT[7] = ten[5];
+        outT[8] = ten[6];
+        }
+      this->OutPtr[ptId] = this->BaselinePtr[ptId] = (T) local.Context->estimatedB0;
+      }
+    }
+
+  void Reduce()
+    {
+    for (typename vtkSMPThreadLocal<LocalContext>::iterator it = this->Local.begin();
+         it != this->Local.end(); ++it)
+      {
+      this->Failed |= !it->Valid;
+      }
+    }
+
+  void Free()
+    {
+    for (typename vtkSMPThreadLocal<LocalContext>::iterator it = this->Local.begin();
+         it != this->Local.end(); ++it)
+      {
+      if (it->Context)
+        {
+        tenEstimateContextNix(it->Context);
+        nrrdNix(it->Gradients);
+        nrrdNuke(it->BMatrix);
+        it->Context = NULL;
+        }
+      }
+    }
+};
+
+//----------------------------------------------------------------------------
+// Masked execution: background voxels are filled from the signal directly,
+// then the voxels inside the mask are estimated, and the baseline of the
+// voxels outside it if FitBaselineOutsideMask is on.
+template <class T>
+static int vtkTeemEstimateDiffusionTensorMaskedExecute(vtkTeemEstimateDiffusionTensor *self,
+                                                       vtkImageData *inData,
+                                                       T * inPtr,
+                                                       vtkImageData *outData,
+                                                       T * outPtr)
+{
+  int *dims = outData->GetDimensions();
+  vtkIdType numPts = static_cast<vtkIdType>(dims[0]) * dims[1] * dims[2];
+  int numInputs = inData->GetNumberOfScalarComponents();
+  vtkIdType *inInc = inData->GetIncrements();
+  T *baselinePtr = static_cast<T*>(self->GetBaseline()->GetScalarPointer());
+  T *averageDWIPtr = static_cast<T*>(self->GetAverageDWI()->GetScalarPointer());
+  float *tensorPtr = vtkFloatArray::SafeDownCast(outData->GetPointData()->GetTensors())->GetPointer(0);
+  double minimumSignal = self->GetMinimumSignalValue();
+
+  std::vector<bool> isDWI(numInputs);
+  for (int k = 0; k < numInputs; k++)
+    {
+    isDWI[k] = self->GetBValues()->GetValue(k) > 1;
+    }
+
+  // Fill every voxel as background: zero tensor, mean baseline signal and
+  // average DWI. The estimation below overwrites the voxels in the mask.
+  vtkSMPTools::For(0, numPts, [&](vtkIdType begin, vtkIdType end)
+    {
+    for (vtkIdType ptId = begin; ptId < end; ++ptId)
+      {
+      vtkIdType i = ptId % dims[0];
+      vtkIdType j = (ptId / dims[0]) % dims[1];
+      vtkIdType k = ptId / (static_cast<vtkIdType>(dims[0]) * dims[1]);
+      const T *voxel = inPtr + i * inInc[0] + j * inInc[1] + k * inInc[2];
+      double baseline = 0.0, averageDWI = 0.0;
+      int numBaseline = 0, numDWI = 0;
+      for (int c = 0; c < numInputs; c++)
+        {
+        if (isDWI[c])
+          {
+          averageDWI += voxel[c];
+          numDWI++;
+          }
+        else
+          {
+          baseline += std::max((double) voxel[c], minimumSignal);
+          numBaseline++;
+          }
+        }
+      outPtr[ptId] = baselinePtr[ptId] = (T) (numBaseline > 0 ? baseline / numBaseline : minimumSignal);
+      averageDWIPtr[ptId] = (T) (numDWI > 0 ? averageDWI / numDWI : 0);
+      std::fill(tensorPtr + 9 * ptId, tensorPtr + 9 * (ptId + 1), 0.0f);
+      }
+    });
+
+  // Compact lists of the voxels to estimate, and of the voxels outside the
+  // mask for which only the baseline is kept
+  vtkDataArray *maskScalars = self->GetMask()->GetPointData()->GetScalars();
+  bool fitOutside = self->GetFitBaselineOutsideMask() != 0;
+  std::vector<vtkIdType> pointIds;
+  std::vector<vtkIdType> outsidePointIds;
+  for (vtkIdType ptId = 0; ptId < numPts; ++ptId)
+    {
+    if (maskScalars->GetComponent(ptId, 0) != 0)
+      {
+      pointIds.push_back(ptId);
+      }
+    else if (fitOutside)
+      {
+      outsidePointIds.push_back(ptId);
+      }
+    }
+
+  vtkTeemEstimateDiffusionTensorMaskedFunctor<T> functor;
+  functor.Self = self;
+  functor.InPtr = inPtr;
+  std::copy(inInc, inInc + 3, functor.InIncrements);
+  std::copy(dims, dims + 3, functor.Dimensions);
+  functor.NumberOfComponents = numInputs;
+  functor.OutPtr = outPtr;
+  functor.BaselinePtr = baselinePtr;
+  functor.TensorPtr = tensorPtr;
+  functor.Failed = false;
+
+  // The voxels are estimated in blocks, so that progress is reported and
+  // abort is checked from this thread between them
+  const vtkIdType total = static_cast<vtkIdType>(pointIds.size() + outsidePointIds.size());
+  const vtkIdType blockSize = std::max<vtkIdType>(total / 50, 1000);
+  vtkIdType done = 0;
+  const std::vector<vtkIdType> *lists[2] = { &pointIds, &outsidePointIds };
+  for (int list = 0; list < 2 && !functor.Failed; ++list)
+    {
+    const vtkIdType size = static_cast<vtkIdType>(lists[list]->size());
+    if (size == 0)
+      {
+      continue;
+      }
+    functor.PointIds = &(*lists[list])[0];
+    functor.WriteTensors = (list == 0);
+    for (vtkIdType begin = 0; begin < size && !functor.Failed && !self->AbortExecute; begin += blockSize)
+      {
+      vtkIdType end = std::min(begin + blockSize, size);
+      vtkSMPTools::For(begin, end, functor);
+      done += end - begin;
+      self->UpdateProgress(static_cast<double>(done) / total);
+      }
+    }
+  functor.Free();
+  return functor.Failed ? 0 : 1;
+}
+
+//----------------------------------------------------------------------------
+int vtkTeemEstimateDiffusionTensor::RequestDataInMask(vtkImageData *inData,
+                                                      vtkImageData *outData)
+{
+  int *dims = outData->GetDimensions();
+  int *maskDims = this->Mask->GetDimensions();
+  if (dims[0] != maskDims[0] || dims[1] != maskDims[1] || dims[2] != maskDims[2]
+      || this->Mask->GetPointData()->GetScalars() == NULL)
+    {
+    vtkErrorMacro("The mask must have scalars and the same dimensions as the output");
+    return 0;
+    }
+
+  int result = 0;
+  void *inPtr = inData->GetScalarPointerForExtent(outData->GetExtent());
+  void *outPtr = outData->GetScalarPointer();
+  switch (inData->GetScalarType())
+    {
+    vtkTemplateMacro(result = vtkTeemEstimateDiffusionTensorMaskedExecute(this,
+                      inData, static_cast<VTK_TT*>(inPtr),
+                      outData, static_cast<VTK_TT*>(outPtr)));
+    default:
+      vtkErrorMacro(<< "Execute: Unknown ScalarType");
+      return 0;
+    }
+  if (!result)
+    {
+    vtkErrorMacro("TenContext cannot be set. Bailing out");
+    }
+  this->UpdateProgress(1.0);
+  return result;
+}
+
 //----------------------------------------------------------------------------
 // To accomodate different b-values we might have to rescale the gradients
 void vtkTeemEstimateDiffusionTensor::RescaleGradients()
@@ -597,7 +880,7 @@ void vtkTeemEstimateDiffusionTensor::ThreadedExecute(vtkImageData *inData,
   // Loop through to fill input pointer array
   inPtrs = inData->GetScalarPointerForExtent(outExt);
 
-  // call Execute method to handle all data at the same time
+  // call Execute method to estimate the tensors of this thread's extent
   switch (inData->GetScalarType())
     {
       vtkTemplateMacro(vtkTeemEstimateDiffusionTensorExecute(this,
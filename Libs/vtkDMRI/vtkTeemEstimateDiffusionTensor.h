@@ -31,6 +31,8 @@
 
 #include "teem/ten.h"
 
+class vtkImageData;
+
 class vtkDMRI_EXPORT vtkTeemEstimateDiffusionTensor : public vtkThreadedImageAlgorithm
 {
  public:
@@ -121,6 +123,24 @@ class vtkDMRI_EXPORT vtkTeemEstimateDiffusionTensor : public vtkThreadedImageAlg
   vtkSetObjectMacro(Transform, vtkTransform);
   vtkGetObjectMacro(Transform, vtkTransform);
 
+  ///
+  /// Optional brain mask with the same dimensions as the output.
+  /// When set, tensors are only estimated for the voxels where the mask is
+  /// non-zero, in parallel over the list of those voxels. Other voxels get a
+  /// zero tensor, see FitBaselineOutsideMask for their baseline.
+  virtual void SetMask(vtkImageData* mask);
+  vtkGetObjectMacro(Mask, vtkImageData);
+
+  ///
+  /// If off (default), the voxels outside the Mask are not fitted and their
+  /// baseline is the mean non diffusion weighted signal (clamped to
+  /// MinimumSignalValue), so that only the voxels in the mask are estimated.
+  /// If on, their baseline is the estimated B0 of a fit, as without a mask,
+  /// which costs as much as estimating the whole volume.
+  vtkSetMacro(FitBaselineOutsideMask, int);
+  vtkGetMacro(FitBaselineOutsideMask, int);
+  vtkBooleanMacro(FitBaselineOutsideMask, int);
+
   ///
   /// Internal class use only
   void TransformDiffusionGradients();
@@ -153,6 +173,10 @@ class vtkDMRI_EXPORT vtkTeemEstimateDiffusionTensor : public vtkThreadedImageAlg
   /// for transforming tensors
   vtkTransform *Transform;
 
+  /// Voxels to estimate (non-zero), or NULL for all voxels
+  vtkImageData *Mask;
+  int FitBaselineOutsideMask;
+
   /// Method
   int EstimationMethod;
 
@@ -179,6 +203,10 @@ class vtkDMRI_EXPORT vtkTeemEstimateDiffusionTensor : public vtkThreadedImageAlg
   void ThreadedExecute(vtkImageData *inData, vtkImageData *outData,
         int extent[6], int id) override;
 
+  /// Estimate only the voxels inside Mask, used by RequestData instead of
+  /// the threaded execution when a mask is set.
+  int RequestDataInMask(vtkImageData *inData, vtkImageData *outData);
+
   /// We override this in order to allocate output tensors
   /// before threading happens.  This replaces the superclass
   /// vtkImageAlgorithm's RequestData function.
@@ -4,6 +4,7 @@
 #include <vtkVersion.h>
 #include <vtkImageCast.h>
 #include <vtkImageData.h>
+#include <vtkSMPTools.h>
 
 // vtkTeem includes
 #include <Libs/vtkTeem/vtkTeemNRRDReader.h>
@@ -17,7 +18,6 @@
 
 // vtkDMRI includes
 #include <vtkTeemEstimateDiffusionTensor.h>
-#include <vtkTensorMask.h>
 
 // ITK includes
 #include <itkFloatingPointExceptions.h>
@@ -31,7 +31,6 @@ bool transformsNotEqual(const vtkMatrix4x4* mat1, const vtkMatrix4x4* mat2);
 int main( int argc, char * argv[] )
 {
   itk::FloatingPointExceptions::Disable();
-  bool applyMask = false;
 
   PARSE_ARGS;
     {
@@ -60,6 +59,11 @@ int main( int argc, char * argv[] )
     estim->SetDiffusionGradients(grads.GetPointer());
     estim->SetBValues(bValues.GetPointer());
     estim->SetShiftNegativeEigenvalues(ShiftNegativeEigenvalues);
+    if( numberOfThreads > 0 )
+      {
+      estim->SetNumberOfThreads(numberOfThreads);
+      vtkSMPTools::Initialize(numberOfThreads);
+      }
 
     // Compute Transformation that brings the gradients to ijk
     // double *sp = reader->GetOutput()->GetSpacing();
@@ -102,9 +106,7 @@ int main( int argc, char * argv[] )
       {
       estim->SetEstimationMethodToWLS();
       }
-    estim->Update();
-    vtkImageData *tensorImage = estim->GetOutput();
-    // Read the tensor mask
+    // Read the brain mask: only the voxels inside it are estimated
     vtkNew<vtkImageData> mask;
     if( strlen(inputMaskVolume.c_str() ) > 0 )
       {
@@ -130,24 +132,12 @@ int main( int argc, char * argv[] )
       cast->Update();
 
       mask->DeepCopy(cast->GetOutput() );
-      applyMask = true;
-      }
-    else
-      {
-      applyMask = false;
+      estim->SetMask(mask.GetPointer());
+      estim->SetFitBaselineOutsideMask(fitBaselineOutsideMask);
       }
 
-    // Mask tensor
-    vtkNew<vtkTensorMask> tensorMask;
-    tensorMask->SetNumberOfThreads(1);
-    if( applyMask )
-      {
-      tensorMask->SetMaskAlpha(0.0);
-      tensorMask->SetInputConnection(estim->GetOutputPort());
-      tensorMask->SetMaskInputData(mask.GetPointer());
-      tensorMask->Update();
-      tensorImage = tensorMask->GetOutput();
-      }
+    estim->Update();
+    vtkImageData *tensorImage = estim->GetOutput();
     /**/
     // Compute IjkToRas (used by Writer)
     vtkMatrix4x4* ijkToRasMatrix = reader->GetRasToIjkMatrix();
@@ -5,169 +5,236 @@
 #include <Libs/vtkTeem/vtkTeemNRRDWriter.h>
 
 // VTK includes
+#include <vtkFloatArray.h>
 #include <vtkImageData.h>
+#include <vtkMath.h>
+#include <vtkMatrix4x4.h>
+#include <vtkNew.h>
+#include <vtkPointData.h>
+#include <vtkSMPTools.h>
+#include <vtkSmartPointer.h>
 
 // ITK includes
 #include <itkFloatingPointExceptions.h>
 
 // STD includes
 #include <iostream>
+#include <vector>
 
 #include "DiffusionTensorScalarMeasurementsCLP.h"
 
-int main( int argc, char * argv[] )
+// Measurement of the name, -1 if not supported
+int getOperation(const std::string &operation)
 {
-  itk::FloatingPointExceptions::Disable();
-
-  PARSE_ARGS;
-
-  vtkTeemNRRDReader *reader = vtkTeemNRRDReader::New();
-  reader->SetFileName(inputVolume.c_str() );
-  reader->Update();
-
-  if( reader->GetOutput()->GetPointData()->GetTensors() == NULL )
-    {
-    std::cerr << argv[0] << ": No tensor data" << std::endl;
-    return EXIT_FAILURE;
-    }
-  vtkDiffusionTensorMathematics *math = vtkDiffusionTensorMathematics::New();
-
-  math->SetInputConnection(0, reader->GetOutputPort() );
-
   if( operation == std::string("Trace") )
     {
-    math->SetOperationToTrace();
+    return vtkDiffusionTensorMathematics::VTK_TENS_TRACE;
     }
   else if( operation == std::string("Determinant") )
     {
-    math->SetOperationToDeterminant();
+    return vtkDiffusionTensorMathematics::VTK_TENS_DETERMINANT;
     }
   else if( operation == std::string("RelativeAnisotropy") )
     {
-    math->SetOperationToRelativeAnisotropy();
+    return vtkDiffusionTensorMathematics::VTK_TENS_RELATIVE_ANISOTROPY;
     }
   else if( operation == std::string("FractionalAnisotropy") )
     {
-    math->SetOperationToFractionalAnisotropy();
+    return vtkDiffusionTensorMathematics::VTK_TENS_FRACTIONAL_ANISOTROPY;
     }
   else if( operation == std::string("Mode") )
     {
-    math->SetOperationToMode();
+    return vtkDiffusionTensorMathematics::VTK_TENS_MODE;
     }
   else if( operation == std::string("LinearMeasurement") || operation == std::string("LinearMeasure") )
     {
-    math->SetOperationToLinearMeasure();
+    return vtkDiffusionTensorMathematics::VTK_TENS_LINEAR_MEASURE;
     }
   else if( operation == std::string("PlanarMeasurement") || operation == std::string("PlanarMeasure") )
     {
-    math->SetOperationToPlanarMeasure();
+    return vtkDiffusionTensorMathematics::VTK_TENS_PLANAR_MEASURE;
     }
   else if( operation == std::string("SphericalMeasurement") || operation == std::string("SphericalMeasure") )
     {
-    math->SetOperationToSphericalMeasure();
+    return vtkDiffusionTensorMathematics::VTK_TENS_SPHERICAL_MEASURE;
     }
   else if( operation == std::string("MinEigenvalue") )
     {
-    math->SetOperationToMinEigenvalue();
+    return vtkDiffusionTensorMathematics::VTK_TENS_MIN_EIGENVALUE;
     }
   else if( operation == std::string("MidEigenvalue") )
     {
-    math->SetOperationToMiddleEigenvalue();
+    return vtkDiffusionTensorMathematics::VTK_TENS_MID_EIGENVALUE;
     }
   else if( operation == std::string("MaxEigenvalue") )
     {
-    math->SetOperationToMaxEigenvalue();
-    }
-  else if( operation == std::string("ColorByOrientation") )
-    {
-    math->SetOperationToColorByOrientation();
+    return vtkDiffusionTensorMathematics::VTK_TENS_MAX_EIGENVALUE;
     }
-  else if( operation == std::string("ColorByMode") )
-    {
-    math->SetOperationToColorByMode();
-    }
-  else if( operation == std::string("MaxEigenvalueProjectionX") )
-    {
-    math->SetOperationToMaxEigenvalueProjectionX();
-    }
-  else if( operation == std::string("MaxEigenvalueProjectionY") )
-    {
-    math->SetOperationToMaxEigenvalueProjectionY();
-    }
-  else if( operation == std::string("MaxEigenvalueProjectionZ") )
-    {
-    math->SetOperationToMaxEigenvalueProjectionZ();
-    }
-  else if( operation == std::string("RAIMaxEigenvecX") )
-    {
-    math->SetOperationToRAIMaxEigenvecX();
-    }
-  else if( operation == std::string("RAIMaxEigenvecY") )
-    {
-    math->SetOperationToRAIMaxEigenvecY();
-    }
-  else if( operation == std::string("RAIMaxEigenvecZ") )
-    {
-    math->SetOperationToRAIMaxEigenvecZ();
-    }
-  else if( operation == std::string("MaxEigenvecX") )
+  else if( operation == std::string("ParallelDiffusivity") )
     {
-    math->SetOperationToMaxEigenvecX();
+    return vtkDiffusionTensorMathematics::VTK_TENS_PARALLEL_DIFFUSIVITY;
     }
-  else if( operation == std::string("MaxEigenvecY") )
+  else if( operation == std::string("PerpendicularDiffusivity") )
     {
-    math->SetOperationToMaxEigenvecY();
+    return vtkDiffusionTensorMathematics::VTK_TENS_PERPENDICULAR_DIFFUSIVITY;
     }
-  else if( operation == std::string("MaxEigenvecZ") )
+  else if( operation == std::string("MeanDiffusivity") )
     {
-    math->SetOperationToMaxEigenvecZ();
+    return vtkDiffusionTensorMathematics::VTK_TENS_MEAN_DIFFUSIVITY;
     }
+  return -1;
+}
 
-  else if( operation == std::string("D11") )
-    {
-    math->SetOperationToD11();
-    }
-  else if( operation == std::string("D22") )
-    {
-    math->SetOperationToD22();
-    }
-  else if( operation == std::string("D33") )
-    {
-    math->SetOperationToD33();
-    }
-  else if( operation == std::string("ParallelDiffusivity") )
-    {
-    math->SetOperationToParallelDiffusivity();
-    }
-  else if( operation == std::string("PerpendicularDiffusivity") )
+// Measurement of a tensor from the tensor and its eigenvalues, as computed
+// by vtkDiffusionTensorMathematics
+double computeMeasurement(int operation, double tensor[3][3], double w[3])
+{
+  switch( operation )
+    {
+    case vtkDiffusionTensorMathematics::VTK_TENS_TRACE:
+      return tensor[0][0] + tensor[1][1] + tensor[2][2];
+    case vtkDiffusionTensorMathematics::VTK_TENS_DETERMINANT:
+      return vtkMath::Determinant3x3(tensor);
+    case vtkDiffusionTensorMathematics::VTK_TENS_RELATIVE_ANISOTROPY:
+      return vtkDiffusionTensorMathematics::RelativeAnisotropy(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_FRACTIONAL_ANISOTROPY:
+      return vtkDiffusionTensorMathematics::FractionalAnisotropy(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_MODE:
+      return vtkDiffusionTensorMathematics::Mode(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_LINEAR_MEASURE:
+      return vtkDiffusionTensorMathematics::LinearMeasure(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_PLANAR_MEASURE:
+      return vtkDiffusionTensorMathematics::PlanarMeasure(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_SPHERICAL_MEASURE:
+      return vtkDiffusionTensorMathematics::SphericalMeasure(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_MIN_EIGENVALUE:
+      return w[2];
+    case vtkDiffusionTensorMathematics::VTK_TENS_MID_EIGENVALUE:
+      return w[1];
+    case vtkDiffusionTensorMathematics::VTK_TENS_MAX_EIGENVALUE:
+    case vtkDiffusionTensorMathematics::VTK_TENS_PARALLEL_DIFFUSIVITY:
+      return w[0];
+    case vtkDiffusionTensorMathematics::VTK_TENS_PERPENDICULAR_DIFFUSIVITY:
+      return 0.5 * (w[1] + w[2]);
+    case vtkDiffusionTensorMathematics::VTK_TENS_MEAN_DIFFUSIVITY:
+      return (w[0] + w[1] + w[2]) / 3;
+    }
+  return 0.0;
+}
+
+int main( int argc, char * argv[] )
+{
+  itk::FloatingPointExceptions::Disable();
+
+  PARSE_ARGS;
+
+  // The measurement of the output volume, then the additional measurements
+  std::vector<std::string> measurements(1, operation);
+  std::vector<std::string> outputs(1, outputScalar);
+  if( operations.size() != outputScalars.size() )
     {
-    math->SetOperationToPerpendicularDiffusivity();
+    std::cerr << argv[0] << ": " << operations.size() << " operations for "
+              << outputScalars.size() << " output volumes" << std::endl;
+    return EXIT_FAILURE;
     }
-  else if( operation == std::string("MeanDiffusivity") )
+  measurements.insert(measurements.end(), operations.begin(), operations.end());
+  outputs.insert(outputs.end(), outputScalars.begin(), outputScalars.end());
+
+  std::vector<int> measurementOperations;
+  bool needEigenvalues = false;
+  for( size_t i = 0; i < measurements.size(); i++ )
     {
-    math->SetOperationToMeanDiffusivity();
+    int measurementOperation = getOperation(measurements[i]);
+    if( measurementOperation < 0 )
+      {
+      std::cerr << argv[0] << ": Operation " << measurements[i] << " not supported" << std::endl;
+      return EXIT_FAILURE;
+      }
+    measurementOperations.push_back(measurementOperation);
+    needEigenvalues = needEigenvalues ||
+      (measurementOperation != vtkDiffusionTensorMathematics::VTK_TENS_TRACE &&
+       measurementOperation != vtkDiffusionTensorMathematics::VTK_TENS_DETERMINANT);
     }
-  else
+
+  // The tensor volume is read once for all the measurements
+  vtkNew<vtkTeemNRRDReader> reader;
+  reader->SetFileName(inputVolume.c_str() );
+  reader->Update();
+
+  vtkImageData *tensorImage = reader->GetOutput();
+  vtkDataArray *tensors = tensorImage->GetPointData()->GetTensors();
+  if( tensors == NULL )
     {
-    std::cerr << argv[0] << ": Operation " << operation << "not supported" << std::endl;
+    std::cerr << argv[0] << ": No tensor data" << std::endl;
     return EXIT_FAILURE;
     }
 
-  math->Update();
+  // One scalar volume per measurement, with the geometry of the tensors
+  vtkIdType numberOfVoxels = tensors->GetNumberOfTuples();
+  std::vector<vtkSmartPointer<vtkImageData> > scalarImages;
+  std::vector<float *> scalars;
+  for( size_t i = 0; i < measurements.size(); i++ )
+    {
+    vtkNew<vtkFloatArray> scalarArray;
+    scalarArray->SetName(measurements[i].c_str());
+    scalarArray->SetNumberOfTuples(numberOfVoxels);
+    scalars.push_back(scalarArray->GetPointer(0));
+
+    vtkSmartPointer<vtkImageData> scalarImage = vtkSmartPointer<vtkImageData>::New();
+    scalarImage->CopyStructure(tensorImage);
+    scalarImage->GetPointData()->SetScalars(scalarArray.GetPointer());
+    scalarImages.push_back(scalarImage);
+    }
+
+  // All the measurements of a voxel are computed from one eigen
+  // decomposition of its tensor
+  size_t numberOfMeasurements = measurementOperations.size();
+  vtkSMPTools::For(0, numberOfVoxels, [&](vtkIdType begin, vtkIdType end)
+    {
+    double tensor[3][3];
+    double *m[3], w[3] = {0.0, 0.0, 0.0}, *v[3];
+    double m0[3], m1[3], m2[3];
+    double v0[3], v1[3], v2[3];
+    m[0] = m0; m[1] = m1; m[2] = m2;
+    v[0] = v0; v[1] = v1; v[2] = v2;
+    for( vtkIdType voxel = begin; voxel < end; voxel++ )
+      {
+      tensors->GetTuple(voxel, (double *)tensor);
+      if( needEigenvalues )
+        {
+        for( int j = 0; j < 3; j++ )
+          {
+          for( int k = 0; k < 3; k++ )
+            {
+            m[k][j] = tensor[j][k];
+            }
+          }
+        vtkDiffusionTensorMathematics::TeemEigenSolver(m, w, v);
+        // Correct for negative eigenvalues
+        vtkDiffusionTensorMathematics::FixNegativeEigenvaluesMethod(w);
+        }
+      for( size_t i = 0; i < numberOfMeasurements; i++ )
+        {
+        scalars[i][voxel] = static_cast<float>(computeMeasurement(measurementOperations[i], tensor, w));
+        }
+      }
+    });
 
-  // Save result
-  vtkTeemNRRDWriter *writer = vtkTeemNRRDWriter::New();
-  writer->SetInputConnection(math->GetOutputPort() );
-  writer->SetFileName( outputScalar.c_str() );
-  writer->UseCompressionOn();
   // Compute IjkToRas (used by Writer)
-  reader->GetRasToIjkMatrix()->Invert();
-  writer->SetIJKToRASMatrix( reader->GetRasToIjkMatrix() );
-  writer->Write();
+  vtkNew<vtkMatrix4x4> ijkToRas;
+  ijkToRas->DeepCopy(reader->GetRasToIjkMatrix());
+  ijkToRas->Invert();
 
-  reader->Delete();
-  writer->Delete();
-  math->Delete();
+  for( size_t i = 0; i < measurements.size(); i++ )
+    {
+    // Save result
+    vtkNew<vtkTeemNRRDWriter> writer;
+    writer->SetInputData(scalarImages[i]);
+    writer->SetFileName( outputs[i].c_str() );
+    writer->UseCompressionOn();
+    writer->SetIJKToRASMatrix( ijkToRas.GetPointer() );
+    writer->Write();
+    }
 
   return EXIT_SUCCESS;
 }
@@ -1,5 +1,6 @@
 #!/usr/bin/env python-real
 
+import os
 import sys
 import argparse
 
@@ -11,6 +12,10 @@ from vtk.util import numpy_support
 if sys.version_info[0] == 2:
   range = xrange
 
+# DMRIPluginsLib is installed with the scripted modules of the extension
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'qt-scripted-modules'))
+from DMRIPluginsLib import GradientTable, detect_shells
+
 def runtests(testdata_path):
   # - runs this script again with test arguments and data
   # - validates the results
@@ -36,6 +41,12 @@ def runtests(testdata_path):
       print("ExtractDWIShells failed!")
       sys.exit(-1)
 
+    return load_bvals(tempdata)
+
+  def load_bvals(tempdata):
+    """
+    returns array of bvalues of a written NRRD
+    """
     # load NRRD into Slicer
     sn = slicer.vtkMRMLNRRDStorageNode()
     sn.SetFileName(tempdata)
@@ -82,11 +93,104 @@ def runtests(testdata_path):
 
     numpy.testing.assert_allclose(bvals, bvals_expected, rtol=1e-5)
 
+  def test3_multiple_outputs():
+    """
+    Test writing several shells from one read of the input with '--extract',
+    in both the two argument and the BVALUES:OUTPUTDWI forms
+    """
+
+    testdata = os.path.join(testdata_path, "3x3x3_13_b1000_b3000.nrrd")
+    tmp_nrrd_out1 = shlex_quote(tempfile.mkstemp(suffix=".nrrd")[1])
+    tmp_nrrd_out2 = shlex_quote(tempfile.mkstemp(suffix=".nrrd")[1])
+    tmp_nrrd_out3 = shlex_quote(tempfile.mkstemp(suffix=".nrrd")[1])
+
+    call_args = ["--inputDWI", testdata,
+                 "--tolerance", "50",
+                 "--extract", "0,1000", tmp_nrrd_out1,
+                 "--extract", "3000:" + tmp_nrrd_out2,
+                 "--extract", "0+1000+3000", tmp_nrrd_out3]
+
+    args = [sys.executable, sys.argv[0]] + call_args
+
+    bvals = run_extract_to_bvals(tmp_nrrd_out1, args)
+    bvals_expected = np.array([0, 1000, 1000, 1000, 1000, 1000, 1000], dtype=np.float64)
+    numpy.testing.assert_allclose(bvals, bvals_expected, rtol=1e-05)
+
+    bvals = load_bvals(tmp_nrrd_out2)
+    bvals_expected = np.array([3000, 3000, 3000, 3000, 3000, 3000], dtype=np.float64)
+    numpy.testing.assert_allclose(bvals, bvals_expected, rtol=1e-05)
+
+    bvals = load_bvals(tmp_nrrd_out3)
+    bvals_expected = np.array([0, 1000, 1000, 1000, 1000, 1000, 1000, 3000, 3000, 3000, 3000, 3000, 3000], dtype=np.float64)
+    numpy.testing.assert_allclose(bvals, bvals_expected, rtol=1e-05)
+
+  def test4_auto_shells():
+    """
+    Test shell detection with '--auto_shells'
+    """
+
+    testdata = os.path.join(testdata_path, "3x3x3_13_b1000_b3000.nrrd")
+    tmp_dir = tempfile.mkdtemp()
+    output_pattern = os.path.join(tmp_dir, "shell_b{bvalue}.nrrd")
+
+    call_args = ["--inputDWI", testdata,
+                 "--tolerance", "50",
+                 "--auto_shells",
+                 "--auto_shells_output", output_pattern]
+
+    args = [sys.executable, sys.argv[0]] + call_args
+
+    bvals = run_extract_to_bvals(output_pattern.format(bvalue=1000), args)
+    bvals_expected = np.array([0, 1000, 1000, 1000, 1000, 1000, 1000], dtype=np.float64)
+    numpy.testing.assert_allclose(bvals, bvals_expected, rtol=1e-05)
+
+    bvals = load_bvals(output_pattern.format(bvalue=3000))
+    bvals_expected = np.array([0, 3000, 3000, 3000, 3000, 3000, 3000], dtype=np.float64)
+    numpy.testing.assert_allclose(bvals, bvals_expected, rtol=1e-05)
+
+    tmp_nrrd_out = os.path.join(tmp_dir, "highest.nrrd")
+    call_args = ["--inputDWI", testdata,
+                 "--tolerance", "50",
+                 "--auto_shells",
+                 "--auto_shells_select", "highest",
+                 "--auto_shells_output", tmp_nrrd_out]
+
+    args = [sys.executable, sys.argv[0]] + call_args
+
+    bvals = run_extract_to_bvals(tmp_nrrd_out, args)
+    bvals_expected = np.array([0, 3000, 3000, 3000, 3000, 3000, 3000], dtype=np.float64)
+    numpy.testing.assert_allclose(bvals, bvals_expected, rtol=1e-05)
+
+  def test5_disable_streaming():
+    """
+    Test loading the input as a volume node with '--disable_streaming'
+    """
+
+    testdata = os.path.join(testdata_path, "3x3x3_13_b1000_b3000.nrrd")
+    tmp_nrrd_out = shlex_quote(tempfile.mkstemp(suffix=".nrrd")[1])
+
+    call_args = ["--inputDWI", testdata,
+                 "--outputDWI", tmp_nrrd_out,
+                 "--bvalues", "0,1000,3000",
+                 "--tolerance", "50",
+                 "--baseline_clamp", "1005",
+                 "--disable_streaming"]
+
+    args = [sys.executable, sys.argv[0]] + call_args
+
+    bvals = run_extract_to_bvals(tmp_nrrd_out, args)
+    bvals_expected = np.array([0, 0,0,0,0,0,0, 3000,3000,3000,3000,3000,3000], dtype=np.float64)
+
+    numpy.testing.assert_allclose(bvals, bvals_expected, rtol=1e-5)
+
   #############################################################################
   # end of test harness definitions
   try:
     test1()
     test2_clamp_grads()
+    test3_multiple_outputs()
+    test4_auto_shells()
+    test5_disable_streaming()
     sys.exit(0) # success
   except:
     raise
@@ -95,87 +199,214 @@ def runtests(testdata_path):
   sys.exit(-1)
 
 
-def main():
-  if "--test" in sys.argv:
-    runtests(sys.argv[2])
-    sys.exit(-1) # default fail, runtests must exit(0)
-
-  # handle arguments
-  parser = argparse.ArgumentParser('Process args')
-  parser.add_argument('--inputDWI', required=True, type=str)
-  parser.add_argument('--bvalues', required=True, type=str)
-  parser.add_argument('--tolerance', required=True, type=float)
-  parser.add_argument('--outputDWI', required=True, type=str)
-  parser.add_argument('--baseline_clamp', required=False, type=str)
-  parser.add_argument('--test')
-  args = parser.parse_args(sys.argv[1:])
-
-  dwifile = args.inputDWI
-  outfile = args.outputDWI
-  target_bvals = [float(bvalue) for bvalue in args.bvalues.split(',')]
-  if args.baseline_clamp:
-    bval_clamp = float(args.baseline_clamp)
-  bval_tolerance = args.tolerance
-
-  # load data
-  sn = slicer.vtkMRMLNRRDStorageNode()
-  sn.SetFileName(dwifile)
-  node_in = mrml.vtkMRMLDiffusionWeightedVolumeNode()
-  print(f"loading: {dwifile}")
-  sn.ReadData(node_in)
-  dwi_in = slicer.util.arrayFromVolume(node_in)
-
-  # sanity check that the last axis is volumes
-  assert (node_in.GetNumberOfGradients() == dwi_in.shape[-1]), "Number of gradients do not match the size of last image axis!"
-
-  bvals_in = numpy_support.vtk_to_numpy(node_in.GetBValues())
-  grads_in = numpy_support.vtk_to_numpy(node_in.GetDiffusionGradients())
-
-  print("  raw input gradients: ")
-  print(f"{grads_in}")
-  print("  raw input bvals: ")
-  print(f"{bvals_in}")
-
-  for (i, g) in enumerate(grads_in):
-    norm = np.linalg.norm(g)
-    if norm > 1e-6: grads_in[i] = g * 1/norm
+def select_indices(bvals, target_bvals, tolerance):
+  """
+  returns the indices of the volumes with a b value within tolerance of any target
+  """
+  distance = np.abs(bvals[:, np.newaxis] - np.asarray(target_bvals)[np.newaxis, :])
+  return np.flatnonzero(np.any(distance < tolerance, axis=1))
+
+
+def auto_shell_extractions(bvals, tolerance, b0_threshold, select, count, output_pattern):
+  """
+  clusters the b values into shells and returns (indices, outfile) pairs for the selected shells
+  """
+  centers, labels = detect_shells(bvals, tolerance)
+  print("detected shells:")
+  for (shell, center) in enumerate(centers):
+    shell_bvals = bvals[labels == shell]
+    print(f"  b={center:.0f}: {shell_bvals.size} volumes (b values {shell_bvals.min():g} to {shell_bvals.max():g})")
+
+  baseline_shells = np.flatnonzero(centers <= b0_threshold)
+  weighted_shells = np.flatnonzero(centers > b0_threshold)
+  if select == 'lowest':
+    weighted_shells = weighted_shells[:count]
+  elif select == 'highest':
+    weighted_shells = weighted_shells[-count:] if count > 0 else weighted_shells[:0]
+  print(f"selected shells: {[round(center) for center in centers[weighted_shells]]}")
+
+  # each output holds the baseline volumes and its shell(s), in input order
+  if '{bvalue}' in output_pattern:
+    groups = [(output_pattern.format(bvalue=round(centers[shell])), [shell]) for shell in weighted_shells]
+  else:
+    groups = [(output_pattern, list(weighted_shells))]
+  return [(np.flatnonzero(np.isin(labels, np.concatenate((baseline_shells, shells)))), outfile)
+          for (outfile, shells) in groups]
+
+
+NRRD_TYPES = {
+  'signed char': 'i1', 'int8': 'i1', 'int8_t': 'i1',
+  'uchar': 'u1', 'unsigned char': 'u1', 'uint8': 'u1', 'uint8_t': 'u1',
+  'short': 'i2', 'short int': 'i2', 'signed short': 'i2', 'signed short int': 'i2', 'int16': 'i2', 'int16_t': 'i2',
+  'ushort': 'u2', 'unsigned short': 'u2', 'unsigned short int': 'u2', 'uint16': 'u2', 'uint16_t': 'u2',
+  'int': 'i4', 'signed int': 'i4', 'int32': 'i4', 'int32_t': 'i4',
+  'uint': 'u4', 'unsigned int': 'u4', 'uint32': 'u4', 'uint32_t': 'u4',
+  'float': 'f4', 'double': 'f8',
+}
+
+
+class RawNrrdDWI(object):
+  """
+  header of a DWI NRRD file with an uncompressed data block that can be memory-mapped
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.lines = []
+    self.fields = {}
+    self.gradient_lines = {}
+
+    with open(path, 'rb') as f:
+      magic = f.readline()
+      if not magic.startswith(b'NRRD'):
+        raise ValueError("not a NRRD file")
+      self.lines.append(magic.decode('ascii').rstrip('\r\n'))
+      for raw_line in f:
+        line = raw_line.decode('latin-1').rstrip('\r\n')
+        if not line:
+          break
+        self.lines.append(line)
+        if line.startswith('#'):
+          continue
+        if ':=' in line:
+          key, value = line.split(':=', 1)
+          if key.startswith('DWMRI_gradient_'):
+            self.gradient_lines[int(key[len('DWMRI_gradient_'):])] = value
+          elif key.startswith('DWMRI_NEX_'):
+            raise ValueError("DWMRI_NEX_ keys are not supported")
+          else:
+            self.fields[key] = value
+        elif ': ' in line:
+          key, value = line.split(': ', 1)
+          self.fields[key.lower()] = value.strip()
+      self.data_offset = f.tell()
+
+    if self.fields.get('encoding', 'raw') != 'raw':
+      raise ValueError(f"encoding is {self.fields['encoding']}")
+    if int(self.fields.get('line skip', 0)) or int(self.fields.get('byte skip', 0)):
+      raise ValueError("line skip and byte skip are not supported")
+    self.data_path = path
+    if 'data file' in self.fields:
+      self.data_path = os.path.join(os.path.dirname(path), self.fields['data file'])
+      self.data_offset = 0
+    if self.fields.get('type') not in NRRD_TYPES:
+      raise ValueError(f"unsupported type {self.fields.get('type')}")
+    self.dtype = np.dtype(NRRD_TYPES[self.fields['type']])
+    if self.dtype.itemsize > 1:
+      self.dtype = self.dtype.newbyteorder('>' if self.fields.get('endian') == 'big' else '<')
+
+    # NRRD sizes are listed from the fastest to the slowest axis
+    self.sizes = [int(size) for size in self.fields['sizes'].split()]
+    kinds = self.fields.get('kinds', '').split()
+    list_axes = [axis for (axis, kind) in enumerate(kinds) if kind not in ('domain', 'space')]
+    if len(self.sizes) != 4 or len(list_axes) != 1 or list_axes[0] not in (0, 3):
+      raise ValueError("gradient axis must be the first or last of 4")
+    self.gradient_axis = list_axes[0]
+    self.num_volumes = self.sizes[self.gradient_axis]
+    if sorted(self.gradient_lines) != list(range(self.num_volumes)):
+      raise ValueError("DWMRI_gradient_ keys do not match the number of volumes")
+
+    # b value of each volume is scaled by the squared gradient norm
+    raw_gradients = np.array([[float(c) for c in self.gradient_lines[i].split()] for i in range(self.num_volumes)])
+    self.gradients = raw_gradients
+    self.bvals = float(self.fields['DWMRI_b-value']) * np.sum(raw_gradients ** 2, axis=1)
+
+  def memmap(self):
+    """
+    returns the data block as a read-only array indexed like the NRRD axes in reverse order
+    """
+    return np.memmap(self.data_path, dtype=self.dtype, mode='r', offset=self.data_offset,
+                     shape=tuple(reversed(self.sizes)))
 
-  # select the indices to keep based on b value
-  indices = []
-  for (i, bval) in enumerate(bvals_in):
-    for check_bval in target_bvals:
-      if abs(bval - check_bval) < bval_tolerance:
-        indices.append(i)
 
-  print(f"selected indices: {indices}")
+def read_raw_nrrd_dwi(path):
+  """
+  returns a RawNrrdDWI for path, or None if it cannot be streamed
+  """
+  if not path.endswith(('.nrrd', '.nhdr')):
+    return None
+  try:
+    header = RawNrrdDWI(path)
+    # the data block must be complete, or the memory map would fail or read past it
+    data_size = int(np.prod(header.sizes)) * header.dtype.itemsize
+    file_size = os.path.getsize(header.data_path)
+    if file_size < header.data_offset + data_size:
+      raise ValueError(f"{header.data_path} has {file_size} bytes, "
+                       f"expected {header.data_offset + data_size}")
+    return header
+  except (ValueError, KeyError, OSError) as e:
+    print(f"  not streaming {path}: {e}")
+    return None
+
+
+def write_subset_streaming(header, table_in, indices, outfile, bval_clamp=None):
+  """
+  copies the volumes of a memory-mapped NRRD selected by indices (in that order) to outfile
+  """
+  sizes_out = list(header.sizes)
+  sizes_out[header.gradient_axis] = len(indices)
+  print(f"output sizes: {sizes_out}")
+
+  gradient_lines = [header.gradient_lines[index] for index in indices]
+  bvals_out = table_in.bvals[indices]
+  if bval_clamp is not None:
+    for (i, bval) in enumerate(bvals_out):
+      if bval < bval_clamp:
+        print(f"  clamping baseline {bval} (gradient {gradient_lines[i]}) to zero")
+        gradient_lines[i] = '0 0 0'
+        bvals_out[i] = 0
+  print(f"selected bvals: {bvals_out}")
 
+  # header: the input header with new sizes and gradients, data attached
+  skipped = ('data file', 'line skip', 'byte skip')
+  header_lines = []
+  for line in header.lines:
+    key = line.split(':', 1)[0]
+    if key.startswith('DWMRI_gradient_') or key.lower() in skipped:
+      continue
+    if key.lower() == 'sizes':
+      line = 'sizes: ' + ' '.join(str(size) for size in sizes_out)
+    header_lines.append(line)
+  header_lines += [f"DWMRI_gradient_{i:04d}:={line}" for (i, line) in enumerate(gradient_lines)]
+
+  data = header.memmap()
+  print(f"writing: {outfile}")
+  with open(outfile, 'wb') as f:
+    f.write(('\n'.join(header_lines) + '\n\n').encode('latin-1'))
+    if header.gradient_axis == 3:
+      # volumes are contiguous: copy them one at a time
+      for index in indices:
+        f.write(data[index].tobytes())
+    else:
+      # gradients are interleaved per voxel: gather them in blocks of about one volume
+      voxels = data.reshape(-1, header.num_volumes)
+      block = max(1, voxels.shape[0] // header.num_volumes)
+      for start in range(0, voxels.shape[0], block):
+        f.write(voxels[start:start + block][:, indices].tobytes())
+
+
+def write_subset(node_in, dwi_in, table_in, indices, outfile, bval_clamp=None):
+  """
+  writes the volumes of node_in selected by indices (in that order) to outfile
+  """
   # output shape: (3d_vol_shape..., num_indices)
   num_indices = len(indices)
   shape_out = dwi_in.shape[:-1] + (num_indices,)
-  print(f"input shape: {dwi_in.shape}")
   print(f"output shape: {shape_out}")
 
-  # construct output subset
-  vol_out = np.zeros(shape_out, dtype=dwi_in.dtype)
-  grads_out = np.zeros((num_indices, 3))
-  bvals_out = np.zeros(num_indices)
-
-  for (new_i, index) in enumerate(indices):
-    vol_out[:,:,:,new_i] = dwi_in[:,:,:,index]
-    grads_out[new_i, :]  = grads_in[index,:]
-    bvals_out[new_i]     = bvals_in[index]
-
-  if args.baseline_clamp:
-    for (i, bval) in enumerate(bvals_out):
-      if bval < bval_clamp:
-        print(f"  clamping baseline {bval} (gradient {grads_out[i, :]}) to zero")
-        bvals_out[i] = 0
-        grads_out[i, :] = np.array([0.,0.,0.])
+  table_out = table_in.subset(indices)
+  grads_out = table_out.gradients
+  bvals_out = table_out.bvals
 
+  if bval_clamp is not None:
+    clamped = bvals_out < bval_clamp
+    for (bval, grad) in zip(bvals_out[clamped], grads_out[clamped]):
+      print(f"  clamping baseline {bval} (gradient {grad}) to zero")
+    bvals_out[clamped] = 0
+    grads_out[clamped] = 0.
 
   print(f"selected bvals: {bvals_out}")
   print(f"  grads_out shape:  {grads_out.shape}")
-  print(f"  vol_out shape:    {vol_out.shape}")
   print(f"  output gradients: {grads_out}")
 
   # write output
@@ -191,15 +422,133 @@ def main():
   for i in range(0, attrs.GetNumberOfValues()):
     node_out.SetAttribute(attrs.GetValue(i), None)
 
-  # reset the data array to force resizing, otherwise we will just keep the old data too
-  node_out.SetAndObserveImageData(None)
-  slicer.util.updateVolumeFromArray(node_out, vol_out)
-  node_out.SetNumberOfGradients(num_indices)
-  node_out.SetBValues(numpy_support.numpy_to_vtk(bvals_out))
-  node_out.SetDiffusionGradients(numpy_support.numpy_to_vtk(grads_out))
+  if np.array_equal(indices, np.arange(dwi_in.shape[-1])):
+    # every volume is kept in the original order: share the input voxels
+    node_out.SetAndObserveImageData(node_in.GetImageData())
+  else:
+    # reset the data array to force resizing, otherwise we will just keep the old data too
+    node_out.SetAndObserveImageData(None)
+    # gather all selected volumes at once
+    slicer.util.updateVolumeFromArray(node_out, dwi_in[..., indices])
+  table_out.apply_to_node(node_out)
   node_out.Modified()
 
+  print(f"writing: {outfile}")
   sn_out.WriteData(node_out)
 
+
+def main():
+  if "--test" in sys.argv:
+    runtests(sys.argv[2])
+    sys.exit(-1) # default fail, runtests must exit(0)
+
+  # handle arguments
+  parser = argparse.ArgumentParser('Process args')
+  parser.add_argument('--inputDWI', required=True, type=str)
+  parser.add_argument('--bvalues', required=False, type=str)
+  parser.add_argument('--tolerance', required=True, type=float)
+  parser.add_argument('--outputDWI', required=False, type=str)
+  parser.add_argument('--extract', required=False, nargs='+', action='append', default=[],
+                      metavar='BVALUES OUTPUTDWI',
+                      help='b values separated by "+" (or commas on the command line) and output path, '
+                           'as two arguments or as one BVALUES:OUTPUTDWI argument; '
+                           'may be repeated to write several outputs from one read of the input')
+  parser.add_argument('--auto_shells', action='store_true',
+                      help='Cluster the b values into shells (values within --tolerance of their neighbors are grouped) and extract them')
+  parser.add_argument('--auto_shells_select', choices=['all', 'lowest', 'highest'], default='all',
+                      help='Extract all detected shells or only the --auto_shells_count lowest or highest ones')
+  parser.add_argument('--auto_shells_count', type=int, default=1)
+  parser.add_argument('--auto_shells_output', type=str,
+                      help='Output path; a {bvalue} placeholder writes one output per shell, otherwise all selected shells go in one output')
+  parser.add_argument('--b0_threshold', type=float, default=50.,
+                      help='Shells with a mean b value at or below this are baselines, included in every automatic output')
+  parser.add_argument('--baseline_clamp', required=False, type=str)
+  parser.add_argument('--disable_streaming', action='store_true',
+                      help='Always load the input as a volume node, even when a raw NRRD could be memory-mapped')
+  parser.add_argument('--test')
+  args = parser.parse_args(sys.argv[1:])
+
+  dwifile = args.inputDWI
+  extractions = []
+  for extract in args.extract:
+    if len(extract) == 1 and ':' in extract[0]:
+      # b values never contain ':', so the first one ends them even if the path has a drive letter
+      extract = extract[0].split(':', 1)
+    if len(extract) != 2:
+      parser.error(f"--extract expects b values and an output path, got {extract}")
+    extractions.append(tuple(extract))
+  if args.bvalues or args.outputDWI:
+    if not (args.bvalues and args.outputDWI):
+      parser.error("--bvalues and --outputDWI must be given together")
+    extractions.insert(0, (args.bvalues, args.outputDWI))
+  if args.auto_shells and not args.auto_shells_output:
+    parser.error("--auto_shells requires --auto_shells_output")
+  if not extractions and not args.auto_shells:
+    parser.error("either --bvalues and --outputDWI, --extract or --auto_shells is required")
+  bval_clamp = float(args.baseline_clamp) if args.baseline_clamp else None
+  bval_tolerance = args.tolerance
+
+  # raw NRRD inputs are memory-mapped and streamed to .nrrd outputs volume by volume
+  outfiles = [outfile for (bvalues, outfile) in extractions]
+  if args.auto_shells:
+    outfiles.append(args.auto_shells_output)
+  header = None
+  if not args.disable_streaming and all(outfile.endswith('.nrrd') for outfile in outfiles):
+    header = read_raw_nrrd_dwi(dwifile)
+
+  if header is not None:
+    print(f"memory-mapping: {header.data_path}")
+    num_volumes = header.num_volumes
+    table_in = GradientTable(header.bvals, header.gradients)
+    raw_gradients = header.gradients
+    print(f"input sizes: {header.sizes}")
+
+    def write(indices, outfile):
+      write_subset_streaming(header, table_in, indices, outfile, bval_clamp)
+  else:
+    # load data
+    sn = slicer.vtkMRMLNRRDStorageNode()
+    sn.SetFileName(dwifile)
+    node_in = mrml.vtkMRMLDiffusionWeightedVolumeNode()
+    print(f"loading: {dwifile}")
+    sn.ReadData(node_in)
+    dwi_in = slicer.util.arrayFromVolume(node_in)
+    num_volumes = dwi_in.shape[-1]
+
+    # sanity check that the last axis is volumes
+    assert (node_in.GetNumberOfGradients() == num_volumes), "Number of gradients do not match the size of last image axis!"
+
+    table_in = GradientTable.from_node(node_in)
+    raw_gradients = numpy_support.vtk_to_numpy(node_in.GetDiffusionGradients())
+    print(f"input shape: {dwi_in.shape}")
+
+    def write(indices, outfile):
+      write_subset(node_in, dwi_in, table_in, indices, outfile, bval_clamp)
+
+  print("  raw input gradients: ")
+  print(f"{raw_gradients}")
+  print("  raw input bvals: ")
+  print(f"{table_in.bvals}")
+
+  table_in.validate(numberOfVolumes=num_volumes, shellTolerance=bval_tolerance)
+
+  selections = []
+  for (bvalues, outfile) in extractions:
+    # Slicer splits the values of a multiple parameter on commas, so '+' also separates b values
+    target_bvals = [float(bvalue) for bvalue in bvalues.replace('+', ',').split(',') if bvalue.strip()]
+
+    # select the indices to keep based on b value
+    indices = select_indices(table_in.bvals, target_bvals, bval_tolerance)
+    print(f"selected indices for b values {target_bvals}: {indices.tolist()}")
+    selections.append((indices, outfile))
+
+  if args.auto_shells:
+    selections += auto_shell_extractions(table_in.bvals, bval_tolerance, args.b0_threshold,
+                                         args.auto_shells_select, args.auto_shells_count,
+                                         args.auto_shells_output)
+
+  for (indices, outfile) in selections:
+    write(indices, outfile)
+
 if __name__ == '__main__':
   main()
@@ -7,6 +7,9 @@
 // vtkITK includes
 #include <vtkITKArchetypeImageSeriesScalarReader.h>
 
+// vtkTeem includes
+#include <vtkDiffusionTensorMathematics.h>
+
 // VTK includes
 #include <vtkCellArray.h>
 #include <vtkFloatArray.h>
@@ -19,6 +22,7 @@
 #include <vtkPolyData.h>
 #include <vtkPolyDataWriter.h>
 #include <vtkPolyDataPointSampler.h>
+#include <vtkSMPTools.h>
 #include <vtkSmartPointer.h>
 #include <vtkStreamingDemandDrivenPipeline.h>
 #include <vtkTimerLog.h>
@@ -35,7 +39,11 @@
 // STD includes
 #include <iostream>
 #include <algorithm>
+#include <fstream>
+#include <map>
+#include <sstream>
 #include <string>
+#include <vector>
 
 void write_output(std::string fname, vtkPolyData* polydata)
 {
@@ -64,43 +72,375 @@ typedef enum _operation {
   op_AND
 } Operation;
 
-int main( int argc, char * argv[] )
+bool parse_operation(const std::string &name, Operation &operation)
 {
-  PARSE_ARGS;
-
-  try
-  {
-  // Label operations
-  Operation includeOperation = op_OR;
-  if (PassOperation == std::string("OR"))
+  if (name == std::string("OR"))
     {
-    includeOperation = op_OR;
+    operation = op_OR;
     }
-  else if (PassOperation == std::string("AND"))
+  else if (name == std::string("AND"))
     {
-    includeOperation = op_AND;
+    operation = op_AND;
     }
   else
     {
-    std::cerr << "unknown include operation";
-    return EXIT_FAILURE;
+    return false;
     }
+  return true;
+}
 
-  Operation excludeOperation = op_OR;
-  if (NoPassOperation == std::string("OR"))
+// One selection: the fibers passing or not passing through labels
+struct LabelQuery
+{
+  std::string Name;
+  std::vector<int> PassLabel;
+  Operation PassOperation;
+  std::vector<int> NotPassLabel;
+  Operation NotPassOperation;
+  std::string OutputFibers;
+};
+
+// Parse a list of labels separated by spaces
+bool parse_labels(const std::string &field, std::vector<int> &labels)
+{
+  std::istringstream stream(field);
+  int label;
+  while (stream >> label)
     {
-    excludeOperation = op_OR;
+    labels.push_back(label);
     }
-  else if (NoPassOperation == std::string("AND"))
+  return stream.eof();
+}
+
+// Read the queries of a query file, one per line:
+//   name, pass labels, pass operation, not pass labels, not pass operation
+// Labels are separated by spaces, empty lines and lines starting with #
+// are ignored. The output of a query is written in outputDirectory, in
+// a file named after the query.
+bool read_queries(const std::string &fileName, const std::string &outputDirectory,
+                  const std::string &extension, std::vector<LabelQuery> &queries)
+{
+  std::ifstream queryFile(fileName.c_str());
+  if (queryFile.fail())
     {
-    excludeOperation = op_AND;
+    std::cerr << "Unable to read query file: " << fileName << std::endl;
+    return false;
     }
-  else
+
+  std::string line;
+  int lineNumber = 0;
+  while (std::getline(queryFile, line))
+    {
+    lineNumber++;
+    line = vtksys::SystemTools::TrimWhitespace(line);
+    if (line.empty() || line[0] == '#')
+      {
+      continue;
+      }
+
+    std::vector<std::string> fields;
+    std::istringstream stream(line);
+    std::string field;
+    while (std::getline(stream, field, ','))
+      {
+      fields.push_back(vtksys::SystemTools::TrimWhitespace(field));
+      }
+
+    LabelQuery query;
+    if (fields.size() != 5 || fields[0].empty() ||
+        !parse_labels(fields[1], query.PassLabel) ||
+        !parse_operation(fields[2], query.PassOperation) ||
+        !parse_labels(fields[3], query.NotPassLabel) ||
+        !parse_operation(fields[4], query.NotPassOperation))
+      {
+      std::cerr << fileName << ":" << lineNumber << ": invalid query: " << line << std::endl;
+      return false;
+      }
+    query.Name = fields[0];
+    query.OutputFibers = outputDirectory + "/" + query.Name + extension;
+    queries.push_back(query);
+    }
+  return true;
+}
+
+// Whether a fiber is selected by a query, from the sorted labels of the
+// volume touched by the sampled points of the fiber
+bool select_fiber(const int *labels, size_t numberOfLabels, const LabelQuery &query)
+{
+  // no sampled point in the volume
+  if (numberOfLabels == 0)
+    {
+    return false;
+    }
+  const int *labelsEnd = labels + numberOfLabels;
+
+  bool nopass = false;
+  if (query.NotPassOperation == op_OR)
+    {
+    for (size_t label = 0; label < query.NotPassLabel.size() && !nopass; label++)
+      {
+      nopass = std::binary_search(labels, labelsEnd, query.NotPassLabel[label]);
+      }
+    }
+  else if (query.NotPassOperation == op_AND)
+    {
+    // all the labels at the same point
+    nopass = (query.NotPassLabel.size() > 0);
+    for (size_t label = 0; label < query.NotPassLabel.size() && nopass; label++)
+      {
+      nopass = (query.NotPassLabel[label] == query.NotPassLabel[0]);
+      }
+    nopass = nopass && std::binary_search(labels, labelsEnd, query.NotPassLabel[0]);
+    }
+  if (nopass)
+    {
+    return false;
+    }
+
+  if (query.PassLabel.size() == 0)
+    {
+    return true;
+    }
+
+  bool pass = (query.PassOperation == op_AND);
+  for (size_t label = 0; label < query.PassLabel.size(); label++)
+    {
+    bool touched = std::binary_search(labels, labelsEnd, query.PassLabel[label]);
+    if (query.PassOperation == op_OR && touched)
+      {
+      return true;
+      }
+    if (query.PassOperation == op_AND && !touched)
+      {
+      return false;
+      }
+    }
+  return pass;
+}
+
+// Write the selected lines of the input, with their point data
+void write_selection(vtkPolyData *input, const std::vector<bool> &addLines, const std::string &fname)
+{
+  vtkPoints *inPts = input->GetPoints();
+  vtkCellArray *inLines = input->GetLines();
+  vtkIdType npts=0;
+#if VTK_MAJOR_VERSION >= 9 || (VTK_MAJOR_VERSION >= 8 && VTK_MINOR_VERSION >= 90)
+  const vtkIdType*pts;
+#else
+  vtkIdType*pts=NULL;
+#endif
+  vtkIdType j;
+  double p[3];
+
+  vtkIdType numNewPts = 0;
+  vtkIdType numNewCells = 0;
+  vtkIdType inCellId;
+  for (inCellId=0, inLines->InitTraversal();
+       inLines->GetNextCell(npts,pts); inCellId++)
+    {
+    if (addLines[inCellId])
+      {
+      numNewPts += npts;
+      numNewCells++;
+      }
+    }
+
+  //Preallocate PolyData elements
+  vtkNew<vtkPolyData> outFibers;
+
+  vtkNew<vtkPoints> points;
+  points->Allocate(numNewPts);
+  outFibers->SetPoints(points.GetPointer());
+
+  vtkNew<vtkCellArray> outFibersCellArray;
+  outFibersCellArray->Allocate(numNewPts+numNewCells);
+  outFibers->SetLines(outFibersCellArray.GetPointer());
+
+  // If the input has point data, including tensors or scalar arrays, copy them to the output.
+  // Currently this ignores cell data, which may be added in the future if needed.
+  // Check for point data arrays to keep and allocate them.
+  int numberArrays = input->GetPointData()->GetNumberOfArrays();
+
+  for (int arrayIdx = 0; arrayIdx < numberArrays; arrayIdx++)
+    {
+      vtkDataArray *oldArray = input->GetPointData()->GetArray(arrayIdx);
+      vtkSmartPointer<vtkFloatArray> newArray = vtkSmartPointer<vtkFloatArray>::New();
+      newArray->SetNumberOfComponents(oldArray->GetNumberOfComponents());
+      newArray->SetName(oldArray->GetName());
+      newArray->Allocate(newArray->GetNumberOfComponents()*numNewPts);
+      outFibers->GetPointData()->AddArray(newArray);
+    }
+
+  vtkIdType ptId = 0;
+
+  for (inCellId=0, inLines->InitTraversal();
+       inLines->GetNextCell(npts,pts); inCellId++)
+    {
+    if (addLines[inCellId])
+      {
+      outFibersCellArray->InsertNextCell(npts);
+      for (j=0; j < npts; j++)
+        {
+        inPts->GetPoint(pts[j],p);
+        points->InsertPoint(ptId,p);
+        outFibersCellArray->InsertCellPoint(ptId);
+
+        // Copy point data from input fiber
+        for (int arrayIdx = 0; arrayIdx < numberArrays; arrayIdx++)
+          {
+            vtkDataArray *newArray = outFibers->GetPointData()->GetArray(arrayIdx);
+            vtkDataArray *oldArray = input->GetPointData()->GetArray(newArray->GetName());
+            newArray->InsertNextTuple(oldArray->GetTuple(pts[j]));
+          }
+
+        ptId++;
+        }
+      }
+    }
+
+  // Copy array attributes from input (TENSORS, scalars, etc)
+  for (int arrayIdx = 0; arrayIdx < numberArrays; arrayIdx++)
+    {
+    int attr = input->GetPointData()->IsArrayAnAttribute(arrayIdx);
+    if (attr >= 0)
+      {
+      outFibers->GetPointData()->SetActiveAttribute(input->GetPointData()->GetArray(arrayIdx)->GetName(), attr);
+      }
+    }
+
+  write_output(fname, outFibers.GetPointer());
+}
+
+// What a fiber passes through
+struct FiberLabels
+{
+  FiberLabels() : Valid(false), StartLabel(0), EndLabel(0), Length(0.0), MeanFA(0.0) {}
+
+  bool Valid;
+  // labels of the first and last sampled points, 0 outside the volume
+  int StartLabel;
+  int EndLabel;
+  double Length;
+  double MeanFA;
+};
+
+// Write the fiber-label incidence as a sparse matrix, one row per fiber:
+// fiber index, start and end labels, and the labels touched by the fiber
+bool write_incidence(const std::string &fname, const std::vector<FiberLabels> &fibers,
+                     const std::vector<vtkIdType> &fiberLabelOffsets,
+                     const std::vector<int> &fiberLabels)
+{
+  std::ofstream ofs(fname.c_str());
+  if (ofs.fail())
+    {
+    std::cerr << "Unable to write incidence file: " << fname << std::endl;
+    return false;
+    }
+  ofs << "Fiber\tStartLabel\tEndLabel\tLabels" << std::endl;
+  for (size_t fiber = 0; fiber < fibers.size(); fiber++)
+    {
+    ofs << fiber << "\t" << fibers[fiber].StartLabel << "\t" << fibers[fiber].EndLabel << "\t";
+    for (vtkIdType idx = fiberLabelOffsets[fiber]; idx < fiberLabelOffsets[fiber + 1]; idx++)
+      {
+      ofs << (idx > fiberLabelOffsets[fiber] ? " " : "") << fiberLabels[idx];
+      }
+    ofs << std::endl;
+    }
+  return true;
+}
+
+// Write the label x label connectivity of the fibers from their end
+// labels: for each pair of labels (not 0) connected by fibers, the number
+// of fibers, their mean length and their mean FA (NAN without tensors)
+bool write_connectivity(const std::string &fname, const std::vector<FiberLabels> &fibers,
+                        bool hasFA)
+{
+  struct Connection
+  {
+    Connection() : Count(0), Length(0.0), FA(0.0) {}
+    vtkIdType Count;
+    double Length;
+    double FA;
+  };
+  std::map<std::pair<int, int>, Connection> connections;
+  for (size_t fiber = 0; fiber < fibers.size(); fiber++)
+    {
+    const FiberLabels &labels = fibers[fiber];
+    if (!labels.Valid || labels.StartLabel == 0 || labels.EndLabel == 0)
+      {
+      continue;
+      }
+    Connection &connection = connections[std::make_pair(
+      std::min(labels.StartLabel, labels.EndLabel), std::max(labels.StartLabel, labels.EndLabel))];
+    connection.Count++;
+    connection.Length += labels.Length;
+    connection.FA += labels.MeanFA;
+    }
+
+  std::ofstream ofs(fname.c_str());
+  if (ofs.fail())
+    {
+    std::cerr << "Unable to write connectivity file: " << fname << std::endl;
+    return false;
+    }
+  ofs << "Label1\tLabel2\tCount\tMeanLength\tMeanFA" << std::endl;
+  std::map<std::pair<int, int>, Connection>::const_iterator it;
+  for (it = connections.begin(); it != connections.end(); ++it)
+    {
+    ofs << it->first.first << "\t" << it->first.second << "\t" << it->second.Count << "\t"
+        << it->second.Length / it->second.Count << "\t";
+    if (hasFA)
+      {
+      ofs << it->second.FA / it->second.Count;
+      }
+    else
+      {
+      ofs << "NAN";
+      }
+    ofs << std::endl;
+    }
+  return true;
+}
+
+int main( int argc, char * argv[] )
+{
+  PARSE_ARGS;
+
+  try
+  {
+  // Label operations
+  LabelQuery selection;
+  selection.PassLabel = PassLabel;
+  selection.NotPassLabel = NotPassLabel;
+  selection.OutputFibers = OutputFibers;
+  if (!parse_operation(PassOperation, selection.PassOperation))
+    {
+    std::cerr << "unknown include operation";
+    return EXIT_FAILURE;
+    }
+  if (!parse_operation(NoPassOperation, selection.NotPassOperation))
     {
     std::cerr << "unknown exclude operation";
     return EXIT_FAILURE;
     }
 
+  // All the selections are computed from the labels touched by the fibers
+  std::vector<LabelQuery> queries;
+  queries.push_back(selection);
+  if (!QueryFile.empty())
+    {
+    std::string outputDirectory = OutputDirectory;
+    if (outputDirectory.empty())
+      {
+      outputDirectory = vtksys::SystemTools::GetFilenamePath(OutputFibers);
+      }
+    if (!read_queries(QueryFile, outputDirectory,
+                      vtksys::SystemTools::GetFilenameLastExtension(OutputFibers), queries))
+      {
+      return EXIT_FAILURE;
+      }
+    }
+
   // Read in Label volume inputs
   vtkNew<vtkImageCast> imageCastLabel_A;
   vtkNew<vtkITKArchetypeImageSeriesScalarReader> readerLabel_A;
@@ -141,14 +481,8 @@ int main( int argc, char * argv[] )
   // This assumes fibers are in RAS space of volume (i.e. RAS==world)
   vtkNew<vtkMatrix4x4> Label_A_RASToIJK;
   Label_A_RASToIJK->DeepCopy(readerLabel_A->GetRasToIjkMatrix());
-
-  //the volume we're probing knows its spacing so take this out of the matrix
-  double sp[3];
-  imageCastLabel_A->GetOutput()->GetSpacing(sp);
-  vtkNew<vtkTransform> trans;
-  trans->Identity();
-  trans->PreMultiply();
-  trans->SetMatrix(Label_A_RASToIJK.GetPointer());
+  // the points are transformed by the matrix directly, which the sampling
+  // threads can share
 
   // 2. Find polylines
   int inExt[6];
@@ -159,7 +493,7 @@ int main( int argc, char * argv[] )
   vtkIdType numPts = inPts->GetNumberOfPoints();
   vtkCellArray *inLines = input->GetLines();
   vtkIdType numLines = inLines->GetNumberOfCells();
-  vtkIdType npts=0, sampledNpts=0;
+  vtkIdType npts=0;
 #if VTK_MAJOR_VERSION >= 9 || (VTK_MAJOR_VERSION >= 8 && VTK_MINOR_VERSION >= 90)
   const vtkIdType*pts;
 #else
@@ -169,240 +503,208 @@ int main( int argc, char * argv[] )
   if ( !inPts || numPts  < 1 || !inLines || numLines < 1 )
     {
     std::cerr << "Missing input data (points or lines), exiting!";
-    write_output(OutputFibers, input);
+    for (size_t q = 0; q < queries.size(); q++)
+      {
+      write_output(queries[q].OutputFibers, input);
+      }
     return EXIT_SUCCESS;
     }
 
-  std::vector<bool> addLines;
-  vtkIdType numNewPts = 0;
-  vtkIdType numNewCells = 0;
-  vtkIdType j;
-  double p[3];
-
-  unsigned int label;
-
-  // Fiber points sampling
-  vtkPolyDataPointSampler *resampler = vtkPolyDataPointSampler::New();
-  resampler->GenerateEdgePointsOn();
-  resampler->GenerateVertexPointsOff();
-  resampler->GenerateInteriorPointsOff();
-  resampler->GenerateVerticesOff();
-
-  std::cout << " Sampling Distance: " << SamplingDistance << std::endl;
-  resampler->SetDistance(SamplingDistance);
-
-  vtkPolyData* tmpPd;
-  vtkIdList* tmpCellPtIds;
-  vtkPoints* tmpPoints;
-  vtkCellArray* tmpLines;
-  vtkPoints* sampledCellPts;
-
-  std::cout << " Total number of fibers before selection: " << numLines << std::endl;
-
-  int *labelDims = imageCastLabel_A->GetOutput()->GetDimensions();
-  // Check lines
-  vtkIdType inCellId;
-  for (inCellId=0, inLines->InitTraversal();
-       inLines->GetNextCell(npts,pts); inCellId++)
+  // Point ids of the fibers
+  std::vector<vtkIdType> fiberOffsets(1, 0);
+  std::vector<vtkIdType> fiberPointIds;
+  for (inLines->InitTraversal(); inLines->GetNextCell(npts,pts); )
     {
-    if (npts < 2)
-      {
-      addLines.push_back(false);
-      std::cerr << "Less than two points in line " << inCellId << std::endl;
-      continue; //skip this polyline
-      }
-
-    std::vector<bool> passAll;
-    for (label=0; label<PassLabel.size(); label++)
-      {
-      passAll.push_back(false);
-      }
+    fiberPointIds.insert(fiberPointIds.end(), pts, pts + npts);
+    fiberOffsets.push_back(static_cast<vtkIdType>(fiberPointIds.size()));
+    }
 
-    // Create a new polydata that only contains the line and the points on it
-    tmpPd = vtkPolyData::New();
-    tmpPoints = vtkPoints::New();
-    tmpCellPtIds = vtkIdList::New();
-    tmpLines = vtkCellArray::New();
-    for (j=0; j < npts; j++)
+  // Tensors for the mean FA of the connections
+  vtkDataArray *tensors = input->GetPointData()->GetTensors();
+  for (int arrayIdx = 0; !tensors && arrayIdx < input->GetPointData()->GetNumberOfArrays(); arrayIdx++)
+    {
+    if (input->GetPointData()->GetArray(arrayIdx)->GetNumberOfComponents() == 9)
       {
-      inPts->GetPoint(pts[j],p);
-      vtkIdType dx = tmpPoints->InsertNextPoint(p);
-      tmpCellPtIds->InsertNextId(dx);
+      tensors = input->GetPointData()->GetArray(arrayIdx);
       }
-    tmpLines->InsertNextCell(tmpCellPtIds);
-
-    tmpPd->SetLines(tmpLines);
-    tmpPd->SetPoints(tmpPoints);
-
-    // Resample the poits on polydata
-    resampler->SetInputData(tmpPd);
-    resampler->Update();
-
-    sampledCellPts = resampler->GetOutput()->GetPoints();
-    sampledNpts = resampler->GetOutput()->GetNumberOfPoints();
+    }
+  if (ConnectivityFile.empty())
+    {
+    tensors = NULL;
+    }
 
-    // Clean memory
-    tmpPd->Delete();
-    tmpPoints->Delete();
-    tmpCellPtIds->Delete();
-    tmpLines->Delete();
+  std::cout << " Sampling Distance: " << SamplingDistance << std::endl;
+  std::cout << " Total number of fibers before selection: " << numLines << std::endl;
 
-    double pIJK[3];
+  // Labels touched by the sampled points of each fiber, sorted, with the
+  // labels of its end points, its length and its mean FA. The fibers are
+  // sampled in parallel, one point sampler per range of fibers.
+  std::vector<std::vector<int> > touchedLabels(numLines);
+  std::vector<FiberLabels> fibers(numLines);
+  vtkImageData *labelImage = imageCastLabel_A->GetOutput();
+  int *labelDims = labelImage->GetDimensions();
+  vtkSMPTools::For(0, numLines, [&](vtkIdType begin, vtkIdType end)
+    {
+    // Fiber points sampling
+    vtkNew<vtkPolyDataPointSampler> resampler;
+    resampler->GenerateEdgePointsOn();
+    resampler->GenerateVertexPointsOff();
+    resampler->GenerateInteriorPointsOff();
+    resampler->GenerateVerticesOff();
+    resampler->SetDistance(SamplingDistance);
+
+    double p[3], prev[3];
+    double pRAS[4] = {0.0, 0.0, 0.0, 1.0};
+    double pIJK[4];
     int pt[3];
-    short *inPtr;
-    bool addLine = false;
-    bool pass = false;
-    bool nopass = false;
-    for (j=0; j < sampledNpts; j++)
+    for (vtkIdType cellId = begin; cellId < end; cellId++)
       {
-      sampledCellPts->GetPoint(j, p);
-      trans->TransformPoint(p,pIJK);
-      pt[0]= (int) round(pIJK[0]);
-      pt[1]= (int) round(pIJK[1]);
-      pt[2]= (int) round(pIJK[2]);
-      if (pt[0] < 0 || pt[1] < 0 || pt[2] < 0 ||
-          pt[0] >= labelDims[0] || pt[1] >= labelDims[1] || pt[2] >= labelDims[2])
+      const vtkIdType *ids = fiberPointIds.data() + fiberOffsets[cellId];
+      vtkIdType nids = fiberOffsets[cellId + 1] - fiberOffsets[cellId];
+      FiberLabels &fiber = fibers[cellId];
+      if (nids < 2)
         {
-        continue;
+        continue; //skip this polyline
         }
-
-      inPtr = (short *) imageCastLabel_A->GetOutput()->GetScalarPointer(pt);
-
-      if (excludeOperation == 0) // OR
+      fiber.Valid = true;
+
+      // Create a new polydata that only contains the line and the points on it
+      vtkNew<vtkPolyData> tmpPd;
+      vtkNew<vtkPoints> tmpPoints;
+      vtkNew<vtkIdList> tmpCellPtIds;
+      vtkNew<vtkCellArray> tmpLines;
+      for (vtkIdType n = 0; n < nids; n++)
         {
-        for(label=0; label<NotPassLabel.size() && !nopass; label++)
+        inPts->GetPoint(ids[n], p);
+        vtkIdType dx = tmpPoints->InsertNextPoint(p);
+        tmpCellPtIds->InsertNextId(dx);
+        if (n > 0)
           {
-          nopass = (*inPtr == NotPassLabel[label]);
+          fiber.Length += sqrt(vtkMath::Distance2BetweenPoints(prev, p));
           }
+        prev[0] = p[0]; prev[1] = p[1]; prev[2] = p[2];
         }
-      else if (excludeOperation == 1) // AND
+      tmpLines->InsertNextCell(tmpCellPtIds.GetPointer());
+
+      tmpPd->SetLines(tmpLines.GetPointer());
+      tmpPd->SetPoints(tmpPoints.GetPointer());
+
+      // Resample the poits on polydata
+      resampler->SetInputData(tmpPd.GetPointer());
+      resampler->Update();
+
+      vtkPoints *sampledCellPts = resampler->GetOutput()->GetPoints();
+      vtkIdType sampledNpts = resampler->GetOutput()->GetNumberOfPoints();
+
+      std::vector<int> &labels = touchedLabels[cellId];
+      for (vtkIdType n = 0; n < sampledNpts; n++)
         {
-        bool nopassAll = (NotPassLabel.size() > 0);
-        for(label=0; label<NotPassLabel.size(); label++)
+        sampledCellPts->GetPoint(n, pRAS);
+        Label_A_RASToIJK->MultiplyPoint(pRAS, pIJK);
+        pt[0]= (int) round(pIJK[0]);
+        pt[1]= (int) round(pIJK[1]);
+        pt[2]= (int) round(pIJK[2]);
+        if (pt[0] < 0 || pt[1] < 0 || pt[2] < 0 ||
+            pt[0] >= labelDims[0] || pt[1] >= labelDims[1] || pt[2] >= labelDims[2])
           {
-          nopassAll = nopassAll & (*inPtr == NotPassLabel[label]);
+          continue;
           }
-        nopass = nopassAll;
-        }
-      if (nopass)
-        {
-        break; //Skip this one, dont check points
-        }
 
-      if (PassLabel.size() == 0)
-        {
-        pass = true;
-        }
-      else
-        {
-        if (includeOperation == 0) // OR
+        int label = *(short *) labelImage->GetScalarPointer(pt);
+        labels.push_back(label);
+        if (n == 0)
           {
-          for(label=0; label<PassLabel.size() &&  !pass; label++)
-            {
-              pass = (*inPtr == PassLabel[label]);
-            }
+          fiber.StartLabel = label;
+          }
+        if (n == sampledNpts - 1)
+          {
+          fiber.EndLabel = label;
           }
-        else if (includeOperation == 1) // AND
+        }
+      std::sort(labels.begin(), labels.end());
+      labels.erase(std::unique(labels.begin(), labels.end()), labels.end());
+
+      if (tensors)
+        {
+        double tensor[3][3];
+        double *m[3], w[3], *v[3];
+        double m0[3], m1[3], m2[3];
+        double v0[3], v1[3], v2[3];
+        m[0] = m0; m[1] = m1; m[2] = m2;
+        v[0] = v0; v[1] = v1; v[2] = v2;
+        double sumFA = 0.0;
+        for (vtkIdType n = 0; n < nids; n++)
           {
-          for(label=0; label<PassLabel.size(); label++)
+          tensors->GetTuple(ids[n], (double *)tensor);
+          for (int r = 0; r < 3; r++)
             {
-            if (*inPtr == PassLabel[label])
+            for (int c = 0; c < 3; c++)
               {
-              passAll[label] = true;
-              break;
+              m[c][r] = tensor[r][c];
               }
-            } // for(label=0;
-          } // else if (includeOperation == 1)
-        } // if !(PassLabel.size() == 0)
-      } //for (j=0; j < npts; j++)
-
-    if (includeOperation == 1 && PassLabel.size() > 0) // AND
-      {
-      pass = true;
-      for (label=0; label<passAll.size(); label++)
-        {
-        pass = pass & passAll[label];
+            }
+          vtkDiffusionTensorMathematics::TeemEigenSolver(m, w, v);
+          vtkDiffusionTensorMathematics::FixNegativeEigenvaluesMethod(w);
+          sumFA += vtkDiffusionTensorMathematics::FractionalAnisotropy(w);
+          }
+        fiber.MeanFA = sumFA / nids;
         }
       }
-    addLine = pass && !nopass;
-
-    addLines.push_back(addLine);
-    if (addLine)
+    });
+
+  // Labels touched by each fiber, stored for all the fibers:
+  // fiberLabels[fiberLabelOffsets[i]..fiberLabelOffsets[i+1]]
+  std::vector<vtkIdType> fiberLabelOffsets(1, 0);
+  std::vector<int> fiberLabels;
+  std::vector<bool> validLines;
+  for (vtkIdType cellId = 0; cellId < numLines; cellId++)
+    {
+    if (!fibers[cellId].Valid)
       {
-      // Add line to the output
-      numNewPts += npts;
-      numNewCells++;
+      std::cerr << "Less than two points in line " << cellId << std::endl;
       }
-    } //for (inCellId=0, inLines->InitTraversal();
-
-  resampler->Delete();
-  std::cout << " Total number of fibers after selection: " << numNewCells << std::endl;
-
-  //Preallocate PolyData elements
-  vtkNew<vtkPolyData> outFibers;
-
-  vtkNew<vtkPoints> points;
-  points->Allocate(numNewPts);
-  outFibers->SetPoints(points.GetPointer());
-
-  vtkNew<vtkCellArray> outFibersCellArray;
-  outFibersCellArray->Allocate(numNewPts+numNewCells);
-  outFibers->SetLines(outFibersCellArray.GetPointer());
-
-  // If the input has point data, including tensors or scalar arrays, copy them to the output.
-  // Currently this ignores cell data, which may be added in the future if needed.
-  // Check for point data arrays to keep and allocate them.
-  int numberArrays = input->GetPointData()->GetNumberOfArrays();
+    fiberLabels.insert(fiberLabels.end(), touchedLabels[cellId].begin(), touchedLabels[cellId].end());
+    fiberLabelOffsets.push_back(static_cast<vtkIdType>(fiberLabels.size()));
+    validLines.push_back(fibers[cellId].Valid);
+    std::vector<int>().swap(touchedLabels[cellId]);
+    }
 
-  for (int arrayIdx = 0; arrayIdx < numberArrays; arrayIdx++)
+  if (!IncidenceFile.empty() &&
+      !write_incidence(IncidenceFile, fibers, fiberLabelOffsets, fiberLabels))
     {
-      vtkDataArray *oldArray = input->GetPointData()->GetArray(arrayIdx);
-      vtkSmartPointer<vtkFloatArray> newArray = vtkSmartPointer<vtkFloatArray>::New();
-      newArray->SetNumberOfComponents(oldArray->GetNumberOfComponents());
-      newArray->SetName(oldArray->GetName());
-      newArray->Allocate(newArray->GetNumberOfComponents()*numNewPts);
-      outFibers->GetPointData()->AddArray(newArray);
+    return EXIT_FAILURE;
+    }
+  if (!ConnectivityFile.empty() &&
+      !write_connectivity(ConnectivityFile, fibers, tensors != NULL))
+    {
+    return EXIT_FAILURE;
     }
 
-  vtkIdType ptId = 0;
-
-  for (inCellId=0, inLines->InitTraversal();
-       inLines->GetNextCell(npts,pts); inCellId++)
+  //3. Answer each query from the touched labels and save the output in VTK or VTP
+  for (size_t q = 0; q < queries.size(); q++)
     {
-    if (addLines[inCellId])
+    const LabelQuery &query = queries[q];
+    std::vector<char> selected(numLines, 0);
+    vtkSMPTools::For(0, numLines, [&](vtkIdType begin, vtkIdType end)
       {
-      outFibersCellArray->InsertNextCell(npts);
-      for (j=0; j < npts; j++)
+      for (vtkIdType cellId = begin; cellId < end; cellId++)
         {
-        inPts->GetPoint(pts[j],p);
-        points->InsertPoint(ptId,p);
-        outFibersCellArray->InsertCellPoint(ptId);
-
-        // Copy point data from input fiber
-        for (int arrayIdx = 0; arrayIdx < numberArrays; arrayIdx++)
-          {
-            vtkDataArray *newArray = outFibers->GetPointData()->GetArray(arrayIdx);
-            vtkDataArray *oldArray = input->GetPointData()->GetArray(newArray->GetName());
-            newArray->InsertNextTuple(oldArray->GetTuple(pts[j]));
-          }
-
-        ptId++;
+        selected[cellId] = validLines[cellId] &&
+          select_fiber(fiberLabels.data() + fiberLabelOffsets[cellId],
+                       fiberLabelOffsets[cellId + 1] - fiberLabelOffsets[cellId], query);
         }
-      }
-    }
+      });
+    std::vector<bool> addLines(selected.begin(), selected.end());
 
-  // Copy array attributes from input (TENSORS, scalars, etc)
-  for (int arrayIdx = 0; arrayIdx < numberArrays; arrayIdx++)
-    {
-    int attr = input->GetPointData()->IsArrayAnAttribute(arrayIdx);
-    if (attr >= 0)
+    std::cout << " Total number of fibers after selection";
+    if (!query.Name.empty())
       {
-      outFibers->GetPointData()->SetActiveAttribute(input->GetPointData()->GetArray(arrayIdx)->GetName(), attr);
+      std::cout << " " << query.Name;
       }
-    }
+    std::cout << ": " << std::count(selected.begin(), selected.end(), 1) << std::endl;
 
-  //3. Save the output in VTK or VTP
-  write_output(OutputFibers, outFibers.GetPointer());
+    write_selection(input, addLines, query.OutputFibers);
+    }
 
   }
   catch ( ... )
@@ -77,16 +77,12 @@ int main( int argc, char * argv[] )
   readerPD->Update();
   baseline = vtkPolyData::SafeDownCast(readerPD->GetOutput());
 
-  // Point and fiber numbers
-  vtkPoints *inPts = output->GetPoints();
-  vtkIdType numPtsOutput = inPts->GetNumberOfPoints();
-  vtkCellArray *inLines = output->GetLines();
-  vtkIdType numLinesOutput = inLines->GetNumberOfCells();
+  // Point and fiber numbers, an empty selection has no points
+  vtkIdType numPtsOutput = output->GetNumberOfPoints();
+  vtkIdType numLinesOutput = output->GetNumberOfLines();
 
-  inPts = baseline->GetPoints();
-  vtkIdType numPtsBaseline = inPts->GetNumberOfPoints();
-  inLines = baseline->GetLines();
-  vtkIdType numLinesBaseline = inLines->GetNumberOfCells();
+  vtkIdType numPtsBaseline = baseline->GetNumberOfPoints();
+  vtkIdType numLinesBaseline = baseline->GetNumberOfLines();
 
 
   std::cout << "   Output : nunber of points " << numPtsOutput << ", number of fibers  " << numLinesOutput << std::endl;
@@ -98,6 +94,12 @@ int main( int argc, char * argv[] )
     return EXIT_FAILURE;
     }
 
+  if (output->GetPointData()->GetNumberOfArrays() != baseline->GetPointData()->GetNumberOfArrays())
+    {
+    std::cerr << "Not matched! " << std::endl;
+    return EXIT_FAILURE;
+    }
+
   for (int i=0; i<output->GetPointData()->GetNumberOfArrays(); i++)
     {
     vtkDataArray *arr = output->GetPointData()->GetArray(i);
@@ -1,5 +1,10 @@
 #include <algorithm>
+#include <cstdint>
+#include <cstring>
+#include <fstream>
 #include <iostream>
+#include <mutex>
+#include <set>
 
 // vtkTeem includes
 #include <vtkDiffusionTensorMathematics.h>
@@ -11,18 +16,21 @@
 #include <vnl/vnl_double_3.h>
 
 // VTK includes
-#include <vtkAssignAttribute.h>
+#include <vtkCellArray.h>
 #include <vtkGlobFileNames.h>
+#include <vtkIdList.h>
 #include <vtkImageData.h>
 #include <vtkMath.h>
 #include <vtkNew.h>
 #include <vtkPointData.h>
-#include <vtkPolyDataTensorToColor.h>
 #include <vtkPolyDataReader.h>
 #include <vtkStringArray.h>
 #include <vtkXMLPolyDataReader.h>
 #include <vtkSortDataArray.h>
 #include <vtkDoubleArray.h>
+#include <vtkSMPThreadLocal.h>
+#include <vtkSMPTools.h>
+#include <vtkByteSwap.h>
 // VTKsys includes
 #include <vtksys/SystemTools.hxx>
 
@@ -48,7 +56,11 @@
 
 //=============================================================================
 // Maps to hold results
-std::map< std::string, std::map<std::string, double> > OutTable;
+typedef std::map< std::string, std::map<std::string, double> > Table_t;
+Table_t OutTable;
+// Along-tract profiles: the mean of each measure at each node, by bundle
+typedef std::map< std::string, std::map<std::string, std::vector<double> > > ProfileTable_t;
+ProfileTable_t ProfileTable;
 std::map< std::string, std::string> ClusterNames;
 std::map< std::string, std::map<std::string, double> > Clusters;
 
@@ -69,24 +81,16 @@ static ClampedOp_t clamped_ops;
 typedef std::vector<std::string> AggNames_t;
 AggNames_t aggregate_names;
 
-// BUG, TODO: this is global because FA calc doesn't work (no scalars) when
-//      the PDTensorToColor is allocated inside function.
-vtkNew<vtkPolyDataTensorToColor> math;
+// Guards the messages printed by the threads measuring files
+std::mutex PrintMutex;
 
 //=============================================================================
 // Function declarations
-void computeFiberStats(vtkSmartPointer<vtkPolyData> input,
-                       std::string &id);
-
-void computeScalarMeasurements(vtkSmartPointer<vtkPolyData> input,
-                               std::string &id,
-                               std::string &operation,
-                               bool moreStatistics);
-
-int computeTensorMeasurement(vtkSmartPointer<vtkPolyData> input,
-                             std::string &id,
-                             std::string &operation,
-                             bool moreStatistics);
+int measureFiberBundle(vtkSmartPointer<vtkPolyData> input,
+                       std::string &id,
+                       const std::vector<std::string> &operations,
+                       bool moreStatistics,
+                       Table_t &table);
 
 void getPathFromParentToChild(vtkMRMLHierarchyNode *parent,
                               vtkMRMLHierarchyNode *child,
@@ -114,6 +118,16 @@ void printCluster(const std::string &id,
                   std::stringstream &measureNames,
                   std::stringstream &measureValues);
 
+bool writeBinaryTable(const std::string &fileName);
+
+void computeAlongTractProfile(vtkSmartPointer<vtkPolyData> poly,
+                              std::string &id,
+                              const std::vector<std::string> &operations,
+                              int numberOfNodes,
+                              ProfileTable_t &profiles);
+
+void printProfiles(std::ostream &ofs);
+
 namespace {
   double median_of_sorted(vtkDoubleArray* d)
   {
@@ -152,300 +166,816 @@ void getPathFromParentToChild(vtkMRMLHierarchyNode *parent,
     }
 }
 
-double computeMeanLineLength(vtkSmartPointer<vtkPolyData> poly)
+// Sum and counts of the values of a measure over a block of points
+struct MeasureAccumulator
 {
-  size_t total_measured_lines = 0;
-  double total_length = 0.0;
-  vnl_double_3 prev, next;
-  vtkNew<vtkIdList> pointIds;
+  MeasureAccumulator() : Sum(0.0), NumberOfNaNs(0), NumberOfExcluded(0) {}
 
-  poly->GetLines()->InitTraversal();
+  void Add(double val, bool clamped, double min, double max)
+  {
+    if (vtkMath::IsNan(val))
+      {
+      this->NumberOfNaNs++;
+      }
+    else if (clamped && (val < min || val > max))
+      {
+      this->NumberOfExcluded++;
+      }
+    else
+      {
+      this->Sum += val;
+      }
+  }
+
+  void Add(const MeasureAccumulator &other)
+  {
+    this->Sum += other.Sum;
+    this->NumberOfNaNs += other.NumberOfNaNs;
+    this->NumberOfExcluded += other.NumberOfExcluded;
+  }
 
-  while(poly->GetLines()->GetNextCell(pointIds.GetPointer()))
+  double Sum;
+  vtkIdType NumberOfNaNs;
+  vtkIdType NumberOfExcluded;
+};
+
+// Whether a measurement is clamped to a specific range, and the range
+bool getClampedRange(const std::string &name, double &op_min, double &op_max)
+{
+  bool measuring_clamped = false;
+  op_max = 0.0;
+  op_min = 0.0;
+  ClampedOp_t::iterator op_iter;
+  for (op_iter = clamped_ops.begin(); op_iter != clamped_ops.end(); op_iter++)
     {
-    // get first point
-    poly->GetPoints()->GetPoint(pointIds->GetId(0), prev.data_block());
+    if (name.find(op_iter->first) != std::string::npos)
+      {
+      measuring_clamped = true;
+      op_min = op_iter->second.first;
+      op_max = op_iter->second.second;
+      }
+    }
+  return measuring_clamped;
+}
+
+// Statistics of the npoints values of a measurement from their sum and
+// counts, value(n) returns the value of point n for the statistics of
+// moreStatistics. npoints_final and npoints_excluded are decremented and
+// incremented by the NaN and clamped values.
+template <class ValueFunction>
+void computeMeasurementStatistics(std::string &id,
+                                  const std::string &name,
+                                  vtkIdType npoints,
+                                  const MeasureAccumulator &accumulator,
+                                  ValueFunction value,
+                                  vtkIdType &npoints_final,
+                                  vtkIdType &npoints_excluded,
+                                  bool moreStatistics,
+                                  Table_t &table)
+{
+  double op_max = 0.0;
+  double op_min = 0.0;
+  bool measuring_clamped = getClampedRange(name, op_min, op_max);
 
-    // count by segments
-    vtkIdType n = 1;
+  npoints_final -= accumulator.NumberOfNaNs + accumulator.NumberOfExcluded;
+  npoints_excluded += accumulator.NumberOfExcluded;
+
+  double sortval = 0;
+  double median  = 0;
+  double mean = 0;
+  double max = 0;
+  double min = 0;
+  double variance = 0;
+
+  if (npoints_final > 0)
+    {
+    mean = accumulator.Sum / npoints_final;
 
-    for ( ; n < pointIds->GetNumberOfIds(); n++)
+    if (moreStatistics)
       {
-      // get next point
-      poly->GetPoints()->GetPoint(pointIds->GetId(n), next.data_block());
+      vtkDoubleArray *vals = vtkDoubleArray::New();
+      vals->Allocate(npoints);
+      for (vtkIdType n=0; n < npoints; n++)
+        {
+        double val = value(n);
+        if (!vtkMath::IsNan(val) && !(measuring_clamped && (val < op_min || val > op_max)))
+          {
+          vals->InsertNextValue(val);
+          }
+        }
+
+      vtkSortDataArray::Sort(vals);
+      min = (double) vals->GetComponent(0, 0);
+      max = (double) vals->GetComponent(npoints_final - 1, 0);
+      median = median_of_sorted(vals);
 
-      // add segment length to total
-      total_length += (next - prev).two_norm();
-      prev = next;
+      for (int n = 0; n < npoints_final; n++)
+        {
+        sortval = (double) vals->GetComponent(n, 0);
+        variance += (sortval - mean) * (sortval - mean);
+        }
+      variance /= npoints_final - 1;
+      vals->Delete();
+      }
+    }
+  else
+    {
+    mean = vtkMath::Nan();
+    if (moreStatistics)
+      {
+      min = vtkMath::Nan();
+      max = vtkMath::Nan();
+      median = vtkMath::Nan();
+      variance = vtkMath::Nan();
       }
+    }
+
+  Table_t::iterator it = table.find(id);
+  if (it == table.end())
+    {
+    table[id] = std::map<std::string, double>();
+    it = table.find(id);
+    }
 
-    // only count line if actually measured
-    if (n > 1) { total_measured_lines++; }
+  std::string name_mean = name + "." + MEAN_PRINT;
+  it->second[name_mean] = mean;
+
+  if (moreStatistics)
+    {
+    std::string name_min = name + "." + MIN_PRINT;
+    std::string name_max = name + "." + MAX_PRINT;
+    std::string name_median = name + "." + MEDIAN_PRINT;
+    std::string name_variance = name + "." + VARIANCE_PRINT;
+    std::string nanid = name + "." + INVALID_NUMBER_PRINT;
+
+    it->second[name_min] = min;
+    it->second[name_max] = max;
+    it->second[name_median] = median;
+    it->second[name_variance] = variance;
+    it->second[nanid] = npoints - npoints_final; // record the number of NaNs for this measurement
+
+    if (measuring_clamped)
+    {
+      // record aggregate count of excluded points outside of clamped range
+      std::string excluded_id = EXCLUDED_NUMBER_PRINT;
+      it->second[excluded_id] += npoints_excluded;
+      }
     }
+}
 
-  return total_length / total_measured_lines;
+// Tensor operation (vtkDiffusionTensorMathematics::VTK_TENS_*) of an
+// operation name, -1 if not supported
+int getTensorOperation(const std::string &operation)
+{
+  if (operation == "Trace")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_TRACE;
+    }
+  else if (operation == "MeanDiffusivity")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_MEAN_DIFFUSIVITY;
+    }
+  else if (operation == "RelativeAnisotropy")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_RELATIVE_ANISOTROPY;
+    }
+  else if (operation == "FractionalAnisotropy")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_FRACTIONAL_ANISOTROPY;
+    }
+  else if (operation == "LinearMeasure")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_LINEAR_MEASURE;
+    }
+  else if (operation == "PlanarMeasure")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_PLANAR_MEASURE;
+    }
+  else if (operation == "SphericalMeasure")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_SPHERICAL_MEASURE;
+    }
+  else if (operation == "MinEigenvalue")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_MIN_EIGENVALUE;
+    }
+  else if (operation == "MidEigenvalue")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_MID_EIGENVALUE;
+    }
+  else if (operation == "MaxEigenvalue")
+    {
+    return vtkDiffusionTensorMathematics::VTK_TENS_MAX_EIGENVALUE;
+    }
+  return -1;
 }
 
-void computeFiberStats(vtkSmartPointer<vtkPolyData> poly,
-                       std::string &id)
+// Scalar of a tensor operation from the eigenvalues, as computed by
+// vtkPolyDataTensorToColor
+double computeTensorScalar(int operation, double w[3])
 {
-  if (!poly) {
-    std::cerr << "computeFiberStats: missing polydata input for id: " << id << std::endl;
-    return;
-  }
+  switch (operation)
+    {
+    case vtkDiffusionTensorMathematics::VTK_TENS_TRACE:
+      return vtkDiffusionTensorMathematics::Trace(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_MEAN_DIFFUSIVITY:
+      return (w[0] + w[1] + w[2]) / 3;
+    case vtkDiffusionTensorMathematics::VTK_TENS_RELATIVE_ANISOTROPY:
+      return vtkDiffusionTensorMathematics::RelativeAnisotropy(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_FRACTIONAL_ANISOTROPY:
+      return vtkDiffusionTensorMathematics::FractionalAnisotropy(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_LINEAR_MEASURE:
+      return vtkDiffusionTensorMathematics::LinearMeasure(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_PLANAR_MEASURE:
+      return vtkDiffusionTensorMathematics::PlanarMeasure(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_SPHERICAL_MEASURE:
+      return vtkDiffusionTensorMathematics::SphericalMeasure(w);
+    case vtkDiffusionTensorMathematics::VTK_TENS_MIN_EIGENVALUE:
+      return w[2];
+    case vtkDiffusionTensorMathematics::VTK_TENS_MID_EIGENVALUE:
+      return w[1];
+    case vtkDiffusionTensorMathematics::VTK_TENS_MAX_EIGENVALUE:
+      return w[0];
+    }
+  return vtkMath::Nan();
+}
 
-  size_t npoints = poly->GetNumberOfPoints();
-  size_t npolys = poly->GetNumberOfCells();
-  double mean_length = computeMeanLineLength(poly);
+// Scalars of the tensor operations at each point of a tensor array,
+// stored by operation: values[op * npoints + ptId]. One eigen
+// decomposition per point gives all the scalars, the points are
+// processed in parallel.
+void computeTensorScalars(vtkDataArray *tensors,
+                          const std::vector<int> &tensorOperations,
+                          std::vector<float> &values)
+{
+  vtkIdType npoints = tensors->GetNumberOfTuples();
+  size_t numOperations = tensorOperations.size();
+  values.resize(numOperations * npoints);
 
-  //if (npoints > 0 && npolys > 0)
-  //  {
-    std::map< std::string, std::map<std::string, double> >::iterator it = OutTable.find(id);
-    if (it == OutTable.end())
+  vtkSMPTools::For(0, npoints, [&](vtkIdType begin, vtkIdType end)
+    {
+    double tensor[3][3];
+    double *m[3], w[3], *v[3];
+    double m0[3], m1[3], m2[3];
+    double v0[3], v1[3], v2[3];
+    m[0] = m0; m[1] = m1; m[2] = m2;
+    v[0] = v0; v[1] = v1; v[2] = v2;
+    for (vtkIdType ptId = begin; ptId < end; ptId++)
       {
-      OutTable[id] = std::map<std::string, double>();
-      it = OutTable.find(id);
+      tensors->GetTuple(ptId, (double *)tensor);
+      for (int j=0; j<3; j++)
+        {
+        for (int k=0; k<3; k++)
+          {
+          m[k][j] = tensor[j][k];
+          }
+        }
+      vtkDiffusionTensorMathematics::TeemEigenSolver(m, w, v);
+      // Correct for negative eigenvalues
+      vtkDiffusionTensorMathematics::FixNegativeEigenvaluesMethod(w);
+      for (size_t op = 0; op < numOperations; op++)
+        {
+        values[op * npoints + ptId] = static_cast<float>(computeTensorScalar(tensorOperations[op], w));
+        }
       }
-    it->second["Num_Points"] = npoints;
-    it->second["Num_Fibers"] = npolys;
-    it->second["Mean_Length"] = mean_length;
-   // }
+    });
 }
 
-void computeScalarMeasurements(vtkSmartPointer<vtkPolyData> poly,
-                               std::string &id,
-                               std::string &operation,
-                               bool moreStatistics)
+// Measure a fiber bundle: number of points and fibers, mean fiber length,
+// statistics of each scalar array and of each tensor operation of each
+// tensor array. The bundle is traversed once: the points, and the fibers
+// for the lengths, are split in blocks measured in parallel, each into its
+// own sums and counts, which are then added in block order so that the
+// result does not depend on the number of threads. The values are only
+// kept (as float for the tensor operations, like the output of
+// vtkPolyDataTensorToColor) for the statistics of moreStatistics.
+int measureFiberBundle(vtkSmartPointer<vtkPolyData> poly,
+                       std::string &id,
+                       const std::vector<std::string> &operations,
+                       bool moreStatistics,
+                       Table_t &table)
 {
-  vtkIdType npoints = poly->GetNumberOfPoints();
-  vtkIdType npoints_final = npoints;
-  vtkIdType npoints_excluded = 0;
-  vtkIdType npolys = poly->GetNumberOfCells();
+  if (!poly) {
+    std::cerr << "measureFiberBundle: missing polydata input for id: " << id << std::endl;
+    return EXIT_FAILURE;
+  }
 
-  if (npoints == 0 || npolys == 0)
+  int result = EXIT_SUCCESS;
+  std::vector<std::string> names;
+  std::vector<int> tensorOperations;
+  for (size_t op = 0; op < operations.size(); op++)
     {
-    //return;
+    int tensorOperation = getTensorOperation(operations[op]);
+    if (tensorOperation < 0)
+      {
+      std::cerr << operations[op] << ": Operation " << operations[op] << "not supported" << std::endl;
+      result = EXIT_FAILURE;
+      continue;
+      }
+    names.push_back(operations[op]);
+    tensorOperations.push_back(tensorOperation);
     }
 
-  // average measurement for each scalar array
+  // scalar measures first, then the operations of each tensor array
+  std::vector<vtkDataArray *> scalarArrays;
+  std::vector<vtkDataArray *> tensorArrays;
+  std::vector<std::string> measureNames;
   for (int i=0; i<poly->GetPointData()->GetNumberOfArrays(); i++)
     {
     vtkDataArray *arr = poly->GetPointData()->GetArray(i);
-    if (arr->GetNumberOfComponents() > 1)
+    if (arr->GetNumberOfComponents() <= 1)
       {
-      continue;
+      scalarArrays.push_back(arr);
+      measureNames.push_back(arr->GetName() ? std::string(arr->GetName()) : std::string());
       }
-
-    std::string name = operation;
-    if (arr->GetName())
-      {
-      name = std::string(arr->GetName());
-      }
-
-    // check whether this measurement should be clamped to specific range.
-    bool measuring_clamped = false;
-    double op_max = 0.0;
-    double op_min = 0.0;
-    ClampedOp_t::iterator op_iter;
-    for (op_iter = clamped_ops.begin(); op_iter != clamped_ops.end(); op_iter++)
+    }
+  for (int i=0; i<poly->GetPointData()->GetNumberOfArrays(); i++)
+    {
+    vtkDataArray *arr = poly->GetPointData()->GetArray(i);
+    if (arr->GetNumberOfComponents() == 9)
       {
-      if (name.find(op_iter->first) != std::string::npos)
+      tensorArrays.push_back(arr);
+      std::string name = arr->GetName() ? std::string(arr->GetName()) : std::string();
+      for (size_t op = 0; op < names.size(); op++)
         {
-        measuring_clamped = true;
-        op_min = op_iter->second.first;
-        op_max = op_iter->second.second;
+        measureNames.push_back(name + std::string(".") + names[op]);
         }
       }
+    }
+  size_t nscalars = scalarArrays.size();
+  size_t nmeasures = measureNames.size();
+  size_t numOperations = tensorOperations.size();
+  std::vector<char> clamped(nmeasures);
+  std::vector<double> clampedMin(nmeasures);
+  std::vector<double> clampedMax(nmeasures);
+  for (size_t m = 0; m < nmeasures; m++)
+    {
+    clamped[m] = getClampedRange(measureNames[m], clampedMin[m], clampedMax[m]);
+    }
 
-    vtkDoubleArray *vals = vtkDoubleArray::New();
-    double val;
-    double sum = 0;
-    for (int n=0; n < npoints; n++)
-      {
-      arr->GetTuple(n, &val);
-
-      if (vtkMath::IsNan(val))
-        {
-        npoints_final -= 1;
-        continue;
-        }
-      if (measuring_clamped && (val < op_min || val > op_max))
-        {
-        npoints_final -= 1;
-        npoints_excluded += 1;
-        continue;
-        }
-      vals->InsertNextValue(val);
-      sum += val;
-      }
+  vtkIdType npoints = poly->GetNumberOfPoints();
+  vtkCellArray *lines = poly->GetLines();
+  vtkIdType nlines = lines ? lines->GetNumberOfCells() : 0;
+  vtkPoints *points = poly->GetPoints();
 
-    vtkSortDataArray::Sort(vals);
+  std::vector<double> scalarValues;
+  std::vector<float> tensorValues;
+  if (moreStatistics)
+    {
+    scalarValues.resize(nscalars * npoints);
+    tensorValues.resize((nmeasures - nscalars) * npoints);
+    }
 
-    double sortval = 0;
-    double median  = 0;
-    double mean = 0;
-    double max = 0;
-    double min = 0;
-    double variance = 0;
+  // blocks of points, and the same share of the fibers
+  const vtkIdType blockSize = 4096;
+  vtkIdType nblocks = std::max<vtkIdType>((npoints + blockSize - 1) / blockSize, 1);
+  std::vector<MeasureAccumulator> accumulators(nblocks * nmeasures);
+  std::vector<double> lengths(nblocks, 0.0);
+  std::vector<vtkIdType> measuredLines(nblocks, 0);
 
-    if (npoints_final > 0)
+  vtkSMPTools::For(0, nblocks, [&](vtkIdType beginBlock, vtkIdType endBlock)
+    {
+    double tensor[3][3];
+    double *m[3], w[3], *v[3];
+    double m0[3], m1[3], m2[3];
+    double v0[3], v1[3], v2[3];
+    m[0] = m0; m[1] = m1; m[2] = m2;
+    v[0] = v0; v[1] = v1; v[2] = v2;
+    double prev[3], next[3];
+    vtkNew<vtkIdList> pts;
+    for (vtkIdType block = beginBlock; block < endBlock; block++)
       {
-      mean = sum / npoints_final;
-
-      if (moreStatistics)
+      MeasureAccumulator *blockAccumulators = accumulators.data() + block * nmeasures;
+      vtkIdType endPoint = std::min((block + 1) * blockSize, npoints);
+      for (vtkIdType ptId = block * blockSize; ptId < endPoint; ptId++)
         {
-        min = (double) vals->GetComponent(0, 0);
-        max = (double) vals->GetComponent(npoints_final - 1, 0);
-        median = median_of_sorted(vals);
-
-        for (int n = 0; n < npoints_final; n++)
+        for (size_t s = 0; s < nscalars; s++)
+          {
+          double val;
+          scalarArrays[s]->GetTuple(ptId, &val);
+          blockAccumulators[s].Add(val, clamped[s], clampedMin[s], clampedMax[s]);
+          if (moreStatistics)
+            {
+            scalarValues[s * npoints + ptId] = val;
+            }
+          }
+        for (size_t t = 0; t < tensorArrays.size() && numOperations > 0; t++)
           {
-          sortval = (double) vals->GetComponent(n, 0);
-          variance += (sortval - mean) * (sortval - mean);
+          tensorArrays[t]->GetTuple(ptId, (double *)tensor);
+          for (int j=0; j<3; j++)
+            {
+            for (int k=0; k<3; k++)
+              {
+              m[k][j] = tensor[j][k];
+              }
+            }
+          vtkDiffusionTensorMathematics::TeemEigenSolver(m, w, v);
+          // Correct for negative eigenvalues
+          vtkDiffusionTensorMathematics::FixNegativeEigenvaluesMethod(w);
+          for (size_t op = 0; op < numOperations; op++)
+            {
+            size_t measure = nscalars + t * numOperations + op;
+            float val = static_cast<float>(computeTensorScalar(tensorOperations[op], w));
+            blockAccumulators[measure].Add(val, clamped[measure], clampedMin[measure], clampedMax[measure]);
+            if (moreStatistics)
+              {
+              tensorValues[(measure - nscalars) * npoints + ptId] = val;
+              }
+            }
           }
-        variance /= npoints_final - 1;
         }
-      }
-    else
-      {
-      mean = vtkMath::Nan();
-      if (moreStatistics)
+
+      // lengths of the fibers, summed segment by segment
+      vtkIdType endLine = (block + 1) * nlines / nblocks;
+      for (vtkIdType lineId = block * nlines / nblocks; lineId < endLine; lineId++)
         {
-        min = vtkMath::Nan();
-        max = vtkMath::Nan();
-        median = vtkMath::Nan();
-        variance = vtkMath::Nan();
+        lines->GetCellAtId(lineId, pts.GetPointer());
+        vtkIdType npts = pts->GetNumberOfIds();
+        if (npts > 0)
+          {
+          points->GetPoint(pts->GetId(0), prev);
+          }
+        for (vtkIdType n = 1; n < npts; n++)
+          {
+          points->GetPoint(pts->GetId(n), next);
+          lengths[block] += sqrt(vtkMath::Distance2BetweenPoints(prev, next));
+          prev[0] = next[0]; prev[1] = next[1]; prev[2] = next[2];
+          }
+
+        // only count line if actually measured
+        if (npts > 1) { measuredLines[block]++; }
         }
       }
+    });
 
-    vals->Delete();
-
-    std::map< std::string, std::map<std::string, double> >::iterator it = OutTable.find(id);
-    if (it == OutTable.end())
+  // reduction, in block order
+  std::vector<MeasureAccumulator> measureAccumulators(nmeasures);
+  double total_length = 0.0;
+  size_t total_measured_lines = 0;
+  for (vtkIdType block = 0; block < nblocks; block++)
+    {
+    for (size_t measure = 0; measure < nmeasures; measure++)
       {
-      OutTable[id] = std::map<std::string, double>();
-      it = OutTable.find(id);
+      measureAccumulators[measure].Add(accumulators[block * nmeasures + measure]);
       }
+    total_length += lengths[block];
+    total_measured_lines += measuredLines[block];
+    }
 
-    std::string name_mean = name + "." + MEAN_PRINT;
-    it->second[name_mean] = mean;
+  Table_t::iterator it = table.find(id);
+  if (it == table.end())
+    {
+    table[id] = std::map<std::string, double>();
+    it = table.find(id);
+    }
+  it->second["Num_Points"] = npoints;
+  it->second["Num_Fibers"] = poly->GetNumberOfCells();
+  it->second["Mean_Length"] = total_length / total_measured_lines;
 
-    if (moreStatistics)
-      {
-      std::string name_min = name + "." + MIN_PRINT;
-      std::string name_max = name + "." + MAX_PRINT;
-      std::string name_median = name + "." + MEDIAN_PRINT;
-      std::string name_variance = name + "." + VARIANCE_PRINT;
-      std::string nanid = name + "." + INVALID_NUMBER_PRINT;
-
-      it->second[name_min] = min;
-      it->second[name_max] = max;
-      it->second[name_median] = median;
-      it->second[name_variance] = variance;
-      it->second[nanid] = npoints - npoints_final; // record the number of NaNs for this measurement
-
-      if (measuring_clamped)
-      {
-        // record aggregate count of excluded points outside of clamped range
-        std::string excluded_id = EXCLUDED_NUMBER_PRINT;
-        it->second[excluded_id] += npoints_excluded;
-        }
-      }
-    } //for (int i=0; i<poly->GetPointData()->GetNumberOfArrays(); i++)
+  // the NaN and excluded counts add up over the scalar arrays
+  vtkIdType npoints_final = npoints;
+  vtkIdType npoints_excluded = 0;
+  for (size_t s = 0; s < nscalars; s++)
+    {
+    const double *values = scalarValues.data() + s * npoints;
+    computeMeasurementStatistics(id, measureNames[s], npoints, measureAccumulators[s],
+                                 [values](vtkIdType n) { return values[n]; },
+                                 npoints_final, npoints_excluded, moreStatistics, table);
+    }
+  for (size_t measure = nscalars; measure < nmeasures; measure++)
+    {
+    const float *values = tensorValues.data() + (measure - nscalars) * npoints;
+    npoints_final = npoints;
+    npoints_excluded = 0;
+    computeMeasurementStatistics(id, measureNames[measure], npoints, measureAccumulators[measure],
+                                 [values](vtkIdType n) { return static_cast<double>(values[n]); },
+                                 npoints_final, npoints_excluded, moreStatistics, table);
+    }
+
+  return result;
 }
 
-int computeTensorMeasurement(vtkSmartPointer<vtkPolyData> poly,
-                             std::string &id,
-                             std::string &operation,
-                             bool moreStatistics)
+// Along-tract profile of a fiber bundle: each fiber is resampled to
+// numberOfNodes nodes equally spaced along its length, and oriented like
+// the bundle centroid (the first fiber, then the mean of the oriented
+// fibers). The profile of each scalar and tensor measure is its mean over
+// the fibers at each node. The fibers are resampled in parallel and
+// averaged in order, so the profile does not depend on the number of
+// threads.
+void computeAlongTractProfile(vtkSmartPointer<vtkPolyData> poly,
+                              std::string &id,
+                              const std::vector<std::string> &operations,
+                              int numberOfNodes,
+                              ProfileTable_t &profiles)
 {
-  //TODO loop over all tensors, use ExtractTensor
-  vtkNew<vtkAssignAttribute> assignAttribute;
-  assignAttribute->SetInputData(poly);
-  math->SetInputConnection(assignAttribute->GetOutputPort());
-
-  for (int i=0; i < getNumberOfTensors(poly); i++)
+  if (!poly || !poly->GetPoints() || !poly->GetLines() || numberOfNodes < 2)
     {
-    std::string name = getNthTensorName(i, poly);
-
-    assignAttribute->Assign(
-      name.c_str(),
-      name.c_str() ? vtkDataSetAttributes::TENSORS : -1,
-      vtkAssignAttribute::POINT_DATA);
+    return;
+    }
+  vtkIdType npoints = poly->GetNumberOfPoints();
 
-    assignAttribute->Update();
+  // values of the measures at each point, by measure
+  std::vector<std::string> measureNames;
+  std::vector<double> pointValues;
 
-    if( operation == std::string("Trace") )
-      {
-      math->ColorGlyphsByTrace();
-      }
-    else if( operation == "MeanDiffusivity")
-      {
-      math->ColorGlyphsByMeanDiffusivity();
-      }
-    else if( operation == std::string("RelativeAnisotropy") )
+  std::vector<int> tensorOperations;
+  std::vector<std::string> tensorOperationNames;
+  for (size_t op = 0; op < operations.size(); op++)
+    {
+    int tensorOperation = getTensorOperation(operations[op]);
+    if (tensorOperation >= 0)
       {
-      math->ColorGlyphsByRelativeAnisotropy();
+      tensorOperations.push_back(tensorOperation);
+      tensorOperationNames.push_back(operations[op]);
       }
-    else if( operation == std::string("FractionalAnisotropy") )
+    }
+
+  std::vector<float> tensorValues;
+  for (int i=0; i<poly->GetPointData()->GetNumberOfArrays(); i++)
+    {
+    vtkDataArray *arr = poly->GetPointData()->GetArray(i);
+    std::string name = arr->GetName() ? std::string(arr->GetName()) : std::string();
+    if (arr->GetNumberOfComponents() == 1 && !name.empty())
       {
-      math->ColorGlyphsByFractionalAnisotropy();
+      measureNames.push_back(name);
+      for (vtkIdType n = 0; n < npoints; n++)
+        {
+        pointValues.push_back(arr->GetComponent(n, 0));
+        }
       }
-    else if( operation == std::string("LinearMeasure") )
+    else if (arr->GetNumberOfComponents() == 9)
       {
-      math->ColorGlyphsByLinearMeasure();
+      computeTensorScalars(arr, tensorOperations, tensorValues);
+      for (size_t op = 0; op < tensorOperations.size(); op++)
+        {
+        measureNames.push_back(name + std::string(".") + tensorOperationNames[op]);
+        pointValues.insert(pointValues.end(),
+                           tensorValues.begin() + op * npoints,
+                           tensorValues.begin() + (op + 1) * npoints);
+        }
       }
-    else if( operation == std::string("PlanarMeasure") )
+    }
+
+  // out of range values of clamped measures are excluded, as in the statistics
+  size_t nmeasures = measureNames.size();
+  for (size_t m = 0; m < nmeasures; m++)
+    {
+    ClampedOp_t::iterator op_iter;
+    for (op_iter = clamped_ops.begin(); op_iter != clamped_ops.end(); op_iter++)
       {
-      math->ColorGlyphsByPlanarMeasure();
+      if (measureNames[m].find(op_iter->first) == std::string::npos)
+        {
+        continue;
+        }
+      for (vtkIdType n = 0; n < npoints; n++)
+        {
+        double &val = pointValues[m * npoints + n];
+        if (val < op_iter->second.first || val > op_iter->second.second)
+          {
+          val = vtkMath::Nan();
+          }
+        }
       }
-    else if( operation == std::string("SphericalMeasure") )
+    }
+
+  // point ids of the fibers
+  std::vector<vtkIdType> fiberOffsets(1, 0);
+  std::vector<vtkIdType> fiberPointIds;
+  vtkIdType npts;
+  const vtkIdType *pts;
+  vtkCellArray *lines = poly->GetLines();
+  for (lines->InitTraversal(); lines->GetNextCell(npts, pts); )
+    {
+    fiberPointIds.insert(fiberPointIds.end(), pts, pts + npts);
+    fiberOffsets.push_back(static_cast<vtkIdType>(fiberPointIds.size()));
+    }
+  vtkIdType nfibers = static_cast<vtkIdType>(fiberOffsets.size()) - 1;
+
+  // resample the positions and the measures of the fibers at the nodes
+  std::vector<double> nodePoints(nfibers * numberOfNodes * 3);
+  std::vector<double> nodeValues(nfibers * numberOfNodes * nmeasures);
+  std::vector<char> resampled(nfibers, 0);
+  vtkPoints *points = poly->GetPoints();
+  vtkSMPTools::For(0, nfibers, [&](vtkIdType begin, vtkIdType end)
+    {
+    std::vector<double> arcLength;
+    double prev[3], next[3];
+    for (vtkIdType f = begin; f < end; f++)
       {
-      math->ColorGlyphsBySphericalMeasure();
+      const vtkIdType *ids = fiberPointIds.data() + fiberOffsets[f];
+      vtkIdType nids = fiberOffsets[f + 1] - fiberOffsets[f];
+      if (nids < 2)
+        {
+        continue;
+        }
+      arcLength.assign(1, 0.0);
+      points->GetPoint(ids[0], prev);
+      for (vtkIdType n = 1; n < nids; n++)
+        {
+        points->GetPoint(ids[n], next);
+        arcLength.push_back(arcLength.back() + sqrt(vtkMath::Distance2BetweenPoints(prev, next)));
+        prev[0] = next[0]; prev[1] = next[1]; prev[2] = next[2];
+        }
+      double length = arcLength.back();
+      if (length <= 0.0)
+        {
+        continue;
+        }
+
+      vtkIdType segment = 1;
+      for (int node = 0; node < numberOfNodes; node++)
+        {
+        double position = length * node / (numberOfNodes - 1);
+        while (segment < nids - 1 && arcLength[segment] < position)
+          {
+          segment++;
+          }
+        double segmentLength = arcLength[segment] - arcLength[segment - 1];
+        double t = segmentLength > 0.0 ? (position - arcLength[segment - 1]) / segmentLength : 0.0;
+        t = std::min(std::max(t, 0.0), 1.0);
+        vtkIdType from = ids[segment - 1];
+        vtkIdType to = ids[segment];
+
+        points->GetPoint(from, prev);
+        points->GetPoint(to, next);
+        double *nodePoint = nodePoints.data() + (f * numberOfNodes + node) * 3;
+        for (int c = 0; c < 3; c++)
+          {
+          nodePoint[c] = (1.0 - t) * prev[c] + t * next[c];
+          }
+        double *nodeValue = nodeValues.data() + (f * numberOfNodes + node) * nmeasures;
+        for (size_t m = 0; m < nmeasures; m++)
+          {
+          nodeValue[m] = (1.0 - t) * pointValues[m * npoints + from] + t * pointValues[m * npoints + to];
+          }
+        }
+      resampled[f] = 1;
       }
-    else if( operation == std::string("MinEigenvalue") )
+    });
+
+  // orient the fibers like the first one, then like the centroid
+  std::vector<char> flipped(nfibers, 0);
+  std::vector<double> centroid;
+  for (vtkIdType f = 0; f < nfibers && centroid.empty(); f++)
+    {
+    if (resampled[f])
       {
-      math->ColorGlyphsByMinEigenvalue();
+      centroid.assign(nodePoints.begin() + f * numberOfNodes * 3,
+                      nodePoints.begin() + (f + 1) * numberOfNodes * 3);
       }
-    else if( operation == std::string("MidEigenvalue") )
+    }
+  if (centroid.empty())
+    {
+    return;
+    }
+  for (int pass = 0; pass < 2; pass++)
+    {
+    std::vector<double> sum(numberOfNodes * 3, 0.0);
+    for (vtkIdType f = 0; f < nfibers; f++)
       {
-      math->ColorGlyphsByMidEigenvalue();
+      if (!resampled[f])
+        {
+        continue;
+        }
+      const double *nodePoint = nodePoints.data() + f * numberOfNodes * 3;
+      double distance = 0.0;
+      double flippedDistance = 0.0;
+      for (int node = 0; node < numberOfNodes; node++)
+        {
+        distance += sqrt(vtkMath::Distance2BetweenPoints(
+          nodePoint + node * 3, centroid.data() + node * 3));
+        flippedDistance += sqrt(vtkMath::Distance2BetweenPoints(
+          nodePoint + (numberOfNodes - 1 - node) * 3, centroid.data() + node * 3));
+        }
+      flipped[f] = flippedDistance < distance;
+      for (int node = 0; node < numberOfNodes; node++)
+        {
+        int fiberNode = flipped[f] ? numberOfNodes - 1 - node : node;
+        for (int c = 0; c < 3; c++)
+          {
+          sum[node * 3 + c] += nodePoint[fiberNode * 3 + c];
+          }
+        }
       }
-    else if( operation == std::string("MaxEigenvalue") )
+    vtkIdType nresampled = std::count(resampled.begin(), resampled.end(), 1);
+    for (size_t c = 0; c < sum.size(); c++)
       {
-      math->ColorGlyphsByMaxEigenvalue();
+      centroid[c] = sum[c] / nresampled;
       }
-    else
+    }
+
+  // mean of the measures at each node, NaN values are ignored
+  std::map<std::string, std::vector<double> > &profile = profiles[id];
+  for (size_t m = 0; m < nmeasures; m++)
+    {
+    std::vector<double> &nodeMeans = profile[measureNames[m]];
+    nodeMeans.assign(numberOfNodes, 0.0);
+    for (int node = 0; node < numberOfNodes; node++)
       {
-      std::cerr << operation << ": Operation " << operation << "not supported" << std::endl;
-      return EXIT_FAILURE;
+      double sum = 0.0;
+      vtkIdType count = 0;
+      for (vtkIdType f = 0; f < nfibers; f++)
+        {
+        if (!resampled[f])
+          {
+          continue;
+          }
+        int fiberNode = flipped[f] ? numberOfNodes - 1 - node : node;
+        double val = nodeValues[(f * numberOfNodes + fiberNode) * nmeasures + m];
+        if (!vtkMath::IsNan(val))
+          {
+          sum += val;
+          count++;
+          }
+        }
+      nodeMeans[node] = count > 0 ? sum / count : vtkMath::Nan();
       }
+    }
+}
 
-    math->Update();
+// Read a fiber bundle file (.vtk or .vtp) and add its measurements to the
+// table, and its along-tract profile to the profiles if numberOfNodes > 1
+void measureFile(std::string fileName,
+                 const std::vector<std::string> &operations,
+                 bool moreStatistics,
+                 Table_t &table,
+                 int numberOfNodes,
+                 ProfileTable_t &profiles)
+{
+  vtkSmartPointer<vtkPolyData> data;
+  if (vtksys::SystemTools::GetFilenameLastExtension(fileName) == ".vtp")
+    {
+    vtkNew<vtkXMLPolyDataReader> reader;
+    reader->SetFileName(fileName.c_str());
+    reader->Update();
+    data = reader->GetOutput();
+    }
+  else
+    {
+    vtkNew<vtkPolyDataReader> reader;
+    reader->SetFileName(fileName.c_str());
+    reader->Update();
+    data = reader->GetOutput();
+    }
 
-    if (!math->GetOutput()->GetPointData() || !math->GetOutput()->GetPointData()->GetScalars())
-      {
-      std::cout << "no scalars computed for cluster: \"" << id << "\" and op: \"" << operation << "\"" << std::endl;
-      }
-    std::string scalarName = name + std::string(".") + operation;
-    computeScalarMeasurements(math->GetOutput(), id, scalarName, moreStatistics);
+  if (numberOfNodes > 1)
+    {
+    computeAlongTractProfile(data, fileName, operations, numberOfNodes, profiles);
     }
 
-  return EXIT_SUCCESS;
+  if( !setTensors(data) )
+    {
+    std::lock_guard<std::mutex> lock(PrintMutex);
+    std::cout << "FiberTractMeasurements : No tensor data for file " << fileName << std::endl;
+    }
+
+  measureFiberBundle(data, fileName, operations, moreStatistics, table);
 }
 
-int computeAllTensorMeasurements(vtkSmartPointer<vtkPolyData> input,
-                                 std::string &id,
-                                 std::vector<std::string> operations,
-                                 bool moreStatistics)
+// Measure the files of a folder in parallel: each thread measures whole
+// files into its own table and the tables are merged into OutTable at
+// the end. The ids of the files are distinct, so the result does not
+// depend on the number of threads.
+class MeasureFilesFunctor
 {
-  int result = EXIT_SUCCESS;
-  std::vector<std::string>::iterator op_iter = operations.begin();
-  for (; op_iter != operations.end(); op_iter++)
-    result = result & computeTensorMeasurement(input, id, *op_iter, moreStatistics);
+public:
+  std::vector<std::string> FileNames;
+  std::vector<std::string> Operations;
+  bool MoreStatistics;
+  int NumberOfProfileNodes;
 
-  return result;
-}
+  vtkSMPThreadLocal<Table_t> Tables;
+  vtkSMPThreadLocal<ProfileTable_t> Profiles;
+
+  void Initialize()
+  {
+  }
+
+  void operator()(vtkIdType begin, vtkIdType end)
+  {
+    Table_t &table = this->Tables.Local();
+    ProfileTable_t &profiles = this->Profiles.Local();
+    for (vtkIdType i = begin; i < end; i++)
+      {
+      measureFile(this->FileNames[i], this->Operations, this->MoreStatistics, table,
+                  this->NumberOfProfileNodes, profiles);
+      }
+  }
+
+  void Reduce()
+  {
+    for (vtkSMPThreadLocal<Table_t>::iterator it = this->Tables.begin();
+         it != this->Tables.end(); ++it)
+      {
+      OutTable.insert(it->begin(), it->end());
+      }
+    for (vtkSMPThreadLocal<ProfileTable_t>::iterator it = this->Profiles.begin();
+         it != this->Profiles.end(); ++it)
+      {
+      ProfileTable.insert(it->begin(), it->end());
+      }
+  }
+};
 
 bool setTensors(vtkPolyData *poly)
 {
@@ -865,6 +1395,190 @@ void printCluster(const std::string &id,
     }
 }
 
+// Print the along-tract profiles: one row per bundle and node, one
+// column per measure
+void printProfiles(std::ostream &ofs)
+{
+  std::set<std::string> names;
+  ProfileTable_t::iterator it;
+  std::map<std::string, std::vector<double> >::iterator it1;
+  for (it = ProfileTable.begin(); it != ProfileTable.end(); it++)
+    {
+    for (it1 = it->second.begin(); it1 != it->second.end(); it1++)
+      {
+      names.insert(it1->first);
+      }
+    }
+
+  ofs << "Name" << SEPARATOR << "Node";
+  std::set<std::string>::iterator it2;
+  for (it2 = names.begin(); it2 != names.end(); it2++)
+    {
+    ofs << SEPARATOR << *it2;
+    }
+  ofs << std::endl;
+
+  for (it = ProfileTable.begin(); it != ProfileTable.end(); it++)
+    {
+    size_t numberOfNodes = it->second.empty() ? 0 : it->second.begin()->second.size();
+    for (size_t node = 0; node < numberOfNodes; node++)
+      {
+      ofs << it->first << SEPARATOR << node;
+      for (it2 = names.begin(); it2 != names.end(); it2++)
+        {
+        ofs << SEPARATOR;
+        it1 = it->second.find(*it2);
+        if (it1 != it->second.end() && !vtkMath::IsNan(it1->second[node]))
+          {
+          ofs << std::fixed << it1->second[node];
+          }
+        else
+          {
+          ofs << INVALID_NUMBER_PRINT;
+          }
+        }
+      ofs << std::endl;
+      }
+    }
+}
+
+// Python literal of a column name in the header of a .npy file
+std::string npyFieldName(const std::string &name)
+{
+  std::string quoted = "'";
+  for (size_t c = 0; c < name.size(); c++)
+    {
+    if (name[c] == '\'' || name[c] == '\\')
+      {
+      quoted += '\\';
+      }
+    quoted += name[c];
+    }
+  return quoted + "'";
+}
+
+// Write the measurements of the fiber bundles (OutTable) followed by the
+// clusters as a NumPy structured array (.npy): one row per bundle or
+// cluster, with its numeric index, its name and one little-endian float64
+// column per measure (NaN when missing). The file is loaded directly with
+// numpy.load(), or pandas.DataFrame(numpy.load()), without parsing text.
+bool writeBinaryTable(const std::string &fileName)
+{
+  std::map<std::string, std::string> names = getMeasureNames();
+
+  // same column order as printTable
+  std::vector<std::string> columns;
+  for (AggNames_t::iterator agg_iter  = aggregate_names.begin();
+                            agg_iter != aggregate_names.end();
+                            agg_iter++)
+    {
+    if (names.find(*agg_iter) != names.end())
+      {
+      columns.push_back(*agg_iter);
+      }
+    }
+  std::map<std::string, std::string>::iterator it2;
+  for (it2 = names.begin(); it2 != names.end(); it2++)
+    {
+    if (std::find(aggregate_names.begin(), aggregate_names.end(), it2->first) == aggregate_names.end())
+      {
+      columns.push_back(it2->first);
+      }
+    }
+
+  std::vector<Table_t *> tables;
+  tables.push_back(&OutTable);
+  tables.push_back(&Clusters);
+
+  size_t nrows = 0;
+  size_t nameLength = 1;
+  Table_t::iterator it;
+  for (size_t t = 0; t < tables.size(); t++)
+    {
+    for (it = tables[t]->begin(); it != tables[t]->end(); it++)
+      {
+      nameLength = std::max(nameLength, it->first.size());
+      nrows++;
+      }
+    }
+
+  // header
+  std::ostringstream descr;
+  descr << "{'descr': [('Index', '<i8'), ('Name', '|S" << nameLength << "')";
+  for (size_t c = 0; c < columns.size(); c++)
+    {
+    descr << ", (" << npyFieldName(columns[c]) << ", '<f8')";
+    }
+  descr << "], 'fortran_order': False, 'shape': (" << nrows << ",), }";
+  std::string header = descr.str();
+
+  // version 1.0 stores the header length on 2 bytes, 2.0 on 4 bytes.
+  // The data starts on a multiple of 64 bytes.
+  unsigned char version = (header.size() + 1 + 10 + 64 > 65535) ? 2 : 1;
+  size_t preambleLength = version == 1 ? 10 : 12;
+  size_t padding = 64 - (preambleLength + header.size() + 1) % 64;
+  header += std::string(padding % 64, ' ') + "\n";
+
+  std::ofstream ofs(fileName.c_str(), std::ios::out | std::ios::binary);
+  if (ofs.fail())
+    {
+    std::cerr << "Unable to write binary output file: " << fileName << std::endl;
+    return false;
+    }
+
+  ofs.write("\x93NUMPY", 6);
+  ofs.put(static_cast<char>(version));
+  ofs.put(0);
+  if (version == 1)
+    {
+    unsigned short headerLength = static_cast<unsigned short>(header.size());
+    vtkByteSwap::Swap2LE(&headerLength);
+    ofs.write(reinterpret_cast<const char *>(&headerLength), 2);
+    }
+  else
+    {
+    unsigned int headerLength = static_cast<unsigned int>(header.size());
+    vtkByteSwap::Swap4LE(&headerLength);
+    ofs.write(reinterpret_cast<const char *>(&headerLength), 4);
+    }
+  ofs.write(header.c_str(), header.size());
+
+  // rows, one buffer per row
+  size_t rowLength = 8 + nameLength + 8 * columns.size();
+  std::vector<char> row(rowLength);
+  std::map<std::string, double>::iterator it1;
+  int64_t index = 0;
+  for (size_t t = 0; t < tables.size(); t++)
+    {
+    for (it = tables[t]->begin(); it != tables[t]->end(); it++, index++)
+      {
+      char *field = row.data();
+
+      int64_t rowIndex = index;
+      vtkByteSwap::Swap8LE(&rowIndex);
+      memcpy(field, &rowIndex, 8);
+      field += 8;
+
+      std::fill(field, field + nameLength, 0);
+      memcpy(field, it->first.c_str(), it->first.size());
+      field += nameLength;
+
+      for (size_t c = 0; c < columns.size(); c++, field += 8)
+        {
+        it1 = it->second.find(columns[c]);
+        double value = it1 != it->second.end() ? it1->second : vtkMath::Nan();
+        vtkByteSwap::Swap8LE(&value);
+        memcpy(field, &value, 8);
+        }
+
+      ofs.write(row.data(), rowLength);
+      }
+    }
+
+  ofs.close();
+  return !ofs.fail();
+}
+
 int main( int argc, char * argv[] )
 {
   itk::FloatingPointExceptions::Disable();
@@ -879,7 +1593,11 @@ int main( int argc, char * argv[] )
     return EXIT_FAILURE;
     }
 
-  vtkNew<vtkPolyDataTensorToColor> math;
+  if (numberOfThreads > 0)
+    {
+    vtkSMPTools::Initialize(numberOfThreads);
+    }
+
   std::vector<std::string> operations;
   operations.push_back(std::string("Trace"));
   operations.push_back(std::string("MeanDiffusivity"));
@@ -891,7 +1609,6 @@ int main( int argc, char * argv[] )
   operations.push_back(std::string("MinEigenvalue"));
   operations.push_back(std::string("MidEigenvalue"));
   operations.push_back(std::string("MaxEigenvalue"));
-  std::string EMPTY_OP("");
 
   clamped_ops["FractionalAnisotropy"] = Range(0.0, 1.0);
   clamped_ops["RelativeAnisotropy"]   = Range(0.0, std::sqrt(2));
@@ -989,9 +1706,11 @@ int main( int argc, char * argv[] )
             // concat hierarchy path to id
             getPathFromParentToChild(topHierNode, dispHierarchyNode, id);
             vtkSmartPointer<vtkPolyData> data = fiberNode->GetPolyData();
-            computeFiberStats(data, id);
-            computeScalarMeasurements(data, id, EMPTY_OP, moreStatistics);
-            computeAllTensorMeasurements(data, id, operations, moreStatistics);
+            measureFiberBundle(data, id, operations, moreStatistics, OutTable);
+            if (!profileFile.empty())
+              {
+              computeAlongTractProfile(data, id, operations, numberOfProfileNodes, ProfileTable);
+              }
             } // if (fiberNode)
           } // if (dispHierarchyNode)
         } // for (unsigned int i = 0; i < allChildren.size(); ++i)
@@ -1009,54 +1728,24 @@ int main( int argc, char * argv[] )
     // override here, because we must always print individual statistics for folders
     printAllStatistics = true;
 
+    MeasureFilesFunctor measureFiles;
+    measureFiles.Operations = operations;
+    measureFiles.MoreStatistics = moreStatistics;
+    measureFiles.NumberOfProfileNodes = profileFile.empty() ? 0 : numberOfProfileNodes;
+
+    // .vtk and .vtp files
     vtkNew<vtkGlobFileNames> glob;
     glob->SetDirectory(InputDirectory.c_str());
-
-    // Loop over .vtk files
     glob->AddFileNames("*.vtk");
-    vtkStringArray *fileNamesVTK = glob->GetFileNames();
-    for (vtkIdType i = 0; i < fileNamesVTK->GetNumberOfValues(); i++)
-      {
-      vtkNew<vtkPolyDataReader> reader;
-      std::string fileName = fileNamesVTK->GetValue(i);
-      reader->SetFileName(fileNamesVTK->GetValue(i).c_str());
-      reader->Update();
-
-      vtkSmartPointer<vtkPolyData> data = reader->GetOutput();
-      computeFiberStats(data, fileName);
-      computeScalarMeasurements(data, fileName, EMPTY_OP, moreStatistics);
-
-      if( !setTensors(data) )
-        {
-        std::cout << argv[0] << " : No tensor data for file " << fileName << std::endl;
-        continue;
-        }
-
-      computeAllTensorMeasurements(data, fileName, operations, moreStatistics);
-      }
-
-    // Loop over .vtp files
-    glob->Reset();
     glob->AddFileNames("*.vtp");
-    vtkStringArray *fileNamesVTP = glob->GetFileNames();
-    for (vtkIdType i = 0; i < fileNamesVTP->GetNumberOfValues(); i++)
+    vtkStringArray *fileNames = glob->GetFileNames();
+    for (vtkIdType i = 0; i < fileNames->GetNumberOfValues(); i++)
       {
-      vtkNew<vtkXMLPolyDataReader> reader;
-      std::string fileName = fileNamesVTP->GetValue(i);
-      reader->SetFileName(fileName.c_str());
-      reader->Update();
-
-      vtkSmartPointer<vtkPolyData> data = reader->GetOutput();
-      computeFiberStats(data, fileName);
-      computeScalarMeasurements(data, fileName, EMPTY_OP, moreStatistics);
-      if( !setTensors(data) )
-        {
-        std::cout << argv[0] << " : No tensor data for file " << fileName << std::endl;
-        continue;
-        }
-
-      computeAllTensorMeasurements(data, fileName, operations, moreStatistics);
+      measureFiles.FileNames.push_back(fileNames->GetValue(i));
       }
+
+    // one file at a time per thread
+    vtkSMPTools::For(0, static_cast<vtkIdType>(measureFiles.FileNames.size()), 1, measureFiles);
     } //if (inputType == std::string("Fibers File Folder") )
 
   if (addClusters() == 0)
@@ -1091,6 +1780,22 @@ int main( int argc, char * argv[] )
 
   ofs.flush();
 
+  if (!outputBinaryFile.empty() && !writeBinaryTable(outputBinaryFile))
+    {
+    return EXIT_FAILURE;
+    }
+
+  if (!profileFile.empty())
+    {
+    std::ofstream profilefilestream(profileFile.c_str());
+    if (profilefilestream.fail())
+      {
+      std::cerr << "Unable to write profile file: " << profileFile << std::endl;
+      return EXIT_FAILURE;
+      }
+    printProfiles(profilefilestream);
+    }
+
   // print to stdout
   std::cout << ofs.str();
   // print to file
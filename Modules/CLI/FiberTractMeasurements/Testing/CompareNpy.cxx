@@ -0,0 +1,263 @@
+#if defined(_MSC_VER)
+#pragma warning ( disable : 4786 )
+#endif
+
+#ifdef __BORLANDC__
+#define ITK_LEAN_AND_MEAN
+#endif
+
+// VTK includes
+#include <vtkByteSwap.h>
+#include <vtkMath.h>
+
+// STD includes
+#include <cmath>
+#include <cstdlib>
+#include <cstring>
+#include <fstream>
+#include <iostream>
+#include <map>
+#include <sstream>
+#include <string>
+#include <vector>
+
+// Read the Python string literal starting at pos, and move pos after it
+bool readQuoted(const std::string &header, size_t &pos, std::string &value)
+{
+  pos = header.find_first_of("'\"", pos);
+  if (pos == std::string::npos)
+    {
+    return false;
+    }
+  char quote = header[pos];
+  value.clear();
+  for (pos++; pos < header.size() && header[pos] != quote; pos++)
+    {
+    if (header[pos] == '\\')
+      {
+      pos++;
+      }
+    value += header[pos];
+    }
+  pos++;
+  return pos <= header.size();
+}
+
+// Split a line of the text table
+std::vector<std::string> splitLine(const std::string &line, char separator)
+{
+  std::vector<std::string> fields;
+  std::stringstream ss(line);
+  std::string field;
+  while (std::getline(ss, field, separator))
+    {
+    fields.push_back(field);
+    }
+  return fields;
+}
+
+// Compare the NumPy structured array written by --outputbinaryfile with the
+// text table of the same run: same columns in the same order, and the same
+// values, up to the 6 decimals of the text, for every row of the text.
+int main( int argc, char * argv[] )
+{
+  if( argc < 3 )
+    {
+    std::cerr << "Both output npy and txt files are required!" << std::endl;
+    return EXIT_FAILURE;
+    }
+
+  std::string npyPath = argv[1];
+  std::string txtPath = argv[2];
+  std::ifstream npy(npyPath.c_str(), std::ios::in | std::ios::binary);
+  std::ifstream txt(txtPath.c_str());
+  if (npy.fail() || txt.fail())
+    {
+    std::cerr << "Unable to read " << npyPath << " or " << txtPath << std::endl;
+    return EXIT_FAILURE;
+    }
+
+  // preamble
+  char magic[8];
+  npy.read(magic, 8);
+  if (npy.fail() || memcmp(magic, "\x93NUMPY", 6) != 0 || (magic[6] != 1 && magic[6] != 2))
+    {
+    std::cerr << "Not a npy file: " << npyPath << std::endl;
+    return EXIT_FAILURE;
+    }
+  size_t headerLength;
+  if (magic[6] == 1)
+    {
+    unsigned short length;
+    npy.read(reinterpret_cast<char *>(&length), 2);
+    vtkByteSwap::Swap2LE(&length);
+    headerLength = length;
+    }
+  else
+    {
+    unsigned int length;
+    npy.read(reinterpret_cast<char *>(&length), 4);
+    vtkByteSwap::Swap4LE(&length);
+    headerLength = length;
+    }
+  std::string header(headerLength, ' ');
+  npy.read(&header[0], headerLength);
+  if (npy.fail() || (static_cast<size_t>(npy.tellg()) % 64) != 0)
+    {
+    std::cerr << "Invalid npy header" << std::endl;
+    return EXIT_FAILURE;
+    }
+
+  // fields: Index, Name, then the float64 measures
+  std::vector<std::string> columns;
+  size_t nameLength = 0;
+  size_t pos = header.find("'descr': [");
+  size_t end = header.find("]", pos);
+  if (pos == std::string::npos || end == std::string::npos)
+    {
+    std::cerr << "Missing descr in npy header" << std::endl;
+    return EXIT_FAILURE;
+    }
+  for (pos = header.find('(', pos); pos < end; pos = header.find('(', pos))
+    {
+    std::string field, type;
+    if (!readQuoted(header, pos, field) || !readQuoted(header, pos, type))
+      {
+      std::cerr << "Invalid descr in npy header" << std::endl;
+      return EXIT_FAILURE;
+      }
+    if (columns.empty() && field == "Index" && type == "<i8")
+      {
+      columns.push_back(field);
+      }
+    else if (columns.size() == 1 && field == "Name" && type.compare(0, 2, "|S") == 0)
+      {
+      nameLength = atoi(type.c_str() + 2);
+      columns.push_back(field);
+      }
+    else if (columns.size() > 1 && type == "<f8")
+      {
+      columns.push_back(field);
+      }
+    else
+      {
+      std::cerr << "Unexpected field " << field << " of type " << type << std::endl;
+      return EXIT_FAILURE;
+      }
+    }
+  if (columns.size() < 2 || nameLength == 0
+      || header.find("'fortran_order': False") == std::string::npos)
+    {
+    std::cerr << "Unexpected npy layout" << std::endl;
+    return EXIT_FAILURE;
+    }
+  pos = header.find("'shape': (");
+  if (pos == std::string::npos)
+    {
+    std::cerr << "Missing shape in npy header" << std::endl;
+    return EXIT_FAILURE;
+    }
+  size_t nrows = strtoul(header.c_str() + pos + 10, NULL, 10);
+
+  // rows, by name
+  size_t rowLength = 8 + nameLength + 8 * (columns.size() - 2);
+  std::vector<char> row(rowLength);
+  std::map<std::string, std::vector<double> > rows;
+  for (size_t r = 0; r < nrows; r++)
+    {
+    npy.read(row.data(), rowLength);
+    if (npy.fail())
+      {
+      std::cerr << "Missing rows: expected " << nrows << ", read " << r << std::endl;
+      return EXIT_FAILURE;
+      }
+    long long index;
+    memcpy(&index, row.data(), 8);
+    vtkByteSwap::Swap8LE(&index);
+    if (index != static_cast<long long>(r))
+      {
+      std::cerr << "Row " << r << " has index " << index << std::endl;
+      return EXIT_FAILURE;
+      }
+    const char *name = row.data() + 8;
+    std::string rowName(name, nameLength);
+    rowName = rowName.substr(0, rowName.find('\0'));
+    std::vector<double> &values = rows[rowName];
+    values.resize(columns.size() - 2);
+    for (size_t c = 0; c < values.size(); c++)
+      {
+      memcpy(&values[c], row.data() + 8 + nameLength + 8 * c, 8);
+      vtkByteSwap::Swap8LE(&values[c]);
+      }
+    }
+  if (npy.peek() != EOF)
+    {
+    std::cerr << "Unexpected data after the " << nrows << " rows" << std::endl;
+    return EXIT_FAILURE;
+    }
+
+  // the text header has the same measures, in the same order
+  std::string line;
+  std::getline(txt, line);
+  char separator = line.find('\t') != std::string::npos ? '\t' :
+                   line.find(',') != std::string::npos ? ',' : ' ';
+  std::vector<std::string> txtColumns = splitLine(line, separator);
+  if (txtColumns.size() != columns.size() - 1)
+    {
+    std::cerr << "The npy file has " << columns.size() - 2 << " measures, the txt file "
+              << static_cast<int>(txtColumns.size()) - 1 << std::endl;
+    return EXIT_FAILURE;
+    }
+  for (size_t c = 1; c < txtColumns.size(); c++)
+    {
+    if (txtColumns[c] != columns[c + 1])
+      {
+      std::cerr << "Column " << c << " is " << columns[c + 1] << " in the npy file and "
+                << txtColumns[c] << " in the txt file" << std::endl;
+      return EXIT_FAILURE;
+      }
+    }
+
+  // every row of the text is in the npy file, with the same values
+  int nlines = 0;
+  while (std::getline(txt, line))
+    {
+    if (line.empty())
+      {
+      continue;
+      }
+    std::vector<std::string> fields = splitLine(line, separator);
+    if (fields.size() != txtColumns.size())
+      {
+      std::cerr << "Unexpected number of fields in line: " << line << std::endl;
+      return EXIT_FAILURE;
+      }
+    std::map<std::string, std::vector<double> >::iterator it = rows.find(fields[0]);
+    if (it == rows.end())
+      {
+      std::cerr << "Missing row in npy file: " << fields[0] << std::endl;
+      return EXIT_FAILURE;
+      }
+    for (size_t c = 1; c < fields.size(); c++)
+      {
+      double value = it->second[c - 1];
+      bool same = (fields[c].empty() || fields[c] == "NAN") ? vtkMath::IsNan(value) :
+        fabs(atof(fields[c].c_str()) - value) <= 5e-7 + 1e-12 * fabs(value);
+      if (!same)
+        {
+        std::cerr << "Measurements are not the same for " << fields[0] << ", " << txtColumns[c]
+                  << ": " << value << " in the npy file, " << fields[c] << " in the txt file" << std::endl;
+        return EXIT_FAILURE;
+        }
+      }
+    nlines++;
+    }
+  if (nlines == 0)
+    {
+    std::cerr << "No measurements in " << txtPath << std::endl;
+    return EXIT_FAILURE;
+    }
+
+  std::cerr << "Same content!!!" << std::endl;
+  return EXIT_SUCCESS;
+}
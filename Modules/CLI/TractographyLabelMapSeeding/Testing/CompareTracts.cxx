@@ -0,0 +1,90 @@
+#if defined(_MSC_VER)
+#pragma warning ( disable : 4786 )
+#endif
+
+#ifdef __BORLANDC__
+#define ITK_LEAN_AND_MEAN
+#endif
+
+// VTK includes
+#include <vtkCellArray.h>
+#include <vtkMath.h>
+#include <vtkNew.h>
+#include <vtkPoints.h>
+#include <vtkPolyData.h>
+#include <vtkXMLPolyDataReader.h>
+#include <vtkVersion.h>
+
+// STD includes
+#include <cmath>
+#include <cstdlib>
+#include <iostream>
+#include <string>
+
+// Compare the tracts of the batch integration with the tracts of the legacy
+// vtkHyperStreamlineDTMRI integration: same streamlines, in the same seed
+// order, with the same number of points at the same positions (up to the
+// tolerance, in mm).
+int main( int argc, char * argv[] )
+{
+  if( argc < 3 )
+    {
+    std::cerr << "Both batch and legacy tracts are required!" << std::endl;
+    return EXIT_FAILURE;
+    }
+  double tolerance = argc > 3 ? atof(argv[3]) : 1e-3;
+
+  vtkNew<vtkXMLPolyDataReader> batchReader;
+  batchReader->SetFileName(argv[1]);
+  batchReader->Update();
+  vtkPolyData* batch = batchReader->GetOutput();
+
+  vtkNew<vtkXMLPolyDataReader> legacyReader;
+  legacyReader->SetFileName(argv[2]);
+  legacyReader->Update();
+  vtkPolyData* legacy = legacyReader->GetOutput();
+
+  if (batch->GetNumberOfLines() == 0 || batch->GetNumberOfLines() != legacy->GetNumberOfLines())
+    {
+    std::cerr << "The batch integration has " << batch->GetNumberOfLines()
+              << " tracts, the legacy integration " << legacy->GetNumberOfLines() << std::endl;
+    return EXIT_FAILURE;
+    }
+
+  vtkIdType batchNpts, legacyNpts;
+#if VTK_MAJOR_VERSION >= 9 || (VTK_MAJOR_VERSION >= 8 && VTK_MINOR_VERSION >= 90)
+  const vtkIdType *batchPts, *legacyPts;
+#else
+  vtkIdType *batchPts, *legacyPts;
+#endif
+  vtkCellArray* batchLines = batch->GetLines();
+  vtkCellArray* legacyLines = legacy->GetLines();
+  batchLines->InitTraversal();
+  legacyLines->InitTraversal();
+  for (vtkIdType line = 0; batchLines->GetNextCell(batchNpts, batchPts); line++)
+    {
+    legacyLines->GetNextCell(legacyNpts, legacyPts);
+    if (batchNpts != legacyNpts)
+      {
+      std::cerr << "Tract " << line << " has " << batchNpts << " points in batch, "
+                << legacyNpts << " in legacy" << std::endl;
+      return EXIT_FAILURE;
+      }
+    for (vtkIdType i = 0; i < batchNpts; i++)
+      {
+      double batchPoint[3], legacyPoint[3];
+      batch->GetPoint(batchPts[i], batchPoint);
+      legacy->GetPoint(legacyPts[i], legacyPoint);
+      double distance = sqrt(vtkMath::Distance2BetweenPoints(batchPoint, legacyPoint));
+      if (distance > tolerance)
+        {
+        std::cerr << "Point " << i << " of tract " << line << " is " << distance
+                  << " mm away from the legacy one" << std::endl;
+        return EXIT_FAILURE;
+        }
+      }
+    }
+
+  std::cerr << "Same tracts!!!" << std::endl;
+  return EXIT_SUCCESS;
+}
@@ -213,6 +213,8 @@ int main( int argc, char * argv[] )
 
     seed->SetIsotropicSeedingResolution(SeedSpacing);
     seed->SetMinimumPathLength(MinimumLength);
+    // trace all the seeds concurrently, unless the legacy integration is asked
+    seed->SetBatchIntegration(!LegacyIntegration);
     seed->UseVtkHyperStreamlinePoints();
     vtkNew<vtkHyperStreamlineDTMRI> streamer;
     seed->SetVtkHyperStreamlinePointsSettings(streamer.GetPointer());
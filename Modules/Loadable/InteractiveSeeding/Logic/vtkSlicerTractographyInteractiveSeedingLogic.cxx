@@ -33,6 +33,12 @@
 #include <vtkDiffusionTensorMathematics.h>
 
 // VTK includes
+#include <vtkAlgorithmOutput.h>
+#include <vtkAppendPolyData.h>
+#include <vtkCallbackCommand.h>
+#include <vtkCellArray.h>
+#include <vtkFloatArray.h>
+#include <vtkIdTypeArray.h>
 #include <vtkImageCast.h>
 #include <vtkImageChangeInformation.h>
 #include <vtkImageThreshold.h>
@@ -40,8 +46,12 @@
 #include <vtkMath.h>
 #include <vtkNew.h>
 #include <vtkPointData.h>
+#include <vtkPoints.h>
+#include <vtkPolyData.h>
 #include <vtkSeedTracts.h>
 #include <vtkSmartPointer.h>
+#include <vtkTimerLog.h>
+#include <vtkTrivialProducer.h>
 
 // STD includes
 #include <iostream>
@@ -49,20 +59,88 @@
 
 // STD includes
 #include <algorithm>
+#include <atomic>
+#include <mutex>
+#include <set>
+#include <sstream>
+#include <thread>
 
 vtkStandardNewMacro(vtkSlicerTractographyInteractiveSeedingLogic);
 
+//----------------------------------------------------------------------------
+// Tracing deferred to the tracking thread. The inputs of the seeding
+// objects are copies of the MRML data, the thread never accesses the scene
+// nor the logic: a canceled job may still run while the next one is
+// prepared.
+struct vtkSlicerTractographyInteractiveSeedingLogic::TrackingJob
+{
+  TrackingJob() : Canceled(false), Finished(false), Done(false) {}
+
+  std::thread Thread;
+  std::atomic<bool> Canceled;
+  // Set when the tracking thread returns
+  std::atomic<bool> Finished;
+  std::string FiberNodeID;
+  double UpdateInterval;
+  double LastPublishTime;
+  // Seeding of the seed points that are not in the cache
+  vtkSmartPointer<vtkSeedTracts> Seed;
+  vtkSmartPointer<vtkPoints> SeedPoints;
+  std::vector<SeedKey> Seeds;
+  // Seeding of each label of the label map
+  std::vector<vtkSmartPointer<vtkSeedTracts> > ROISeeds;
+  // Producers of the copied inputs
+  std::vector<vtkSmartPointer<vtkTrivialProducer> > Inputs;
+  // Streamlines of the seed points, added to the cache when done
+  std::map<SeedKey, CachedStreamline> Streamlines;
+  // Tracts traced so far, in RAS
+  std::vector<vtkSmartPointer<vtkPolyData> > Tracts;
+  // Tracts of the cached streamlines, shown with the partial results.
+  // Only used in the main thread: their points are updated in place.
+  vtkSmartPointer<vtkPolyData> CachedFibers;
+
+  // Latest result of the tracking thread, guarded by Mutex
+  std::mutex Mutex;
+  vtkSmartPointer<vtkPolyData> Output;
+  bool Done;
+};
+
+namespace
+{
+//----------------------------------------------------------------------------
+// Producer of a shallow copy of the current output of a connection, so the
+// tracking thread does not update the MRML pipelines.
+vtkSmartPointer<vtkTrivialProducer> DetachInput(vtkAlgorithmOutput *connection)
+{
+  vtkAlgorithm *producer = connection->GetProducer();
+  producer->Update(connection->GetIndex());
+  vtkSmartPointer<vtkImageData> image = vtkSmartPointer<vtkImageData>::New();
+  image->ShallowCopy(producer->GetOutputDataObject(connection->GetIndex()));
+  vtkSmartPointer<vtkTrivialProducer> trivialProducer = vtkSmartPointer<vtkTrivialProducer>::New();
+  trivialProducer->SetOutput(image);
+  return trivialProducer;
+}
+} // end of anonymous namespace
+
 //----------------------------------------------------------------------------
 vtkSlicerTractographyInteractiveSeedingLogic::vtkSlicerTractographyInteractiveSeedingLogic()
 {
   this->MaskPoints = vtkMaskPoints::New();
   this->TractographyInteractiveSeedingNode = NULL;
   this->DiffusionTensorVolumeNode = NULL;
+  this->BackgroundTracking = 0;
+  this->TrackingUpdateInterval = 0.1;
+  this->PreparingJob = NULL;
+  this->RunningJob = NULL;
+  this->NumberOfTracedSeeds = 0;
+  this->ResetCachedFibers();
 }
 
 //----------------------------------------------------------------------------
 vtkSlicerTractographyInteractiveSeedingLogic::~vtkSlicerTractographyInteractiveSeedingLogic()
 {
+  this->CancelTracking();
+  this->JoinCanceledJobs(true);
   this->MaskPoints->Delete();
   this->RemoveMRMLNodesObservers();
   vtkSetAndObserveMRMLNodeMacro(this->TractographyInteractiveSeedingNode, NULL);
@@ -317,6 +395,9 @@ void vtkSlicerTractographyInteractiveSeedingLogic::CreateTractsForOneSeed(vtkSee
   vtkMRMLMarkupsFiducialNode *markupsFiducialNode = vtkMRMLMarkupsFiducialNode::SafeDownCast(transformableNode);
   vtkMRMLModelNode *modelNode = vtkMRMLModelNode::SafeDownCast(transformableNode);
 
+  // Collect all the seed points, they are traced together at the end
+  vtkNew<vtkPoints> seedPoints;
+
   // if annotation
   if (annotationNode && annotationNode->GetNumberOfControlPoints() &&
      (!seedSelectedFiducials || (seedSelectedFiducials && annotationNode->GetSelected())) )
@@ -335,8 +416,7 @@ void vtkSlicerTractographyInteractiveSeedingLogic::CreateTractsForOneSeed(vtkSee
             newXYZ[1] = xyzf[1] + y;
             newXYZ[2] = xyzf[2] + z;
             float *xyz = transFiducial->TransformFloatPoint(newXYZ);
-            //Run the thing
-            seed->SeedStreamlineFromPoint(xyz[0], xyz[1], xyz[2]);
+            seedPoints->InsertNextPoint(xyz[0], xyz[1], xyz[2]);
             }
           }
         }
@@ -363,8 +443,7 @@ void vtkSlicerTractographyInteractiveSeedingLogic::CreateTractsForOneSeed(vtkSee
               newXYZ[1] = xyzf[1] + y;
               newXYZ[2] = xyzf[2] + z;
               float *xyz = transFiducial->TransformFloatPoint(newXYZ);
-              //Run the thing
-              seed->SeedStreamlineFromPoint(xyz[0], xyz[1], xyz[2]);
+              seedPoints->InsertNextPoint(xyz[0], xyz[1], xyz[2]);
               }
             }
           }
@@ -385,11 +464,257 @@ void vtkSlicerTractographyInteractiveSeedingLogic::CreateTractsForOneSeed(vtkSee
       double *xyzf = mpoly->GetPoint(f);
 
       double *xyz = transFiducial->TransformDoublePoint(xyzf);
+      seedPoints->InsertNextPoint(xyz);
+      }
+    }
+
+  //Run the thing
+  this->CreateTractsForSeedPoints(seed, seedPoints.GetPointer());
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::CreateTractsForSeedPoints(vtkSeedTracts *seed,
+                                                                             vtkPoints *seedPoints)
+{
+  // Only the streamlines traced in batch and kept in memory are cached
+  if (!seed->IsBatchIntegrationUsed())
+    {
+    seed->SeedStreamlinesFromPoints(seedPoints);
+    return;
+    }
+
+  if (this->PreparingJob)
+    {
+    // The tracking thread traces the seeds that are not cached and
+    // fills the cache when it completes
+    for (vtkIdType i = 0; i < seedPoints->GetNumberOfPoints(); i++)
+      {
+      double *xyz = seedPoints->GetPoint(i);
+      SeedKey key = {{xyz[0], xyz[1], xyz[2]}};
+      this->CachedSeeds.push_back(key);
+      if (this->StreamlineCache.find(key) == this->StreamlineCache.end())
+        {
+        this->PreparingJob->SeedPoints->InsertNextPoint(xyz);
+        this->PreparingJob->Seeds.push_back(key);
+        this->NumberOfTracedSeeds++;
+        }
+      }
+    return;
+    }
+
+  vtkNew<vtkPoints> newSeedPoints;
+  std::vector<SeedKey> newSeeds;
+  for (vtkIdType i = 0; i < seedPoints->GetNumberOfPoints(); i++)
+    {
+    double *xyz = seedPoints->GetPoint(i);
+    SeedKey key = {{xyz[0], xyz[1], xyz[2]}};
+    this->CachedSeeds.push_back(key);
+    if (this->StreamlineCache.insert(std::make_pair(key, CachedStreamline())).second)
+      {
+      newSeedPoints->InsertNextPoint(xyz);
+      newSeeds.push_back(key);
+      }
+    }
+  if (newSeeds.empty())
+    {
+    return;
+    }
+  this->NumberOfTracedSeeds += static_cast<int>(newSeeds.size());
+
+  // Trace the new seeds and keep their streamlines
+  seed->DeleteAllStreamlines();
+  seed->SeedStreamlinesFromPoints(newSeedPoints.GetPointer());
+  this->CacheStreamlines(seed, newSeeds, this->StreamlineCache);
+  seed->DeleteAllStreamlines();
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::CacheStreamlines(vtkSeedTracts *seed,
+                                                                    const std::vector<SeedKey> &seeds,
+                                                                    std::map<SeedKey, CachedStreamline> &cache)
+{
+  // Streamlines in RAS
+  vtkNew<vtkPolyData> newFibers;
+  seed->TransformStreamlinesToRASAndAppendToPolyData(newFibers.GetPointer());
+
+  vtkIdTypeArray *seedIds = seed->GetBatchSeedIds();
+  vtkIdTypeArray *offsets = seed->GetBatchOffsets();
+  for (vtkIdType line = 0; line < seedIds->GetNumberOfTuples(); line++)
+    {
+    float *points = static_cast<float*>(newFibers->GetPoints()->GetVoidPointer(0));
+    float *tensors = vtkFloatArray::SafeDownCast(newFibers->GetPointData()->GetTensors())->GetPointer(0);
+    vtkIdType begin = offsets->GetValue(line);
+    vtkIdType end = offsets->GetValue(line + 1);
+
+    CachedStreamline &streamline = cache[seeds[seedIds->GetValue(line)]];
+    streamline.Points.assign(points + 3 * begin, points + 3 * end);
+    streamline.Tensors.assign(tensors + 9 * begin, tensors + 9 * end);
+    }
+  // Seeds without streamline
+  for (size_t i = 0; i < seeds.size(); i++)
+    {
+    cache.insert(std::make_pair(seeds[i], CachedStreamline()));
+    }
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::PruneStreamlineCache()
+{
+  std::set<SeedKey> currentSeeds(this->CachedSeeds.begin(), this->CachedSeeds.end());
+  for (std::map<SeedKey, CachedStreamline>::iterator it = this->StreamlineCache.begin();
+       it != this->StreamlineCache.end(); )
+    {
+    if (currentSeeds.count(it->first))
+      {
+      ++it;
+      }
+    else
+      {
+      this->StreamlineCache.erase(it++);
+      }
+    }
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::ResetCachedFibers()
+{
+  this->CachedFiberPoints = vtkSmartPointer<vtkPoints>::New();
+  this->CachedFiberTensors = vtkSmartPointer<vtkFloatArray>::New();
+  this->CachedFiberTensors->SetNumberOfComponents(9);
+  this->CachedFiberRanges.clear();
+  this->NumberOfUnusedCachedFiberPoints = 0;
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::UpdateCachedFibers(vtkPolyData *outFibers)
+{
+  typedef std::map<SeedKey, std::pair<vtkIdType, vtkIdType> > RangeMap;
+
+  // The points of the seeds that are gone are not used anymore
+  std::set<SeedKey> currentSeeds(this->CachedSeeds.begin(), this->CachedSeeds.end());
+  for (RangeMap::iterator it = this->CachedFiberRanges.begin(); it != this->CachedFiberRanges.end(); )
+    {
+    if (currentSeeds.count(it->first))
+      {
+      ++it;
+      }
+    else
+      {
+      this->NumberOfUnusedCachedFiberPoints += it->second.second;
+      this->CachedFiberRanges.erase(it++);
+      }
+    }
+
+  // Compact the points when most of them are unused. The compacted points
+  // go to new arrays so that the tracts already set to a fiber bundle are
+  // left untouched.
+  if (this->NumberOfUnusedCachedFiberPoints > 0 &&
+      2 * this->NumberOfUnusedCachedFiberPoints > this->CachedFiberPoints->GetNumberOfPoints())
+    {
+    vtkSmartPointer<vtkPoints> points = this->CachedFiberPoints;
+    vtkSmartPointer<vtkFloatArray> tensors = this->CachedFiberTensors;
+    vtkIdType numberOfUsedPoints = points->GetNumberOfPoints() - this->NumberOfUnusedCachedFiberPoints;
+    RangeMap ranges;
+    ranges.swap(this->CachedFiberRanges);
+    this->ResetCachedFibers();
+    this->CachedFiberPoints->SetNumberOfPoints(numberOfUsedPoints);
+    this->CachedFiberTensors->SetNumberOfTuples(numberOfUsedPoints);
+    const float *inPoints = static_cast<float*>(points->GetVoidPointer(0));
+    const float *inTensors = tensors->GetPointer(0);
+    float *outPoints = static_cast<float*>(this->CachedFiberPoints->GetVoidPointer(0));
+    float *outTensors = this->CachedFiberTensors->GetPointer(0);
+    vtkIdType ptId = 0;
+    for (RangeMap::iterator it = ranges.begin(); it != ranges.end(); ++it)
+      {
+      vtkIdType first = it->second.first;
+      vtkIdType count = it->second.second;
+      std::copy(inPoints + 3 * first, inPoints + 3 * (first + count), outPoints + 3 * ptId);
+      std::copy(inTensors + 9 * first, inTensors + 9 * (first + count), outTensors + 9 * ptId);
+      this->CachedFiberRanges[it->first] = std::make_pair(ptId, count);
+      ptId += count;
+      }
+    }
 
-      //Run the thing
-      seed->SeedStreamlineFromPoint(xyz[0], xyz[1], xyz[2]);
+  // Streamlines of the seeds that are not in the points yet
+  std::vector<std::pair<SeedKey, const CachedStreamline*> > newStreamlines;
+  vtkIdType numberOfNewPoints = 0;
+  for (size_t i = 0; i < this->CachedSeeds.size(); i++)
+    {
+    if (this->CachedFiberRanges.count(this->CachedSeeds[i]))
+      {
+      continue;
       }
+    std::map<SeedKey, CachedStreamline>::const_iterator it = this->StreamlineCache.find(this->CachedSeeds[i]);
+    if (it == this->StreamlineCache.end() || it->second.Points.empty())
+      {
+      continue;
+      }
+    vtkIdType count = static_cast<vtkIdType>(it->second.Points.size() / 3);
+    this->CachedFiberRanges[it->first] = std::make_pair(vtkIdType(0), count);
+    newStreamlines.push_back(std::make_pair(it->first, &it->second));
+    numberOfNewPoints += count;
     }
+
+  // Append them after the points already there, vtkDataArray keeps the
+  // values and over-allocates when it grows.
+  if (numberOfNewPoints > 0)
+    {
+    vtkIdType ptId = this->CachedFiberPoints->GetNumberOfPoints();
+    this->CachedFiberPoints->SetNumberOfPoints(ptId + numberOfNewPoints);
+    this->CachedFiberTensors->SetNumberOfTuples(ptId + numberOfNewPoints);
+    float *outPoints = static_cast<float*>(this->CachedFiberPoints->GetVoidPointer(0));
+    float *outTensors = this->CachedFiberTensors->GetPointer(0);
+    for (size_t i = 0; i < newStreamlines.size(); i++)
+      {
+      const CachedStreamline &streamline = *newStreamlines[i].second;
+      std::copy(streamline.Points.begin(), streamline.Points.end(), outPoints + 3 * ptId);
+      std::copy(streamline.Tensors.begin(), streamline.Tensors.end(), outTensors + 9 * ptId);
+      this->CachedFiberRanges[newStreamlines[i].first].first = ptId;
+      ptId += static_cast<vtkIdType>(streamline.Points.size() / 3);
+      }
+    this->CachedFiberPoints->Modified();
+    this->CachedFiberTensors->Modified();
+    }
+
+  // Only the lines are rebuilt, in the order of the seeds
+  vtkIdType npts = 0;
+  vtkIdType ncells = 0;
+  std::vector<std::pair<vtkIdType, vtkIdType> > lines;
+  for (size_t i = 0; i < this->CachedSeeds.size(); i++)
+    {
+    RangeMap::const_iterator it = this->CachedFiberRanges.find(this->CachedSeeds[i]);
+    if (it == this->CachedFiberRanges.end())
+      {
+      continue;
+      }
+    lines.push_back(it->second);
+    npts += it->second.second;
+    ncells++;
+    }
+
+  vtkNew<vtkCellArray> outFibersCellArray;
+  outFibersCellArray->SetNumberOfCells(ncells);
+  vtkIdTypeArray *cellArray = outFibersCellArray->GetData();
+  cellArray->SetNumberOfTuples(npts+ncells);
+  vtkIdType *cells = cellArray->GetPointer(0);
+  for (size_t i = 0; i < lines.size(); i++)
+    {
+    *cells++ = lines[i].second;
+    for (vtkIdType n = 0; n < lines[i].second; n++)
+      {
+      *cells++ = lines[i].first + n;
+      }
+    }
+
+#ifdef VTK_CELL_ARRAY_V2
+  // For vtk9 vtkCellArray::GetData returns a copy of the structure,
+  // so we must copy the data into the actual structure used by the vtkPolyData.
+  outFibersCellArray->ImportLegacyFormat(cellArray);
+#endif
+
+  outFibers->SetPoints(this->CachedFiberPoints);
+  outFibers->GetPointData()->SetTensors(this->CachedFiberTensors);
+  outFibers->SetLines(outFibersCellArray.GetPointer());
 }
 
 //----------------------------------------------------------------------------
@@ -407,6 +732,12 @@ int vtkSlicerTractographyInteractiveSeedingLogic::CreateTracts(vtkMRMLTractograp
                                                             int seedSelectedFiducials,
                                                             int vtkNotUsed(displayMode))
 {
+  // the tracts traced here replace the ones of the tracking thread
+  if (!this->PreparingJob)
+    {
+    this->CancelTracking();
+    }
+
   // 0. check inputs
   if (volumeNode == NULL || seedingNode == NULL || fiberNode == NULL ||
       volumeNode->GetImageData() == NULL)
@@ -418,7 +749,40 @@ int vtkSlicerTractographyInteractiveSeedingLogic::CreateTracts(vtkMRMLTractograp
     return 0;
     }
 
-  vtkNew<vtkSeedTracts> seed;
+  vtkSmartPointer<vtkSeedTracts> seed = vtkSmartPointer<vtkSeedTracts>::New();
+  // trace all the seeds concurrently
+  seed->BatchIntegrationOn();
+
+  // The cached streamlines are valid for the same tensors and tracking
+  // parameters, only the seeds that moved or were added are traced again.
+  std::ostringstream parameters;
+  parameters.precision(17);
+  parameters << volumeNode->GetID() << " " << volumeNode->GetImageData()->GetMTime();
+  vtkNew<vtkMatrix4x4> rasToIJK;
+  volumeNode->GetRASToIJKMatrix(rasToIJK.GetPointer());
+  vtkNew<vtkMatrix4x4> measurementFrame;
+  volumeNode->GetMeasurementFrameMatrix(measurementFrame.GetPointer());
+  for (int i = 0; i < 16; i++)
+    {
+    parameters << " " << rasToIJK->GetElement(i / 4, i % 4)
+               << " " << measurementFrame->GetElement(i / 4, i % 4);
+    }
+  vtkMRMLTransformNode *volumeTransformNode = volumeNode->GetParentTransformNode();
+  if (volumeTransformNode)
+    {
+    parameters << " " << volumeTransformNode->GetID()
+               << " " << volumeTransformNode->GetTransformToWorldMTime();
+    }
+  parameters << " " << thresholdMode << " " << stoppingValue << " " << stoppingCurvature
+             << " " << integrationStepLength << " " << minPathLength;
+  if (parameters.str() != this->StreamlineCacheParameters)
+    {
+    this->StreamlineCache.clear();
+    this->ResetCachedFibers();
+    this->StreamlineCacheParameters = parameters.str();
+    }
+  this->CachedSeeds.clear();
+  this->NumberOfTracedSeeds = 0;
 
   //1. Set Input
 
@@ -461,7 +825,17 @@ int vtkSlicerTractographyInteractiveSeedingLogic::CreateTracts(vtkMRMLTractograp
         continue;
         }
 
-      this->CreateTractsForLabelMap(seed.GetPointer(), volumeNode, labelMapNode,
+      vtkSeedTracts *labelSeed = seed.GetPointer();
+      if (this->PreparingJob)
+        {
+        // each label is traced with its own seeding in the tracking thread
+        vtkSmartPointer<vtkSeedTracts> roiSeed = vtkSmartPointer<vtkSeedTracts>::New();
+        roiSeed->BatchIntegrationOn();
+        this->PreparingJob->ROISeeds.push_back(roiSeed);
+        labelSeed = roiSeed.GetPointer();
+        }
+
+      this->CreateTractsForLabelMap(labelSeed, volumeNode, labelMapNode,
                                     parametersNode->GetROILabels()->GetValue(i),
                                     parametersNode->GetUseIndexSpace(),
                                     parametersNode->GetSeedSpacing(),
@@ -517,10 +891,43 @@ int vtkSlicerTractographyInteractiveSeedingLogic::CreateTracts(vtkMRMLTractograp
                                  sampleStep, maxNumberOfSeeds, seedSelectedFiducials);
     }
 
+  if (this->PreparingJob)
+    {
+    // The tracking thread traces on a copy of the tensors, starting
+    // from the cached streamlines
+    TrackingJob *job = this->PreparingJob;
+    job->Seed = seed;
+    vtkSmartPointer<vtkTrivialProducer> tensors = DetachInput(ici->GetOutputPort());
+    job->Inputs.push_back(tensors);
+    seed->SetInputTensorFieldConnection(tensors->GetOutputPort());
+    for (size_t i = 0; i < job->ROISeeds.size(); i++)
+      {
+      job->ROISeeds[i]->SetInputTensorFieldConnection(tensors->GetOutputPort());
+      }
+    if (!this->CachedSeeds.empty())
+      {
+      job->CachedFibers = vtkSmartPointer<vtkPolyData>::New();
+      this->UpdateCachedFibers(job->CachedFibers);
+      }
+    return 1;
+    }
+
   //6. Extract PolyData in RAS
   vtkNew<vtkPolyData> outFibers;
 
-  seed->TransformStreamlinesToRASAndAppendToPolyData(outFibers.GetPointer());
+  if (!this->CachedSeeds.empty())
+    {
+    // The streamlines of the seed points are all cached
+    this->UpdateCachedFibers(outFibers.GetPointer());
+    }
+  else
+    {
+    seed->TransformStreamlinesToRASAndAppendToPolyData(outFibers.GetPointer());
+    }
+
+  // Forget the streamlines of the seeds that are gone
+  this->PruneStreamlineCache();
+
   fiberNode->SetAndObservePolyData(outFibers.GetPointer());
 
   return 1;
@@ -649,18 +1056,25 @@ void vtkSlicerTractographyInteractiveSeedingLogic
     return;
     }
 
-  this->CreateTracts(snode, volumeNode, seedingNode, fiberNode,
-                     snode->GetThresholdMode(),
-                     snode->GetStoppingValue(),
-                     snode->GetStoppingCurvature(),
-                     snode->GetIntegrationStep(),
-                     snode->GetMinimumPathLength(),
-                     snode->GetSeedingRegionSize(),
-                     snode->GetSeedingRegionStep(),
-                     snode->GetMaxNumberOfSeeds(),
-                     snode->GetSeedSelectedFiducials(),
-                     snode->GetDisplayMode()
-                     );
+  if (this->BackgroundTracking && !snode->GetWriteToFile())
+    {
+    this->StartTracking(snode, volumeNode, seedingNode, fiberNode);
+    }
+  else
+    {
+    this->CreateTracts(snode, volumeNode, seedingNode, fiberNode,
+                       snode->GetThresholdMode(),
+                       snode->GetStoppingValue(),
+                       snode->GetStoppingCurvature(),
+                       snode->GetIntegrationStep(),
+                       snode->GetMinimumPathLength(),
+                       snode->GetSeedingRegionSize(),
+                       snode->GetSeedingRegionStep(),
+                       snode->GetMaxNumberOfSeeds(),
+                       snode->GetSeedSelectedFiducials(),
+                       snode->GetDisplayMode()
+                       );
+    }
 
   // Make sure output fiber node is under the DTI volume in subject hierarchy
   vtkMRMLSubjectHierarchyNode* shNode =
@@ -926,7 +1340,282 @@ int vtkSlicerTractographyInteractiveSeedingLogic::CreateTractsForLabelMap(
   // seed->GetInputTensorField()->GetPointData()->SetScalars(math->GetOutput()->GetPointData()->GetScalars());
 
   // 5. Run the thing
+  if (this->PreparingJob)
+    {
+    // traced in the tracking thread, on a copy of the ROI
+    vtkSmartPointer<vtkTrivialProducer> roi = DetachInput(ROIConnection.GetPointer());
+    this->PreparingJob->Inputs.push_back(roi);
+    seed->SetInputROIConnection(roi->GetOutputPort());
+    return 1;
+    }
   seed->SeedStreamlinesInROI();
 
   return 1;
 }
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::StartTracking(vtkMRMLTractographyInteractiveSeedingNode *snode,
+                                                                 vtkMRMLDiffusionTensorVolumeNode *volumeNode,
+                                                                 vtkMRMLNode *seedingNode,
+                                                                 vtkMRMLFiberBundleNode *fiberNode)
+{
+  this->CancelTracking();
+
+  TrackingJob *job = new TrackingJob;
+  job->FiberNodeID = fiberNode->GetID();
+  job->UpdateInterval = this->TrackingUpdateInterval;
+  job->LastPublishTime = vtkTimerLog::GetUniversalTime();
+  job->SeedPoints = vtkSmartPointer<vtkPoints>::New();
+
+  // Read the seeds and the inputs from the scene
+  this->PreparingJob = job;
+  int prepared = this->CreateTracts(snode, volumeNode, seedingNode, fiberNode,
+                                    snode->GetThresholdMode(),
+                                    snode->GetStoppingValue(),
+                                    snode->GetStoppingCurvature(),
+                                    snode->GetIntegrationStep(),
+                                    snode->GetMinimumPathLength(),
+                                    snode->GetSeedingRegionSize(),
+                                    snode->GetSeedingRegionStep(),
+                                    snode->GetMaxNumberOfSeeds(),
+                                    snode->GetSeedSelectedFiducials(),
+                                    snode->GetDisplayMode());
+  this->PreparingJob = NULL;
+  if (!prepared)
+    {
+    delete job;
+    return;
+    }
+
+  this->RunningJob = job;
+  job->Thread = std::thread([this, job]()
+    {
+    this->RunTracking(job);
+    job->Finished = true;
+    });
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::CancelTracking()
+{
+  TrackingJob *job = this->RunningJob;
+  this->RunningJob = NULL;
+  if (job)
+    {
+    // the thread stops after the seed it is tracing, it is joined by
+    // JoinCanceledJobs once finished
+      {
+      std::lock_guard<std::mutex> lock(job->Mutex);
+      job->Canceled = true;
+      job->Output = NULL;
+      }
+    if (job->Seed)
+      {
+      job->Seed->AbortExecuteOn();
+      }
+    for (size_t i = 0; i < job->ROISeeds.size(); i++)
+      {
+      job->ROISeeds[i]->AbortExecuteOn();
+      }
+    this->CanceledJobs.push_back(job);
+    }
+  this->JoinCanceledJobs(false);
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::JoinCanceledJobs(bool wait)
+{
+  std::vector<TrackingJob *> running;
+  for (size_t i = 0; i < this->CanceledJobs.size(); i++)
+    {
+    TrackingJob *job = this->CanceledJobs[i];
+    if (!wait && !job->Finished)
+      {
+      running.push_back(job);
+      continue;
+      }
+    job->Thread.join();
+    delete job;
+    }
+  this->CanceledJobs.swap(running);
+}
+
+//----------------------------------------------------------------------------
+bool vtkSlicerTractographyInteractiveSeedingLogic::ProcessTrackingResults()
+{
+  this->JoinCanceledJobs(false);
+  TrackingJob *job = this->RunningJob;
+  if (job == NULL)
+    {
+    return false;
+    }
+
+  vtkSmartPointer<vtkPolyData> output;
+  bool done;
+    {
+    std::lock_guard<std::mutex> lock(job->Mutex);
+    output = job->Output;
+    job->Output = NULL;
+    done = job->Done;
+    }
+
+  if (done)
+    {
+    job->Thread.join();
+    if (!this->CachedSeeds.empty())
+      {
+      // all the streamlines of the seed points are cached now, only the
+      // new ones are added to the cached fibers
+      for (std::map<SeedKey, CachedStreamline>::iterator it = job->Streamlines.begin();
+           it != job->Streamlines.end(); ++it)
+        {
+        this->StreamlineCache[it->first].Points.swap(it->second.Points);
+        this->StreamlineCache[it->first].Tensors.swap(it->second.Tensors);
+        }
+      output = vtkSmartPointer<vtkPolyData>::New();
+      this->UpdateCachedFibers(output);
+      }
+    this->PruneStreamlineCache();
+    }
+  else if (output != NULL && job->CachedFibers != NULL && job->CachedFibers->GetNumberOfPoints() > 0)
+    {
+    // partial result of the new seeds, with the cached ones
+    vtkNew<vtkAppendPolyData> append;
+    append->AddInputData(job->CachedFibers);
+    append->AddInputData(output);
+    append->Update();
+    output = append->GetOutput();
+    }
+
+  if (output != NULL && this->GetMRMLScene())
+    {
+    vtkMRMLFiberBundleNode *fiberNode = vtkMRMLFiberBundleNode::SafeDownCast(
+      this->GetMRMLScene()->GetNodeByID(job->FiberNodeID.c_str()));
+    if (fiberNode)
+      {
+      fiberNode->SetAndObservePolyData(output);
+      }
+    }
+
+  if (done)
+    {
+    delete job;
+    this->RunningJob = NULL;
+    }
+  return !done;
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::RunTracking(TrackingJob *job)
+{
+  vtkNew<vtkCallbackCommand> progressCallback;
+  progressCallback->SetCallback(vtkSlicerTractographyInteractiveSeedingLogic::TrackingProgressCallback);
+  progressCallback->SetClientData(job);
+
+  // Seed points: the new streamlines go to the cache
+  if (job->SeedPoints->GetNumberOfPoints() > 0)
+    {
+    job->Seed->AddObserver(vtkCommand::ProgressEvent, progressCallback.GetPointer());
+    job->Seed->SetProgressInterval(job->UpdateInterval);
+    job->Seed->SeedStreamlinesFromPoints(job->SeedPoints);
+    if (job->Canceled)
+      {
+      return;
+      }
+    CacheStreamlines(job->Seed, job->Seeds, job->Streamlines);
+    job->Seed->DeleteAllStreamlines();
+    }
+
+  // Label map
+  for (size_t i = 0; i < job->ROISeeds.size(); i++)
+    {
+    vtkSeedTracts *seed = job->ROISeeds[i];
+    seed->AddObserver(vtkCommand::ProgressEvent, progressCallback.GetPointer());
+    seed->SetProgressInterval(job->UpdateInterval);
+    seed->SeedStreamlinesInROI();
+    if (job->Canceled)
+      {
+      return;
+      }
+    vtkNew<vtkPolyData> tracts;
+    seed->TransformStreamlinesToRASAndAppendToPolyData(tracts.GetPointer());
+    job->Tracts.push_back(tracts.GetPointer());
+    seed->DeleteAllStreamlines();
+    }
+
+  // The cached streamlines are set to the output in the main thread, see
+  // ProcessTrackingResults
+  PublishTracking(job, NULL, true);
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::PublishTracking(TrackingJob *job,
+                                                                   vtkSeedTracts *current,
+                                                                   bool done)
+{
+  std::vector<vtkSmartPointer<vtkPolyData> > tracts;
+  for (size_t i = 0; i < job->Tracts.size(); i++)
+    {
+    if (job->Tracts[i]->GetNumberOfPoints() > 0)
+      {
+      tracts.push_back(job->Tracts[i]);
+      }
+    }
+  if (current)
+    {
+    vtkNew<vtkPolyData> currentTracts;
+    current->TransformStreamlinesToRASAndAppendToPolyData(currentTracts.GetPointer());
+    if (currentTracts->GetNumberOfPoints() > 0)
+      {
+      tracts.push_back(currentTracts.GetPointer());
+      }
+    }
+
+  vtkSmartPointer<vtkPolyData> output;
+  if (tracts.size() == 1)
+    {
+    output = tracts[0];
+    }
+  else
+    {
+    output = vtkSmartPointer<vtkPolyData>::New();
+    if (tracts.size() > 1)
+      {
+      vtkNew<vtkAppendPolyData> append;
+      for (size_t i = 0; i < tracts.size(); i++)
+        {
+        append->AddInputData(tracts[i]);
+        }
+      append->Update();
+      output->ShallowCopy(append->GetOutput());
+      }
+    }
+
+  std::lock_guard<std::mutex> lock(job->Mutex);
+  if (job->Canceled)
+    {
+    return;
+    }
+  job->Output = output;
+  job->Done = done;
+  job->LastPublishTime = vtkTimerLog::GetUniversalTime();
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerTractographyInteractiveSeedingLogic::TrackingProgressCallback(vtkObject *caller,
+                                                                            unsigned long vtkNotUsed(eid),
+                                                                            void *clientData,
+                                                                            void *vtkNotUsed(callData))
+{
+  TrackingJob *job = static_cast<TrackingJob*>(clientData);
+  vtkSeedTracts *seed = vtkSeedTracts::SafeDownCast(caller);
+  if (job->Canceled)
+    {
+    seed->AbortExecuteOn();
+    return;
+    }
+  if (vtkTimerLog::GetUniversalTime() - job->LastPublishTime >= job->UpdateInterval)
+    {
+    PublishTracking(job, seed, false);
+    }
+}
@@ -22,10 +22,15 @@
 #ifndef __vtkSlicerTractographyInteractiveSeedingLogic_h
 #define __vtkSlicerTractographyInteractiveSeedingLogic_h
 
+#include <array>
 #include <cstdlib>
 #include <iosfwd>
+#include <map>
+#include <string>
+#include <vector>
 
 #include "vtkSlicerModuleLogic.h"
+#include <vtkSmartPointer.h>
 #include "vtkIntxSeedingLogicExport.h"
 
 class vtkMRMLTractographyInteractiveSeedingNode;
@@ -34,7 +39,10 @@ class vtkMRMLScalarVolumeNode;
 class vtkMRMLAnnotationHierarchyNode;
 class vtkMRMLFiberBundleNode;
 class vtkMRMLTransformableNode;
+class vtkFloatArray;
 class vtkMaskPoints;
+class vtkPoints;
+class vtkPolyData;
 class vtkSeedTracts;
 
 class VTK_SLICER_TRACTOGRAPHYINTERACTIVESEEDING_MODULE_LOGIC_EXPORT vtkSlicerTractographyInteractiveSeedingLogic :
@@ -66,6 +74,16 @@ public:
                               int maxNumberOfSeeds,
                               int seedSelectedFiducials);
 
+  // Trace the streamlines of the seed points (in the tensor volume RAS).
+  // Seeds already traced with the same volume and parameters reuse their
+  // cached streamlines, only the new seeds are traced.
+  void CreateTractsForSeedPoints(vtkSeedTracts *seed, vtkPoints *seedPoints);
+
+  /// Number of seed points traced (or to be traced by the background
+  /// tracking) by the last CreateTracts, the other seed points reused
+  /// their cached streamlines.
+  vtkGetMacro(NumberOfTracedSeeds, int);
+
   int CreateTracts( vtkMRMLTractographyInteractiveSeedingNode *parametersNode,
                     vtkMRMLDiffusionTensorVolumeNode *volumeNode,
                     vtkMRMLNode *seedingNode,
@@ -100,6 +118,29 @@ public:
 
   void UpdateOnce();
 
+  /// Trace the tracts of the parameter node in a background thread when
+  /// the seeds or parameters change, instead of before returning from the
+  /// MRML event. A new update cancels the running one. The results are set
+  /// to the output fiber bundle by ProcessTrackingResults. Off by default.
+  vtkSetMacro(BackgroundTracking, int);
+  vtkGetMacro(BackgroundTracking, int);
+  vtkBooleanMacro(BackgroundTracking, int);
+
+  /// Minimum time between two partial results of the background
+  /// tracking, in seconds. Default is 0.1.
+  vtkSetMacro(TrackingUpdateInterval, double);
+  vtkGetMacro(TrackingUpdateInterval, double);
+
+  /// Stop the background tracking, if any. The tracts traced so far
+  /// are discarded. The tracking thread stops after the seed it is
+  /// tracing, without waiting for it.
+  void CancelTracking();
+
+  /// Set the latest result of the background tracking, partial or final,
+  /// to the output fiber bundle. To be called periodically from the main
+  /// thread. Return true while the tracking is running.
+  bool ProcessTrackingResults();
+
 protected:
   vtkSlicerTractographyInteractiveSeedingLogic();
   ~vtkSlicerTractographyInteractiveSeedingLogic();
@@ -129,8 +170,74 @@ protected:
 
   void RemoveMRMLNodesObservers();
 
+  // Update the tracts of the cached streamlines to the seeds of
+  // CachedSeeds and set them to the polydata. Only the streamlines of the
+  // seeds that were removed or added change, see CachedFiberPoints.
+  void UpdateCachedFibers(vtkPolyData *outFibers);
+
+  // Start new cached fibers, without streamline
+  void ResetCachedFibers();
+
+  // Store the batch streamlines of the seeds in the cache
+  struct CachedStreamline;
+  static void CacheStreamlines(vtkSeedTracts *seed, const std::vector<std::array<double, 3> > &seeds,
+                               std::map<std::array<double, 3>, CachedStreamline> &cache);
+
+  // Drop the streamlines of the seeds that are not in CachedSeeds
+  void PruneStreamlineCache();
+
+  // Prepare the tracking job of the parameters node with CreateTracts
+  // and trace it in the tracking thread
+  void StartTracking(vtkMRMLTractographyInteractiveSeedingNode *snode,
+                     vtkMRMLDiffusionTensorVolumeNode *volumeNode,
+                     vtkMRMLNode *seedingNode,
+                     vtkMRMLFiberBundleNode *fiberNode);
+
+  // Body of the tracking thread
+  struct TrackingJob;
+  void RunTracking(TrackingJob *job);
+  static void PublishTracking(TrackingJob *job, vtkSeedTracts *current, bool done);
+  // Join the threads of the canceled jobs that are finished, or of all of
+  // them if wait is set, and delete the jobs
+  void JoinCanceledJobs(bool wait);
+  static void TrackingProgressCallback(vtkObject *caller, unsigned long eid,
+                                       void *clientData, void *callData);
+
   vtkMaskPoints *MaskPoints;
 
+  // Streamline of a seed, in RAS: 3 coordinates and 9 tensor components
+  // per point. Empty if the seed produced no streamline.
+  struct CachedStreamline
+  {
+    std::vector<float> Points;
+    std::vector<float> Tensors;
+  };
+  typedef std::array<double, 3> SeedKey;
+  std::map<SeedKey, CachedStreamline> StreamlineCache;
+  // Tensor volume (with its geometry, measurement frame and parent
+  // transform) and tracking parameters the cache was computed with
+  std::string StreamlineCacheParameters;
+  // Seeds of the current tracts, in order
+  std::vector<SeedKey> CachedSeeds;
+  // Points and tensors of the tracts of the cached streamlines, updated in
+  // place: the streamlines of new seeds are appended, the points of the
+  // seeds that are gone are left unused until they are half of the points.
+  vtkSmartPointer<vtkPoints> CachedFiberPoints;
+  vtkSmartPointer<vtkFloatArray> CachedFiberTensors;
+  // First point and number of points of the streamline of each seed
+  std::map<SeedKey, std::pair<vtkIdType, vtkIdType> > CachedFiberRanges;
+  vtkIdType NumberOfUnusedCachedFiberPoints;
+  int NumberOfTracedSeeds;
+
+  int BackgroundTracking;
+  double TrackingUpdateInterval;
+  // Job being prepared by CreateTracts: the tracing is deferred to the
+  // tracking thread. NULL when tracing before returning.
+  TrackingJob *PreparingJob;
+  TrackingJob *RunningJob;
+  // Jobs whose tracking thread is still stopping
+  std::vector<TrackingJob *> CanceledJobs;
+
   vtkMRMLTractographyInteractiveSeedingNode *TractographyInteractiveSeedingNode;
   std::vector<vtkMRMLTransformableNode *> ObservedNodes;
   vtkMRMLDiffusionTensorVolumeNode       *DiffusionTensorVolumeNode;
@@ -0,0 +1,150 @@
+/*=auto=========================================================================
+
+  Portions (c) Copyright 2005 Brigham and Women's Hospital (BWH)
+  All Rights Reserved.
+
+  See COPYRIGHT.txt
+  or http://www.slicer.org/copyright/copyright.txt for details.
+
+  Program:   3D Slicer
+
+=========================================================================auto=*/
+
+#include "vtkMRMLCoreTestingMacros.h"
+
+// vtkDMRI includes
+#include <vtkSeedTracts.h>
+
+// VTK includes
+#include <vtkCallbackCommand.h>
+#include <vtkCommand.h>
+#include <vtkFloatArray.h>
+#include <vtkIdTypeArray.h>
+#include <vtkImageData.h>
+#include <vtkNew.h>
+#include <vtkPointData.h>
+#include <vtkPoints.h>
+#include <vtkTrivialProducer.h>
+
+// STD includes
+#include <algorithm>
+#include <iostream>
+
+namespace
+{
+
+//----------------------------------------------------------------------------
+// Trace the seed in batch and return the x range of its streamline
+bool TraceSeed(vtkImageData* tensors, int direction, double seed[3],
+               vtkIdType& numberOfPoints, double range[2])
+{
+  vtkNew<vtkTrivialProducer> producer;
+  producer->SetOutput(tensors);
+
+  vtkNew<vtkSeedTracts> seedTracts;
+  seedTracts->SetInputTensorFieldConnection(producer->GetOutputPort());
+  seedTracts->BatchIntegrationOn();
+  seedTracts->UseVtkHyperStreamlinePoints();
+  seedTracts->SetMinimumPathLength(1.0);
+  seedTracts->SetIntegrationDirection(direction);
+
+  vtkNew<vtkPoints> seeds;
+  seeds->InsertNextPoint(seed);
+  seedTracts->SeedStreamlinesFromPoints(seeds.GetPointer());
+
+  vtkIdTypeArray* offsets = seedTracts->GetBatchOffsets();
+  if (offsets->GetNumberOfTuples() != 2)
+    {
+    std::cerr << "Expected one streamline for direction " << direction
+              << ", got " << offsets->GetNumberOfTuples() - 1 << std::endl;
+    return false;
+    }
+  numberOfPoints = offsets->GetValue(1);
+  vtkPoints* points = seedTracts->GetBatchPoints();
+  range[0] = range[1] = seed[0];
+  for (vtkIdType i = 0; i < numberOfPoints; i++)
+    {
+    double x = points->GetPoint(i)[0];
+    range[0] = std::min(range[0], x);
+    range[1] = std::max(range[1], x);
+    }
+  return true;
+}
+
+//----------------------------------------------------------------------------
+void AbortOnProgress(vtkObject* caller, unsigned long vtkNotUsed(eid),
+                     void* vtkNotUsed(clientData), void* vtkNotUsed(callData))
+{
+  vtkSeedTracts::SafeDownCast(caller)->AbortExecuteOn();
+}
+
+} // end of anonymous namespace
+
+//----------------------------------------------------------------------------
+int vtkSeedTractsTest1(int vtkNotUsed(argc), char * vtkNotUsed(argv)[])
+{
+  // Linear tensors along x
+  vtkNew<vtkImageData> tensors;
+  tensors->SetDimensions(41, 5, 5);
+  vtkNew<vtkFloatArray> tensorArray;
+  tensorArray->SetNumberOfComponents(9);
+  tensorArray->SetNumberOfTuples(tensors->GetNumberOfPoints());
+  float tensor[9] = {1.f, 0.f, 0.f, 0.f, 0.1f, 0.f, 0.f, 0.f, 0.1f};
+  for (vtkIdType i = 0; i < tensors->GetNumberOfPoints(); i++)
+    {
+    tensorArray->SetTypedTuple(i, tensor);
+    }
+  tensors->GetPointData()->SetTensors(tensorArray.GetPointer());
+
+  double seed[3] = {20., 2., 2.};
+  vtkIdType numberOfPoints[3];
+  double range[3][2];
+  CHECK_BOOL(TraceSeed(tensors.GetPointer(), VTK_INTEGRATE_BOTH_DIRECTIONS, seed,
+                       numberOfPoints[0], range[0]), true);
+  CHECK_BOOL(TraceSeed(tensors.GetPointer(), VTK_INTEGRATE_FORWARD, seed,
+                       numberOfPoints[1], range[1]), true);
+  CHECK_BOOL(TraceSeed(tensors.GetPointer(), VTK_INTEGRATE_BACKWARD, seed,
+                       numberOfPoints[2], range[2]), true);
+
+  // Both directions reach the two ends of the field
+  CHECK_BOOL(range[0][0] < 5. && range[0][1] > 35., true);
+
+  // One direction stays on one side of the seed, the other direction on
+  // the other side, and together they make the whole streamline
+  bool forwardIncreasing = (range[1][1] > seed[0]);
+  CHECK_BOOL(forwardIncreasing ? range[1][0] == seed[0] : range[1][1] == seed[0], true);
+  CHECK_BOOL(forwardIncreasing ? range[2][1] == seed[0] : range[2][0] == seed[0], true);
+  CHECK_BOOL(forwardIncreasing ? range[2][0] < 5. : range[2][1] > 35., true);
+  CHECK_INT(numberOfPoints[1] + numberOfPoints[2] - 1, numberOfPoints[0]);
+
+  // Only vtkHyperStreamlineDTMRI streamlines are traced in batch
+  vtkNew<vtkSeedTracts> seedTracts;
+  seedTracts->BatchIntegrationOn();
+  seedTracts->UseVtkHyperStreamlinePoints();
+  CHECK_INT(seedTracts->IsBatchIntegrationUsed(), 1);
+  seedTracts->UseVtkHyperStreamlineTeem();
+  CHECK_INT(seedTracts->IsBatchIntegrationUsed(), 0);
+
+  // The first blocks of seeds are small: aborting at the first progress
+  // keeps the streamlines of a few seeds only
+  vtkNew<vtkTrivialProducer> producer;
+  producer->SetOutput(tensors.GetPointer());
+  vtkNew<vtkSeedTracts> abortedTracts;
+  abortedTracts->SetInputTensorFieldConnection(producer->GetOutputPort());
+  abortedTracts->BatchIntegrationOn();
+  abortedTracts->UseVtkHyperStreamlinePoints();
+  abortedTracts->SetMinimumPathLength(1.0);
+  vtkNew<vtkCallbackCommand> abortCallback;
+  abortCallback->SetCallback(AbortOnProgress);
+  abortedTracts->AddObserver(vtkCommand::ProgressEvent, abortCallback.GetPointer());
+  vtkNew<vtkPoints> seeds;
+  for (int i = 0; i < 1000; i++)
+    {
+    seeds->InsertNextPoint(10. + 0.02 * i, 2., 2.);
+    }
+  abortedTracts->SeedStreamlinesFromPoints(seeds.GetPointer());
+  vtkIdType numberOfStreamlines = abortedTracts->GetBatchOffsets()->GetNumberOfTuples() - 1;
+  CHECK_BOOL(numberOfStreamlines > 0 && numberOfStreamlines < 1000, true);
+
+  return EXIT_SUCCESS;
+}
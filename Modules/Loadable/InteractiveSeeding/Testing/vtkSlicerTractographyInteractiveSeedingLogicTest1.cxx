@@ -0,0 +1,144 @@
+/*=auto=========================================================================
+
+  Portions (c) Copyright 2005 Brigham and Women's Hospital (BWH)
+  All Rights Reserved.
+
+  See COPYRIGHT.txt
+  or http://www.slicer.org/copyright/copyright.txt for details.
+
+  Program:   3D Slicer
+
+=========================================================================auto=*/
+
+#include "vtkMRMLCoreTestingMacros.h"
+
+// InteractiveSeeding includes
+#include "vtkMRMLTractographyInteractiveSeedingNode.h"
+#include "vtkSlicerTractographyInteractiveSeedingLogic.h"
+
+// MRML includes
+#include <vtkMRMLDiffusionTensorVolumeNode.h>
+#include <vtkMRMLFiberBundleNode.h>
+#include <vtkMRMLLinearTransformNode.h>
+#include <vtkMRMLMarkupsFiducialNode.h>
+#include <vtkMRMLScene.h>
+
+// VTK includes
+#include <vtkFloatArray.h>
+#include <vtkImageData.h>
+#include <vtkMatrix4x4.h>
+#include <vtkNew.h>
+#include <vtkPointData.h>
+#include <vtkPolyData.h>
+#include <vtkVector.h>
+
+// STD includes
+#include <iostream>
+
+namespace
+{
+
+//----------------------------------------------------------------------------
+// Trace the tracts of the two fiducials, with stopping value 0.1 unless
+// specified, and return the number of seeds that were not cached
+int Update(vtkSlicerTractographyInteractiveSeedingLogic* logic,
+           vtkMRMLTractographyInteractiveSeedingNode* parametersNode,
+           vtkMRMLDiffusionTensorVolumeNode* volumeNode,
+           vtkMRMLMarkupsFiducialNode* fiducialNode,
+           vtkMRMLFiberBundleNode* fiberNode,
+           double stoppingValue = 0.1)
+{
+  logic->CreateTracts(parametersNode, volumeNode, fiducialNode, fiberNode,
+                      parametersNode->GetThresholdMode(), stoppingValue,
+                      parametersNode->GetStoppingCurvature(),
+                      parametersNode->GetIntegrationStep(),
+                      1.0, // minimum path length
+                      0.0, 1.0, // one seed per fiducial
+                      parametersNode->GetMaxNumberOfSeeds(),
+                      0, parametersNode->GetDisplayMode());
+  return logic->GetNumberOfTracedSeeds();
+}
+
+} // end of anonymous namespace
+
+//----------------------------------------------------------------------------
+int vtkSlicerTractographyInteractiveSeedingLogicTest1(int vtkNotUsed(argc), char * vtkNotUsed(argv)[])
+{
+  vtkNew<vtkMRMLScene> scene;
+  vtkNew<vtkSlicerTractographyInteractiveSeedingLogic> logic;
+  logic->SetMRMLScene(scene.GetPointer());
+
+  // Linear tensors along x
+  vtkNew<vtkImageData> tensors;
+  tensors->SetDimensions(41, 5, 5);
+  vtkNew<vtkFloatArray> tensorArray;
+  tensorArray->SetNumberOfComponents(9);
+  tensorArray->SetNumberOfTuples(tensors->GetNumberOfPoints());
+  float tensor[9] = {1.f, 0.f, 0.f, 0.f, 0.1f, 0.f, 0.f, 0.f, 0.1f};
+  for (vtkIdType i = 0; i < tensors->GetNumberOfPoints(); i++)
+    {
+    tensorArray->SetTypedTuple(i, tensor);
+    }
+  tensors->GetPointData()->SetTensors(tensorArray.GetPointer());
+
+  vtkNew<vtkMRMLDiffusionTensorVolumeNode> volumeNode;
+  scene->AddNode(volumeNode.GetPointer());
+  volumeNode->SetAndObserveImageData(tensors.GetPointer());
+
+  vtkNew<vtkMRMLMarkupsFiducialNode> fiducialNode;
+  scene->AddNode(fiducialNode.GetPointer());
+  fiducialNode->AddControlPoint(vtkVector3d(10., 2., 2.));
+  fiducialNode->AddControlPoint(vtkVector3d(30., 2., 2.));
+
+  vtkNew<vtkMRMLFiberBundleNode> fiberNode;
+  scene->AddNode(fiberNode.GetPointer());
+
+  vtkNew<vtkMRMLTractographyInteractiveSeedingNode> parametersNode;
+  scene->AddNode(parametersNode.GetPointer());
+
+  // Both seeds are traced the first time
+  CHECK_INT(Update(logic.GetPointer(), parametersNode.GetPointer(), volumeNode.GetPointer(),
+                   fiducialNode.GetPointer(), fiberNode.GetPointer()), 2);
+  CHECK_INT(fiberNode->GetPolyData()->GetNumberOfLines(), 2);
+  vtkIdType numberOfPoints = fiberNode->GetPolyData()->GetNumberOfPoints();
+
+  // Nothing changed: the cached streamlines are reused
+  CHECK_INT(Update(logic.GetPointer(), parametersNode.GetPointer(), volumeNode.GetPointer(),
+                   fiducialNode.GetPointer(), fiberNode.GetPointer()), 0);
+  CHECK_INT(fiberNode->GetPolyData()->GetNumberOfLines(), 2);
+  CHECK_INT(fiberNode->GetPolyData()->GetNumberOfPoints(), numberOfPoints);
+
+  // Only the seed that moved is traced
+  fiducialNode->SetNthControlPointPosition(1, 25., 2., 2.);
+  CHECK_INT(Update(logic.GetPointer(), parametersNode.GetPointer(), volumeNode.GetPointer(),
+                   fiducialNode.GetPointer(), fiberNode.GetPointer()), 1);
+  CHECK_INT(fiberNode->GetPolyData()->GetNumberOfLines(), 2);
+
+  // New tracking parameters invalidate the cache
+  CHECK_INT(Update(logic.GetPointer(), parametersNode.GetPointer(), volumeNode.GetPointer(),
+                   fiducialNode.GetPointer(), fiberNode.GetPointer(), 0.2), 2);
+  CHECK_INT(Update(logic.GetPointer(), parametersNode.GetPointer(), volumeNode.GetPointer(),
+                   fiducialNode.GetPointer(), fiberNode.GetPointer(), 0.2), 0);
+
+  // So does a new measurement frame of the tensors
+  vtkNew<vtkMatrix4x4> measurementFrame;
+  measurementFrame->SetElement(0, 0, -1.);
+  measurementFrame->SetElement(1, 1, -1.);
+  volumeNode->SetMeasurementFrameMatrix(measurementFrame.GetPointer());
+  CHECK_INT(Update(logic.GetPointer(), parametersNode.GetPointer(), volumeNode.GetPointer(),
+                   fiducialNode.GetPointer(), fiberNode.GetPointer(), 0.2), 2);
+
+  // And a parent transform of the tensors, even if it does not move the
+  // seeds relative to the tensors
+  vtkNew<vtkMRMLLinearTransformNode> transformNode;
+  scene->AddNode(transformNode.GetPointer());
+  volumeNode->SetAndObserveTransformNodeID(transformNode->GetID());
+  fiducialNode->SetAndObserveTransformNodeID(transformNode->GetID());
+  CHECK_INT(Update(logic.GetPointer(), parametersNode.GetPointer(), volumeNode.GetPointer(),
+                   fiducialNode.GetPointer(), fiberNode.GetPointer(), 0.2), 2);
+  CHECK_INT(Update(logic.GetPointer(), parametersNode.GetPointer(), volumeNode.GetPointer(),
+                   fiducialNode.GetPointer(), fiberNode.GetPointer(), 0.2), 0);
+  CHECK_INT(fiberNode->GetPolyData()->GetNumberOfLines(), 2);
+
+  return EXIT_SUCCESS;
+}
@@ -0,0 +1,138 @@
+/*=auto=========================================================================
+
+  Portions (c) Copyright 2005 Brigham and Women's Hospital (BWH)
+  All Rights Reserved.
+
+  See COPYRIGHT.txt
+  or http://www.slicer.org/copyright/copyright.txt for details.
+
+  Program:   3D Slicer
+
+=========================================================================auto=*/
+
+#include "vtkMRMLCoreTestingMacros.h"
+
+// InteractiveSeeding includes
+#include "vtkMRMLTractographyInteractiveSeedingNode.h"
+#include "vtkSlicerTractographyInteractiveSeedingLogic.h"
+
+// MRML includes
+#include <vtkMRMLDiffusionTensorVolumeNode.h>
+#include <vtkMRMLFiberBundleNode.h>
+#include <vtkMRMLMarkupsFiducialNode.h>
+#include <vtkMRMLScene.h>
+
+// VTK includes
+#include <vtkFloatArray.h>
+#include <vtkImageData.h>
+#include <vtkNew.h>
+#include <vtkPointData.h>
+#include <vtkPolyData.h>
+#include <vtkVector.h>
+
+// STD includes
+#include <chrono>
+#include <iostream>
+#include <thread>
+
+namespace
+{
+
+//----------------------------------------------------------------------------
+// Process the results of the background tracking until it is done.
+// Return false if it does not end within a minute.
+bool WaitForTracking(vtkSlicerTractographyInteractiveSeedingLogic* logic)
+{
+  for (int i = 0; i < 6000; i++)
+    {
+    if (!logic->ProcessTrackingResults())
+      {
+      return true;
+      }
+    std::this_thread::sleep_for(std::chrono::milliseconds(10));
+    }
+  std::cerr << "Background tracking did not end" << std::endl;
+  return false;
+}
+
+} // end of anonymous namespace
+
+//----------------------------------------------------------------------------
+int vtkSlicerTractographyInteractiveSeedingLogicTest2(int vtkNotUsed(argc), char * vtkNotUsed(argv)[])
+{
+  vtkNew<vtkMRMLScene> scene;
+  vtkNew<vtkSlicerTractographyInteractiveSeedingLogic> logic;
+  logic->SetMRMLScene(scene.GetPointer());
+  logic->BackgroundTrackingOn();
+
+  // Linear tensors along x
+  vtkNew<vtkImageData> tensors;
+  tensors->SetDimensions(41, 9, 9);
+  vtkNew<vtkFloatArray> tensorArray;
+  tensorArray->SetNumberOfComponents(9);
+  tensorArray->SetNumberOfTuples(tensors->GetNumberOfPoints());
+  float tensor[9] = {1.f, 0.f, 0.f, 0.f, 0.1f, 0.f, 0.f, 0.f, 0.1f};
+  for (vtkIdType i = 0; i < tensors->GetNumberOfPoints(); i++)
+    {
+    tensorArray->SetTypedTuple(i, tensor);
+    }
+  tensors->GetPointData()->SetTensors(tensorArray.GetPointer());
+
+  vtkNew<vtkMRMLDiffusionTensorVolumeNode> volumeNode;
+  scene->AddNode(volumeNode.GetPointer());
+  volumeNode->SetAndObserveImageData(tensors.GetPointer());
+
+  vtkNew<vtkMRMLMarkupsFiducialNode> fiducialNode;
+  scene->AddNode(fiducialNode.GetPointer());
+  fiducialNode->AddControlPoint(vtkVector3d(20., 4., 4.));
+
+  vtkNew<vtkMRMLFiberBundleNode> fiberNode;
+  scene->AddNode(fiberNode.GetPointer());
+
+  vtkNew<vtkMRMLTractographyInteractiveSeedingNode> parametersNode;
+  scene->AddNode(parametersNode.GetPointer());
+  parametersNode->SetEnableSeeding(0);
+  parametersNode->SetInputVolumeRef(volumeNode->GetID());
+  parametersNode->SetInputFiducialRef(fiducialNode->GetID());
+  parametersNode->SetOutputFiberRef(fiberNode->GetID());
+  parametersNode->SetStoppingValue(0.1);
+  parametersNode->SetMinimumPathLength(1.0);
+  // 9 x 9 x 9 seeds around the fiducial
+  parametersNode->SetSeedingRegionSize(4.0);
+  parametersNode->SetSeedingRegionStep(0.5);
+  logic->SetAndObserveTractographyInteractiveSeedingNode(parametersNode.GetPointer());
+
+  // Nothing runs before an update
+  CHECK_BOOL(logic->ProcessTrackingResults(), false);
+
+  // The tracts are set to the fiber bundle when the tracking is done
+  logic->UpdateOnce();
+  CHECK_BOOL(WaitForTracking(logic.GetPointer()), true);
+  CHECK_NOT_NULL(fiberNode->GetPolyData());
+  vtkIdType numberOfLines = fiberNode->GetPolyData()->GetNumberOfLines();
+  CHECK_BOOL(numberOfLines > 0, true);
+  vtkPolyData* tracts = fiberNode->GetPolyData();
+
+  // A canceled tracking leaves the fiber bundle unchanged
+  fiducialNode->SetNthControlPointPosition(0, 21., 4., 4.);
+  logic->UpdateOnce();
+  logic->CancelTracking();
+  CHECK_BOOL(logic->ProcessTrackingResults(), false);
+  CHECK_POINTER(fiberNode->GetPolyData(), tracts);
+
+  // A new update after the cancellation traces the moved seeds
+  logic->UpdateOnce();
+  CHECK_BOOL(WaitForTracking(logic.GetPointer()), true);
+  CHECK_POINTER_DIFFERENT(fiberNode->GetPolyData(), tracts);
+  CHECK_INT(fiberNode->GetPolyData()->GetNumberOfLines(), numberOfLines);
+
+  // A new update cancels the running one
+  fiducialNode->SetNthControlPointPosition(0, 20., 4., 4.);
+  logic->UpdateOnce();
+  fiducialNode->SetNthControlPointPosition(0, 22., 4., 4.);
+  logic->UpdateOnce();
+  CHECK_BOOL(WaitForTracking(logic.GetPointer()), true);
+  CHECK_INT(fiberNode->GetPolyData()->GetNumberOfLines(), numberOfLines);
+
+  return EXIT_SUCCESS;
+}
@@ -1,3 +1,9 @@
+// Qt includes
+#include <QTimer>
+
+// Slicer includes
+#include <qSlicerApplication.h>
+
 // Tractography Logic includes
 #include "vtkSlicerTractographyInteractiveSeedingLogic.h"
 
@@ -11,6 +17,36 @@ qSlicerTractographyInteractiveSeedingModule(QObject* _parent):Superclass(_parent
 {
 }
 
+//-----------------------------------------------------------------------------
+void qSlicerTractographyInteractiveSeedingModule::setup()
+{
+  this->Superclass::setup();
+
+  vtkSlicerTractographyInteractiveSeedingLogic* seedingLogic =
+    vtkSlicerTractographyInteractiveSeedingLogic::SafeDownCast(this->logic());
+  // Without event loop the tracts are traced before returning
+  if (!seedingLogic || !qSlicerApplication::application())
+    {
+    return;
+    }
+  seedingLogic->BackgroundTrackingOn();
+  QTimer* trackingTimer = new QTimer(this);
+  trackingTimer->setInterval(static_cast<int>(seedingLogic->GetTrackingUpdateInterval() * 1000));
+  QObject::connect(trackingTimer, SIGNAL(timeout()), this, SLOT(processTrackingResults()));
+  trackingTimer->start();
+}
+
+//-----------------------------------------------------------------------------
+void qSlicerTractographyInteractiveSeedingModule::processTrackingResults()
+{
+  vtkSlicerTractographyInteractiveSeedingLogic* seedingLogic =
+    vtkSlicerTractographyInteractiveSeedingLogic::SafeDownCast(this->logic());
+  if (seedingLogic)
+    {
+    seedingLogic->ProcessTrackingResults();
+    }
+}
+
 //-----------------------------------------------------------------------------
 qSlicerAbstractModuleRepresentation* qSlicerTractographyInteractiveSeedingModule::createWidgetRepresentation()
 {
@@ -29,7 +29,14 @@ public:
   virtual QString acknowledgementText() const override;
   virtual QStringList contributors() const override;
 
+protected slots:
+  /// Show the tracts of the background tracking
+  void processTrackingResults();
+
 protected:
+  /// Trace the tracts in the background, polled by a timer
+  virtual void setup() override;
+
   /// Create and return a widget representation of the object
   virtual qSlicerAbstractModuleRepresentation* createWidgetRepresentation() override;
   virtual vtkMRMLAbstractLogic* createLogic() override;
@@ -26,8 +26,10 @@
 #include "vtkMRMLFiberBundleGlyphDisplayNode.h"
 #endif
 #include <vtkMRMLScene.h>
+#include <vtkObserverManager.h>
 
 // VTK includes
+#include <vtkIntArray.h>
 #include <vtkNew.h>
 #include <vtkObjectFactory.h>
 #include <vtkPolyData.h>
@@ -39,13 +41,16 @@
 #include <itksys/Directory.hxx>
 
 // STD includes
+#include <algorithm>
 #include <iostream>
+#include <vector>
 
 vtkStandardNewMacro(vtkSlicerFiberBundleLogic);
 
 //----------------------------------------------------------------------------
 vtkSlicerFiberBundleLogic::vtkSlicerFiberBundleLogic()
 {
+  this->BackgroundTubes = 0;
 }
 
 //----------------------------------------------------------------------------
@@ -181,6 +186,85 @@ void vtkSlicerFiberBundleLogic::PrintSelf(std::ostream& os, vtkIndent indent)
   this->vtkObject::PrintSelf(os, indent);
 
   os << indent << "vtkSlicerFiberBundleLogic:             " << this->GetClassName() << "\n";
+  os << indent << "BackgroundTubes:             " << this->BackgroundTubes << "\n";
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerFiberBundleLogic::SetBackgroundTubes(int background)
+{
+  if (this->BackgroundTubes == background)
+    {
+    return;
+    }
+  this->BackgroundTubes = background;
+#ifdef MRML_USE_vtkTeem
+  if (this->GetMRMLScene())
+    {
+    std::vector<vtkMRMLNode*> nodes;
+    this->GetMRMLScene()->GetNodesByClass("vtkMRMLFiberBundleTubeDisplayNode", nodes);
+    for (unsigned int i = 0; i < nodes.size(); i++)
+      {
+      vtkMRMLFiberBundleTubeDisplayNode::SafeDownCast(nodes[i])->SetBackgroundTubes(background);
+      }
+    }
+#endif
+  this->Modified();
+}
+
+//----------------------------------------------------------------------------
+bool vtkSlicerFiberBundleLogic::ProcessBackgroundTubes()
+{
+  bool updated = false;
+#ifdef MRML_USE_vtkTeem
+  // Only the nodes that started a worker thread are checked, until it ends
+  std::vector<vtkWeakPointer<vtkMRMLFiberBundleTubeDisplayNode> > pendingNodes;
+  for (size_t i = 0; i < this->PendingTubeDisplayNodes.size(); i++)
+    {
+    vtkMRMLFiberBundleTubeDisplayNode *tubeDisplayNode = this->PendingTubeDisplayNodes[i];
+    if (!tubeDisplayNode)
+      {
+      continue;
+      }
+    if (tubeDisplayNode->ProcessBackgroundTubes())
+      {
+      updated = true;
+      }
+    else
+      {
+      pendingNodes.push_back(tubeDisplayNode);
+      }
+    }
+  this->PendingTubeDisplayNodes.swap(pendingNodes);
+#endif
+  return updated;
+}
+
+//----------------------------------------------------------------------------
+bool vtkSlicerFiberBundleLogic::GetBackgroundTubesPending()
+{
+  return !this->PendingTubeDisplayNodes.empty();
+}
+
+//----------------------------------------------------------------------------
+void vtkSlicerFiberBundleLogic::ProcessMRMLNodesEvents(vtkObject* caller,
+                                                       unsigned long event,
+                                                       void* callData)
+{
+#ifdef MRML_USE_vtkTeem
+  vtkMRMLFiberBundleTubeDisplayNode *tubeDisplayNode =
+    vtkMRMLFiberBundleTubeDisplayNode::SafeDownCast(caller);
+  if (tubeDisplayNode && event == vtkMRMLFiberBundleTubeDisplayNode::TubesPendingEvent)
+    {
+    if (std::find(this->PendingTubeDisplayNodes.begin(), this->PendingTubeDisplayNodes.end(),
+                  tubeDisplayNode) == this->PendingTubeDisplayNodes.end())
+      {
+      this->PendingTubeDisplayNodes.push_back(tubeDisplayNode);
+      }
+    this->InvokeEvent(vtkSlicerFiberBundleLogic::BackgroundTubesPendingEvent);
+    return;
+    }
+#endif
+  this->Superclass::ProcessMRMLNodesEvents(caller, event, callData);
 }
 
 //---------------------------------------------------------------------------
@@ -211,6 +295,18 @@ void vtkSlicerFiberBundleLogic::RegisterNodes()
 //---------------------------------------------------------------------------
 void vtkSlicerFiberBundleLogic::OnMRMLSceneNodeAdded(vtkMRMLNode* node)
 {
+#ifdef MRML_USE_vtkTeem
+  vtkMRMLFiberBundleTubeDisplayNode *tubeDisplayNode =
+    vtkMRMLFiberBundleTubeDisplayNode::SafeDownCast(node);
+  if (tubeDisplayNode)
+    {
+    tubeDisplayNode->SetBackgroundTubes(this->BackgroundTubes);
+    vtkNew<vtkIntArray> events;
+    events->InsertNextValue(vtkMRMLFiberBundleTubeDisplayNode::TubesPendingEvent);
+    this->GetMRMLNodesObserverManager()->AddObjectEvents(tubeDisplayNode, events.GetPointer());
+    return;
+    }
+#endif
   if ((!node) || (!node->IsA("vtkMRMLFiberBundleNode")))
     {
     return;
@@ -233,3 +329,14 @@ void vtkSlicerFiberBundleLogic::OnMRMLSceneNodeAdded(vtkMRMLNode* node)
     fbNode->CreateDefaultDisplayNodes();
     }
 }
+
+//---------------------------------------------------------------------------
+void vtkSlicerFiberBundleLogic::OnMRMLSceneNodeRemoved(vtkMRMLNode* node)
+{
+#ifdef MRML_USE_vtkTeem
+  if (vtkMRMLFiberBundleTubeDisplayNode::SafeDownCast(node))
+    {
+    this->GetMRMLNodesObserverManager()->RemoveObjectEvents(node);
+    }
+#endif
+}
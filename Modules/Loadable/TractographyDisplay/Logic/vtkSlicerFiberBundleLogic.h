@@ -23,11 +23,17 @@
 #include "vtkSlicerModuleLogic.h"
 #include "vtkSlicerTractographyDisplayModuleLogicExport.h"
 
+// VTK includes
+#include <vtkCommand.h>
+#include <vtkWeakPointer.h>
+
 // STD includes
 #include <cstdlib>
 #include <iosfwd>
+#include <vector>
 
 class vtkMRMLFiberBundleNode;
+class vtkMRMLFiberBundleTubeDisplayNode;
 
 class VTK_SLICER_TRACTOGRAPHYDISPLAY_MODULE_LOGIC_EXPORT vtkSlicerFiberBundleLogic
   : public vtkSlicerModuleLogic
@@ -63,8 +69,33 @@ class VTK_SLICER_TRACTOGRAPHYDISPLAY_MODULE_LOGIC_EXPORT vtkSlicerFiberBundleLog
   // Gets called automatically when the MRMLScene is attached to this logic class.
   virtual void RegisterNodes() override;
 
+  enum
+  {
+    // Invoked when tubes start being generated on a worker thread
+    BackgroundTubesPendingEvent = vtkCommand::UserEvent + 1
+  };
+
+  // Description:
+  // Generate the tubes of the fiber bundles on a worker thread, displaying
+  // the lines until they are done. BackgroundTubesPendingEvent is invoked
+  // when a worker thread starts, ProcessBackgroundTubes must then be
+  // called regularly while GetBackgroundTubesPending is true. Off by default.
+  void SetBackgroundTubes(int background);
+  vtkGetMacro(BackgroundTubes, int);
+  vtkBooleanMacro(BackgroundTubes, int);
+
+  // Description:
+  // Display the tubes finished on the worker threads of the tube display
+  // nodes. Returns true if a display was updated.
+  bool ProcessBackgroundTubes();
+
+  // Description:
+  // Whether tubes are being generated on worker threads
+  bool GetBackgroundTubesPending();
+
   virtual void SetMRMLSceneInternal(vtkMRMLScene*) override;
   virtual void OnMRMLSceneNodeAdded(vtkMRMLNode*) override;
+  virtual void OnMRMLSceneNodeRemoved(vtkMRMLNode*) override;
 
 protected:
   vtkSlicerFiberBundleLogic();
@@ -79,6 +110,12 @@ protected:
   // Description:
   // Collection of pointers to display logic objects for fiber bundle nodes in the scene.
   vtkCollection *DisplayLogicCollection;
+
+  virtual void ProcessMRMLNodesEvents(vtkObject* caller, unsigned long event, void* callData) override;
+
+  int BackgroundTubes;
+  // Tube display nodes generating tubes on a worker thread
+  std::vector<vtkWeakPointer<vtkMRMLFiberBundleTubeDisplayNode> > PendingTubeDisplayNodes;
 };
 
 #endif
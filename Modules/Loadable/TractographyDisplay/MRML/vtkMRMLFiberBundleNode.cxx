@@ -26,19 +26,26 @@ Version:   $Revision: 1.3 $
 
 // VTK includes
 #include <vtkAlgorithmOutput.h>
+#include <vtkBitArray.h>
 #include <vtkCellArray.h>
+#include <vtkCellData.h>
 #include <vtkCommand.h>
 #include <vtkExtractPolyDataGeometry.h>
 #include <vtkIdList.h>
 #include <vtkIdTypeArray.h>
 #include <vtkInformation.h>
+#include <vtkInformationObjectBaseKey.h>
 #include <vtkLineSource.h>
+#include <vtkMath.h>
 #include <vtkNew.h>
 #include <vtkObjectFactory.h>
 #include <vtkPointData.h>
 #include <vtkPlanes.h>
 #include <vtkPassThrough.h>
 #include <vtkPolyData.h>
+#include <vtkTypeInt32Array.h>
+#include <vtkTypeInt64Array.h>
+#include <vtkUnsignedCharArray.h>
 #include <vtkVersion.h>
 
 // STD includes
@@ -62,6 +69,20 @@ vtkPolyData* getAlgorithmPolyData(vtkAlgorithmOutput* output)
   int index = output ? output->GetIndex() : -1;
   return vtkPolyData::SafeDownCast(producer->GetOutputDataObject(index));
 }
+
+// Replace the array by a new one, a copy of it if copy is true: the views
+// of the previous array in copies of the subsampled polydata stay valid.
+template <class T>
+void renewArray(T*& array, bool copy)
+{
+  T* newArray = T::New();
+  if (copy)
+    {
+    newArray->DeepCopy(array);
+    }
+  array->Delete();
+  array = newArray;
+}
 }; // anonymous namespace
 
 //------------------------------------------------------------------------------
@@ -70,6 +91,9 @@ vtkCxxSetReferenceStringMacro(vtkMRMLFiberBundleNode, MarkupsNodeID);
 //------------------------------------------------------------------------------
 vtkMRMLNodeNewMacro(vtkMRMLFiberBundleNode);
 
+//------------------------------------------------------------------------------
+vtkInformationKeyMacro(vtkMRMLFiberBundleNode, VIEWED_ARRAY, ObjectBase);
+
 //------------------------------------------------------------------------------
 vtkIdType vtkMRMLFiberBundleNode::MaxNumberOfFibersToShowByDefault = 10000;
 
@@ -83,20 +107,31 @@ vtkMRMLFiberBundleNode::~vtkMRMLFiberBundleNode()
   this->ShuffledIds->Delete();
   this->LocalPassThrough->Delete();
   this->SubsampledPolyData->Delete();
+  this->ShuffledOffsets->Delete();
+  this->ShuffledConnectivity->Delete();
+  this->DecimatedOffsets->Delete();
+  this->DecimatedConnectivity->Delete();
+  this->DeletedFibers->Delete();
+  this->ShuffledGhosts->Delete();
+  this->MaskedPolyData->Delete();
 }
 
 //-----------------------------------------------------------------------------
 /* Pipeline:
   *
   * Subsampling produces SubsampledPolyData, which shares its points and point-data
-  * arrays by reference with the original input polydata. Only the cell array is rebuilt
-  * each time the ratio changes. This means scalar array names/active-attributes are
-  * stable across subsample updates (the Qt scalar combo box never sees them change).
+  * arrays by reference with the original input polydata. This means scalar array
+  * names/active-attributes are stable across subsample updates (the Qt scalar combo
+  * box never sees them change). The lines are laid out once in shuffled order, and
+  * the cell array only views a prefix of that layout, so changing the ratio copies
+  * no cells. The viewed arrays are kept alive by their views, and replaced instead
+  * of modified, so copies of previous outputs stay valid.
   *
   * Output:
   *
   *   if SelectWithMarkups
   *     MeshConnection -> ExtractFromROI -> LocalPassThrough -> GetFilteredMeshConnection
+  *     (MaskedPolyData -> ExtractFromROI while fibers are deleted)
   *   else
   *     SubsampledPolyData -> LocalPassThrough -> GetFilteredMeshConnection
 */
@@ -111,7 +146,21 @@ vtkMRMLFiberBundleNode::vtkMRMLFiberBundleNode() :
   Planes(vtkPlanes::New()),
   LocalPassThrough(vtkPassThrough::New()),
   LastNumberOfCellsKept(-1),
-  SubsampledPolyData(vtkPolyData::New())
+  SubsampledPolyData(vtkPolyData::New()),
+  ShuffledOffsets(vtkIdTypeArray::New()),
+  ShuffledConnectivity(vtkIdTypeArray::New()),
+  LevelOfDetailFiberFraction(1.0),
+  LevelOfDetailDecimatePoints(false),
+  LevelOfDetailPointStep(4),
+  NumberOfLevelOfDetailInteractions(0),
+  LastDecimatePoints(false),
+  DecimatedOffsets(vtkIdTypeArray::New()),
+  DecimatedConnectivity(vtkIdTypeArray::New()),
+  DecimatedPointStep(0),
+  DeletedFibers(vtkBitArray::New()),
+  NumberOfDeletedFibers(0),
+  ShuffledGhosts(vtkUnsignedCharArray::New()),
+  MaskedPolyData(vtkPolyData::New())
 {
   this->SubsamplingRatio = 1.0;
   this->SelectWithMarkups = false;
@@ -217,6 +266,11 @@ void vtkMRMLFiberBundleNode::Copy(vtkMRMLNode *anode)
 void vtkMRMLFiberBundleNode::PrintSelf(std::ostream& os, vtkIndent indent)
 {
   Superclass::PrintSelf(os,indent);
+  os << indent << "LevelOfDetailFiberFraction: " << this->LevelOfDetailFiberFraction << "\n";
+  os << indent << "LevelOfDetailDecimatePoints: " << this->LevelOfDetailDecimatePoints << "\n";
+  os << indent << "LevelOfDetailPointStep: " << this->LevelOfDetailPointStep << "\n";
+  os << indent << "NumberOfLevelOfDetailInteractions: " << this->NumberOfLevelOfDetailInteractions << "\n";
+  os << indent << "NumberOfDeletedFibers: " << this->NumberOfDeletedFibers << "\n";
 }
 
 //---------------------------------------------------------------------------
@@ -241,6 +295,7 @@ void vtkMRMLFiberBundleNode::ProcessMRMLEvents (vtkObject *caller,
       (this->GetMeshConnection()->GetProducer() == caller))
   {
     this->UpdateSubsampling();
+    this->UpdateDeletedFibersMask();
   }
 
 
@@ -405,6 +460,7 @@ void vtkMRMLFiberBundleNode::SetMeshConnection(vtkAlgorithmOutput *inputPort)
     this->SetSubsamplingRatio(subsamplingRatio);
 
     this->UpdateSubsampling();
+    this->UpdateDeletedFibersMask();
 
     if (this->GetSelectWithMarkups() == true)
       {
@@ -427,6 +483,181 @@ void vtkMRMLFiberBundleNode::SetSubsamplingRatio (float ratio)
   }
 
 
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleNode::SetLevelOfDetail(double fiberFraction, bool decimatePoints)
+{
+  fiberFraction = vtkMath::ClampValue<double>(fiberFraction, 0.0, 1.0);
+  if (this->LevelOfDetailFiberFraction == fiberFraction &&
+      this->LevelOfDetailDecimatePoints == decimatePoints)
+    {
+    return;
+    }
+  this->LevelOfDetailFiberFraction = fiberFraction;
+  this->LevelOfDetailDecimatePoints = decimatePoints;
+  this->UpdateSubsampling();
+}
+
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleNode::StartLevelOfDetailInteraction(double fiberFraction, bool decimatePoints)
+{
+  this->NumberOfLevelOfDetailInteractions++;
+  if (this->NumberOfLevelOfDetailInteractions > 1)
+    {
+    // keep the coarser level of detail of the views
+    fiberFraction = std::min(fiberFraction, this->LevelOfDetailFiberFraction);
+    decimatePoints = decimatePoints || this->LevelOfDetailDecimatePoints;
+    }
+  this->SetLevelOfDetail(fiberFraction, decimatePoints);
+}
+
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleNode::EndLevelOfDetailInteraction()
+{
+  if (this->NumberOfLevelOfDetailInteractions == 0)
+    {
+    return;
+    }
+  this->NumberOfLevelOfDetailInteractions--;
+  if (this->NumberOfLevelOfDetailInteractions == 0)
+    {
+    this->SetLevelOfDetail(1.0, false);
+    }
+}
+
+//----------------------------------------------------------------------------
+double vtkMRMLFiberBundleNode::GetLevelOfDetailCost()
+{
+  return this->LevelOfDetailFiberFraction /
+    (this->LevelOfDetailDecimatePoints ? this->LevelOfDetailPointStep : 1);
+}
+
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleNode::DeleteFibers(vtkIdList* fiberIds)
+{
+  if (!fiberIds)
+    {
+    return;
+    }
+  std::vector<vtkIdType> deletedFibers;
+  renewArray(this->ShuffledGhosts, true);
+  for (vtkIdType i = 0; i < fiberIds->GetNumberOfIds(); i++)
+    {
+    vtkIdType fiberId = fiberIds->GetId(i);
+    if (fiberId < 0 || fiberId >= this->DeletedFibers->GetNumberOfTuples() ||
+        this->DeletedFibers->GetValue(fiberId))
+      {
+      continue;
+      }
+    this->DeletedFibers->SetValue(fiberId, 1);
+    this->ShuffledGhosts->SetValue(this->ShuffledPositions[fiberId], vtkDataSetAttributes::HIDDENCELL);
+    deletedFibers.push_back(fiberId);
+    }
+  if (deletedFibers.empty())
+    {
+    return;
+    }
+  this->NumberOfDeletedFibers += static_cast<vtkIdType>(deletedFibers.size());
+  this->DeletedFibersHistory.push_back(deletedFibers);
+
+  this->UpdateDeletedFibersMask();
+  this->LastNumberOfCellsKept = -1;  // force ghost array update
+  this->UpdateSubsampling();
+}
+
+//----------------------------------------------------------------------------
+bool vtkMRMLFiberBundleNode::UndoDeleteFibers()
+{
+  if (this->DeletedFibersHistory.empty())
+    {
+    return false;
+    }
+  const std::vector<vtkIdType>& deletedFibers = this->DeletedFibersHistory.back();
+  renewArray(this->ShuffledGhosts, true);
+  for (size_t i = 0; i < deletedFibers.size(); i++)
+    {
+    this->DeletedFibers->SetValue(deletedFibers[i], 0);
+    this->ShuffledGhosts->SetValue(this->ShuffledPositions[deletedFibers[i]], 0);
+    }
+  this->NumberOfDeletedFibers -= static_cast<vtkIdType>(deletedFibers.size());
+  this->DeletedFibersHistory.pop_back();
+
+  this->UpdateDeletedFibersMask();
+  this->LastNumberOfCellsKept = -1;  // force ghost array update
+  this->UpdateSubsampling();
+  return true;
+}
+
+//----------------------------------------------------------------------------
+bool vtkMRMLFiberBundleNode::IsFiberDeleted(vtkIdType fiberId)
+{
+  return fiberId >= 0 && fiberId < this->DeletedFibers->GetNumberOfTuples() &&
+    this->DeletedFibers->GetValue(fiberId) != 0;
+}
+
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleNode::RemoveDeletedFibers()
+{
+  if (!this->GetPolyData() || this->NumberOfDeletedFibers == 0)
+    {
+    return;
+    }
+  vtkNew<vtkPolyData> compactedPolyData;
+  this->GetCompactedPolyData(compactedPolyData.GetPointer());
+
+  // the number of fibers changes: the deletions are reset
+  this->SetAndObservePolyData(compactedPolyData.GetPointer());
+}
+
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleNode::GetCompactedPolyData(vtkPolyData* compactedPolyData)
+{
+  vtkPolyData* polyData = getAlgorithmPolyData(this->Superclass::GetMeshConnection());
+  if (!compactedPolyData)
+    {
+    return;
+    }
+  compactedPolyData->Initialize();
+  if (!polyData)
+    {
+    return;
+    }
+  if (this->NumberOfDeletedFibers == 0)
+    {
+    compactedPolyData->ShallowCopy(polyData);
+    return;
+    }
+
+  vtkIdType npts;
+#if VTK_MAJOR_VERSION >= 9 || (VTK_MAJOR_VERSION >= 8 && VTK_MINOR_VERSION >= 90)
+  const vtkIdType* pts;
+#else
+  vtkIdType* pts;
+#endif
+
+  compactedPolyData->SetPoints(polyData->GetPoints());
+  compactedPolyData->GetPointData()->ShallowCopy(polyData->GetPointData());
+
+  // lines are numbered after the vertices in the cell data
+  vtkCellData* cellData = polyData->GetCellData();
+  vtkCellData* compactedCellData = compactedPolyData->GetCellData();
+  compactedCellData->CopyAllocate(cellData, polyData->GetNumberOfLines() - this->NumberOfDeletedFibers);
+  vtkIdType cellId = polyData->GetNumberOfVerts();
+
+  vtkNew<vtkCellArray> lines;
+  vtkCellArray* inputLines = polyData->GetLines();
+  vtkIdType fiberId = 0;
+  for (inputLines->InitTraversal(); inputLines->GetNextCell(npts, pts); fiberId++, cellId++)
+    {
+    if (this->IsFiberDeleted(fiberId))
+      {
+      continue;
+      }
+    vtkIdType newCellId = lines->InsertNextCell(npts, pts);
+    compactedCellData->CopyData(cellData, cellId, newCellId);
+    }
+  compactedPolyData->SetLines(lines.GetPointer());
+}
+
 //----------------------------------------------------------------------------
 void vtkMRMLFiberBundleNode::SetSelectWithMarkups(bool state)
 {
@@ -515,6 +746,121 @@ void vtkMRMLFiberBundleNode::SetAndObserveMarkupsNodeID(const char *id)
   this->UpdateROISelection();
 }
 
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleNode::UpdateShuffledLines(vtkPolyData* polyData)
+{
+  vtkCellArray* lines = polyData->GetLines();
+  const vtkIdType numberOfFibers = this->ShuffledIds->GetNumberOfTuples();
+
+  // Lines of the input in their order
+  std::vector<vtkIdType> lineStarts;
+  std::vector<vtkIdType> lineSizes;
+  std::vector<vtkIdType> lineIds;
+  lineStarts.reserve(numberOfFibers);
+  lineSizes.reserve(numberOfFibers);
+  vtkIdType npts = 0;
+#if VTK_MAJOR_VERSION >= 9 || (VTK_MAJOR_VERSION >= 8 && VTK_MINOR_VERSION >= 90)
+  const vtkIdType* pts = NULL;
+#else
+  vtkIdType* pts = NULL;
+#endif
+  for (lines->InitTraversal(); lines->GetNextCell(npts, pts); )
+    {
+    lineStarts.push_back(static_cast<vtkIdType>(lineIds.size()));
+    lineSizes.push_back(npts);
+    lineIds.insert(lineIds.end(), pts, pts + npts);
+    }
+
+  // Shuffled layout: the offsets of the lines in the connectivity, which
+  // also stores the number of points of each line in the legacy format
+#ifdef VTK_CELL_ARRAY_V2
+  const vtkIdType entriesPerLine = 0;
+#else
+  const vtkIdType entriesPerLine = 1;
+#endif
+  renewArray(this->ShuffledOffsets, false);
+  this->ShuffledOffsets->SetNumberOfValues(numberOfFibers + 1);
+  vtkIdType* offsets = this->ShuffledOffsets->GetPointer(0);
+  offsets[0] = 0;
+  for (vtkIdType i = 0; i < numberOfFibers; i++)
+    {
+    vtkIdType line = this->ShuffledIds->GetValue(i);
+    vtkIdType size = line < static_cast<vtkIdType>(lineSizes.size()) ? lineSizes[line] : 0;
+    offsets[i + 1] = offsets[i] + entriesPerLine + size;
+    }
+
+  renewArray(this->ShuffledConnectivity, false);
+  this->ShuffledConnectivity->SetNumberOfValues(offsets[numberOfFibers]);
+  vtkIdType* connectivity = this->ShuffledConnectivity->GetPointer(0);
+  for (vtkIdType i = 0; i < numberOfFibers; i++)
+    {
+    vtkIdType line = this->ShuffledIds->GetValue(i);
+    vtkIdType* cell = connectivity + offsets[i];
+    vtkIdType size = offsets[i + 1] - offsets[i] - entriesPerLine;
+    if (entriesPerLine)
+      {
+      *cell++ = size;
+      }
+    if (size > 0)
+      {
+      std::copy(lineIds.begin() + lineStarts[line], lineIds.begin() + lineStarts[line] + size, cell);
+      }
+    }
+
+  this->ShuffledLinesTime.Modified();
+}
+
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleNode::UpdateDecimatedLines()
+{
+#ifdef VTK_CELL_ARRAY_V2
+  const vtkIdType entriesPerLine = 0;
+#else
+  const vtkIdType entriesPerLine = 1;
+#endif
+  const vtkIdType numberOfFibers = this->ShuffledOffsets->GetNumberOfValues() - 1;
+  const vtkIdType step = this->LevelOfDetailPointStep;
+  const vtkIdType* offsets = this->ShuffledOffsets->GetPointer(0);
+  const vtkIdType* connectivity = this->ShuffledConnectivity->GetPointer(0);
+
+  // one point out of step, and the last one
+  renewArray(this->DecimatedOffsets, false);
+  this->DecimatedOffsets->SetNumberOfValues(numberOfFibers + 1);
+  vtkIdType* decimatedOffsets = this->DecimatedOffsets->GetPointer(0);
+  decimatedOffsets[0] = 0;
+  for (vtkIdType i = 0; i < numberOfFibers; i++)
+    {
+    vtkIdType npts = offsets[i + 1] - offsets[i] - entriesPerLine;
+    vtkIdType decimatedNpts = npts > 0 ? (npts - 1) / step + 1 + ((npts - 1) % step ? 1 : 0) : 0;
+    decimatedOffsets[i + 1] = decimatedOffsets[i] + entriesPerLine + decimatedNpts;
+    }
+
+  renewArray(this->DecimatedConnectivity, false);
+  this->DecimatedConnectivity->SetNumberOfValues(decimatedOffsets[numberOfFibers]);
+  vtkIdType* decimatedConnectivity = this->DecimatedConnectivity->GetPointer(0);
+  for (vtkIdType i = 0; i < numberOfFibers; i++)
+    {
+    const vtkIdType* pts = connectivity + offsets[i] + entriesPerLine;
+    vtkIdType npts = offsets[i + 1] - offsets[i] - entriesPerLine;
+    vtkIdType* cell = decimatedConnectivity + decimatedOffsets[i];
+    if (entriesPerLine)
+      {
+      *cell++ = decimatedOffsets[i + 1] - decimatedOffsets[i] - entriesPerLine;
+      }
+    for (vtkIdType n = 0; n < npts; n += step)
+      {
+      *cell++ = pts[n];
+      }
+    if (npts > 0 && (npts - 1) % step)
+      {
+      *cell++ = pts[npts - 1];
+      }
+    }
+
+  this->DecimatedPointStep = this->LevelOfDetailPointStep;
+  this->DecimatedLinesTime.Modified();
+}
+
 //----------------------------------------------------------------------------
 void vtkMRMLFiberBundleNode::UpdateSubsampling()
 {
@@ -528,7 +874,8 @@ void vtkMRMLFiberBundleNode::UpdateSubsampling()
     }
 
   const vtkIdType numberOfFibers = polyData->GetNumberOfLines();
-  const vtkIdType numberOfCellsToKeep = vtkIdType(floor(numberOfFibers * this->SubsamplingRatio));
+  const vtkIdType numberOfCellsToKeep = vtkIdType(floor(
+    vtkIdType(floor(numberOfFibers * this->SubsamplingRatio)) * this->LevelOfDetailFiberFraction));
 
   // Rebuild shuffled order when the fiber count changes
   if (this->ShuffledIds->GetNumberOfTuples() != numberOfFibers)
@@ -549,10 +896,42 @@ void vtkMRMLFiberBundleNode::UpdateSubsampling()
     this->ShuffledIds->SetNumberOfTuples(idVector.size());
     vtkIdType* ids = this->ShuffledIds->GetPointer(0);
     std::copy(idVector.begin(), idVector.end(), ids);
+    this->ShuffledIds->Modified();
+
+    // Deleted fibers refer to the previous fibers
+    this->DeletedFibers->Initialize();
+    this->DeletedFibers->SetNumberOfTuples(numberOfFibers);
+    this->DeletedFibers->FillComponent(0, 0);
+    this->NumberOfDeletedFibers = 0;
+    this->DeletedFibersHistory.clear();
+    renewArray(this->ShuffledGhosts, false);
+    this->ShuffledGhosts->SetNumberOfTuples(numberOfFibers);
+    this->ShuffledGhosts->FillComponent(0, 0);
+    this->ShuffledPositions.resize(numberOfFibers);
+    for (vtkIdType i = 0; i < numberOfFibers; i++)
+      {
+      this->ShuffledPositions[ids[i]] = i;
+      }
+    }
+
+  // Lay out the lines in shuffled order when the order or the lines change
+  if (this->ShuffledIds->GetMTime() > this->ShuffledLinesTime ||
+      polyData->GetLines()->GetMTime() > this->ShuffledLinesTime)
+    {
+    this->UpdateShuffledLines(polyData);
     this->LastNumberOfCellsKept = -1;  // force ghost array update after reshuffle
     }
 
-  if (numberOfCellsToKeep == this->LastNumberOfCellsKept)
+  const bool decimatePoints = this->LevelOfDetailDecimatePoints;
+  if (decimatePoints && (this->DecimatedLinesTime < this->ShuffledLinesTime ||
+                         this->DecimatedPointStep != this->LevelOfDetailPointStep))
+    {
+    this->UpdateDecimatedLines();
+    this->LastNumberOfCellsKept = -1;
+    }
+
+  if (numberOfCellsToKeep == this->LastNumberOfCellsKept &&
+      decimatePoints == this->LastDecimatePoints)
     {
     // no change, no-op
     return;
@@ -565,22 +944,98 @@ void vtkMRMLFiberBundleNode::UpdateSubsampling()
   this->SubsampledPolyData->SetPoints(polyData->GetPoints());
   this->SubsampledPolyData->GetPointData()->ShallowCopy(polyData->GetPointData());
 
-  vtkNew<vtkCellArray> visibleLines;
-  vtkNew<vtkIdList> ptIds;
-  for (vtkIdType i = 0; i < numberOfCellsToKeep; i++)
+  // The visible lines are the first numberOfCellsToKeep shuffled lines,
+  // at full or decimated resolution: view them without copying.
+  vtkIdTypeArray* linesOffsets = decimatePoints ? this->DecimatedOffsets : this->ShuffledOffsets;
+  vtkIdTypeArray* linesConnectivity = decimatePoints ? this->DecimatedConnectivity : this->ShuffledConnectivity;
+  // The cell array keeps the views, which keep the viewed arrays. It copies
+  // vtkIdTypeArray views into its own storage type, so use that type.
+#if !defined(VTK_CELL_ARRAY_V2)
+  typedef vtkIdTypeArray LinesArrayType;
+#elif defined(VTK_USE_64BIT_IDS)
+  typedef vtkTypeInt64Array LinesArrayType;
+#else
+  typedef vtkTypeInt32Array LinesArrayType;
+#endif
+  vtkNew<LinesArrayType> connectivity;
+  connectivity->SetArray(reinterpret_cast<LinesArrayType::ValueType*>(linesConnectivity->GetPointer(0)),
+                         linesOffsets->GetValue(numberOfCellsToKeep), 1);
+  connectivity->GetInformation()->Set(VIEWED_ARRAY(), linesConnectivity);
+  vtkNew<vtkCellArray> lines;
+#ifdef VTK_CELL_ARRAY_V2
+  vtkNew<LinesArrayType> offsets;
+  offsets->SetArray(reinterpret_cast<LinesArrayType::ValueType*>(linesOffsets->GetPointer(0)),
+                    numberOfCellsToKeep + 1, 1);
+  offsets->GetInformation()->Set(VIEWED_ARRAY(), linesOffsets);
+  lines->SetData(offsets.GetPointer(), connectivity.GetPointer());
+#else
+  lines->SetCells(numberOfCellsToKeep, connectivity.GetPointer());
+#endif
+  this->SubsampledPolyData->SetLines(lines.GetPointer());
+
+  // Hide the deleted fibers with the ghost array of the visible lines
+  if (this->NumberOfDeletedFibers > 0)
     {
-    polyData->GetCellPoints(this->ShuffledIds->GetValue(i), ptIds);
-    visibleLines->InsertNextCell(ptIds);
+    vtkNew<vtkUnsignedCharArray> ghosts;
+    ghosts->SetName(vtkDataSetAttributes::GhostArrayName());
+    ghosts->SetArray(this->ShuffledGhosts->GetPointer(0), numberOfCellsToKeep, 1);
+    ghosts->GetInformation()->Set(VIEWED_ARRAY(), this->ShuffledGhosts);
+    this->SubsampledPolyData->GetCellData()->AddArray(ghosts.GetPointer());
     }
-  this->SubsampledPolyData->SetLines(visibleLines);
   this->SubsampledPolyData->Modified();
 
   this->LastNumberOfCellsKept = numberOfCellsToKeep;
+  this->LastDecimatePoints = decimatePoints;
 
   // tell the displaynode to render
   this->InvokeCustomModifiedEvent(vtkMRMLModelNode::MeshModifiedEvent, this);
 }
 
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleNode::UpdateDeletedFibersMask()
+{
+  vtkAlgorithmOutput* meshConnection = this->Superclass::GetMeshConnection();
+  vtkPolyData* polyData = getAlgorithmPolyData(meshConnection);
+  if (!polyData || this->NumberOfDeletedFibers == 0)
+    {
+    this->MaskedPolyData->Initialize();
+    if (this->ExtractFromROI->GetInputConnection(0, 0) != meshConnection)
+      {
+      this->ExtractFromROI->SetInputConnection(0, meshConnection);
+      }
+    return;
+    }
+
+  // The ROI selection extracts the hidden cells with the others, and
+  // keeps them hidden. The polydata is not modified: a new ghost array,
+  // with the ghosts of the polydata, is set to a shallow copy of it.
+  this->MaskedPolyData->ShallowCopy(polyData);
+  vtkNew<vtkUnsignedCharArray> ghosts;
+  vtkUnsignedCharArray* inputGhosts = polyData->GetCellGhostArray();
+  if (inputGhosts)
+    {
+    ghosts->DeepCopy(inputGhosts);
+    }
+  else
+    {
+    ghosts->SetNumberOfTuples(polyData->GetNumberOfCells());
+    ghosts->FillComponent(0, 0);
+    }
+  ghosts->SetName(vtkDataSetAttributes::GhostArrayName());
+  // lines are numbered after the vertices in the cell data
+  const vtkIdType firstLine = polyData->GetNumberOfVerts();
+  for (vtkIdType fiberId = 0; fiberId < this->DeletedFibers->GetNumberOfTuples(); fiberId++)
+    {
+    if (this->DeletedFibers->GetValue(fiberId))
+      {
+      ghosts->SetValue(firstLine + fiberId,
+        ghosts->GetValue(firstLine + fiberId) | vtkDataSetAttributes::HIDDENCELL);
+      }
+    }
+  this->MaskedPolyData->GetCellData()->AddArray(ghosts.GetPointer());
+  this->ExtractFromROI->SetInputData(this->MaskedPolyData);
+}
+
 //----------------------------------------------------------------------------
 void vtkMRMLFiberBundleNode::UpdateROISelection()
 {
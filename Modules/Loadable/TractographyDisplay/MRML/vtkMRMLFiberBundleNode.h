@@ -24,21 +24,30 @@
 
 #include "vtkMRMLModelNode.h"
 
+// VTK includes
+#include <vtkTimeStamp.h>
+
 // STD includes
 #include <iosfwd>
+#include <vector>
 
 // Tractography includes
 #include "vtkSlicerTractographyDisplayModuleMRMLExport.h"
 
 class vtMRMLModelDisplayNode;
+class vtkBitArray;
+class vtkCellArray;
 class vtkExtractPolyDataGeometry;
+class vtkIdList;
 class vtkIdTypeArray;
+class vtkInformationObjectBaseKey;
 class vtkLineSource;
 class vtkMRMLFiberBundleDisplayNode;
 class vtkMRMLMarkupsNode;
 class vtkPassThrough;
 class vtkPlanes;
 class vtkPolyData;
+class vtkUnsignedCharArray;
 
 class VTK_SLICER_TRACTOGRAPHYDISPLAY_MODULE_MRML_EXPORT vtkMRMLFiberBundleNode : public vtkMRMLModelNode
 {
@@ -103,6 +112,65 @@ public:
 
   //vtkSetClampMacro(SubsamplingRatio, float, 0, 1);
 
+  ///
+  /// Set the level of detail of the fibers shown: the fraction of the
+  /// subsampled fibers that is shown, and whether only one point out of
+  /// LevelOfDetailPointStep of each fiber is kept. Both levels are cached,
+  /// switching between them copies no cells. Lowered while the views are
+  /// interacted with, see StartLevelOfDetailInteraction, not saved in the scene.
+  void SetLevelOfDetail(double fiberFraction, bool decimatePoints);
+  vtkGetMacro(LevelOfDetailFiberFraction, double);
+  vtkGetMacro(LevelOfDetailDecimatePoints, bool);
+
+  ///
+  /// Set the level of detail while a view is interacted with. The level of
+  /// detail is shared by the views of the fiber bundle: the coarser level
+  /// of the interacting views is kept, and full detail is restored when all
+  /// the views that started an interaction ended it.
+  void StartLevelOfDetailInteraction(double fiberFraction, bool decimatePoints);
+  void EndLevelOfDetailInteraction();
+  vtkGetMacro(NumberOfLevelOfDetailInteractions, int);
+
+  ///
+  /// Fraction of the full detail rendering cost at the current level of detail
+  double GetLevelOfDetailCost();
+
+  ///
+  /// Step between the points kept on the fibers at the coarse level of detail
+  vtkGetMacro(LevelOfDetailPointStep, int);
+  vtkSetClampMacro(LevelOfDetailPointStep, int, 2, VTK_INT_MAX);
+
+  ///
+  /// Delete fibers, by fiber id. The deleted fibers are hidden from the
+  /// display, with or without markups selection, and kept in the polydata
+  /// until RemoveDeletedFibers. They are not saved with the fiber bundle.
+  /// Each call can be undone by UndoDeleteFibers. Deletions are kept
+  /// while the number of fibers of the polydata does not change.
+  void DeleteFibers(vtkIdList* fiberIds);
+
+  ///
+  /// Undo the last call to DeleteFibers.
+  /// Returns false if there is no deletion to undo.
+  bool UndoDeleteFibers();
+
+  ///
+  /// Whether the fiber was deleted by DeleteFibers
+  bool IsFiberDeleted(vtkIdType fiberId);
+
+  ///
+  /// Number of fibers deleted and not removed yet
+  vtkGetMacro(NumberOfDeletedFibers, vtkIdType);
+
+  ///
+  /// Remove the deleted fibers from the polydata. The points and point
+  /// data are shared with the current polydata.
+  void RemoveDeletedFibers();
+
+  ///
+  /// Set compactedPolyData to the polydata without the deleted fibers.
+  /// The points and point data are shared with the polydata.
+  void GetCompactedPolyData(vtkPolyData* compactedPolyData);
+
   ///
   /// Get annotation MRML object.
   vtkMRMLMarkupsNode* GetMarkupsNode ( );
@@ -228,8 +296,46 @@ private:
   vtkIdType LastNumberOfCellsKept;
   vtkPolyData* SubsampledPolyData;
 
+  // Lines of the input in shuffled order, built once per shuffle: the
+  // visible lines are a prefix of ShuffledOffsets and ShuffledConnectivity.
+  // Each update of SubsampledPolyData gets new arrays viewing the prefix,
+  // which keep the viewed array alive with the VIEWED_ARRAY key. Viewed
+  // arrays are never modified: they are replaced by new arrays instead.
+  vtkIdTypeArray* ShuffledOffsets;
+  vtkIdTypeArray* ShuffledConnectivity;
+  vtkTimeStamp ShuffledLinesTime;
+  static vtkInformationObjectBaseKey* VIEWED_ARRAY();
+
+  // Level of detail: the decimated lines have the layout of the shuffled
+  // lines, with one point out of LevelOfDetailPointStep (and the last one)
+  double LevelOfDetailFiberFraction;
+  bool LevelOfDetailDecimatePoints;
+  int LevelOfDetailPointStep;
+  int NumberOfLevelOfDetailInteractions;
+  bool LastDecimatePoints;
+  vtkIdTypeArray* DecimatedOffsets;
+  vtkIdTypeArray* DecimatedConnectivity;
+  int DecimatedPointStep;
+  vtkTimeStamp DecimatedLinesTime;
+
+  // Deleted fibers, by fiber id, and the ids of each call to DeleteFibers.
+  // The ghost value of each fiber in shuffled order hides the deleted
+  // fibers from the display: the visible ghosts are a prefix of it.
+  vtkBitArray* DeletedFibers;
+  vtkIdType NumberOfDeletedFibers;
+  std::vector<std::vector<vtkIdType> > DeletedFibersHistory;
+  vtkUnsignedCharArray* ShuffledGhosts;
+  std::vector<vtkIdType> ShuffledPositions;
+
+  // Input of ExtractFromROI while fibers are deleted: the polydata, with
+  // a ghost array hiding the deleted fibers
+  vtkPolyData* MaskedPolyData;
+
   // Internal methods
+  void UpdateShuffledLines(vtkPolyData* polyData);
+  void UpdateDecimatedLines();
   void UpdateSubsampling();
+  void UpdateDeletedFibersMask();
   void UpdateROISelection();
 };
 
@@ -14,7 +14,12 @@ Version:   $Revision: 1.2 $
 
 
 #include "vtkObjectFactory.h"
+#include "vtkMRMLFiberBundleNode.h"
 #include "vtkMRMLFiberBundleStorageNode.h"
+#include "vtkMRMLModelNode.h"
+
+#include <vtkNew.h>
+#include <vtkPolyData.h>
 
 
 
@@ -40,3 +45,21 @@ void vtkMRMLFiberBundleStorageNode::InitializeSupportedWriteFileTypes()
 {
   this->Superclass::InitializeSupportedWriteFileTypes();
 }
+
+//----------------------------------------------------------------------------
+int vtkMRMLFiberBundleStorageNode::WriteDataInternal(vtkMRMLNode *refNode)
+{
+  vtkMRMLFiberBundleNode *fiberBundleNode = vtkMRMLFiberBundleNode::SafeDownCast(refNode);
+  if (!fiberBundleNode || fiberBundleNode->GetNumberOfDeletedFibers() == 0)
+    {
+    return this->Superclass::WriteDataInternal(refNode);
+    }
+
+  // Write the fibers that are not deleted, and leave the fiber bundle
+  // unchanged: its deletions can still be undone after saving
+  vtkNew<vtkPolyData> compactedPolyData;
+  fiberBundleNode->GetCompactedPolyData(compactedPolyData.GetPointer());
+  vtkNew<vtkMRMLModelNode> compactedNode;
+  compactedNode->SetAndObservePolyData(compactedPolyData.GetPointer());
+  return this->Superclass::WriteDataInternal(compactedNode.GetPointer());
+}
@@ -48,6 +48,10 @@ class VTK_SLICER_TRACTOGRAPHYDISPLAY_MODULE_MRML_EXPORT vtkMRMLFiberBundleStorag
   virtual void InitializeSupportedWriteFileTypes() override;
 
 protected:
+  ///
+  /// Remove the deleted fibers of the fiber bundle before writing it
+  virtual int WriteDataInternal(vtkMRMLNode *refNode) override;
+
   vtkMRMLFiberBundleStorageNode();
   ~vtkMRMLFiberBundleStorageNode(){};
   vtkMRMLFiberBundleStorageNode(const vtkMRMLFiberBundleStorageNode&);
@@ -17,6 +17,7 @@ Version:   $Revision: 1.3 $
 #include "vtkMRMLScene.h"
 
 // Teem includes
+#include "vtkCachedTubeFilter.h"
 #include "vtkPolyDataTensorToColor.h"
 #include "vtkPolyDataColorLinesByOrientation.h"
 
@@ -27,7 +28,6 @@ Version:   $Revision: 1.3 $
 #include <vtkCellData.h>
 #include <vtkObjectFactory.h>
 #include <vtkPointData.h>
-#include <vtkTubeFilter.h>
 
 // STD includes
 #include <iostream>
@@ -43,7 +43,7 @@ vtkMRMLFiberBundleTubeDisplayNode::vtkMRMLFiberBundleTubeDisplayNode()
   this->ColorLinesByOrientation->SetInputConnection(
     this->Superclass::GetOutputMeshConnection());
 
-  this->TubeFilter = vtkTubeFilter::New();
+  this->TubeFilter = vtkCachedTubeFilter::New();
   this->TubeNumberOfSides = 6;
   this->TubeRadius = 0.5;
 
@@ -51,7 +51,7 @@ vtkMRMLFiberBundleTubeDisplayNode::vtkMRMLFiberBundleTubeDisplayNode()
   this->TubeFilter->SetRadius(this->GetTubeRadius());
   this->TubeFilter->SetInputConnection(
     this->Superclass::GetOutputMeshConnection());
-
+  this->TubeFilter->AddObserver(vtkCachedTubeFilter::TubesPendingEvent, this->MRMLCallbackCommand);
 
   this->TensorToColor = vtkPolyDataTensorToColor::New();
   this->TensorToColor->SetInputConnection(this->TubeFilter->GetOutputPort());
@@ -68,6 +68,7 @@ vtkMRMLFiberBundleTubeDisplayNode::vtkMRMLFiberBundleTubeDisplayNode()
 vtkMRMLFiberBundleTubeDisplayNode::~vtkMRMLFiberBundleTubeDisplayNode()
 {
   this->RemoveObservers ( vtkCommand::ModifiedEvent, this->MRMLCallbackCommand );
+  this->TubeFilter->RemoveObservers(vtkCachedTubeFilter::TubesPendingEvent, this->MRMLCallbackCommand);
   this->TubeFilter->Delete();
   this->TensorToColor->Delete();
   this->ColorLinesByOrientation->Delete();
@@ -140,6 +141,49 @@ void vtkMRMLFiberBundleTubeDisplayNode::PrintSelf(std::ostream& os, vtkIndent in
   os << indent << "TubeRadius:             " << this->TubeRadius << "\n";
 }
 
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleTubeDisplayNode::SetBackgroundTubes(int background)
+{
+  this->TubeFilter->SetBackgroundGeneration(background);
+}
+
+//----------------------------------------------------------------------------
+int vtkMRMLFiberBundleTubeDisplayNode::GetBackgroundTubes()
+{
+  return this->TubeFilter->GetBackgroundGeneration();
+}
+
+//----------------------------------------------------------------------------
+void vtkMRMLFiberBundleTubeDisplayNode::ProcessMRMLEvents(vtkObject *caller,
+                                                          unsigned long event,
+                                                          void *callData)
+{
+  if (caller == this->TubeFilter && event == vtkCachedTubeFilter::TubesPendingEvent)
+    {
+    this->InvokeEvent(vtkMRMLFiberBundleTubeDisplayNode::TubesPendingEvent);
+    return;
+    }
+  this->Superclass::ProcessMRMLEvents(caller, event, callData);
+}
+
+//----------------------------------------------------------------------------
+bool vtkMRMLFiberBundleTubeDisplayNode::ProcessBackgroundTubes()
+{
+  if (!this->TubeFilter->ProcessBackgroundTubes())
+    {
+    return false;
+    }
+  // the tube filter is modified: views showing the lines get the tubes
+  this->Modified();
+  return true;
+}
+
+//----------------------------------------------------------------------------
+bool vtkMRMLFiberBundleTubeDisplayNode::GetTubesPending()
+{
+  return this->TubeFilter->GetTubesPending();
+}
+
 //----------------------------------------------------------------------------
 vtkAlgorithmOutput* vtkMRMLFiberBundleTubeDisplayNode::GetOutputMeshConnection()
 {
@@ -24,12 +24,15 @@
 
 #include "vtkMRMLFiberBundleDisplayNode.h"
 
+// VTK includes
+#include <vtkCommand.h>
+
 // STD includes
 #include <iosfwd>
 
+class vtkCachedTubeFilter;
 class vtkPolyData;
 class vtkPolyDataTensorToColor;
-class vtkTubeFilter;
 class vtkPolyDataColorLinesByOrientation;
 
 class VTK_SLICER_TRACTOGRAPHYDISPLAY_MODULE_MRML_EXPORT vtkMRMLFiberBundleTubeDisplayNode : public vtkMRMLFiberBundleDisplayNode
@@ -45,6 +48,12 @@ class VTK_SLICER_TRACTOGRAPHYDISPLAY_MODULE_MRML_EXPORT vtkMRMLFiberBundleTubeDi
 
   virtual vtkMRMLNode* CreateNodeInstance (  ) override;
 
+  enum
+  {
+    /// Invoked when tubes start being generated in the background
+    TubesPendingEvent = vtkCommand::UserEvent + 1
+  };
+
   ///
   /// Read node attributes from XML (MRML) file
   virtual void ReadXMLAttributes ( const char** atts ) override;
@@ -58,6 +67,12 @@ class VTK_SLICER_TRACTOGRAPHYDISPLAY_MODULE_MRML_EXPORT vtkMRMLFiberBundleTubeDi
   /// Copy the node's attributes to this object
   virtual void Copy ( vtkMRMLNode *node ) override;
 
+  ///
+  /// Forward the TubesPendingEvent of the tube filter
+  virtual void ProcessMRMLEvents ( vtkObject *caller,
+                                   unsigned long event,
+                                   void *callData ) override;
+
   ///
   /// Get node XML tag name (like Volume, UnstructuredGrid)
   virtual const char* GetNodeTagName ( ) override {return "FiberBundleTubeDisplayNode";};
@@ -80,6 +95,24 @@ class VTK_SLICER_TRACTOGRAPHYDISPLAY_MODULE_MRML_EXPORT vtkMRMLFiberBundleTubeDi
   vtkSetMacro ( TubeNumberOfSides , int );
   vtkGetMacro ( TubeNumberOfSides , int );
 
+  ///
+  /// Generate the tubes missing from the cache on a worker thread, and
+  /// display the lines until they are done. TubesPendingEvent is invoked
+  /// when a worker thread starts, ProcessBackgroundTubes() must then be
+  /// called regularly from the main thread until it returns true. Off by
+  /// default, not saved in the scene.
+  virtual void SetBackgroundTubes(int background);
+  virtual int GetBackgroundTubes();
+  vtkBooleanMacro ( BackgroundTubes , int );
+
+  ///
+  /// Display the tubes finished on the worker thread.
+  /// Returns true if the display was updated.
+  bool ProcessBackgroundTubes();
+
+  ///
+  /// True if the lines are displayed while the tubes are being generated
+  bool GetTubesPending();
 
  protected:
   vtkMRMLFiberBundleTubeDisplayNode ( );
@@ -97,7 +130,7 @@ class VTK_SLICER_TRACTOGRAPHYDISPLAY_MODULE_MRML_EXPORT vtkMRMLFiberBundleTubeDi
   double TubeRadius;
 
   /// dispaly pipeline
-  vtkTubeFilter *TubeFilter;
+  vtkCachedTubeFilter *TubeFilter;
   vtkPolyDataTensorToColor *TensorToColor;
   vtkPolyDataColorLinesByOrientation *ColorLinesByOrientation;
 
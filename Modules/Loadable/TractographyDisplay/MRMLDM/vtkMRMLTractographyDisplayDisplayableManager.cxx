@@ -38,7 +38,10 @@
 
 // VTK includes
 
+#include <vtkCamera.h>
+#include <vtkIdList.h>
 #include "vtkInteractorStyle.h"
+#include <vtkMath.h>
 #include <vtkNew.h>
 #include "vtkObjectFactory.h"
 #include "vtkRenderWindow.h"
@@ -48,6 +51,7 @@
 #include "vtkPointData.h"
 
 // STD includes
+#include <algorithm>
 #include <iostream>
 
 // ITKSys includes
@@ -64,6 +68,8 @@ vtkMRMLTractographyDisplayDisplayableManager::vtkMRMLTractographyDisplayDisplaya
 {
   this->EnableFiberEdit = 0;
   this->SelectedFiberBundleNode = 0;
+  this->AutoLevelOfDetail = 1;
+  this->TargetFrameTime = 1.0 / 15.0;
 
   this->RemoveInteractorStyleObservableEvent(vtkCommand::LeftButtonPressEvent);
   this->RemoveInteractorStyleObservableEvent(vtkCommand::LeftButtonReleaseEvent);
@@ -76,17 +82,28 @@ vtkMRMLTractographyDisplayDisplayableManager::vtkMRMLTractographyDisplayDisplaya
   this->RemoveInteractorStyleObservableEvent(vtkCommand::EnterEvent);
   this->RemoveInteractorStyleObservableEvent(vtkCommand::LeaveEvent);
   this->AddInteractorStyleObservableEvent(vtkCommand::KeyPressEvent);
+  this->AddInteractorStyleObservableEvent(vtkCommand::StartInteractionEvent);
+  this->AddInteractorStyleObservableEvent(vtkCommand::EndInteractionEvent);
 }
 
 //---------------------------------------------------------------------------
 vtkMRMLTractographyDisplayDisplayableManager::~vtkMRMLTractographyDisplayDisplayableManager()
 {
+  for (size_t i = 0; i < this->LevelOfDetailNodes.size(); i++)
+    {
+    if (this->LevelOfDetailNodes[i])
+      {
+      this->LevelOfDetailNodes[i]->EndLevelOfDetailInteraction();
+      }
+    }
 }
 
 //---------------------------------------------------------------------------
 void vtkMRMLTractographyDisplayDisplayableManager::PrintSelf(std::ostream &os, vtkIndent indent)
 {
   os<<indent<<"Print logic"<<std::endl;
+  os<<indent<<"AutoLevelOfDetail: "<<this->AutoLevelOfDetail<<std::endl;
+  os<<indent<<"TargetFrameTime: "<<this->TargetFrameTime<<std::endl;
 }
 
 //---------------------------------------------------------------------------
@@ -99,12 +116,22 @@ int vtkMRMLTractographyDisplayDisplayableManager::ActiveInteractionModes()
 //---------------------------------------------------------------------------
 void vtkMRMLTractographyDisplayDisplayableManager::OnInteractorStyleEvent(int eventid)
 {
+  if (eventid == vtkCommand::StartInteractionEvent ||
+      eventid == vtkCommand::EndInteractionEvent)
+    {
+    this->UpdateLevelOfDetail(this->GetAutoLevelOfDetail() &&
+                              eventid == vtkCommand::StartInteractionEvent);
+    this->PassThroughInteractorStyleEvent(eventid);
+    return;
+    }
+
   //if (eventid == vtkCommand::LeftButtonReleaseEvent && keyPressed)
   if (this->GetEnableFiberEdit() &&
       eventid == vtkCommand::KeyPressEvent &&
       (this->GetInteractor()->GetKeyCode() == 'd' ||
        this->GetInteractor()->GetKeyCode() == 'x' ||
-       this->GetInteractor()->GetKeyCode() == 's') )
+       this->GetInteractor()->GetKeyCode() == 's' ||
+       this->GetInteractor()->GetKeyCode() == 'u') )
     {
     double x = this->GetInteractor()->GetEventPosition()[0];
     double y = this->GetInteractor()->GetEventPosition()[1];
@@ -206,6 +233,11 @@ void vtkMRMLTractographyDisplayDisplayableManager::OnInteractorStyleEvent(int ev
         // unselect all selected fibers
         this->ClearSelectedFibers();
         }
+      else if (this->GetInteractor()->GetKeyCode() == 'u')
+        {
+        // restore the last deleted fibers
+        this->UndoDeletePickedFibers();
+        }
 
       }
 
@@ -217,6 +249,79 @@ void vtkMRMLTractographyDisplayDisplayableManager::OnInteractorStyleEvent(int ev
   return;
 }
 
+//---------------------------------------------------------------------------
+void vtkMRMLTractographyDisplayDisplayableManager::UpdateLevelOfDetail(bool interacting)
+{
+  vtkMRMLScene* scene = this->GetMRMLScene();
+  vtkRenderer* renderer = this->GetRenderer();
+  if (!scene || !renderer)
+    {
+    return;
+    }
+
+  // Cost of the last frame, relative to full detail, from the level of
+  // detail of the fiber bundles weighted by their number of fibers: the
+  // level of detail may have been lowered by other views
+  std::vector<vtkMRMLFiberBundleNode*> fiberBundleNodes;
+  double cost = 0.;
+  double numberOfFibers = 0.;
+  for (int i = 0; i < scene->GetNumberOfNodesByClass("vtkMRMLFiberBundleNode"); i++)
+    {
+    vtkMRMLFiberBundleNode* fiberBundleNode = vtkMRMLFiberBundleNode::SafeDownCast(
+      scene->GetNthNodeByClass(i, "vtkMRMLFiberBundleNode"));
+    if (!fiberBundleNode)
+      {
+      continue;
+      }
+    fiberBundleNodes.push_back(fiberBundleNode);
+    vtkPolyData* polyData = fiberBundleNode->GetPolyData();
+    double n = polyData ? polyData->GetNumberOfLines() * fiberBundleNode->GetSubsamplingRatio() : 0.;
+    cost += n * fiberBundleNode->GetLevelOfDetailCost();
+    numberOfFibers += n;
+    }
+  cost = numberOfFibers > 0. ? cost / numberOfFibers : 1.;
+
+  // The previous interaction of this view ends
+  for (size_t i = 0; i < this->LevelOfDetailNodes.size(); i++)
+    {
+    if (this->LevelOfDetailNodes[i])
+      {
+      this->LevelOfDetailNodes[i]->EndLevelOfDetailInteraction();
+      }
+    }
+  this->LevelOfDetailNodes.clear();
+
+  if (interacting)
+    {
+    // Estimate the time a frame takes at full detail from the last one,
+    // and lower the detail so that a frame takes about TargetFrameTime
+    double fullFrameTime = renderer->GetLastRenderTimeInSeconds() / std::max(0.001, cost);
+    double ratio = fullFrameTime > 0. ? this->TargetFrameTime / fullFrameTime : 1.;
+    if (ratio < 1.)
+      {
+      // When zoomed out, a fiber point spans less than a pixel: dropping
+      // points is barely visible, dropping fibers thins out the bundle
+      vtkCamera* camera = renderer->GetActiveCamera();
+      double viewHeight = camera->GetParallelProjection() ?
+        2. * camera->GetParallelScale() :
+        2. * camera->GetDistance() * tan(vtkMath::RadiansFromDegrees(camera->GetViewAngle()) / 2.);
+      double pixelsPerMillimeter = viewHeight > 0. ? renderer->GetSize()[1] / viewHeight : 0.;
+      bool decimatePoints = pixelsPerMillimeter < 4.;
+
+      for (size_t i = 0; i < fiberBundleNodes.size(); i++)
+        {
+        // Decimating the points already divides the cost by the point step
+        int pointStep = decimatePoints ? fiberBundleNodes[i]->GetLevelOfDetailPointStep() : 1;
+        double fiberFraction = std::max(0.01, std::min(1., ratio * pointStep));
+        fiberBundleNodes[i]->StartLevelOfDetailInteraction(fiberFraction, decimatePoints);
+        this->LevelOfDetailNodes.push_back(fiberBundleNodes[i]);
+        }
+      }
+    }
+
+  this->RequestRender();
+}
+
 //---------------------------------------------------------------------------
 void vtkMRMLTractographyDisplayDisplayableManager::ClearSelectedFibers()
 {
@@ -263,13 +368,14 @@ vtkMRMLTractographyDisplayDisplayableManager::GetPickedFiber(vtkMRMLFiberBundleD
   vtkMRMLFiberBundleTubeDisplayNode *tubeDisplayNode = vtkMRMLFiberBundleTubeDisplayNode::SafeDownCast(displayNode);
   vtkMRMLFiberBundleGlyphDisplayNode *glyphDisplayNode = vtkMRMLFiberBundleGlyphDisplayNode::SafeDownCast(displayNode);
 
-  if (tubeDisplayNode)
+  if (tubeDisplayNode && !tubeDisplayNode->GetTubesPending())
     {
     int numSides = tubeDisplayNode->GetTubeNumberOfSides();
     cellID = pickedCell/numSides;
     }
-  else if (lineDisplayNode)
+  else if (lineDisplayNode || tubeDisplayNode)
     {
+    // tubes being generated display the lines
     cellID = pickedCell;
     }
   else if (glyphDisplayNode)
@@ -295,18 +401,36 @@ void vtkMRMLTractographyDisplayDisplayableManager::DeletePickedFibers(vtkMRMLFib
     return;
   }
 
-  vtkPolyData *polyData = vtkPolyData::New();
-  polyData->DeepCopy(fiberBundleNode->GetPolyData());
+  // the fibers are hidden, and removed when the fiber bundle is saved
+  vtkNew<vtkIdList> fiberIDs;
   for (unsigned int i=0; i<cellIDs.size(); i++)
     {
     if (cellIDs[i] >= 0)
       {
-      polyData->DeleteCell(cellIDs[i]);
+      fiberIDs->InsertNextId(cellIDs[i]);
+      }
+    }
+  vtkIdType numberOfDeletedFibers = fiberBundleNode->GetNumberOfDeletedFibers();
+  fiberBundleNode->DeleteFibers(fiberIDs.GetPointer());
+  if (fiberBundleNode->GetNumberOfDeletedFibers() != numberOfDeletedFibers)
+    {
+    this->DeletedFiberBundleNodes.push_back(fiberBundleNode);
+    }
+}
+
+//---------------------------------------------------------------------------
+void vtkMRMLTractographyDisplayDisplayableManager::UndoDeletePickedFibers()
+{
+  while (!this->DeletedFiberBundleNodes.empty())
+    {
+    vtkMRMLFiberBundleNode *fiberBundleNode = this->DeletedFiberBundleNodes.back();
+    this->DeletedFiberBundleNodes.pop_back();
+    // the node may have been removed, or its fibers saved
+    if (fiberBundleNode && fiberBundleNode->UndoDeleteFibers())
+      {
+      return;
       }
     }
-  polyData->RemoveDeletedCells();
-  fiberBundleNode->SetAndObservePolyData(polyData);
-  polyData->Delete();
 }
 
 //---------------------------------------------------------------------------
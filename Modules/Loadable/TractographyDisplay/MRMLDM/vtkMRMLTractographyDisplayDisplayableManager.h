@@ -30,6 +30,9 @@ class vtkMRMLFiberBundleNode;
 // MRML DisplayableManager includes
 #include <vtkMRMLAbstractThreeDViewDisplayableManager.h>
 
+// VTK includes
+#include <vtkWeakPointer.h>
+
 // STD includes
 #include <iosfwd>
 #include <vector>
@@ -46,6 +49,19 @@ public:
   vtkGetMacro(EnableFiberEdit, int);
   vtkSetMacro(EnableFiberEdit, int);
 
+  /// While the view is rotated, panned or zoomed, lower the level of detail
+  /// of the fiber bundles so that a frame is rendered in about
+  /// TargetFrameTime seconds. Full detail is restored when the interaction
+  /// ends. On by default.
+  vtkGetMacro(AutoLevelOfDetail, int);
+  vtkSetMacro(AutoLevelOfDetail, int);
+  vtkBooleanMacro(AutoLevelOfDetail, int);
+
+  /// Time in seconds a frame should take to render during interaction.
+  /// 1/15s by default.
+  vtkGetMacro(TargetFrameTime, double);
+  vtkSetClampMacro(TargetFrameTime, double, 0.001, VTK_DOUBLE_MAX);
+
 protected:
   vtkMRMLTractographyDisplayDisplayableManager();
   ~vtkMRMLTractographyDisplayDisplayableManager();
@@ -64,13 +80,26 @@ protected:
   void DeleteSelectedFibers();
   void ClearSelectedFibers();
   void DeletePickedFibers(vtkMRMLFiberBundleNode *fiberBundleNode, std::vector<vtkIdType> &cellIDs);
+  void UndoDeletePickedFibers();
   void SelectPickedFibers(vtkMRMLFiberBundleNode *fiberBundleNode, std::vector<vtkIdType> &cellIDs);
 
+  /// Set the level of detail of all the fiber bundles, for an interaction
+  /// starting (interacting is true) or ending
+  void UpdateLevelOfDetail(bool interacting);
+
 protected:
 
   int EnableFiberEdit;
   vtkMRMLFiberBundleNode* SelectedFiberBundleNode;
   std::map <vtkIdType, std::vector<double> > SelectedCells;
+  /// Fiber bundles of the deletions that can be undone, last one last
+  std::vector<vtkWeakPointer<vtkMRMLFiberBundleNode> > DeletedFiberBundleNodes;
+
+  int AutoLevelOfDetail;
+  double TargetFrameTime;
+  /// Fiber bundles whose level of detail is lowered by the interaction
+  /// of this view
+  std::vector<vtkWeakPointer<vtkMRMLFiberBundleNode> > LevelOfDetailNodes;
 };
 
 #endif
@@ -17,11 +17,95 @@
 #include "vtkMRMLFiberBundleLineDisplayNode.h"
 #include "vtkMRMLFiberBundleStorageNode.h"
 #include "vtkMRMLFiberBundleTubeDisplayNode.h"
+#include "vtkMRMLMarkupsROINode.h"
 #include "vtkMRMLScene.h"
 #include "vtkSmartPointer.h"
 
+// VTK includes
+#include <vtkAlgorithm.h>
+#include <vtkAlgorithmOutput.h>
+#include <vtkCell.h>
+#include <vtkCellArray.h>
+#include <vtkCellData.h>
+#include <vtkIdList.h>
+#include <vtkPoints.h>
+#include <vtkPolyData.h>
+#include <vtkUnsignedCharArray.h>
+
 // STD includes
+#include <algorithm>
 #include <iostream>
+#include <vector>
+
+namespace
+{
+
+//----------------------------------------------------------------------------
+// Number of points of the fibers of CreateFibers
+const int FiberLength = 10;
+
+//----------------------------------------------------------------------------
+// Polydata of n fibers along z, fiber i at x = i
+vtkSmartPointer<vtkPolyData> CreateFibers(int n)
+{
+  vtkNew<vtkPoints> points;
+  vtkNew<vtkCellArray> lines;
+  for (int i = 0; i < n; i++)
+    {
+    lines->InsertNextCell(FiberLength);
+    for (int j = 0; j < FiberLength; j++)
+      {
+      lines->InsertCellPoint(points->InsertNextPoint(i, 0., j));
+      }
+    }
+  vtkSmartPointer<vtkPolyData> fibers = vtkSmartPointer<vtkPolyData>::New();
+  fibers->SetPoints(points.GetPointer());
+  fibers->SetLines(lines.GetPointer());
+  return fibers;
+}
+
+//----------------------------------------------------------------------------
+// Updated output of the node
+vtkPolyData* GetFilteredOutput(vtkMRMLFiberBundleNode* node)
+{
+  vtkAlgorithmOutput* output = node->GetFilteredMeshConnection();
+  output->GetProducer()->Update();
+  return vtkPolyData::SafeDownCast(output->GetProducer()->GetOutputDataObject(output->GetIndex()));
+}
+
+//----------------------------------------------------------------------------
+// Whether the lines are the first fibers of the shuffled order, with one
+// point out of step and the last point
+bool CheckShuffledFibers(vtkPolyData* lines, vtkIdType numberOfLines,
+                         const std::vector<vtkIdType>& shuffledIds, int step = 1)
+{
+  if (lines->GetNumberOfLines() != numberOfLines)
+    {
+    std::cerr << "Expected " << numberOfLines << " lines, got "
+              << lines->GetNumberOfLines() << std::endl;
+    return false;
+    }
+  const int numberOfPoints = (FiberLength - 1) / step + 1 + ((FiberLength - 1) % step ? 1 : 0);
+  for (vtkIdType i = 0; i < numberOfLines; i++)
+    {
+    vtkCell* cell = lines->GetCell(i);
+    bool same = (cell->GetNumberOfPoints() == numberOfPoints);
+    for (int j = 0; same && j < numberOfPoints; j++)
+      {
+      double* point = lines->GetPoint(cell->GetPointId(j));
+      same = (point[0] == shuffledIds[i] && point[2] == std::min(j * step, FiberLength - 1));
+      }
+    if (!same)
+      {
+      std::cerr << "Line " << i << " is not fiber " << shuffledIds[i]
+                << " with step " << step << std::endl;
+      return false;
+      }
+    }
+  return true;
+}
+
+} // end of anonymous namespace
 
 int vtkMRMLFiberBundleNodeTest1(int argc, char * argv[] )
 {
@@ -35,6 +119,151 @@ int vtkMRMLFiberBundleNodeTest1(int argc, char * argv[] )
   vtkNew<vtkMRMLFiberBundleNode> node1;
   EXERCISE_ALL_BASIC_MRML_METHODS(node1.GetPointer());
 
+  // 3 fibers of 2 points
+  vtkNew<vtkPoints> points;
+  vtkNew<vtkCellArray> lines;
+  for (int i = 0; i < 3; i++)
+    {
+    lines->InsertNextCell(2);
+    lines->InsertCellPoint(points->InsertNextPoint(i, 0., 0.));
+    lines->InsertCellPoint(points->InsertNextPoint(i, 0., 1.));
+    }
+  vtkNew<vtkPolyData> fibers;
+  fibers->SetPoints(points.GetPointer());
+  fibers->SetLines(lines.GetPointer());
+
+  vtkNew<vtkMRMLFiberBundleNode> node2;
+  node2->SetAndObservePolyData(fibers.GetPointer());
+  vtkNew<vtkIdList> fiberIds;
+  fiberIds->InsertNextId(1);
+  node2->DeleteFibers(fiberIds.GetPointer());
+  CHECK_INT(node2->GetNumberOfDeletedFibers(), 1);
+  CHECK_BOOL(node2->IsFiberDeleted(1), true);
+  CHECK_BOOL(node2->IsFiberDeleted(0), false);
+  // deleted fibers are kept until they are removed
+  CHECK_INT(node2->GetPolyData()->GetNumberOfLines(), 3);
+
+  CHECK_BOOL(node2->UndoDeleteFibers(), true);
+  CHECK_INT(node2->GetNumberOfDeletedFibers(), 0);
+  CHECK_BOOL(node2->UndoDeleteFibers(), false);
+
+  // a compacted copy leaves the node and its deletions unchanged
+  node2->DeleteFibers(fiberIds.GetPointer());
+  vtkNew<vtkPolyData> compacted;
+  node2->GetCompactedPolyData(compacted.GetPointer());
+  CHECK_INT(compacted->GetNumberOfLines(), 2);
+  CHECK_DOUBLE(compacted->GetPoint(compacted->GetCell(1)->GetPointId(0))[0], 2.);
+  CHECK_POINTER(node2->GetPolyData(), fibers.GetPointer());
+  CHECK_INT(node2->GetNumberOfDeletedFibers(), 1);
+
+  // deleted fibers stay hidden in markups selection
+  vtkNew<vtkMRMLScene> roiScene;
+  roiScene->AddNode(node2.GetPointer());
+  vtkNew<vtkMRMLMarkupsROINode> roiNode;
+  roiScene->AddNode(roiNode.GetPointer());
+  roiNode->SetCenter(1., 0., 0.5);
+  roiNode->SetSize(4., 2., 2.);
+  node2->SetAndObserveMarkupsNodeID(roiNode->GetID());
+  node2->SetSelectWithMarkups(true);
+  vtkPolyData* selected = GetFilteredOutput(node2.GetPointer());
+  CHECK_INT(selected->GetNumberOfLines(), 3);
+  vtkUnsignedCharArray* selectedGhosts = selected->GetCellGhostArray();
+  CHECK_NOT_NULL(selectedGhosts);
+  for (vtkIdType i = 0; i < selected->GetNumberOfCells(); i++)
+    {
+    bool isFiber1 = (selected->GetPoint(selected->GetCell(i)->GetPointId(0))[0] == 1.);
+    CHECK_BOOL((selectedGhosts->GetValue(i) & vtkDataSetAttributes::HIDDENCELL) != 0, isFiber1);
+    }
+  // the polydata of the node is not modified
+  CHECK_NULL(fibers->GetCellGhostArray());
+
+  CHECK_BOOL(node2->UndoDeleteFibers(), true);
+  CHECK_NULL(GetFilteredOutput(node2.GetPointer())->GetCellGhostArray());
+  node2->SetSelectWithMarkups(false);
+
+  node2->DeleteFibers(fiberIds.GetPointer());
+  node2->RemoveDeletedFibers();
+  CHECK_INT(node2->GetPolyData()->GetNumberOfLines(), 2);
+  CHECK_INT(node2->GetNumberOfDeletedFibers(), 0);
+  CHECK_DOUBLE(node2->GetPolyData()->GetPoint(
+    node2->GetPolyData()->GetCell(1)->GetPointId(0))[0], 2.);
+
+  // Subsampling shows the first floor(ratio * n) fibers of the shuffled order
+  vtkSmartPointer<vtkMRMLFiberBundleNode> node3 = vtkSmartPointer<vtkMRMLFiberBundleNode>::New();
+  node3->SetAndObservePolyData(CreateFibers(100));
+  std::vector<vtkIdType> shuffledIds;
+  for (vtkIdType i = 0; i < 100; i++)
+    {
+    shuffledIds.push_back(node3->GetUnShuffledFiberID(i));
+    }
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node3), 100, shuffledIds), true);
+  node3->SetSubsamplingRatio(0.25);
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node3), 25, shuffledIds), true);
+
+  // Copies of an output are not changed by the next subsamplings,
+  // the deletions, or the deletion of the node
+  vtkNew<vtkPolyData> subsampled;
+  subsampled->ShallowCopy(GetFilteredOutput(node3));
+  node3->SetSubsamplingRatio(0.5);
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node3), 50, shuffledIds), true);
+  node3->SetSubsamplingRatio(0.2);
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node3), 20, shuffledIds), true);
+
+  fiberIds->Reset();
+  fiberIds->InsertNextId(shuffledIds[0]);
+  node3->DeleteFibers(fiberIds.GetPointer());
+  vtkNew<vtkPolyData> deleted;
+  deleted->ShallowCopy(GetFilteredOutput(node3));
+  vtkUnsignedCharArray* ghosts = vtkUnsignedCharArray::SafeDownCast(
+    deleted->GetCellData()->GetArray(vtkDataSetAttributes::GhostArrayName()));
+  CHECK_NOT_NULL(ghosts);
+  CHECK_INT(ghosts->GetValue(0), vtkDataSetAttributes::HIDDENCELL);
+  CHECK_INT(ghosts->GetValue(1), 0);
+  CHECK_BOOL(node3->UndoDeleteFibers(), true);
+  CHECK_INT(ghosts->GetValue(0), vtkDataSetAttributes::HIDDENCELL);
+
+  node3 = NULL;
+  CHECK_BOOL(CheckShuffledFibers(subsampled.GetPointer(), 25, shuffledIds), true);
+  CHECK_BOOL(CheckShuffledFibers(deleted.GetPointer(), 20, shuffledIds), true);
+  CHECK_INT(ghosts->GetValue(0), vtkDataSetAttributes::HIDDENCELL);
+
+  // The level of detail shows a fraction of the subsampled fibers, with
+  // all their points or one point out of the point step
+  vtkNew<vtkMRMLFiberBundleNode> node4;
+  node4->SetAndObservePolyData(CreateFibers(100));
+  shuffledIds.clear();
+  for (vtkIdType i = 0; i < 100; i++)
+    {
+    shuffledIds.push_back(node4->GetUnShuffledFiberID(i));
+    }
+  node4->SetSubsamplingRatio(0.5);
+  CHECK_INT(node4->GetLevelOfDetailPointStep(), 4);
+  node4->SetLevelOfDetail(0.5, false);
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node4.GetPointer()), 25, shuffledIds), true);
+  node4->SetLevelOfDetail(0.5, true);
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node4.GetPointer()), 25, shuffledIds, 4), true);
+  CHECK_DOUBLE(node4->GetLevelOfDetailCost(), 0.125);
+  node4->SetLevelOfDetailPointStep(3);
+  node4->SetLevelOfDetail(1., true);
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node4.GetPointer()), 50, shuffledIds, 3), true);
+  node4->SetLevelOfDetail(1., false);
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node4.GetPointer()), 50, shuffledIds), true);
+  CHECK_DOUBLE(node4->GetLevelOfDetailCost(), 1.);
+
+  // The coarser level of detail of the interacting views is kept until
+  // the last interaction ends
+  node4->StartLevelOfDetailInteraction(0.2, true);
+  node4->StartLevelOfDetailInteraction(0.5, false);
+  CHECK_INT(node4->GetNumberOfLevelOfDetailInteractions(), 2);
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node4.GetPointer()), 10, shuffledIds, 3), true);
+  node4->EndLevelOfDetailInteraction();
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node4.GetPointer()), 10, shuffledIds, 3), true);
+  node4->EndLevelOfDetailInteraction();
+  CHECK_INT(node4->GetNumberOfLevelOfDetailInteractions(), 0);
+  CHECK_BOOL(CheckShuffledFibers(GetFilteredOutput(node4.GetPointer()), 50, shuffledIds), true);
+  node4->EndLevelOfDetailInteraction();
+  CHECK_INT(node4->GetNumberOfLevelOfDetailInteractions(), 0);
+
   const char* sceneFilePath = argv[1];
   vtkNew<vtkMRMLScene> scene;
   scene->RegisterNodeClass(vtkSmartPointer<vtkMRMLCommandLineModuleNode>::New());
@@ -13,10 +13,115 @@
 #include "vtkMRMLCoreTestingMacros.h"
 #include "vtkMRMLFiberBundleTubeDisplayNode.h"
 
+// VTK includes
+#include <vtkCallbackCommand.h>
+#include <vtkCellArray.h>
+#include <vtkPoints.h>
+#include <vtkPolyData.h>
+#include <vtkSmartPointer.h>
+#include <vtkTrivialProducer.h>
+
+// STD includes
+#include <chrono>
+#include <thread>
+
+namespace
+{
+
+//----------------------------------------------------------------------------
+// Count the events
+void CountEvent(vtkObject* vtkNotUsed(caller), unsigned long vtkNotUsed(eventId),
+                void* clientData, void* vtkNotUsed(callData))
+{
+  ++*reinterpret_cast<int*>(clientData);
+}
+
+} // end of anonymous namespace
+
 int vtkMRMLFiberBundleTubeDisplayNodeTest1(int , char * [] )
 {
   vtkNew<vtkMRMLFiberBundleTubeDisplayNode> node1;
   // exercising the display mrml methods fails on the ScalarVisibility boolean test
   CHECK_EXIT_SUCCESS(vtkMRMLCoreTestingUtilities::ExerciseBasicMRMLMethods(node1.GetPointer()));
+
+  // 3 straight fibers of 4 points
+  vtkNew<vtkPoints> points;
+  vtkNew<vtkCellArray> lines;
+  for (int i = 0; i < 3; i++)
+    {
+    lines->InsertNextCell(4);
+    for (int j = 0; j < 4; j++)
+      {
+      lines->InsertCellPoint(points->InsertNextPoint(i, 0., j));
+      }
+    }
+  vtkNew<vtkPolyData> fibers;
+  fibers->SetPoints(points.GetPointer());
+  fibers->SetLines(lines.GetPointer());
+  vtkNew<vtkTrivialProducer> producer;
+  producer->SetOutput(fibers.GetPointer());
+
+  vtkNew<vtkMRMLFiberBundleTubeDisplayNode> node2;
+  node2->SetColorMode(vtkMRMLFiberBundleDisplayNode::colorModeScalarData);
+  node2->SetTubeNumberOfSides(6);
+  node2->SetInputMeshConnection(producer->GetOutputPort());
+  CHECK_INT(node2->GetOutputMesh()->GetNumberOfStrips(), 3 * 6);
+  CHECK_BOOL(node2->GetTubesPending(), false);
+  vtkSmartPointer<vtkPoints> tubePoints = node2->GetOutputMesh()->GetPoints();
+
+  node2->SetTubeRadius(1.);
+  node2->UpdateAssignedAttribute();
+  vtkSmartPointer<vtkPoints> radiusPoints = node2->GetOutputMesh()->GetPoints();
+  CHECK_BOOL(radiusPoints != tubePoints, true);
+
+  // the tubes are cached for each radius
+  producer->Modified();
+  CHECK_POINTER(node2->GetOutputMesh()->GetPoints(), radiusPoints.GetPointer());
+  node2->SetTubeRadius(0.5);
+  node2->UpdateAssignedAttribute();
+  CHECK_POINTER(node2->GetOutputMesh()->GetPoints(), tubePoints.GetPointer());
+
+  // and for each level of detail of the lines
+  vtkNew<vtkCellArray> fewerLines;
+  for (int i = 0; i < 2; i++)
+    {
+    fewerLines->InsertNextCell(4);
+    for (int j = 0; j < 4; j++)
+      {
+      fewerLines->InsertCellPoint(i * 4 + j);
+      }
+    }
+  fibers->SetLines(fewerLines.GetPointer());
+  producer->Modified();
+  CHECK_INT(node2->GetOutputMesh()->GetNumberOfStrips(), 2 * 6);
+  fibers->SetLines(lines.GetPointer());
+  producer->Modified();
+  CHECK_POINTER(node2->GetOutputMesh()->GetPoints(), tubePoints.GetPointer());
+
+  // tubes generated in the background are signaled, and displayed once
+  // they are processed
+  int numberOfPendingEvents = 0;
+  vtkNew<vtkCallbackCommand> countEvent;
+  countEvent->SetCallback(CountEvent);
+  countEvent->SetClientData(&numberOfPendingEvents);
+  node2->AddObserver(vtkMRMLFiberBundleTubeDisplayNode::TubesPendingEvent, countEvent.GetPointer());
+  node2->BackgroundTubesOn();
+  node2->SetTubeRadius(2.);
+  node2->UpdateAssignedAttribute();
+  CHECK_INT(node2->GetOutputMesh()->GetNumberOfStrips(), 0);
+  CHECK_INT(node2->GetOutputMesh()->GetNumberOfLines(), 3);
+  CHECK_BOOL(node2->GetTubesPending(), true);
+  CHECK_INT(numberOfPendingEvents, 1);
+  bool processed = false;
+  for (int i = 0; i < 6000 && !processed; i++)
+    {
+    processed = node2->ProcessBackgroundTubes();
+    std::this_thread::sleep_for(std::chrono::milliseconds(10));
+    }
+  CHECK_BOOL(processed, true);
+  CHECK_INT(node2->GetOutputMesh()->GetNumberOfStrips(), 3 * 6);
+  CHECK_BOOL(node2->GetTubesPending(), false);
+  CHECK_INT(numberOfPendingEvents, 1);
+
   return EXIT_SUCCESS;
 }
@@ -18,7 +18,11 @@
 
 ==============================================================================*/
 
+// Qt includes
+#include <QTimer>
+
 // Slicer includes
+#include <qSlicerApplication.h>
 #include <qSlicerCoreApplication.h>
 #include <qSlicerCoreIOManager.h>
 #include <qSlicerNodeWriter.h>
@@ -39,10 +43,32 @@
 #include <vtkAutoInit.h>
 VTK_MODULE_INIT(vtkTractographyDisplayMRMLDM)
 
+//-----------------------------------------------------------------------------
+class qSlicerTractographyDisplayModulePrivate
+{
+public:
+  qSlicerTractographyDisplayModulePrivate();
+
+  /// Polls the tubes generated in the background while some are pending
+  QTimer* TubesTimer;
+};
+
+//-----------------------------------------------------------------------------
+qSlicerTractographyDisplayModulePrivate::qSlicerTractographyDisplayModulePrivate()
+{
+  this->TubesTimer = 0;
+}
+
 //-----------------------------------------------------------------------------
 qSlicerTractographyDisplayModule::
 qSlicerTractographyDisplayModule(QObject* _parent)
   : Superclass(_parent)
+  , d_ptr(new qSlicerTractographyDisplayModulePrivate)
+{
+}
+
+//-----------------------------------------------------------------------------
+qSlicerTractographyDisplayModule::~qSlicerTractographyDisplayModule()
 {
 }
 
@@ -64,6 +90,35 @@ void qSlicerTractographyDisplayModule::setup()
   coreIOManager->registerIO(new qSlicerNodeWriter(
     "FiberBundles", QString("FiberBundleFile"),
     QStringList() << "vtkMRMLFiberBundleNode", true, this));
+
+  // Without event loop the tubes are generated before returning
+  if (!fiberBundleLogic || !qSlicerApplication::application())
+    {
+    return;
+    }
+  Q_D(qSlicerTractographyDisplayModule);
+  fiberBundleLogic->BackgroundTubesOn();
+  d->TubesTimer = new QTimer(this);
+  d->TubesTimer->setInterval(100);
+  QObject::connect(d->TubesTimer, SIGNAL(timeout()), this, SLOT(processBackgroundTubes()));
+  this->qvtkConnect(fiberBundleLogic, vtkSlicerFiberBundleLogic::BackgroundTubesPendingEvent,
+                    d->TubesTimer, SLOT(start()));
+}
+
+//-----------------------------------------------------------------------------
+void qSlicerTractographyDisplayModule::processBackgroundTubes()
+{
+  vtkSlicerFiberBundleLogic* fiberBundleLogic =
+    vtkSlicerFiberBundleLogic::SafeDownCast(this->logic());
+  Q_D(qSlicerTractographyDisplayModule);
+  if (fiberBundleLogic)
+    {
+    fiberBundleLogic->ProcessBackgroundTubes();
+    }
+  if (!fiberBundleLogic || !fiberBundleLogic->GetBackgroundTubesPending())
+    {
+    d->TubesTimer->stop();
+    }
 }
 
 //-----------------------------------------------------------------------------
@@ -23,6 +23,7 @@
 
 // CTK includes
 #include <ctkPimpl.h>
+#include <ctkVTKObject.h>
 
 /// SlicerQT includes
 #include "qSlicerLoadableModule.h"
@@ -36,12 +37,14 @@ class Q_SLICER_QTMODULES_TRACTOGRAPHYDISPLAY_EXPORT qSlicerTractographyDisplayMo
   :public qSlicerLoadableModule
 {
   Q_OBJECT
+  QVTK_OBJECT
   Q_PLUGIN_METADATA(IID "org.slicer.modules.loadable.qSlicerLoadableModule/1.0");
   Q_INTERFACES(qSlicerLoadableModule);
 public:
   typedef qSlicerLoadableModule Superclass;
 
   qSlicerTractographyDisplayModule(QObject *_parent = 0);
+  virtual ~qSlicerTractographyDisplayModule();
 
   /// Categories of the module
   virtual QStringList categories() const override;
@@ -55,9 +58,17 @@ public:
   /// Specify editable node types
   virtual QStringList associatedNodeTypes() const override;
 
+protected slots:
+  /// Show the tubes generated in the background, and stop polling when
+  /// none is pending
+  void processBackgroundTubes();
 
 protected:
-  /// Initialize the module. Register the volumes reader/writer
+  QScopedPointer<qSlicerTractographyDisplayModulePrivate> d_ptr;
+
+  /// Initialize the module. Register the volumes reader/writer, and
+  /// generate the tubes in the background, polled by a timer while tubes
+  /// are pending
   virtual void setup() override;
 
   /// Create and return a widget representation of the object
@@ -65,6 +76,10 @@ protected:
 
   /// Create and return the logic associated to this module
   virtual vtkMRMLAbstractLogic* createLogic() override;
+
+private:
+  Q_DECLARE_PRIVATE(qSlicerTractographyDisplayModule);
+  Q_DISABLE_COPY(qSlicerTractographyDisplayModule);
 };
 #endif
 
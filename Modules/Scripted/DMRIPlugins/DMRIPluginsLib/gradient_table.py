@@ -0,0 +1,162 @@
+"""Diffusion gradient tables shared by the SlicerDMRI readers and CLIs.
+
+b-values and gradient directions are handled as whole NumPy arrays: parsed
+from FSL .bval/.bvec files or read from a vtkMRMLDiffusionWeightedVolumeNode,
+normalized and validated in vectorized form, and pushed back to a node with a
+single array call per table.
+"""
+
+import logging
+
+import numpy as np
+
+__all__ = ['GradientTable', 'read_bvals', 'read_bvecs', 'detect_shells']
+
+
+def read_bvals(path):
+  """Read an FSL .bval file (whitespace separated values) as a 1D array."""
+  return np.loadtxt(path, dtype=np.float64, ndmin=1).ravel()
+
+
+def read_bvecs(path):
+  """Read an FSL .bvec file as an (N, 3) array.
+
+  FSL stores one row per axis (3 x N); files with one row per direction
+  (N x 3) are accepted as well.
+  """
+  bvecs = np.loadtxt(path, dtype=np.float64, ndmin=2)
+  if bvecs.shape[0] == 3:
+    return np.ascontiguousarray(bvecs.T)
+  if bvecs.shape[1] == 3:
+    return bvecs
+  raise ValueError(f"{path}: expected 3 rows or 3 columns, got shape {bvecs.shape}")
+
+
+def detect_shells(bvals, tolerance=50.0, iterations=10):
+  """Group b-values into shells.
+
+  b-values are sorted and split wherever two consecutive values differ by
+  more than tolerance. The resulting groups seed a 1D k-means that moves
+  values to the nearest shell mean for at most iterations rounds. Returns
+  the mean b-value of each shell in increasing order and, for every input
+  b-value, the index of its shell.
+  """
+  bvals = np.asarray(bvals, dtype=np.float64)
+  if bvals.size == 0:
+    return np.zeros(0), np.zeros(0, dtype=int)
+  order = np.argsort(bvals, kind='stable')
+  sortedBvals = bvals[order]
+  starts = np.concatenate(([0], np.flatnonzero(np.diff(sortedBvals) > tolerance) + 1))
+  counts = np.diff(np.append(starts, bvals.size))
+  centers = np.add.reduceat(sortedBvals, starts) / counts
+  labels = np.empty(bvals.size, dtype=int)
+  labels[order] = np.repeat(np.arange(starts.size), counts)
+
+  for iteration in range(iterations):
+    newLabels = np.argmin(np.abs(bvals[:, np.newaxis] - centers[np.newaxis, :]), axis=1)
+    if np.array_equal(newLabels, labels):
+      break
+    labels = newLabels
+    counts = np.bincount(labels, minlength=centers.size)
+    # Drop shells that lost all their values and renumber the others
+    kept = np.flatnonzero(counts)
+    centers = np.bincount(labels, weights=bvals, minlength=centers.size)[kept] / counts[kept]
+    labels = np.searchsorted(kept, labels)
+  return centers, labels
+
+
+class GradientTable(object):
+  """b-values and unit gradient directions of a DWI.
+
+  bvals is an (N,) array and gradients an (N, 3) array. norms keeps the
+  length each gradient had before normalization. unitGradients tells
+  whether the source format requires unit directions (FSL .bvec); NRRD and
+  DWI nodes scale the b-value by the squared gradient length instead.
+  """
+
+  def __init__(self, bvals, gradients, unitGradients=False):
+    bvals = np.asarray(bvals, dtype=np.float64).ravel()
+    gradients = np.asarray(gradients, dtype=np.float64).reshape(-1, 3)
+    if bvals.shape[0] != gradients.shape[0]:
+      raise ValueError(f"{bvals.shape[0]} b-values but {gradients.shape[0]} gradient directions")
+    if not (np.all(np.isfinite(bvals)) and np.all(np.isfinite(gradients))):
+      raise ValueError("Gradient table contains non-finite values")
+    if np.any(bvals < 0):
+      raise ValueError("Gradient table contains negative b-values")
+    self.bvals = bvals
+    self.unitGradients = unitGradients
+    self.norms = np.linalg.norm(gradients, axis=1)
+    self.gradients = gradients.copy()
+    nonzero = self.norms > 1e-6
+    self.gradients[nonzero] /= self.norms[nonzero, np.newaxis]
+
+  def __len__(self):
+    return self.bvals.shape[0]
+
+  @classmethod
+  def from_files(cls, bvalPath, bvecPath):
+    """Create a table from FSL .bval and .bvec files."""
+    return cls(read_bvals(bvalPath), read_bvecs(bvecPath), unitGradients=True)
+
+  @classmethod
+  def from_node(cls, diffusionNode):
+    """Create a table from the b-values and gradients of a DWI node."""
+    from vtk.util.numpy_support import vtk_to_numpy
+    return cls(vtk_to_numpy(diffusionNode.GetBValues()),
+               vtk_to_numpy(diffusionNode.GetDiffusionGradients()))
+
+  def subset(self, indices):
+    """Return a new table with the given volumes, in the given order."""
+    table = GradientTable.__new__(GradientTable)
+    table.bvals = self.bvals[indices]
+    table.unitGradients = self.unitGradients
+    table.norms = self.norms[indices]
+    table.gradients = self.gradients[indices]
+    return table
+
+  def shells(self, tolerance=50.0):
+    """Return shell b-values and per-volume shell labels, see detect_shells."""
+    return detect_shells(self.bvals, tolerance)
+
+  def validate(self, numberOfVolumes=None, b0Threshold=50.0, shellTolerance=50.0, normTolerance=1e-2):
+    """Check the table for common acquisition and file format problems.
+
+    Raises ValueError if the table does not match numberOfVolumes. Returns a
+    list of warnings (also logged) for diffusion weighted volumes without a
+    direction, for directions repeated within a shell and, if the source
+    format requires unit directions, for non unit directions.
+    """
+    if numberOfVolumes is not None and len(self) != numberOfVolumes:
+      raise ValueError(f"Gradient table has {len(self)} entries but the image has {numberOfVolumes} volumes")
+
+    warnings = []
+    weighted = self.bvals > b0Threshold
+    missing = np.flatnonzero(weighted & (self.norms <= 1e-6))
+    if missing.size:
+      warnings.append(f"Diffusion weighted volumes without gradient direction: {missing.tolist()}")
+    if self.unitGradients:
+      nonUnit = np.flatnonzero(weighted & (self.norms > 1e-6) & (np.abs(self.norms - 1.0) > normTolerance))
+      if nonUnit.size:
+        warnings.append(f"{nonUnit.size} gradient directions are not unit length and were normalized")
+
+    centers, labels = self.shells(shellTolerance)
+    for shell, center in enumerate(centers):
+      if center <= b0Threshold:
+        continue
+      directions = self.gradients[(labels == shell) & (self.norms > 1e-6)]
+      # Antipodal directions are equivalent for diffusion
+      alignment = np.abs(directions @ directions.T)
+      duplicates = np.count_nonzero(np.triu(alignment > 1.0 - 1e-6, k=1))
+      if duplicates:
+        warnings.append(f"Shell b={center:g} has {duplicates} repeated gradient directions")
+
+    for warning in warnings:
+      logging.warning(warning)
+    return warnings
+
+  def apply_to_node(self, diffusionNode):
+    """Set the b-values and gradients of a DWI node in one call each."""
+    from vtk.util.numpy_support import numpy_to_vtk
+    diffusionNode.SetNumberOfGradients(len(self))
+    diffusionNode.SetBValues(numpy_to_vtk(self.bvals, deep=1))
+    diffusionNode.SetDiffusionGradients(numpy_to_vtk(self.gradients, deep=1))
@@ -12,7 +12,10 @@ class NIfTIFile(ScriptedLoadableModule):
     parent.dependencies = []
     parent.contributors = ["Steve Pieper (Isomics)", ]
     parent.helpText = '''
-    This module is used to implement diffusion nifti reading and writing using the conversion tool from PNL at BWH.
+    This module is used to implement diffusion nifti reading and writing of .nii.gz files with
+    FSL style .bval and .bvec files next to them. Voxels are read with nibabel in their stored
+    data type. Gradient directions are normalized to unit length when loaded, their original
+    length is not used as a b-value scale.
     '''
     parent.acknowledgementText = '''
     Thanks to:
@@ -25,9 +28,205 @@ class NIfTIFile(ScriptedLoadableModule):
 
 def _NIfTIFileInstallPackage():
   try:
-    import conversion
+    import nibabel
   except ModuleNotFoundError:
-    slicer.util.pip_install("https://github.com/pnlbwh/conversion/archive/refs/tags/v2.4.zip")
+    slicer.util.pip_install("nibabel")
+
+
+def _NIfTIFileOpenGzip(filePath):
+  """Open a gzip compressed file for reading.
+
+  When the indexed_gzip package is available the file is opened with it and
+  a seek index cached next to the file (filePath + '.gzidx') is imported, so
+  that repeated loads and reads of a subset of volumes are random access.
+  Returns the file object and the path the index should be (re)written to
+  once the file has been read, which is None if no index is used or if the
+  cached index was imported.
+  """
+  import gzip
+  try:
+    import indexed_gzip
+  except ImportError:
+    return gzip.open(filePath, 'rb'), None
+
+  indexPath = filePath + '.gzidx'
+  gzipFile = indexed_gzip.IndexedGzipFile(filePath)
+  if os.path.exists(indexPath) and os.path.getmtime(indexPath) >= os.path.getmtime(filePath):
+    try:
+      gzipFile.import_index(indexPath)
+      return gzipFile, None
+    except Exception as e:
+      logging.warning(f'Ignoring invalid gzip index {indexPath}: {e}')
+  # Missing, stale or invalid index
+  return gzipFile, indexPath
+
+
+def _NIfTIFileIterGzipVolumes(filePath, niftiImage, volumeIndices=None):
+  """Decompress a 4D .nii.gz file one 3D volume at a time.
+
+  Yields (volumeIndex, volume) pairs in increasing volume order, where volume
+  is a [k, j, i] array in the stored data type. Only the requested volumes
+  (all by default) are decoded. The array is a view of a buffer that is
+  reused for the next volume, so it has to be copied before advancing.
+  """
+  import numpy
+
+  shape = niftiImage.shape
+  header = niftiImage.header
+  dtype = header.get_data_dtype()
+  dataOffset = int(header.get_data_offset())
+  bytesPerVolume = int(numpy.prod(shape[:3])) * dtype.itemsize
+  if volumeIndices is None:
+    volumeIndices = range(shape[3])
+
+  buffer = bytearray(bytesPerVolume)
+  view = memoryview(buffer)
+  # NIfTI voxels are stored with i varying fastest, so a volume read in
+  # C order with reversed dimensions is directly indexed [k, j, i]
+  volume = numpy.frombuffer(buffer, dtype=dtype).reshape(shape[2], shape[1], shape[0])
+
+  gzipFile, indexPath = _NIfTIFileOpenGzip(filePath)
+  try:
+    for volumeIndex in sorted(volumeIndices):
+      gzipFile.seek(dataOffset + volumeIndex * bytesPerVolume)
+      bytesRead = 0
+      while bytesRead < bytesPerVolume:
+        count = gzipFile.readinto(view[bytesRead:])
+        if not count:
+          raise EOFError(f'{filePath} ended while reading volume {volumeIndex}')
+        bytesRead += count
+      yield volumeIndex, volume
+    if indexPath:
+      try:
+        gzipFile.export_index(indexPath)
+      except Exception as e:
+        logging.warning(f'Could not write gzip index {indexPath}: {e}')
+  finally:
+    gzipFile.close()
+
+
+def _NIfTIFileReadDiffusionImage(niftiImage, diffusionNode, filePath, progressCallback=None):
+  """Fill the image data of diffusionNode from the 4D .nii.gz file filePath,
+  loaded as niftiImage by nibabel.
+
+  Voxels are read one gradient volume at a time in their stored data type
+  and copied straight into the vtkImageData scalars, so no float64 or
+  transposed copy of the whole 4D array is made. The data is only converted
+  to float32 when the header defines scl_slope/scl_inter.
+
+  The gzip stream is decoded sequentially and each volume is copied as soon
+  as it is complete. progressCallback, if given, is called with the fraction
+  of volumes loaded after each volume.
+  """
+  import numpy
+  from vtk.util import numpy_support
+
+  shape = niftiImage.shape
+  if len(shape) != 4:
+    raise ValueError(f"Expected a 4D diffusion image, got shape {shape}")
+
+  slope, inter = niftiImage.header.get_slope_inter()
+  scaled = (slope is not None and slope != 1) or (inter is not None and inter != 0)
+  if scaled:
+    dtype = numpy.dtype(numpy.float32)
+  else:
+    dtype = niftiImage.get_data_dtype().newbyteorder('=')
+
+  diffusionImage = vtk.vtkImageData()
+  diffusionImage.SetDimensions(shape[0], shape[1], shape[2])
+  diffusionImage.AllocateScalars(numpy_support.get_vtk_array_type(dtype), shape[3])
+  diffusionNode.SetAndObserveImageData(diffusionImage)
+
+  # Array is indexed [k, j, i, gradient], NIfTI volumes are [i, j, k]
+  nodeArray = slicer.util.arrayFromVolume(diffusionNode)
+  if scaled:
+    slope = numpy.float32(1 if slope is None else slope)
+    inter = numpy.float32(0 if inter is None else inter)
+
+  for volumeIndex, volume in _NIfTIFileIterGzipVolumes(filePath, niftiImage):
+    if scaled:
+      nodeArray[..., volumeIndex] = volume * slope + inter
+    else:
+      nodeArray[..., volumeIndex] = volume
+    if progressCallback:
+      progressCallback((volumeIndex + 1) / shape[3])
+  slicer.util.arrayFromVolumeModified(diffusionNode)
+
+
+def _NIfTIFileOpenGzipForWriting(filePath):
+  """Open a gzip file for writing, using multithreaded block compression
+  when the mgzip package is available."""
+  import gzip
+  try:
+    import mgzip
+  except ImportError:
+    return gzip.open(filePath, 'wb', compresslevel=6)
+  return mgzip.open(filePath, 'wb', compresslevel=6)
+
+
+def _NIfTIFileWriteDiffusionImage(diffusionNode, filePath, progressCallback=None):
+  """Write the image data of diffusionNode as a 4D NIfTI file.
+
+  The header uses the IJK to RAS matrix of the node as affine (as the reader
+  assumes) and the stored data type of the image. Gradient volumes are
+  streamed to the (compressed) file one at a time, so only one 3D volume is
+  copied at any moment.
+  """
+  import nibabel
+  import numpy
+
+  nodeArray = slicer.util.arrayFromVolume(diffusionNode)
+  if nodeArray.ndim != 4:
+    raise ValueError(f"Expected a diffusion weighted volume, got shape {nodeArray.shape}")
+  # Array is indexed [k, j, i, gradient], NIfTI volumes are [i, j, k]
+  shape = nodeArray.shape[2::-1] + nodeArray.shape[3:]
+
+  ijkToRAS = vtk.vtkMatrix4x4()
+  diffusionNode.GetIJKToRASMatrix(ijkToRAS)
+  affine = numpy.array([[ijkToRAS.GetElement(row, column) for column in range(4)] for row in range(4)])
+
+  header = nibabel.Nifti1Header()
+  header.set_data_shape(shape)
+  header.set_data_dtype(nodeArray.dtype)
+  header.set_qform(affine, code=1)
+  header.set_sform(affine, code=1)
+  header.set_xyzt_units('mm')
+
+  if filePath.endswith('.gz'):
+    outputFile = _NIfTIFileOpenGzipForWriting(filePath)
+  else:
+    outputFile = open(filePath, 'wb')
+  with outputFile:
+    header.write_to(outputFile)
+    for volumeIndex in range(shape[3]):
+      # C order of a [k, j, i] volume is the NIfTI voxel order
+      outputFile.write(numpy.ascontiguousarray(nodeArray[..., volumeIndex]).tobytes())
+      if progressCallback:
+        progressCallback((volumeIndex + 1) / shape[3])
+
+
+def _NIfTIFileWriteGradients(diffusionNode, bvalPath, bvecPath):
+  """Write the b-values and gradient directions of diffusionNode in FSL
+  format.
+
+  Gradients are rotated to RAS by the measurement frame of the node and
+  then expressed in the frame the reader assigns to .bvec files
+  (diag(-1, -1, 1)), so that a written file loads back unchanged.
+  """
+  import numpy
+  from vtk.util.numpy_support import vtk_to_numpy
+
+  bvals = vtk_to_numpy(diffusionNode.GetBValues())
+  gradients = vtk_to_numpy(diffusionNode.GetDiffusionGradients()).reshape(-1, 3)
+
+  measurementFrame = vtk.vtkMatrix4x4()
+  diffusionNode.GetMeasurementFrameMatrix(measurementFrame)
+  rasFromMeasurement = numpy.array([[measurementFrame.GetElement(row, column) for column in range(3)] for row in range(3)])
+  bvecFromRAS = numpy.diag([-1.0, -1.0, 1.0])
+  bvecs = gradients @ (bvecFromRAS @ rasFromMeasurement).T
+
+  numpy.savetxt(bvalPath, bvals[numpy.newaxis], fmt='%g')
+  numpy.savetxt(bvecPath, bvecs.T, fmt='%.8f')
 
 
 class NIfTIFileWidget(ScriptedLoadableModuleWidget):
@@ -57,6 +256,9 @@ class NIfTIFileFileReader(object):
 
   def load(self, properties):
     """
+    Gradient directions read from the .bvec file are normalized to unit
+    length, see GradientTable.
+
     uses properties:
         fileName - path to the .nii.gz file
         name (optional) - name for the loaded node
@@ -66,10 +268,8 @@ class NIfTIFileFileReader(object):
     try:
 
       _NIfTIFileInstallPackage()
-      import conversion
       import nibabel
-      import numpy
-
+      from DMRIPluginsLib import GradientTable
 
       filePath = properties['fileName']
 
@@ -95,30 +295,22 @@ class NIfTIFileFileReader(object):
           ijkToRAS.SetElement(row, column, affine[row][column])
       diffusionNode.SetIJKToRASMatrix(ijkToRAS)
 
-      fdata = niftiImage.get_fdata()
-      diffusionArray = numpy.transpose(fdata, axes=[2,1,0,3])
-
-      diffusionImage = vtk.vtkImageData()
-      dshape = diffusionArray.shape
-      diffusionImage.SetDimensions(dshape[2],dshape[1],dshape[0])
-      diffusionImage.AllocateScalars(vtk.VTK_FLOAT, dshape[3])
-      diffusionNode.SetAndObserveImageData(diffusionImage)
-
-      nodeArray = slicer.util.arrayFromVolume(diffusionNode)
-      nodeArray[:] = diffusionArray
-      slicer.util.arrayFromVolumeModified(diffusionNode)
-
+      progressDialog = slicer.util.createProgressDialog(
+        labelText=f'Loading {baseName}...', value=0, maximum=100)
+      def updateProgress(fraction):
+        progressDialog.setValue(int(fraction * 100))
+        slicer.app.processEvents()
+      try:
+        _NIfTIFileReadDiffusionImage(niftiImage, diffusionNode, filePath, updateProgress)
+      finally:
+        progressDialog.close()
 
       pathBase = filePath[:-len(".nii.gz")]
       bvalPath = f"{pathBase}.bval"
       bvecPath = f"{pathBase}.bvec"
-      bval = conversion.bval_bvec_io.read_bvals(bvalPath)
-      bvec = conversion.bval_bvec_io.read_bvecs(bvecPath)
-
-      diffusionNode.SetNumberOfGradients(len(bval))
-      for index in range(len(bval)):
-        diffusionNode.SetBValue(index, bval[index])
-        diffusionNode.SetDiffusionGradient(index, bvec[index])
+      gradientTable = GradientTable.from_files(bvalPath, bvecPath)
+      gradientTable.validate(numberOfVolumes=niftiImage.shape[3])
+      gradientTable.apply_to_node(diffusionNode)
 
       diffusionNode.CreateDefaultDisplayNodes()
 
@@ -149,14 +341,41 @@ class NIfTIFileFileWriter(object):
     return ['NIfTI (*.nii.gz)']
 
   def canWriteObject(self, obj):
-    # Only enable this writer in testing mode
-    if not slicer.app.testingEnabled():
-      return False
-
     return bool(obj.IsA("vtkMRMLDiffusionWeightedVolumeNode"))
 
   def write(self, properties):
-    return False
+    """
+    uses properties:
+        fileName - path to the .nii.gz file, .bval and .bvec are written next to it
+        nodeID - ID of the diffusion weighted volume node to write
+    """
+    try:
+      _NIfTIFileInstallPackage()
+
+      filePath = properties['fileName']
+      nodeID = properties['nodeID']
+      diffusionNode = slicer.mrmlScene.GetNodeByID(nodeID)
+
+      if not diffusionNode or not diffusionNode.IsA('vtkMRMLDiffusionWeightedVolumeNode'):
+        logging.error('NIfTI writer: invalid node')
+        return False
+
+      if filePath.endswith('.nii.gz'):
+        pathBase = filePath[:-len('.nii.gz')]
+      else:
+        pathBase = os.path.splitext(filePath)[0]
+
+      _NIfTIFileWriteDiffusionImage(diffusionNode, filePath)
+      _NIfTIFileWriteGradients(diffusionNode, f"{pathBase}.bval", f"{pathBase}.bvec")
+
+    except Exception as e:
+      logging.error('Failed to write file: '+str(e))
+      import traceback
+      traceback.print_exc()
+      return False
+
+    self.parent.writtenNodes = [nodeID]
+    return True
 
 
 class NIfTIFileTest(ScriptedLoadableModuleTest):
@@ -180,14 +399,44 @@ class NIfTIFileTest(ScriptedLoadableModuleTest):
   def test_Reader(self):
     # Writer and reader tests are put in the same function to ensure
     # that writing is done before reading (it generates input data for reading).
+    import numpy
+    from vtk.util.numpy_support import vtk_to_numpy
 
-    # TODO: rewrite this for NIfTI
-    pass
+    filePath = os.path.join(self.tempDir, 'dwi.nii.gz')
+    self.assertTrue(slicer.app.coreIOManager().loadNodes('NIfTI', {'fileName': filePath}))
+    diffusionNode = slicer.mrmlScene.GetFirstNodeByName('dwi.nii')
+
+    numpy.testing.assert_array_equal(slicer.util.arrayFromVolume(diffusionNode), self.diffusionArray)
+    numpy.testing.assert_allclose(vtk_to_numpy(diffusionNode.GetBValues()), self.bvals)
+    numpy.testing.assert_allclose(vtk_to_numpy(diffusionNode.GetDiffusionGradients()), self.gradients, atol=1e-6)
 
   def test_Writer(self):
     # Writer and reader tests are put in the same function to ensure
     # that writing is done before reading (it generates input data for reading).
-
-    # TODO: rewrite this for NIfTI
-    pass
+    import numpy
+
+    self.diffusionArray = numpy.random.randint(0, 1000, size=(4, 5, 6, 7)).astype(numpy.int16)
+    self.bvals = numpy.array([0, 1000, 1000, 1000, 2000, 2000, 2000], dtype=float)
+    self.gradients = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1],
+                                  [-1, 0, 0], [0, -1, 0], [0, 0, -1]], dtype=float)
+
+    diffusionNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLDiffusionWeightedVolumeNode', 'dwi')
+    measurementFrame = vtk.vtkMatrix4x4()
+    measurementFrame.SetElement(0,0,-1)
+    measurementFrame.SetElement(1,1,-1)
+    diffusionNode.SetMeasurementFrameMatrix(measurementFrame)
+    diffusionImage = vtk.vtkImageData()
+    diffusionImage.SetDimensions(6, 5, 4)
+    diffusionImage.AllocateScalars(vtk.VTK_SHORT, 7)
+    diffusionNode.SetAndObserveImageData(diffusionImage)
+    slicer.util.arrayFromVolume(diffusionNode)[:] = self.diffusionArray
+    diffusionNode.SetNumberOfGradients(len(self.bvals))
+    for index in range(len(self.bvals)):
+      diffusionNode.SetBValue(index, self.bvals[index])
+      diffusionNode.SetDiffusionGradient(index, self.gradients[index])
+
+    filePath = os.path.join(self.tempDir, 'dwi.nii.gz')
+    self.assertTrue(slicer.util.saveNode(diffusionNode, filePath, {'fileFormat': 'NIfTI (*.nii.gz)'}))
+    for path in ['dwi.nii.gz', 'dwi.bval', 'dwi.bvec']:
+      self.assertTrue(os.path.exists(os.path.join(self.tempDir, path)))
 
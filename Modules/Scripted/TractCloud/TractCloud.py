@@ -1,8 +1,10 @@
+import collections
 import json
 import logging
 import os
 import shutil
 import tempfile
+import time
 
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
@@ -171,7 +173,16 @@ class TractCloudWidget(ScriptedLoadableModuleWidget):
 
 
 class TractCloudLogic(ScriptedLoadableModuleLogic):
-    """Runs TractCloud as a QProcess subprocess."""
+    """Runs TractCloud as a QProcess subprocess.
+
+    Tract files reported by the subprocess through ``partial_result``
+    messages are queued and loaded into the scene in short time slices
+    on the Qt event loop, so results appear while the parcellation is
+    still running instead of all at once when it finishes.
+    """
+
+    # Maximum time (in seconds) spent creating nodes per event loop slice
+    loadTimeSlice = 0.05
 
     def __init__(self):
         ScriptedLoadableModuleLogic.__init__(self)
@@ -181,6 +192,17 @@ class TractCloudLogic(ScriptedLoadableModuleLogic):
         self._process = None
         self._tempDir = None
         self._inputNode = None
+        self._outputDir = None
+        self._pendingFiles = collections.deque()
+        self._seenFiles = set()
+        self._createdIDs = []
+        self._rootFolderID = None
+        self._categoryFolderIDs = {}
+        self._colorIndex = 1
+        self._processFinished = False
+        self._loadTimer = qt.QTimer()
+        self._loadTimer.setInterval(0)
+        self._loadTimer.timeout.connect(self._loadPendingSlice)
 
     def _status(self, msg):
         if self.statusCallback:
@@ -221,11 +243,19 @@ class TractCloudLogic(ScriptedLoadableModuleLogic):
         """Run TractCloud parcellation via QProcess.
 
         The computation runs in a subprocess so Slicer remains responsive.
-        Results are loaded into the scene when the process completes.
+        Tracts are loaded into the scene as the subprocess reports them;
+        anything not reported is picked up when the process completes.
         """
         self._ensureDependencies()
 
         self._inputNode = inputNode
+        self._pendingFiles.clear()
+        self._seenFiles = set()
+        self._createdIDs = []
+        self._rootFolderID = None
+        self._categoryFolderIDs = {}
+        self._colorIndex = 1
+        self._processFinished = False
         self._tempDir = tempfile.mkdtemp(prefix="tractcloud_")
 
         # Save input polydata to temp file
@@ -280,6 +310,7 @@ class TractCloudLogic(ScriptedLoadableModuleLogic):
                      4: "Write error", 3: "Read error", 5: "Unknown error"}
         msg = errorMsgs.get(error, f"Error code {error}")
         logging.error(f"TractCloud QProcess error: {msg}")
+        self._loadTimer.stop()
         if self.completionCallback:
             self.completionCallback(False, msg)
 
@@ -305,6 +336,9 @@ class TractCloudLogic(ScriptedLoadableModuleLogic):
                     step = msg.get("step", "")
                     self._status(
                         f"Step {step}: {remaining:.0f}s remaining...")
+            elif msgType == "partial_result":
+                self._queueResultFiles(msg.get("category", ""),
+                                       msg.get("files", []))
             elif msgType == "result":
                 totalTime = msg.get("total_time")
                 timeStr = (f" in {totalTime:.1f}s"
@@ -314,8 +348,9 @@ class TractCloudLogic(ScriptedLoadableModuleLogic):
                     + timeStr)
 
     def _onFinished(self, exitCode, exitStatus=None):
-        """Load output VTP files into the Slicer scene."""
+        """Queue any remaining output VTP files and finish loading them."""
         if exitCode != 0:
+            self._loadTimer.stop()
             stderr = self._process.readAllStandardError().data().decode()
             if self.completionCallback:
                 self.completionCallback(False, stderr[-500:])
@@ -324,68 +359,119 @@ class TractCloudLogic(ScriptedLoadableModuleLogic):
 
         self._status("Loading results into scene...")
         try:
-            nodeIDs = self._loadResults()
-            msg = f"Parcellation complete: {len(nodeIDs)} tracts"
-            if self.completionCallback:
-                self.completionCallback(True, msg)
+            self._queueRemainingResults()
         except Exception as e:
+            self._loadTimer.stop()
             if self.completionCallback:
                 self.completionCallback(False, str(e))
+            self._cleanup()
+            return
 
-        self._cleanup()
+        self._processFinished = True
+        self._loadTimer.start()
 
-    def _loadResults(self):
-        """Load output VTP files into MRML scene with hierarchy and colors."""
-        shNode = slicer.mrmlScene.GetSubjectHierarchyNode()
-        sceneItemID = shNode.GetSceneItemID()
-        baseName = self._inputNode.GetName() + "_TractCloud"
-        rootFolderID = shNode.CreateFolderItem(sceneItemID, baseName)
+    def _queueResultFiles(self, categoryName, files):
+        """Queue tract files reported by the subprocess for loading.
 
-        colorNode = slicer.util.getNode("GenericColors")
-        colorIndex = 1
-        createdIDs = []
+        Paths may be absolute or relative to the category directory in
+        the output directory. Files already queued are ignored.
+        """
+        if isinstance(files, str):
+            files = [files]
+        for filepath in files:
+            if not os.path.isabs(filepath):
+                filepath = os.path.join(
+                    self._outputDir, categoryName, filepath)
+            filepath = os.path.normpath(filepath)
+            if filepath in self._seenFiles:
+                continue
+            self._seenFiles.add(filepath)
+            self._pendingFiles.append((categoryName, filepath))
+        if self._pendingFiles and not self._loadTimer.isActive():
+            self._loadTimer.start()
+
+    def _queueRemainingResults(self):
+        """Queue output VTP files that were not reported while running.
 
-        # Walk the category directories
+        This also covers versions of the subprocess that do not emit
+        partial_result messages, in which case everything is loaded here.
+        """
+        if not os.path.isdir(self._outputDir):
+            return
         for categoryName in sorted(os.listdir(self._outputDir)):
             catDir = os.path.join(self._outputDir, categoryName)
             if not os.path.isdir(catDir):
                 continue
+            vtpFiles = sorted(f for f in os.listdir(catDir)
+                              if f.endswith(".vtp"))
+            self._queueResultFiles(categoryName, vtpFiles)
 
-            vtpFiles = [f for f in os.listdir(catDir)
-                        if f.endswith(".vtp")]
-            if not vtpFiles:
-                continue
+    def _loadPendingSlice(self):
+        """Load queued tracts until the time slice is used up."""
+        deadline = time.monotonic() + self.loadTimeSlice
+        try:
+            while self._pendingFiles and time.monotonic() < deadline:
+                categoryName, filepath = self._pendingFiles.popleft()
+                self._loadResult(categoryName, filepath)
+        except Exception as e:
+            self._loadTimer.stop()
+            self._pendingFiles.clear()
+            if self._process is not None:
+                self._process.finished.disconnect(self._onFinished)
+                self._process.kill()
+            if self.completionCallback:
+                self.completionCallback(False, str(e))
+            self._cleanup()
+            return
 
-            catFolderID = shNode.CreateFolderItem(
-                rootFolderID, categoryName)
-
-            for vtpFile in sorted(vtpFiles):
-                filepath = os.path.join(catDir, vtpFile)
-                nodeName = os.path.splitext(vtpFile)[0]
-
-                node = slicer.util.loadFiberBundle(filepath)
-                if node is None:
-                    continue
-                node.SetName(nodeName)
-
-                # Set color
-                color = [0.0, 0.0, 0.0, 0.0]
-                colorNode.GetColor(colorIndex, color)
-                lineDisp = node.GetLineDisplayNode()
-                if lineDisp:
-                    lineDisp.SetColor(color[0], color[1], color[2])
-                    lineDisp.SetColorModeToSolid()
-                tubeDisp = node.GetTubeDisplayNode()
-                if tubeDisp:
-                    tubeDisp.SetColor(color[0], color[1], color[2])
-                    tubeDisp.SetColorModeToSolid()
-                colorIndex += 1
-
-                itemID = shNode.GetItemByDataNode(node)
-                shNode.SetItemParent(itemID, catFolderID)
-                createdIDs.append(node.GetID())
-
-        return createdIDs
+        if self._pendingFiles:
+            return
+        self._loadTimer.stop()
+        if self._processFinished:
+            msg = f"Parcellation complete: {len(self._createdIDs)} tracts"
+            if self.completionCallback:
+                self.completionCallback(True, msg)
+            self._cleanup()
+
+    def _categoryFolder(self, categoryName):
+        """Return the SubjectHierarchy folder for a category, creating the
+        output root and category folders on first use."""
+        shNode = slicer.mrmlScene.GetSubjectHierarchyNode()
+        if self._rootFolderID is None:
+            baseName = self._inputNode.GetName() + "_TractCloud"
+            self._rootFolderID = shNode.CreateFolderItem(
+                shNode.GetSceneItemID(), baseName)
+        if categoryName not in self._categoryFolderIDs:
+            self._categoryFolderIDs[categoryName] = shNode.CreateFolderItem(
+                self._rootFolderID, categoryName)
+        return self._categoryFolderIDs[categoryName]
+
+    def _loadResult(self, categoryName, filepath):
+        """Load one output VTP file into the scene with hierarchy and color."""
+        node = slicer.util.loadFiberBundle(filepath)
+        if node is None:
+            return None
+        node.SetName(os.path.splitext(os.path.basename(filepath))[0])
+
+        # Set color
+        colorNode = slicer.util.getNode("GenericColors")
+        color = [0.0, 0.0, 0.0, 0.0]
+        colorNode.GetColor(self._colorIndex, color)
+        lineDisp = node.GetLineDisplayNode()
+        if lineDisp:
+            lineDisp.SetColor(color[0], color[1], color[2])
+            lineDisp.SetColorModeToSolid()
+        tubeDisp = node.GetTubeDisplayNode()
+        if tubeDisp:
+            tubeDisp.SetColor(color[0], color[1], color[2])
+            tubeDisp.SetColorModeToSolid()
+        self._colorIndex += 1
+
+        shNode = slicer.mrmlScene.GetSubjectHierarchyNode()
+        itemID = shNode.GetItemByDataNode(node)
+        shNode.SetItemParent(itemID, self._categoryFolder(categoryName))
+        self._createdIDs.append(node.GetID())
+        return node.GetID()
 
     def _cleanup(self):
         """Remove temporary directory."""